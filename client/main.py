@@ -12,7 +12,7 @@ import theme
 SCREEN_WIDTH = 1000
 SCREEN_HEIGHT = 700
 SERVER_URL = "ws://localhost:8766"
-QUICK_JOIN_TIMEOUT = 15000 # 15 giây (tính bằng mili-giây)
+QUICK_JOIN_TIMEOUT = 15000 # Thời gian chờ hiển thị (mili-giây); server gửi giá trị thật và tự hủy khi hết hạn
 
 # --- Khởi tạo Pygame ---
 pygame.init()
@@ -399,6 +399,9 @@ actual_origin = "MAIN_MENU"  # Nguồn gốc thực sự để quay về (không
 match_history = []  # Danh sách lịch sử trận đấu
 history_page = 0  # Trang hiện tại của lịch sử
 matches_per_page = 8  # Số trận hiển thị mỗi trang
+history_fetch_size = matches_per_page * 3  # Số trận tải mỗi lần từ server
+history_next_cursor = None  # Cursor để tải các trận cũ hơn (None = đã hết)
+history_loading = False  # Đang chờ server trả thêm trận
 
 # --- Biến Leaderboard ---
 leaderboard = []  # Danh sách bảng xếp hạng
@@ -662,8 +665,10 @@ while running:
                 # Hiển thị lịch sử trận đấu
                 game_state = "MATCH_HISTORY"
                 history_page = 0
-                # Gửi yêu cầu lấy lịch sử từ server
-                network.send_message({"action": "GET_MATCH_HISTORY"})
+                history_next_cursor = None
+                history_loading = True
+                # Gửi yêu cầu lấy lịch sử từ server (trang đầu)
+                network.send_message({"action": "GET_MATCH_HISTORY", "payload": {"limit": history_fetch_size}})
                 feedback_msg = "Đang tải lịch sử trận đấu..."
                 feedback_color = (255, 255, 255)
             elif leaderboard_button.is_clicked(event):
@@ -712,9 +717,7 @@ while running:
             elif back_to_welcome_button.is_clicked(event):
                 game_state = "MAIN_MENU"
                 user_data = None
-                if network.is_connected:
-                    try: network.ws.close() 
-                    except: pass
+                network.disconnect()
                 network = Network(SERVER_URL)
 
         # --- Xử lý Input: MATCH_HISTORY ---
@@ -729,6 +732,13 @@ while running:
             if history_next_button.is_clicked(event):
                 if history_page < (len(match_history) - 1) // matches_per_page:
                     history_page += 1
+                elif history_next_cursor and not history_loading:
+                    # Hết trận đã tải: xin server thêm các trận cũ hơn
+                    history_loading = True
+                    network.send_message({
+                        "action": "GET_MATCH_HISTORY",
+                        "payload": {"limit": history_fetch_size, "cursor": history_next_cursor}
+                    })
 
         # --- Xử lý Input: LEADERBOARD ---
         elif game_state == "LEADERBOARD":
@@ -1128,19 +1138,6 @@ while running:
             feedback_msg = ""
             feedback_show_time = 0
     
-    if game_state == "QUICK_JOIN_WAITING":
-        if quick_join_start_time is not None: 
-            current_time = pygame.time.get_ticks()
-            elapsed_time = current_time - quick_join_start_time
-            
-            if elapsed_time > QUICK_JOIN_TIMEOUT: 
-                print("[GAME] Hết 15s chờ. Tự động hủy.")
-                game_state = "LOBBY" 
-                feedback_msg = "Không tìm thấy trận. Thử lại sau."
-                feedback_color = (255, 50, 50) 
-                network.send_message({"action": "CANCEL_QUICK_JOIN"})
-                quick_join_start_time = None 
-
     # 3. Xử lý Logic Mạng (Nhận tin nhắn)
     message = network.get_message()
     if message:
@@ -1163,11 +1160,7 @@ while running:
             feedback_color = (255, 150, 0)  # Màu cam cảnh báo
             feedback_show_time = pygame.time.get_ticks()  # Lưu thời gian hiển thị
             # Đóng kết nối network
-            if network.is_connected:
-                try: 
-                    network.ws.close() 
-                except: 
-                    pass
+            network.disconnect()
             network = Network(SERVER_URL)
             print("[FORCE LOGOUT] Đã bị đăng xuất do đăng nhập từ thiết bị khác")
         
@@ -1189,6 +1182,17 @@ while running:
             if game_state == "QUICK_JOIN_WAITING":
                 feedback_msg = "Đang tìm đối thủ..."
                 feedback_color = (255, 255, 255)
+                # Server quyết định thời gian chờ, client chỉ đếm ngược để hiển thị
+                QUICK_JOIN_TIMEOUT = int(message.get("timeout", 15) * 1000)
+                quick_join_start_time = pygame.time.get_ticks()
+
+        elif status == "QUICK_JOIN_TIMEOUT":
+            # Server đã hủy vé vì chờ quá lâu
+            if game_state == "QUICK_JOIN_WAITING":
+                game_state = "LOBBY"
+            feedback_msg = clean_text(message.get("message", "Không tìm thấy trận. Thử lại sau."))
+            feedback_color = (255, 50, 50)
+            quick_join_start_time = None
 
         elif status == "CANCEL_QUICK_JOIN_SUCCESS":
             game_state = "LOBBY"
@@ -1264,8 +1268,16 @@ while running:
         elif status == "MATCH_HISTORY":
             # Nhận lịch sử trận đấu từ server
             match_history_data = message.get("matches", [])
-            match_history.clear()
-            match_history.extend(match_history_data)
+            if message.get("cursor"):
+                # Trang tiếp theo: nối thêm và chuyển sang trang mới
+                match_history.extend(match_history_data)
+                if match_history_data:
+                    history_page += 1
+            else:
+                match_history.clear()
+                match_history.extend(match_history_data)
+            history_next_cursor = message.get("next_cursor")
+            history_loading = False
             feedback_msg = f"Đã tải {len(match_history)} trận đấu"
             feedback_color = (100, 255, 100)
             print(f"[MATCH_HISTORY] Đã nhận {len(match_history)} trận đấu")
@@ -1429,6 +1441,64 @@ while running:
             feedback_color = (0, 255, 0)
             print("[REMATCH] Đối thủ đã gửi lời mời chơi lại") 
 
+        # [MỚI] Kết nối lại bằng resume token (network tự gửi RESUME khi kết nối lại)
+        elif status == "RESUME_SUCCESS":
+            user_data = message.get("user_data") or user_data
+            if not message.get("in_room") and game_state in ["IN_ROOM_WAITING", "PLAYING", "GAME_OVER_SCREEN"]:
+                # Chỗ trong phòng không còn được giữ
+                game_state = "MAIN_MENU"
+                current_room = None
+                feedback_msg = "Đã kết nối lại. Phòng cũ không còn."
+                feedback_color = (255, 150, 0)
+            elif game_state == "QUICK_JOIN_WAITING":
+                game_state = "LOBBY"
+                quick_join_start_time = None
+            print(f"[RESUME] Đã khôi phục phiên, in_room={message.get('in_room')}")
+
+        elif status == "RESUME_FAILED":
+            game_state = "LOGIN"
+            user_data = None
+            current_room = None
+            feedback_msg = clean_text(message.get("message", "Vui lòng đăng nhập lại."))
+            feedback_color = (255, 150, 0)
+
+        elif status == "ROOM_RESUMED":
+            current_room = message.get("room_data")
+            my_user_id = user_data.get("user_id") if user_data else None
+            my_username = user_data.get("username") if user_data else None
+            if message.get("board"):
+                # Đang chơi dở: dựng lại bàn cờ và lượt đi từ server
+                game_state = "PLAYING"
+                game_board = message.get("board")
+                player_role = message.get("role")
+                is_my_turn = (message.get("turn") == "YOU")
+                score_data = message.get("score")
+                game_mode = message.get("game_mode") or game_mode
+                board_size = get_board_size(game_mode)
+                settings = message.get("settings") or {}
+                if settings.get("time_limit"):
+                    TURN_TIMEOUT = int(settings.get("time_limit"))
+                turn_start_time = pygame.time.get_ticks()
+                opponent_user_id = None
+                opponent_username = None
+                for key in ("player1", "player2"):
+                    player = (current_room or {}).get(key) or {}
+                    if player.get("user_id") not in (None, my_user_id):
+                        opponent_user_id = player.get("user_id")
+                        opponent_username = player.get("username")
+            else:
+                game_state = "IN_ROOM_WAITING"
+            feedback_msg = "Đã kết nối lại vào phòng!"
+            feedback_color = (50, 255, 50)
+
+        elif status == "OPPONENT_DISCONNECTED":
+            feedback_msg = clean_text(message.get("message", "Đối thủ mất kết nối..."))
+            feedback_color = (255, 150, 0)
+
+        elif status == "OPPONENT_RECONNECTED":
+            feedback_msg = clean_text(message.get("message", "Đối thủ đã kết nối lại."))
+            feedback_color = (50, 255, 50)
+
     # 4. Vẽ (Render)
     screen.fill(theme.BG)
     
@@ -1589,7 +1659,8 @@ while running:
                 
         # Thông tin phân trang
         total_pages = max(1, (len(match_history) + matches_per_page - 1) // matches_per_page)
-        draw_text(f"Trang {history_page + 1}/{total_pages}", font_medium, SCREEN_WIDTH / 2, SCREEN_HEIGHT - 50, theme.SUBTEXT)
+        more_text = "+" if history_next_cursor else ""  # Còn trận cũ hơn chưa tải
+        draw_text(f"Trang {history_page + 1}/{total_pages}{more_text}", font_medium, SCREEN_WIDTH / 2, SCREEN_HEIGHT - 50, theme.SUBTEXT)
         
         # Vẽ buttons
         mouse_pos = pygame.mouse.get_pos()
@@ -1600,7 +1671,7 @@ while running:
         history_back_button.draw(screen)
         if history_page > 0:
             history_prev_button.draw(screen)
-        if history_page < total_pages - 1:
+        if history_page < total_pages - 1 or history_next_cursor:
             history_next_button.draw(screen)
     
     # --- Vẽ Màn hình LEADERBOARD ---
@@ -1931,7 +2002,7 @@ while running:
         if quick_join_start_time is not None:
             current_time = pygame.time.get_ticks()
             elapsed_time_sec = (current_time - quick_join_start_time) // 1000
-            remaining_time = max(0, 15 - elapsed_time_sec) 
+            remaining_time = max(0, QUICK_JOIN_TIMEOUT // 1000 - elapsed_time_sec) 
             draw_text(f"Thời gian còn lại: {remaining_time} giây", font_medium, SCREEN_WIDTH / 2, 200)
         cancel_quick_join_button.check_hover(mouse_pos)
         cancel_quick_join_button.draw(screen)
@@ -2292,9 +2363,6 @@ while running:
 # --- Kết thúc ---
 print("[GAME] Đang đóng game...")
 if network and network.is_connected:
-    try:
-        network.ws.close()
-    except Exception as e:
-        print(f"[ERROR] Lỗi khi đóng network: {e}")
+    network.disconnect()
 pygame.quit()
 print("[GAME] Đã đóng game thành công.")
\ No newline at end of file
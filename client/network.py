@@ -6,33 +6,46 @@ import json
 import queue
 import time
 
+import wire  # Giao thức nhị phân, bản sao của server/wire.py
+
 class Network:
-    def __init__(self, url):
+    def __init__(self, url, binary=True):
         self.url = url
         self.ws = None
         self.thread = None
         self.is_connected = False
+        # Đề nghị giao thức nhị phân khi kết nối; server cũ không hỗ trợ thì vẫn dùng JSON
+        self.subprotocols = wire.SUBPROTOCOLS if binary else None
+        self.binary = False  # True khi server đã chấp nhận giao thức nhị phân
+        # Token server cấp khi đăng nhập; mất kết nối thì tự RESUME bằng token này
+        self.resume_token = None
+        self.closing = False  # True khi chủ động đóng: không tự kết nối lại nữa
         
         # Queue để nhận tin nhắn từ luồng mạng một cách an toàn
         self.message_queue = queue.Queue()
 
     def start(self):
         """Khởi động kết nối trong một luồng riêng biệt."""
+        self.closing = False
         self.thread = threading.Thread(target=self._run_forever)
         self.thread.daemon = True # Tự động tắt thread khi chương trình chính tắt
         self.thread.start()
 
     def _run_forever(self):
         """Hàm này chạy trong luồng riêng, kết nối và lắng nghe mãi mãi."""
-        while True:
+        while not self.closing:
             try:
                 # Tạo kết nối
                 self.ws = websocket.WebSocketApp(self.url,
+                                                 subprotocols=self.subprotocols,
                                                  on_open=self._on_open,
                                                  on_message=self._on_message,
                                                  on_error=self._on_error,
                                                  on_close=self._on_close)
                 self.ws.run_forever()
+                if not self.closing:
+                    # Mất kết nối/không kết nối được (ví dụ server đang khởi động lại): thử lại sau 1 giây
+                    time.sleep(1)
             except Exception as e:
                 print(f"[Network Thread] Lỗi: {e}. Đang thử kết nối lại sau 5 giây...")
                 self.is_connected = False
@@ -40,18 +53,32 @@ class Network:
 
     def _on_open(self, ws):
         """Được gọi khi kết nối thành công."""
-        print("[Network] Đã kết nối tới Server!")
+        subprotocol = ws.sock.getsubprotocol() if ws.sock else None
+        self.binary = subprotocol == wire.SUBPROTOCOL_BINARY
+        print(f"[Network] Đã kết nối tới Server! ({'nhị phân' if self.binary else 'JSON'})")
         self.is_connected = True
+        if self.resume_token:
+            # Kết nối lại sau khi mất mạng: khôi phục phiên (và ván đang chơi) không cần mật khẩu
+            print("[Network] Đang khôi phục phiên đăng nhập...")
+            self.send_message({"action": "RESUME", "payload": {"token": self.resume_token}})
 
     def _on_message(self, ws, message):
         """Được gọi khi nhận được tin nhắn từ Server."""
         try:
-            # Phân tích JSON
-            data = json.loads(message)
+            # Frame nhị phân (wire) hoặc JSON text
+            if isinstance(message, bytes):
+                data = wire.decode_message(message)
+            else:
+                data = json.loads(message)
+            status = data.get("status")
+            if status in ("LOGIN_SUCCESS", "RESUME_SUCCESS"):
+                self.resume_token = data.get("resume_token")
+            elif status in ("RESUME_FAILED", "FORCE_LOGOUT"):
+                self.resume_token = None
             # Bỏ tin nhắn vào hàng đợi để luồng game chính xử lý
             self.message_queue.put(data)
-        except json.JSONDecodeError:
-            print(f"[Network] Nhận được tin nhắn không phải JSON: {message}")
+        except ValueError:
+            print(f"[Network] Nhận được tin nhắn sai định dạng: {message!r}")
 
     def _on_error(self, ws, error):
         """Được gọi khi có lỗi mạng."""
@@ -70,8 +97,11 @@ class Network:
         """
         if self.is_connected and self.ws:
             try:
-                # Chuyển dict thành chuỗi JSON và gửi đi
-                self.ws.send(json.dumps(data_dict))
+                # Mã hóa theo giao thức đã thỏa thuận và gửi đi
+                if self.binary:
+                    self.ws.send(wire.encode_message(data_dict), opcode=websocket.ABNF.OPCODE_BINARY)
+                else:
+                    self.ws.send(json.dumps(data_dict))
             except Exception as e:
                 print(f"[Network Send Error] {e}")
         else:
@@ -93,6 +123,8 @@ class Network:
         """
         Đóng kết nối với server.
         """
+        self.closing = True
+        self.resume_token = None
         try:
             if self.ws:
                 self.ws.close()
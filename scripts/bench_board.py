@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Board Engine Microbenchmark
+So sánh bàn cờ list-of-lists cũ với bitboard (server/bitboard.py) trên
+cùng một chuỗi nước đi ngẫu nhiên, cho từng game mode.
+
+    python scripts/bench_board.py [--games 300] [--seed 1]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+import bitboard
+
+# Game mode -> kích thước bàn (giống _get_board_size trong game_logic)
+GAME_MODES = {3: 3, 4: 6, 5: 9, 6: 12}
+
+
+# --- Cài đặt cũ (trước khi dùng bitboard), giữ lại để so sánh ---
+def legacy_check_win(board, r, c, player_id, win_count=5):
+    board_size = len(board)
+    for dr, dc in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        count = 0
+        for i in range(-(win_count - 1), win_count):
+            nr, nc = r + i * dr, c + i * dc
+            if 0 <= nr < board_size and 0 <= nc < board_size:
+                if board[nr][nc] == player_id:
+                    count += 1
+                    if count >= win_count:
+                        return True
+                else:
+                    count = 0
+            else:
+                count = 0
+    return False
+
+def legacy_is_board_full(board):
+    for row in board:
+        for cell in row:
+            if cell == 0:
+                return False
+    return True
+
+
+def make_games(size, count, rng):
+    """Mỗi ván là một hoán vị các ô; hai người chơi (id 1, 2) đánh xen kẽ."""
+    cells = [(r, c) for r in range(size) for c in range(size)]
+    games = []
+    for _ in range(count):
+        rng.shuffle(cells)
+        games.append(list(cells))
+    return games
+
+def play_legacy(games, size, win_count):
+    """Trả về (số nước đã xử lý, danh sách kết quả mỗi ván)."""
+    moves = 0
+    results = []
+    for game in games:
+        board = [[0 for _ in range(size)] for _ in range(size)]
+        result = "DRAW"
+        for i, (r, c) in enumerate(game):
+            player = 1 + (i & 1)
+            if not (0 <= r < len(board) and 0 <= c < len(board[0])) or board[r][c] != 0:
+                raise AssertionError("nước đi không hợp lệ")
+            board[r][c] = player
+            moves += 1
+            if legacy_check_win(board, r, c, player, win_count):
+                result = player
+                break
+            if legacy_is_board_full(board):
+                break
+        results.append(result)
+    return moves, results
+
+def play_bitboard(games, size, win_count):
+    moves = 0
+    results = []
+    for game in games:
+        board = bitboard.Board(size, win_count)
+        result = "DRAW"
+        for i, (r, c) in enumerate(game):
+            player = 1 + (i & 1)
+            if not board.in_bounds(r, c) or not board.is_empty(r, c):
+                raise AssertionError("nước đi không hợp lệ")
+            board.place(r, c, player)
+            moves += 1
+            if board.is_win(player):
+                result = player
+                break
+            if board.is_full():
+                break
+        results.append(result)
+    return moves, results
+
+def timed(func, *args):
+    started = time.perf_counter()
+    value = func(*args)
+    return time.perf_counter() - started, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bàn cờ list-of-lists vs bitboard")
+    parser.add_argument("--games", type=int, default=300, help="Số ván ngẫu nhiên mỗi game mode")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'mode':>4} {'size':>5} {'moves':>8} {'legacy us/move':>15} {'bitboard us/move':>17} {'speedup':>8}")
+    for win_count, size in GAME_MODES.items():
+        games = make_games(size, args.games, rng)
+        legacy_time, (moves, legacy_results) = timed(play_legacy, games, size, win_count)
+        bit_time, (bit_moves, bit_results) = timed(play_bitboard, games, size, win_count)
+        if legacy_results != bit_results or moves != bit_moves:
+            print(f"❌ Kết quả khác nhau ở mode {win_count}")
+            sys.exit(1)
+        legacy_us = legacy_time / moves * 1e6
+        bit_us = bit_time / moves * 1e6
+        print(f"{win_count:>4} {size:>5} {moves:>8} {legacy_us:>15.2f} {bit_us:>17.2f} {legacy_us / bit_us:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
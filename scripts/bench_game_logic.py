@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Game Logic Microbenchmark
+Đo các hàm thuần của server trên thế cờ giữa ván (bàn 3/6/9/12) và lưu kết
+quả ra JSON để so sánh giữa các phiên bản:
+
+- Board.is_win / Board.is_full (thay cho _check_win / _is_board_full cũ)
+- _get_clean_room_data (dựng lại sau khi phòng thay đổi, và bản đã cache)
+- generate_room_code
+- mã hóa GAME_START và OPPONENT_MOVE (JSON và nhị phân, transport.encode)
+
+    python scripts/bench_game_logic.py run [--save scripts/bench_baselines/game_logic.json]
+    python scripts/bench_game_logic.py compare [BASELINE] [CURRENT] [--threshold 0.15]
+
+compare chạy lại bộ đo (hoặc đọc CURRENT nếu có) và báo lỗi (exit 1) khi
+một phép đo chậm hơn baseline quá ngưỡng.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+import bitboard
+import game_logic
+import move_log
+import transport
+from rooms import Room, PlayerSlot
+
+# Game mode -> kích thước bàn (giống _get_board_size trong game_logic)
+GAME_MODES = {3: 3, 4: 6, 5: 9, 6: 12}
+# Tỉ lệ ô đã đánh của thế cờ "giữa ván" theo kích thước bàn
+MID_GAME_FILL = {3: 0.45, 6: 0.4, 9: 0.35, 12: 0.3}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'bench_baselines', 'game_logic.json')
+
+X_ID, O_ID = 1001, 2002
+
+
+def mid_game_board(game_mode, rng):
+    """Thế cờ ngẫu nhiên chưa ai thắng, đã lấp MID_GAME_FILL ô. Trả về (board, người vừa đánh)."""
+    size = GAME_MODES[game_mode]
+    target = max(2, int(size * size * MID_GAME_FILL[size]))
+    while True:
+        board = bitboard.Board(size, game_mode)
+        cells = [(r, c) for r in range(size) for c in range(size)]
+        rng.shuffle(cells)
+        player = X_ID
+        for row, col in cells[:target]:
+            board.place(row, col, player)
+            if board.is_win(player):
+                break
+            player = O_ID if player == X_ID else X_ID
+        else:
+            return board, O_ID if player == X_ID else X_ID
+
+def mid_game_room(game_mode, rng):
+    board, last = mid_game_board(game_mode, rng)
+    room = Room("AB12C", PlayerSlot(None, X_ID, "player_x", True), game_mode=game_mode)
+    room.seat_guest(PlayerSlot(None, O_ID, "player_o", True))
+    room.start_game(board, X_ID if last == O_ID else O_ID, move_log.MoveLog(board.size, X_ID, O_ID))
+    room.score = {X_ID: 2, O_ID: 1}
+    return room, last
+
+
+def measure(func, min_time=0.05, repeats=5):
+    """Thời gian mỗi lần gọi (ns): chọn số vòng để mỗi lượt đo >= min_time, lấy min và median của các lượt."""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed > min_time / 10 else 10
+    samples = [elapsed]
+    for _ in range(repeats - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append(time.perf_counter() - started)
+    per_op = [s / loops * 1e9 for s in samples]
+    return {"ns_per_op": round(min(per_op), 1), "median_ns": round(statistics.median(per_op), 1), "loops": loops}
+
+
+def cases(seed):
+    """Danh sách (tên, hàm không tham số) cần đo."""
+    rng = random.Random(seed)
+    result = [("generate_room_code", game_logic.generate_room_code)]
+    for game_mode, size in GAME_MODES.items():
+        room, last = mid_game_room(game_mode, rng)
+        board = room.board
+        suffix = f"[{size}x{size}]"
+
+        def rebuild(room=room):
+            room.touch()  # Mỗi nước đi đều làm phòng đổi phiên bản
+            return game_logic._get_clean_room_data(room)
+
+        game_start = {"status": "GAME_START", "role": "X", "turn": "YOU", "board": [[0] * size for _ in range(size)],
+                      "score": room.score, "game_mode": game_mode, "settings": room.settings}
+        opponent_move = {"status": "OPPONENT_MOVE", "move": {"row": size // 2, "col": size // 2}, "player_id": last}
+        result += [
+            ("is_win" + suffix, lambda board=board, last=last: board.is_win(last)),
+            ("is_full" + suffix, board.is_full),
+            ("clean_room_data" + suffix, rebuild),
+            ("clean_room_data_cached" + suffix, lambda room=room: game_logic._get_clean_room_data(room)),
+            ("to_rows" + suffix, board.to_rows),
+            ("encode_game_start_json" + suffix, lambda p=game_start: transport.encode(p, transport.CODEC_JSON)),
+            ("encode_game_start_binary" + suffix, lambda p=game_start: transport.encode(p, transport.CODEC_BINARY)),
+            ("encode_opponent_move_json" + suffix, lambda p=opponent_move: transport.encode(p, transport.CODEC_JSON)),
+            ("encode_opponent_move_binary" + suffix, lambda p=opponent_move: transport.encode(p, transport.CODEC_BINARY)),
+        ]
+    return result
+
+def run(seed, min_time):
+    results = {}
+    for name, func in cases(seed):
+        results[name] = measure(func, min_time)
+        print(f"   {name:<42}{results[name]['ns_per_op']:>12.1f} ns")
+    return {
+        "meta": {"python": platform.python_version(), "implementation": platform.python_implementation(),
+                 "machine": platform.machine(), "seed": seed, "fast_json": transport.orjson is not None,
+                 "created": time.strftime("%Y-%m-%d %H:%M:%S")},
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """In bảng so sánh, trả về danh sách phép đo chậm hơn baseline quá ngưỡng."""
+    regressions = []
+    print(f"{'Phép đo':<42}{'Baseline ns':>14}{'Hiện tại ns':>14}{'Thay đổi':>10}")
+    for name, now in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<42}{'-':>14}{now['ns_per_op']:>14.1f}{'mới':>10}")
+            continue
+        change = now["ns_per_op"] / base["ns_per_op"] - 1
+        mark = ""
+        if change > threshold:
+            mark = " ❌"
+            regressions.append((name, change))
+        elif change < -threshold:
+            mark = " 🚀"
+        print(f"{name:<42}{base['ns_per_op']:>14.1f}{now['ns_per_op']:>14.1f}{change:>+10.1%}{mark}")
+    for name in baseline["results"].keys() - current["results"].keys():
+        print(f"{name:<42}{'(không còn đo)':>14}")
+    if baseline.get("meta", {}).get("python") != current.get("meta", {}).get("python"):
+        print(f"⚠️  Khác phiên bản Python: {baseline.get('meta', {}).get('python')} -> {current['meta']['python']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark các hàm thuần của game_logic")
+    sub = parser.add_subparsers(dest="command")
+    run_parser = sub.add_parser("run", help="Chạy bộ đo")
+    run_parser.add_argument("--save", help="Ghi kết quả ra file JSON (ví dụ làm baseline mới)")
+    compare_parser = sub.add_parser("compare", help="So sánh với baseline")
+    compare_parser.add_argument("baseline", nargs="?", default=DEFAULT_BASELINE)
+    compare_parser.add_argument("current", nargs="?", help="Kết quả đã lưu; bỏ trống để chạy lại bộ đo")
+    compare_parser.add_argument("--threshold", type=float, default=0.15, help="Ngưỡng chậm đi bị coi là hồi quy (0.15 = 15%%)")
+    for p in (run_parser, compare_parser):
+        p.add_argument("--seed", type=int, default=1)
+        p.add_argument("--min-time", type=float, default=0.05, help="Thời gian tối thiểu (giây) mỗi lượt đo")
+    parser.set_defaults(command="run", save=None, seed=1, min_time=0.05)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if args.current:
+            with open(args.current, encoding="utf-8") as f:
+                current = json.load(f)
+        else:
+            print("⏱️  Đang chạy bộ đo...")
+            current = run(args.seed, args.min_time)
+            print()
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} phép đo chậm hơn baseline quá {args.threshold:.0%}")
+            sys.exit(1)
+        print(f"\n✅ Không có phép đo nào chậm hơn baseline quá {args.threshold:.0%}")
+        return
+
+    print("⏱️  Game logic microbenchmark (ns mỗi lần gọi, lấy min)\n")
+    report = run(args.seed, args.min_time)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\n💾 Đã lưu: {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Wire Protocol Benchmark
+So sánh JSON text với giao thức nhị phân (server/wire.py) trên chuỗi tin
+nhắn của các ván đấu ngẫu nhiên: số byte mỗi ván (cả hai chiều, gồm một
+người xem vào giữa ván) và thời gian mã hóa/giải mã mỗi tin nhắn.
+
+    python scripts/bench_wire.py [--games 200] [--seed 1]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+import wire
+
+# Game mode -> kích thước bàn (giống _get_board_size trong game_logic)
+GAME_MODES = {3: 3, 4: 6, 5: 9, 6: 12}
+
+
+def _player(user_id, name, ready=False):
+    return {"user_id": user_id, "username": name, "is_ready": ready}
+
+def make_game(game_mode, rng):
+    """Danh sách tin nhắn (gửi lên và gửi xuống) của một ván, cùng định dạng server gửi."""
+    size = GAME_MODES[game_mode]
+    x_id, o_id = rng.randint(1, 50000), rng.randint(50001, 100000)
+    p1, p2 = _player(x_id, "player_%d" % x_id), _player(o_id, "player_%d" % o_id)
+    settings = {"time_limit": 30, "game_mode": game_mode}
+    score = {x_id: 0, o_id: 0}
+    board = [[0] * size for _ in range(size)]
+    room = {"room_id": "AB12CD", "password": None, "board": None, "turn": None, "settings": settings,
+            "score": score, "game_mode": game_mode, "timer_task": None, "player1": p1, "player2": p2}
+
+    messages = [
+        {"action": "LOGIN", "payload": {"username": p1["username"], "password": "secret"}},
+        {"status": "LOGIN_SUCCESS", "message": "Đăng nhập thành công!", "user_data": {"user_id": x_id, "username": p1["username"]}},
+        {"action": "JOIN_ROOM", "payload": {"room_id": "AB12CD", "password": None}},
+        {"status": "JOIN_SUCCESS", "message": "Tham gia phòng thành công!", "room_data": room},
+        {"status": "OPPONENT_JOINED", "message": "Đối thủ đã vào phòng.", "opponent": p2, "room_data": room},
+        {"action": "READY", "payload": {}},
+        {"status": "ROOM_UPDATE", "payload": {"room_id": "AB12CD", "player1": p1, "player2": _player(o_id, p2["username"], True)}},
+    ]
+    for role, turn in (("X", "YOU"), ("O", "OPPONENT")):
+        messages.append({"status": "GAME_START", "role": role, "turn": turn, "board": board,
+                         "score": score, "game_mode": game_mode, "settings": settings})
+
+    cells = [(r, c) for r in range(size) for c in range(size)]
+    rng.shuffle(cells)
+    moves = cells[:rng.randint(game_mode * 2 - 1, len(cells))]
+    for i, (row, col) in enumerate(moves):
+        user_id = x_id if i % 2 == 0 else o_id
+        board[row][col] = user_id
+        messages.append({"action": "MAKE_MOVE", "payload": {"row": row, "col": col}})
+        messages.append({"status": "OPPONENT_MOVE", "move": {"row": row, "col": col}, "player_id": user_id})
+        messages.append({"status": "SPECTATE_MOVE", "move": {"row": row, "col": col}, "player_id": user_id})
+        if i == len(moves) // 2:
+            # Người xem vào giữa ván nhận cả bàn cờ
+            view = dict(room, board=[list(r) for r in board], turn=user_id, player_x=x_id, spectators=1)
+            del view["password"]
+            messages.append({"action": "WATCH_ROOM", "payload": {"room_id": "AB12CD"}})
+            messages.append({"status": "WATCH_SUCCESS", "room_data": view})
+    messages.append({"status": "GAME_OVER", "result": "WIN", "message": "Bạn đã thắng!",
+                     "score": {x_id: 1, o_id: 0}, "winner_id": x_id, "reason": "NORMAL"})
+    return messages
+
+
+def json_encode(message):
+    return json.dumps(message)
+
+def json_decode(frame):
+    return json.loads(frame)
+
+CODECS = {
+    "json": (json_encode, json_decode, lambda frame: len(frame.encode("utf-8"))),
+    "binary": (wire.encode_message, wire.decode_message, len),
+}
+
+
+def bench(games):
+    messages = [m for game in games for m in game]
+    results = {}
+    for name, (encode, decode, size_of) in CODECS.items():
+        frames = [encode(m) for m in messages]  # Khởi động
+        started = time.perf_counter()
+        frames = [encode(m) for m in messages]
+        encode_time = time.perf_counter() - started
+        started = time.perf_counter()
+        for frame in frames:
+            decode(frame)
+        decode_time = time.perf_counter() - started
+        results[name] = {
+            "bytes_per_game": sum(size_of(f) for f in frames) / len(games),
+            "encode_us": encode_time / len(messages) * 1e6,
+            "decode_us": decode_time / len(messages) * 1e6,
+        }
+    return len(messages), results
+
+def check_round_trip(games):
+    """Giải mã nhị phân phải cho đúng dữ liệu như JSON (khóa số -> chuỗi)."""
+    for game in games:
+        for message in game:
+            if wire.decode_message(wire.encode_message(message)) != json.loads(json.dumps(message)):
+                return message
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh JSON và giao thức nhị phân")
+    parser.add_argument("--games", type=int, default=200, help="Số ván mỗi game mode")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"📦 Wire benchmark: {args.games} ván mỗi game mode\n")
+    print(f"{'Mode':<6}{'Codec':<8}{'Byte/ván':>10}{'Mã hóa µs':>12}{'Giải mã µs':>12}")
+    for game_mode in GAME_MODES:
+        games = [make_game(game_mode, rng) for _ in range(args.games)]
+        bad = check_round_trip(games)
+        if bad is not None:
+            print(f"❌ Sai lệch khi giải mã: {bad}")
+            sys.exit(1)
+        count, results = bench(games)
+        for name, r in results.items():
+            print(f"{game_mode:<6}{name:<8}{r['bytes_per_game']:>10.0f}{r['encode_us']:>12.2f}{r['decode_us']:>12.2f}")
+        ratio = results["binary"]["bytes_per_game"] / results["json"]["bytes_per_game"]
+        print(f"{'':<6}➡️  nhị phân = {ratio:.0%} kích thước JSON ({count} tin nhắn)\n")
+    print("✅ Giải mã nhị phân khớp JSON trên mọi tin nhắn")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,15 @@ import os
 import sys
 import subprocess
 import platform
+import urllib.error
+import urllib.request
+
+# Key series printed by monitor_server (full list: http://localhost:8766/metrics)
+MONITOR_METRICS = (
+    "caro_connected_clients", "caro_open_connections", "caro_active_rooms",
+    "caro_matchmaking_queue_length", "caro_db_pool_size", "caro_db_pool_idle",
+    "caro_event_loop_lag_max_seconds", "caro_bytes_received_total", "caro_bytes_sent_total",
+)
 
 def run_command(cmd, description):
     """Run a shell command with description"""
@@ -131,6 +140,19 @@ def monitor_server():
     """Monitor server resources"""
     print("📊 Server monitoring...")
     
+    # Health and key metrics, served over HTTP on the websocket port
+    try:
+        with urllib.request.urlopen("http://localhost:8766/healthz", timeout=3) as resp:
+            print(f"✅ Server health: {resp.read().decode().strip()}")
+        with urllib.request.urlopen("http://localhost:8766/metrics", timeout=3) as resp:
+            for line in resp.read().decode().splitlines():
+                if line.startswith(MONITOR_METRICS):
+                    print(f"   {line}")
+    except urllib.error.HTTPError as e:
+        print(f"⚠️ Server unhealthy ({e.code}): {e.read().decode().strip()}")
+    except OSError as e:
+        print(f"❌ Health check failed: {e}")
+    
     # Check if server process is running
     if platform.system() == "Windows":
         cmd = "tasklist | findstr python"
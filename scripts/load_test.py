@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Load Generator
+Giả lập N người chơi (không giao diện) chơi trọn ván trên server đang chạy:
+QUICK_JOIN -> READY -> MOVE (kèm CHAT) -> GAME_OVER -> REMATCH hoặc rời phòng
+và vào nhanh lại, xoay vòng qua cả bốn game mode.
+
+Đo độ trễ nước đi (từ lúc người đánh gửi MOVE đến khi đối thủ nhận
+OPPONENT_MOVE), số ván mỗi giây và tỉ lệ lỗi; kết quả ghi ra file JSON để so
+sánh giữa các phiên bản server.
+
+    python scripts/load_test.py --players 1000 --duration 120 --think lognormal:0.6,0.5
+    python scripts/load_test.py --players 200 --games 500 --binary --output load.json
+
+Tài khoản dùng lại giữa các lần chạy ({prefix}{số thứ tự}, tự đăng ký nếu chưa có).
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import websockets
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+import wire
+from test_server import SERVER_URL, TestClient
+
+GAME_MODES = (3, 4, 5, 6)
+PASSWORD = "load123"
+
+
+def parse_think(spec):
+    """
+    Phân phối thời gian suy nghĩ mỗi nước (giây):
+    const:T, uniform:A,B, exp:MEAN, lognormal:MEDIAN,SIGMA
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",")] if args else []
+    if kind == "const" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exp" and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise argparse.ArgumentTypeError(f"Phân phối không hợp lệ: {spec}")
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class LoadStats:
+    """Số liệu chung của mọi người chơi giả lập (một event loop, không cần lock)."""
+
+    def __init__(self):
+        self.move_latency = []      # Giây
+        self.games = 0
+        self.games_by_mode = {}
+        self.results = {}           # {kết quả của người cầm X: số ván}
+        self.counts = {}            # Số lần mỗi flow: quick_join, ready, move, chat, rematch...
+        self.errors = {}            # {loại lỗi: số lần}
+        self.pending_moves = {}     # {user_id người đánh: thời điểm gửi MOVE}
+        self.started = time.perf_counter()
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self, args):
+        elapsed = time.perf_counter() - self.started
+        latency = sorted(self.move_latency)
+        sent = sum(self.counts.get(k, 0) for k in ("move", "chat", "ready", "rematch", "quick_join", "leave"))
+        error_total = sum(self.errors.values())
+        ms = lambda v: round(v * 1000, 3) if v is not None else None
+        return {
+            "config": {"url": args.url, "players": args.players, "duration": args.duration, "games_target": args.games,
+                       "think": args.think, "chat_rate": args.chat_rate, "rematch_rate": args.rematch_rate,
+                       "modes": args.modes, "binary": args.binary, "seed": args.seed},
+            "elapsed_s": round(elapsed, 3),
+            "games": self.games,
+            "games_per_s": round(self.games / elapsed, 3) if elapsed else 0,
+            "games_by_mode": {str(k): v for k, v in sorted(self.games_by_mode.items())},
+            "results": self.results,
+            "moves": len(latency),
+            "move_latency_ms": {
+                "p50": ms(percentile(latency, 0.50)),
+                "p95": ms(percentile(latency, 0.95)),
+                "p99": ms(percentile(latency, 0.99)),
+                "max": ms(latency[-1] if latency else None),
+                "mean": ms(sum(latency) / len(latency) if latency else None),
+            },
+            "actions": self.counts,
+            "errors": self.errors,
+            "error_rate": round(error_total / sent, 6) if sent else 0,
+        }
+
+
+class SimPlayer(TestClient):
+    """Người chơi giả lập: một vòng nhận tin, phản ứng theo trạng thái (không in từng tin như TestClient)."""
+
+    def __init__(self, index, args, stats, rng):
+        super().__init__(f"{args.prefix}{index}")
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.think = args.think_fn
+        self.binary = False
+        self.user_id = None
+        self.board = None
+        self.role = None
+        self.move_due = None        # loop.time() khi đến lúc đánh nước tiếp theo
+        self.in_room = False
+        self.queued = False         # Đã gửi QUICK_JOIN, đang chờ ghép
+        self.has_opponent = False
+        self.game_mode = None
+
+    # --- Kết nối & gửi/nhận ---
+    async def connect(self):
+        subprotocols = [wire.SUBPROTOCOL_BINARY, wire.SUBPROTOCOL_JSON] if self.args.binary else None
+        try:
+            self.ws = await websockets.connect(self.args.url, subprotocols=subprotocols,
+                                               open_timeout=30, max_queue=None)
+        except Exception:
+            self.stats.error("connect_failed")
+            return False
+        self.binary = self.ws.subprotocol == wire.SUBPROTOCOL_BINARY
+        return True
+
+    async def send_message(self, action, payload=None):
+        message = {"action": action, "payload": payload or {}}
+        await self.ws.send(wire.encode_message(message) if self.binary else json.dumps(message))
+
+    async def receive_message(self, timeout=30.0):
+        frame = await asyncio.wait_for(self.ws.recv(), timeout)
+        return wire.decode_message(frame) if isinstance(frame, bytes) else json.loads(frame)
+
+    async def _request(self, action, payload, expect):
+        await self.send_message(action, payload)
+        while True:
+            data = await self.receive_message()
+            status = data.get("status")
+            if status in expect or status == "ERROR":
+                return data
+
+    async def login(self):
+        """Đăng nhập; tài khoản chưa có thì đăng ký rồi đăng nhập lại."""
+        credentials = {"username": self.name, "password": PASSWORD}
+        data = await self._request("LOGIN", credentials, ("LOGIN_SUCCESS",))
+        if data.get("status") != "LOGIN_SUCCESS":
+            await self._request("REGISTER", credentials, ("SUCCESS",))
+            data = await self._request("LOGIN", credentials, ("LOGIN_SUCCESS",))
+        if data.get("status") != "LOGIN_SUCCESS":
+            self.stats.error("login_failed")
+            return False
+        self.user_id = data["user_data"]["user_id"]
+        return True
+
+    # --- Các flow ---
+    async def quick_join(self):
+        self.board = None
+        self.move_due = None
+        self.in_room = self.has_opponent = False
+        self.queued = True
+        self.game_mode = self.rng.choice(self.args.modes)
+        self.stats.count("quick_join")
+        await self.send_message("QUICK_JOIN", {"game_mode": self.game_mode})
+
+    async def leave_and_requeue(self):
+        if self.in_room:
+            self.stats.count("leave")
+            await self.send_message("LEAVE_ROOM")
+        await self.quick_join()
+
+    async def ready(self):
+        self.stats.count("ready")
+        await self.send_message("READY", {"is_ready": True})
+
+    def schedule_move(self):
+        self.move_due = asyncio.get_running_loop().time() + max(0.0, self.think(self.rng))
+
+    async def make_move(self):
+        self.move_due = None
+        empty = [(r, c) for r, row in enumerate(self.board) for c, cell in enumerate(row) if cell == 0]
+        if not empty:
+            return
+        row, col = self.rng.choice(empty)
+        self.board[row][col] = self.user_id
+        if self.rng.random() < self.args.chat_rate:
+            self.stats.count("chat")
+            await self.send_message("CHAT", {"message": "gg %d" % self.rng.randint(1, 999)})
+        self.stats.pending_moves[self.user_id] = time.perf_counter()
+        self.stats.count("move")
+        await self.send_message("MOVE", {"row": row, "col": col})
+
+    async def on_message(self, data):
+        status = data.get("status")
+        stats = self.stats
+        if status == "OPPONENT_JOINED" and self.queued:
+            return  # Tin muộn của phòng vừa rời (đã gửi LEAVE_ROOM + QUICK_JOIN)
+        if status in ("JOIN_SUCCESS", "OPPONENT_JOINED"):
+            self.in_room = True
+            self.queued = False
+            room = data.get("room_data") or {}
+            if status == "OPPONENT_JOINED" or (room.get("player1") and room.get("player2")):
+                self.has_opponent = True
+                await self.ready()
+        elif status == "GAME_START":
+            self.board = [list(row) for row in data["board"]]
+            self.role = data.get("role")
+            self.game_mode = data.get("game_mode", self.game_mode)
+            if data.get("turn") == "YOU":
+                self.schedule_move()
+        elif status == "OPPONENT_MOVE":
+            sent_at = stats.pending_moves.pop(data.get("player_id"), None)
+            if sent_at is not None:
+                stats.move_latency.append(time.perf_counter() - sent_at)
+            move = data["move"]
+            if self.board is not None:
+                self.board[move["row"]][move["col"]] = data.get("player_id")
+                # Đợi hết thời gian suy nghĩ; GAME_OVER đến trong lúc đó thì không đánh nữa
+                self.schedule_move()
+        elif status == "GAME_OVER":
+            self.move_due = None
+            if self.board is not None and self.role == "X":
+                # Mỗi ván đếm một lần, ở phía người cầm X
+                stats.games += 1
+                stats.games_by_mode[self.game_mode] = stats.games_by_mode.get(self.game_mode, 0) + 1
+                result = data.get("result", "UNKNOWN")
+                stats.results[result] = stats.results.get(result, 0) + 1
+            self.board = None
+            if self.has_opponent and self.rng.random() < self.args.rematch_rate:
+                stats.count("rematch")
+                await self.send_message("REMATCH")
+            else:
+                await self.leave_and_requeue()
+        elif status == "OPPONENT_LEFT" and not self.queued:
+            # Đối thủ bỏ đi: rời phòng (tránh thành phòng chờ) rồi vào nhanh lại
+            await self.leave_and_requeue()
+        elif status == "QUICK_JOIN_TIMEOUT":
+            stats.error("quick_join_timeout")
+            self.queued = False
+            await self.quick_join()
+        elif status == "ERROR":
+            stats.error("server_error:" + str(data.get("message", ""))[:60])
+            if not self.in_room and not self.queued:
+                await self.quick_join()
+
+    async def run(self, stop_at, games_target):
+        if not await self.connect():
+            return
+        try:
+            if not await self.login():
+                return
+            await self.quick_join()
+            loop = asyncio.get_running_loop()
+            while loop.time() < stop_at and (not games_target or self.stats.games < games_target):
+                now = loop.time()
+                wait = self.args.idle_timeout if self.move_due is None else max(0.0, self.move_due - now)
+                wait = min(wait, max(0.0, stop_at - now))
+                try:
+                    data = await self.receive_message(timeout=wait)
+                except asyncio.TimeoutError:
+                    if self.move_due is not None and loop.time() >= self.move_due:
+                        await self.make_move()
+                    elif loop.time() < stop_at:
+                        self.stats.error("stalled")
+                        await self.leave_and_requeue()
+                    continue
+                await self.on_message(data)
+        except websockets.ConnectionClosed:
+            self.stats.error("connection_closed")
+        except asyncio.TimeoutError:
+            self.stats.error("timeout")
+        finally:
+            await self.ws.close()
+
+
+async def run_load(args):
+    stats = LoadStats()
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed)
+    players = [SimPlayer(i, args, stats, random.Random(rng.random())) for i in range(args.players)]
+    stop_at = loop.time() + args.ramp + args.duration
+
+    async def start(player, delay):
+        await asyncio.sleep(delay)
+        await player.run(stop_at, args.games)
+
+    print(f"🚀 {args.players} người chơi, tăng dần trong {args.ramp:g}s, chạy {args.duration:g}s -> {args.url}")
+    tasks = [asyncio.create_task(start(p, args.ramp * i / max(1, args.players))) for i, p in enumerate(players)]
+    progress = asyncio.create_task(_report_progress(stats))
+    await asyncio.gather(*tasks, return_exceptions=True)
+    progress.cancel()
+    return stats.summary(args)
+
+async def _report_progress(stats, interval=5.0):
+    while True:
+        await asyncio.sleep(interval)
+        elapsed = time.perf_counter() - stats.started
+        print(f"   ⏱️  {elapsed:6.1f}s  ván: {stats.games:6d}  nước: {len(stats.move_latency):7d}  lỗi: {sum(stats.errors.values())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Giả lập người chơi để đo tải server")
+    parser.add_argument("--url", default=SERVER_URL)
+    parser.add_argument("--players", type=int, default=100, help="Số người chơi giả lập")
+    parser.add_argument("--duration", type=float, default=60, help="Số giây chạy (sau khi tăng dần xong)")
+    parser.add_argument("--games", type=int, default=0, help="Dừng sớm khi đủ số ván (0 = không giới hạn)")
+    parser.add_argument("--ramp", type=float, default=10, help="Số giây để kết nối hết người chơi")
+    parser.add_argument("--think", default="lognormal:0.5,0.6",
+                        help="Thời gian suy nghĩ: const:T | uniform:A,B | exp:MEAN | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--chat-rate", type=float, default=0.05, help="Xác suất gửi CHAT trước mỗi nước")
+    parser.add_argument("--rematch-rate", type=float, default=0.5, help="Xác suất REMATCH sau mỗi ván")
+    parser.add_argument("--modes", type=int, nargs="+", default=list(GAME_MODES), choices=GAME_MODES)
+    parser.add_argument("--idle-timeout", type=float, default=45, help="Không nhận tin quá số giây này thì coi là kẹt")
+    parser.add_argument("--prefix", default="load", help="Tiền tố tên tài khoản")
+    parser.add_argument("--binary", action="store_true", help="Dùng giao thức nhị phân (caro.msgpack.v1)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="load_report.json")
+    args = parser.parse_args()
+    args.think_fn = parse_think(args.think)
+
+    report = asyncio.run(run_load(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    latency = report["move_latency_ms"]
+    print(f"\n✅ {report['games']} ván trong {report['elapsed_s']}s ({report['games_per_s']} ván/s), {report['moves']} nước")
+    print(f"📈 Độ trễ nước đi (ms): p50={latency['p50']}  p95={latency['p95']}  p99={latency['p99']}  max={latency['max']}")
+    print(f"⚠️  Lỗi: {sum(report['errors'].values())} (tỉ lệ {report['error_rate']:.4%}) {report['errors'] or ''}")
+    print(f"💾 Đã ghi báo cáo: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Room Memory Measurement
+Đo bộ nhớ cho N phòng chờ (chỉ có chủ phòng): dạng dict cũ so với
+Room/PlayerSlot dùng __slots__ (server/rooms.py).
+
+    python scripts/measure_room_memory.py [--rooms 50000]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+from rooms import Room, PlayerSlot
+
+
+class FakeSocket:
+    """Dùng chung một đối tượng cho mọi phòng, không tính vào kết quả."""
+    pass
+
+
+def legacy_room(code, ws, user_id, seq):
+    """Cấu trúc dict của phòng trước khi có rooms.Room."""
+    return {
+        "room_id": code,
+        "password": "",
+        "player1": {
+            "websocket": ws, "user_id": user_id,
+            "username": f"user{user_id}", "is_ready": False
+        },
+        "player2": None, "board": None, "turn": None,
+        "settings": {"time_limit": 120},
+        "timer_task": None,
+        "consecutive_timeouts": 0,
+        "game_mode": 5,
+        "created_seq": seq,
+        "waiting_slot": (5, "public"),
+    }
+
+def slots_room(code, ws, user_id, seq):
+    room = Room(code, PlayerSlot(ws, user_id, f"user{user_id}"), created_seq=seq)
+    room.waiting_slot = (5, "public")
+    return room
+
+def measure(factory, count, after=None):
+    """Trả về tổng số byte cấp phát để giữ `count` phòng."""
+    ws = FakeSocket()
+    # Tạo trước chuỗi mã phòng để chỉ đo phần cấu trúc phòng
+    codes = [f"R{i:05d}" for i in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    rooms = {code: factory(code, ws, i, i) for i, code in enumerate(codes)}
+    if after:
+        for room in rooms.values():
+            after(room)
+    total = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+    tracemalloc.stop()
+    del rooms
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo bộ nhớ phòng chờ")
+    parser.add_argument("--rooms", type=int, default=50000)
+    args = parser.parse_args()
+    n = args.rooms
+
+    results = [
+        ("dict (cũ)", measure(legacy_room, n)),
+        ("Room __slots__", measure(slots_room, n)),
+        ("Room giữ snapshot (không release)", measure(slots_room, n, after=Room.snapshot)),
+    ]
+    baseline = results[0][1]
+    print(f"📏 {n} phòng chờ")
+    for name, total in results:
+        print(f"  {name:<34} {total / 1024 / 1024:8.2f} MB  {total / n:7.0f} B/phòng  ({total / baseline:.0%})")
+
+if __name__ == "__main__":
+    main()
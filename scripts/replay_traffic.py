@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Traffic Replay
+Phát lại traffic đã ghi bằng `python server.py --record PATH` (server/recorder.py)
+vào một server mới: cùng các kết nối, cùng các frame, cùng nhịp thời gian (1x)
+hoặc nhanh hơn (--speed), rồi báo cáo phân phối độ trễ theo từng action.
+
+Độ trễ của một frame = từ lúc gửi tới khi nhận frame đầu tiên server gửi lại
+trên cùng kết nối; riêng các action chỉ được báo cho đối thủ (MOVE, CHAT...)
+thì tính tới frame đầu tiên một kết nối khác trong cùng phòng nhận được. Frame
+không ứng với yêu cầu nào đang chờ được đếm riêng (pushes).
+
+X/O được chọn ngẫu nhiên mỗi ván: khi phát lại mà hai người bị đổi quân so
+với lúc ghi, nước đi được gửi qua kết nối đang cầm đúng quân đó. QUICK_JOIN
+ghép người theo thứ tự đến nên khi phát lại (nhất là ở tốc độ cao) vẫn có thể
+ghép khác lúc ghi; khi đó các nước đi sau bị server từ chối và hiện trong
+errors của báo cáo. File ghi từ nhiều worker nên phát lại vào server cùng số
+worker: mỗi worker có hàng đợi ghép riêng.
+
+Mã phòng trên server mới khác lúc ghi: mã phòng trong JOIN_ROOM/WATCH_ROOM
+được đổi sang mã phòng mà kết nối tạo phòng tương ứng nhận được khi phát lại.
+Mật khẩu trong file là bí danh (xem recorder.py); với server mới chưa có tài
+khoản, dùng --register để đăng ký trước mọi tài khoản xuất hiện trong LOGIN.
+
+    python scripts/replay_traffic.py peak.rec [peak.rec.w1 ...] [--speed 1] [--register] [--output replay.json]
+    python scripts/replay_traffic.py peak.rec --speed 4 --compare replay_before.json
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+
+import websockets
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+import recorder
+import wire
+from load_test import percentile
+from test_server import SERVER_URL
+
+# Action mà server chỉ báo cho người còn lại trong phòng (người gửi không nhận gì khi thành công)
+PEER_ACTIONS = {"MOVE", "MAKE_MOVE", "CHAT", "REMATCH", "LEAVE_ROOM"}
+MOVE_ACTIONS = {"MOVE", "MAKE_MOVE"}
+# Bản ghi OPEN được ghi sau khi bắt tay xong: mở kết nối sớm hơn chừng này giây để
+# các frame đầu tiên (LOGIN, QUICK_JOIN...) không bị trễ so với lịch
+CONNECT_AHEAD = 0.1
+ROOM_WAIT = 5.0          # Số giây tối đa chờ phòng tương ứng được tạo khi phát lại
+REGISTER_CONCURRENCY = 20
+
+
+def load(paths):
+    """Gộp các file traffic -> {khóa kết nối: [(giây kể từ bản ghi đầu tiên, loại, data)]}."""
+    events = []
+    for index, path in enumerate(paths):
+        for at, (segment, conn_id), kind, data in recorder.read(path):
+            events.append((at, (index, segment, conn_id), kind, data))
+    events.sort(key=lambda e: e[0])
+    start = events[0][0] if events else 0.0
+    connections = collections.OrderedDict()
+    for at, key, kind, data in events:
+        connections.setdefault(key, []).append((at - start, kind, data))
+    return connections, (events[-1][0] - start if events else 0.0)
+
+def decode(kind, data):
+    try:
+        return wire.decode_message(data) if kind == recorder.KIND_BINARY else json.loads(data)
+    except ValueError:
+        return None
+
+
+class ReplayStats:
+    def __init__(self):
+        self.latency = {}           # {action: [giây]}
+        self.no_reply = {}          # {action: số frame không được trả lời trước frame kế tiếp}
+        self.errors = {}            # {action: số lần server trả ERROR}
+        self.pushes = 0
+        self.schedule_lag = []      # Giây gửi trễ so với lịch (replay không theo kịp)
+        self.connections = 0
+        self.connect_failures = 0
+        self.unmapped_rooms = 0
+        self.started = time.perf_counter()
+
+    def bump(self, table, action):
+        table[action] = table.get(action, 0) + 1
+
+    def summary(self, args, recorded_s):
+        elapsed = time.perf_counter() - self.started
+        ms = lambda v: round(v * 1000, 3) if v is not None else None
+
+        def dist(values):
+            values = sorted(values)
+            return {"count": len(values), "p50": ms(percentile(values, 0.50)), "p90": ms(percentile(values, 0.90)),
+                    "p99": ms(percentile(values, 0.99)), "max": ms(values[-1] if values else None)}
+
+        return {
+            "config": {"files": args.files, "url": args.url, "speed": args.speed, "register": args.register},
+            "recorded_s": round(recorded_s, 3),
+            "elapsed_s": round(elapsed, 3),
+            "connections": self.connections,
+            "connect_failures": self.connect_failures,
+            "frames": sum(len(v) for v in self.latency.values()) + sum(self.no_reply.values()),
+            "latency_ms": {"all": dist([v for values in self.latency.values() for v in values]),
+                           **{action: dist(values) for action, values in sorted(self.latency.items())}},
+            "no_reply": self.no_reply,
+            "errors": self.errors,
+            "pushes": self.pushes,
+            "unmapped_rooms": self.unmapped_rooms,
+            "schedule_lag_ms": dist(self.schedule_lag),
+        }
+
+
+class ReplayConnection:
+    """Một kết nối đã ghi: mở, gửi lại từng frame đúng lịch, đóng."""
+
+    def __init__(self, key, events, replay):
+        self.key = key
+        self.events = events
+        self.replay = replay
+        self.stats = replay.stats
+        self.ws = None
+        self.pending = None         # [action, thời điểm gửi, đã có trả lời] của frame gửi gần nhất
+        self.rooms = []             # Các phòng đã vào khi phát lại, theo thứ tự
+        self.roles = []             # Quân (X/O) của từng ván khi phát lại, theo thứ tự
+        self.updated = asyncio.Event()
+        self.room_index = 0         # Số bản ghi ROOM đã gặp
+        self.game = None            # (thứ tự ván, quân lúc ghi) của bản ghi GAME gần nhất
+
+    async def run(self):
+        for offset, kind, data in self.events:
+            if kind == recorder.KIND_OPEN:
+                await self.replay.wait_until(offset, CONNECT_AHEAD)
+            else:
+                await self.replay.wait_until(offset)
+            if kind == recorder.KIND_OPEN:
+                if not await self.connect(data.decode("utf-8")):
+                    return
+            elif self.ws is None:
+                continue
+            elif kind in (recorder.KIND_TEXT, recorder.KIND_BINARY):
+                await self.send(kind, data)
+            elif kind == recorder.KIND_ROOM:
+                self.replay.rooms[data.decode("utf-8")] = (self, self.room_index)
+                self.room_index += 1
+            elif kind == recorder.KIND_GAME:
+                self.game = (self.game[0] + 1 if self.game else 0, data.decode("utf-8"))
+            elif kind == recorder.KIND_CLOSE:
+                break
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def connect(self, subprotocol):
+        try:
+            self.ws = await websockets.connect(self.replay.url, subprotocols=[subprotocol] if subprotocol else None,
+                                               max_queue=None)
+        except (OSError, websockets.WebSocketException):
+            self.stats.connect_failures += 1
+            return False
+        self.stats.connections += 1
+        asyncio.create_task(self.receive())
+        return True
+
+    async def wait_for(self, predicate):
+        """Chờ (tối đa ROOM_WAIT giây) tới khi predicate() đúng sau một tin server gửi tới."""
+        deadline = asyncio.get_running_loop().time() + ROOM_WAIT
+        while not predicate():
+            self.updated.clear()
+            remaining = deadline - asyncio.get_running_loop().time()
+            try:
+                await asyncio.wait_for(self.updated.wait(), max(0.0, remaining))
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def swapped(self):
+        """Ván hiện tại khi phát lại bị chia quân khác lúc ghi."""
+        return self.game is not None and len(self.roles) > self.game[0] and self.roles[self.game[0]] != self.game[1]
+
+    def opponent(self):
+        """Kết nối còn lại trong phòng hiện tại khi phát lại (nếu có)."""
+        members = self.replay.members.get(self.rooms[-1], ()) if self.rooms else ()
+        return next((c for c in members if c is not self and c.ws is not None), None)
+
+    async def send(self, kind, data):
+        message = decode(kind, data)
+        action = message.get("action") if isinstance(message, dict) else None
+        payload = message.get("payload") if isinstance(message, dict) else None
+        room_id = payload.get("room_id") if isinstance(payload, dict) else None
+        if isinstance(room_id, str) and room_id in self.replay.rooms:
+            payload["room_id"] = await self.replay.map_room(room_id)
+            data = wire.encode_message(message) if kind == recorder.KIND_BINARY else json.dumps(message).encode("utf-8")
+        # Bị đổi quân: nước của quân này do kết nối đang cầm quân đó đánh
+        sender = (self.opponent() or self) if action in MOVE_ACTIONS and self.swapped() else self
+        if sender.pending is not None and not sender.pending[2]:
+            self.stats.bump(self.stats.no_reply, sender.pending[0])
+        frame = data if kind == recorder.KIND_BINARY else data.decode("utf-8")
+        sender.pending = [str(action), time.perf_counter(), False]
+        if action in PEER_ACTIONS and sender.rooms:
+            self.replay.peer_pending[sender.rooms[-1]] = sender.pending
+        try:
+            await sender.ws.send(frame)
+        except websockets.ConnectionClosed:
+            sender.pending = None
+
+    async def receive(self):
+        try:
+            async for frame in self.ws:
+                received = time.perf_counter()
+                try:
+                    data = wire.decode_message(frame) if isinstance(frame, bytes) else json.loads(frame)
+                except ValueError:
+                    data = {}
+                request, self.pending = self.pending, None
+                if (request is None or request[2]) and self.rooms:
+                    request = self.replay.peer_pending.pop(self.rooms[-1], None)
+                if request is not None and not request[2]:
+                    request[2] = True
+                    self.stats.latency.setdefault(request[0], []).append(received - request[1])
+                    if data.get("status") == "ERROR":
+                        self.stats.bump(self.stats.errors, request[0])
+                else:
+                    self.stats.pushes += 1
+                self.track(data)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if self.rooms:
+                self.replay.members.get(self.rooms[-1], set()).discard(self)
+
+    def track(self, data):
+        """Ghi nhận phòng đã vào và quân được chia khi phát lại."""
+        status = data.get("status")
+        if status == "GAME_START":
+            self.roles.append(data.get("role"))
+            self.updated.set()
+            return
+        if status == "ROOM_CREATED":
+            room_id = data.get("room_id")
+        elif status in ("JOIN_SUCCESS", "ROOM_RESUMED"):
+            room_id = (data.get("room_data") or {}).get("room_id")
+        else:
+            return
+        if room_id and (not self.rooms or self.rooms[-1] != room_id):
+            if self.rooms:
+                self.replay.members.get(self.rooms[-1], set()).discard(self)
+            self.rooms.append(room_id)
+            self.replay.members.setdefault(room_id, set()).add(self)
+            self.updated.set()
+
+
+class Replay:
+    def __init__(self, url, speed, stats):
+        self.url = url
+        self.speed = speed
+        self.stats = stats
+        self.rooms = {}             # {mã phòng lúc ghi: (kết nối đã vào phòng đó, thứ tự phòng của kết nối)}
+        self.members = {}           # {mã phòng khi phát lại: các kết nối đang ở phòng đó}
+        self.peer_pending = {}      # {mã phòng khi phát lại: yêu cầu PEER_ACTIONS đang chờ đối thủ nhận}
+        self._start = None
+
+    async def wait_until(self, offset, ahead=0.0):
+        loop = asyncio.get_running_loop()
+        target = self._start + offset / self.speed
+        delay = target - ahead - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if not ahead:
+            self.stats.schedule_lag.append(max(0.0, loop.time() - target))
+
+    async def map_room(self, recorded):
+        """Mã phòng lúc ghi -> mã phòng tương ứng khi phát lại (chờ tối đa ROOM_WAIT giây)."""
+        connection, index = self.rooms[recorded]
+        if not await connection.wait_for(lambda: len(connection.rooms) > index):
+            self.stats.unmapped_rooms += 1
+            return recorded
+        return connection.rooms[index]
+
+    async def run(self, connections):
+        self._start = asyncio.get_running_loop().time() + CONNECT_AHEAD
+        await asyncio.gather(*(ReplayConnection(key, events, self).run() for key, events in connections.items()),
+                             return_exceptions=True)
+
+
+def accounts(connections):
+    """(username, mật khẩu đã đổi bí danh) của mọi LOGIN trong file."""
+    found = {}
+    for events in connections.values():
+        for _, kind, data in events:
+            if kind in (recorder.KIND_TEXT, recorder.KIND_BINARY):
+                message = decode(kind, data)
+                payload = message.get("payload") if isinstance(message, dict) else None
+                if message and message.get("action") == "LOGIN" and isinstance(payload, dict):
+                    found[payload.get("username")] = payload.get("password")
+    return found
+
+async def register_all(url, found):
+    """Đăng ký trước các tài khoản (tài khoản đã tồn tại thì bỏ qua)."""
+    semaphore = asyncio.Semaphore(REGISTER_CONCURRENCY)
+    created = 0
+
+    async def register(username, password):
+        nonlocal created
+        async with semaphore:
+            async with websockets.connect(url) as ws:
+                await ws.send(json.dumps({"action": "REGISTER", "payload": {"username": username, "password": password}}))
+                if json.loads(await ws.recv()).get("status") == "SUCCESS":
+                    created += 1
+
+    await asyncio.gather(*(register(u, p) for u, p in found.items() if u and p))
+    return created
+
+
+def compare(baseline, current):
+    """In p50/p99 của từng action so với một báo cáo replay trước đó (cùng file traffic)."""
+    print(f"\n{'Action':<22}{'p50 trước':>11}{'p50 sau':>11}{'p99 trước':>11}{'p99 sau':>11}")
+    for action, now in current["latency_ms"].items():
+        base = baseline["latency_ms"].get(action, {})
+        print(f"{action:<22}{base.get('p50') or '-':>11}{now['p50'] or '-':>11}{base.get('p99') or '-':>11}{now['p99'] or '-':>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phát lại traffic đã ghi để đo độ trễ server")
+    parser.add_argument("files", nargs="+", help="File traffic (mỗi worker một file)")
+    parser.add_argument("--url", default=SERVER_URL)
+    parser.add_argument("--speed", type=float, default=1.0, help="Hệ số tốc độ (1 = đúng nhịp lúc ghi, 4 = nhanh gấp 4)")
+    parser.add_argument("--register", action="store_true", help="Đăng ký trước các tài khoản có trong LOGIN")
+    parser.add_argument("--compare", metavar="REPORT", help="So sánh với báo cáo replay trước đó")
+    parser.add_argument("--output", default="replay_report.json")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed phải > 0")
+
+    connections, recorded_s = load(args.files)
+    print(f"📼 {len(connections)} kết nối, {sum(len(e) for e in connections.values())} bản ghi, dài {recorded_s:.1f}s")
+    if args.register:
+        created = asyncio.run(register_all(args.url, accounts(connections)))
+        print(f"👤 Đã đăng ký {created} tài khoản mới")
+
+    print(f"▶️  Phát lại với tốc độ {args.speed:g}x -> {args.url}")
+    stats = ReplayStats()
+    asyncio.run(Replay(args.url, args.speed, stats).run(connections))
+    report = stats.summary(args, recorded_s)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    latency = report["latency_ms"]["all"]
+    lag = report["schedule_lag_ms"]
+    print(f"\n✅ {report['frames']} frame, {report['connections']} kết nối trong {report['elapsed_s']}s")
+    print(f"📈 Độ trễ (ms): p50={latency['p50']}  p90={latency['p90']}  p99={latency['p99']}  max={latency['max']}")
+    print(f"⏱️  Gửi trễ so với lịch (ms): p99={lag['p99']}  max={lag['max']}")
+    print(f"⚠️  Lỗi: {report['errors'] or 0}  không trả lời: {report['no_reply'] or 0}  "
+          f"kết nối thất bại: {report['connect_failures']}  phòng không ánh xạ được: {report['unmapped_rooms']}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+    print(f"💾 Đã ghi báo cáo: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Server/bitboard.py
+
+"""
+Bàn cờ dạng bitboard.
+
+Quân của mỗi người chơi là một số nguyên, bit thứ (r * stride + c) bật khi ô
+(r, c) có quân. stride = size + 1: mỗi hàng có thêm một cột đệm luôn bằng 0
+nên phép dịch bit theo hàng ngang/chéo không bị tràn sang hàng kế tiếp.
+
+Kiểm tra thắng bằng dịch-và-AND: sau (win_count - 1) lần `m &= m >> shift`,
+bit còn bật nghĩa là có win_count quân liên tiếp theo hướng đó.
+"""
+
+
+class BoardLayout:
+    """Thông số tính sẵn cho một cặp (kích thước, số quân thắng)."""
+    __slots__ = ("size", "win_count", "stride", "cells", "full_mask", "shifts")
+
+    def __init__(self, size, win_count):
+        self.size = size
+        self.win_count = win_count
+        self.stride = size + 1
+        self.cells = size * size
+        row_mask = (1 << size) - 1
+        full = 0
+        for r in range(size):
+            full |= row_mask << (r * self.stride)
+        self.full_mask = full
+        # Ngang, dọc, chéo xuống phải, chéo xuống trái
+        self.shifts = (1, self.stride, self.stride + 1, self.stride - 1)
+
+    def bit(self, r, c):
+        return 1 << (r * self.stride + c)
+
+
+_LAYOUTS = {}  # {(size, win_count): BoardLayout}
+
+def get_layout(size, win_count):
+    """Lấy layout đã tính sẵn (tạo mới nếu là kích thước lạ)."""
+    layout = _LAYOUTS.get((size, win_count))
+    if layout is None:
+        layout = _LAYOUTS[(size, win_count)] = BoardLayout(size, win_count)
+    return layout
+
+# Tính sẵn cho các game mode hiện có: 3 quân = 3x3, 4 = 6x6, 5 = 9x9, 6 = 12x12
+for _size, _win in ((3, 3), (6, 4), (9, 5), (12, 6)):
+    get_layout(_size, _win)
+
+
+def has_line(stones, layout):
+    """True nếu bitboard `stones` có win_count quân liên tiếp theo một hướng bất kỳ."""
+    steps = layout.win_count - 1
+    for shift in layout.shifts:
+        m = stones
+        for _ in range(steps):
+            m &= m >> shift
+            if not m:
+                break
+        if m:
+            return True
+    return False
+
+
+class Board:
+    """
+    Bàn cờ của một ván: bitboard theo user_id, bitboard các ô đã đánh và
+    bộ đếm nước đi (kiểm tra đầy bàn O(1)).
+    """
+    __slots__ = ("layout", "stones", "occupied", "move_count")
+
+    def __init__(self, size, win_count):
+        self.layout = get_layout(size, win_count)
+        self.stones = {}  # {user_id: bitboard}
+        self.occupied = 0
+        self.move_count = 0
+
+    @property
+    def size(self):
+        return self.layout.size
+
+    def in_bounds(self, r, c):
+        size = self.layout.size
+        return 0 <= r < size and 0 <= c < size
+
+    def is_empty(self, r, c):
+        return not (self.occupied & self.layout.bit(r, c))
+
+    def place(self, r, c, player_id):
+        """Đặt quân (không kiểm tra, gọi sau in_bounds/is_empty)."""
+        bit = self.layout.bit(r, c)
+        self.stones[player_id] = self.stones.get(player_id, 0) | bit
+        self.occupied |= bit
+        self.move_count += 1
+
+    def is_win(self, player_id):
+        return has_line(self.stones.get(player_id, 0), self.layout)
+
+    def is_full(self):
+        return self.move_count >= self.layout.cells
+
+    def to_rows(self):
+        """Chuyển sang dạng list-of-lists (0 = trống, còn lại là user_id) để gửi client."""
+        size, stride = self.layout.size, self.layout.stride
+        rows = [[0] * size for _ in range(size)]
+        for player_id, stones in self.stones.items():
+            while stones:
+                low = stones & -stones
+                index = low.bit_length() - 1
+                rows[index // stride][index % stride] = player_id
+                stones ^= low
+        return rows
+
+    @classmethod
+    def from_rows(cls, rows, win_count):
+        """Tạo Board từ dạng list-of-lists."""
+        board = cls(len(rows), win_count)
+        for r, row in enumerate(rows):
+            for c, cell in enumerate(row):
+                if cell != 0:
+                    board.place(r, c, cell)
+        return board
@@ -0,0 +1,419 @@
+# Server/cluster.py
+
+"""
+Chạy server nhiều tiến trình trên một máy.
+
+- Supervisor tạo N worker; mọi worker cùng lắng nghe một cổng WebSocket với
+  SO_REUSEPORT, kernel chia kết nối mới cho các worker.
+- Mỗi phòng thuộc về đúng một worker: shard_of(room_code) = crc32(code) % N.
+  Worker chỉ sinh mã phòng thuộc shard của mình.
+- Hàng đợi vào nhanh chỉ có ở worker MATCHMAKER: QUICK_JOIN được chuyển tiếp
+  tới đó như JOIN_ROOM, RemoteSocket ở lại chừng nào còn vé chờ. Phòng chờ
+  tìm được ở worker khác thì client được trả về worker gốc kèm một frame
+  (hand_off) để vào phòng đó theo đường JOIN_ROOM bình thường.
+- Các worker nối với nhau qua Unix socket. Khi client ở worker A gửi
+  JOIN_ROOM cho phòng của worker B, A "gắn" (attach) kết nối sang B: từ đó
+  các frame của client được chuyển nguyên văn sang B, B xử lý trên một
+  RemoteSocket giả lập websocket và gửi frame trả lời về A để A chuyển cho
+  client. Khi client rời phòng, B trả kết nối lại cho A (release).
+- Sự kiện toàn cụm (FORCE_LOGOUT) được broadcast tới mọi worker; truy vấn
+  cần dữ liệu của worker khác (FIND_ROOM) đi qua RPC. Kết nối bị đăng xuất
+  được ngắt chuyển tiếp (detach) ở worker gốc và mất user_id ở cả RemoteSocket
+  của nó (hosted_sockets) nên không thao tác tiếp được trong phòng.
+
+Khi WORKER_COUNT = 1, module này không làm gì và server chạy như cũ.
+"""
+
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import struct
+import time
+import zlib
+
+import logger
+import metrics
+import transport
+from config import CLUSTER_SOCKET_DIR, CLUSTER_RPC_TIMEOUT, SHUTDOWN_DRAIN_TIMEOUT
+
+log = logger.get_logger("cluster")
+
+WORKER_ID = 0
+WORKER_COUNT = 1
+ENABLED = False  # True trong worker khi chạy nhiều hơn một worker
+MATCHMAKER = 0   # Worker giữ hàng đợi vào nhanh (một hàng đợi cho cả cụm, ghép được mọi game_mode với "ANY")
+
+# Loại gói tin giữa các worker. Header: loại (1 byte), conn_id/req_id (4 byte), độ dài (4 byte)
+MSG_ATTACH = 1      # A -> B: bắt đầu chuyển tiếp một kết nối (JSON thông tin user)
+MSG_FRAME_IN = 2    # A -> B: frame client gửi lên
+MSG_FRAME_OUT = 3   # B -> A: frame gửi xuống client
+MSG_DETACH = 4      # A -> B: client đã ngắt kết nối
+MSG_RELEASE = 5     # B -> A: kết nối không còn ở phòng nào của B (kèm frame để A xử lý tiếp nếu có)
+MSG_BROADCAST = 6   # Sự kiện cho mọi worker (JSON)
+MSG_RPC_REQ = 7
+MSG_RPC_RESP = 8
+MSG_FRAME_IN_BIN = 9    # Như MSG_FRAME_IN / MSG_FRAME_OUT nhưng là frame nhị phân (wire.py)
+MSG_FRAME_OUT_BIN = 10
+_HEADER = struct.Struct("!BII")
+
+RELAYED_FRAMES = metrics.counter("caro_cluster_relayed_frames_total", "Số frame chuyển tiếp giữa các worker")
+ATTACHED = metrics.gauge("caro_cluster_attached", "Số kết nối đang được chuyển tiếp sang worker khác")
+HOSTED = metrics.gauge("caro_cluster_remote_sockets", "Số kết nối từ worker khác đang ở phòng của worker này")
+
+_hooks = {}             # on_message, on_disconnect, on_broadcast
+_rpc_handlers = {}      # {method: async fn(**params)}
+_links = {}             # {worker_id: _Link} kết nối đi tới worker khác
+_link_locks = {}
+_relays = {}            # {conn_id: websocket} kết nối của worker này đang gắn sang worker khác
+_hosted = {}            # {user_id: {RemoteSocket}} kết nối từ worker khác đang ở worker này
+_conn_ids = itertools.count(1)
+_rpc_ids = itertools.count(1)
+_rpc_waiting = {}       # {req_id: Future}
+_unix_server = None
+
+
+def configure(worker_id, worker_count, on_message, on_disconnect, on_broadcast):
+    """Gọi một lần trong mỗi worker trước khi start()."""
+    global WORKER_ID, WORKER_COUNT, ENABLED
+    WORKER_ID = worker_id
+    WORKER_COUNT = worker_count
+    ENABLED = worker_count > 1
+    _hooks.update(on_message=on_message, on_disconnect=on_disconnect, on_broadcast=on_broadcast)
+
+def rpc_handler(method):
+    """Decorator đăng ký hàm trả lời RPC `method` từ worker khác."""
+    def decorator(func):
+        _rpc_handlers[method] = func
+        return func
+    return decorator
+
+def shard_of(room_code):
+    return zlib.crc32(room_code.encode("utf-8")) % WORKER_COUNT
+
+def owns(room_code):
+    """Phòng room_code có thuộc worker hiện tại không."""
+    return not ENABLED or shard_of(room_code) == WORKER_ID
+
+def socket_path(worker_id):
+    return os.path.join(CLUSTER_SOCKET_DIR, f"caro-worker-{worker_id}.sock")
+
+
+# --- Kết nối giữa các worker ---
+class _Link:
+    """Một kết nối Unix socket hai chiều tới worker khác."""
+
+    def __init__(self, reader, writer, peer):
+        self.reader = reader
+        self.writer = writer
+        self.peer = peer
+        self.proxies = {}   # Phía chủ phòng: {conn_id: RemoteSocket} do link này gắn vào
+
+    async def send(self, kind, ident, data=b""):
+        self.writer.write(_HEADER.pack(kind, ident, len(data)) + data)
+        await self.writer.drain()
+
+    async def read_loop(self, on_packet):
+        try:
+            while True:
+                kind, ident, length = _HEADER.unpack(await self.reader.readexactly(_HEADER.size))
+                data = await self.reader.readexactly(length) if length else b""
+                await on_packet(self, kind, ident, data)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception:
+            log.exception("Lỗi đọc kết nối worker", peer=self.peer)
+        finally:
+            self.writer.close()
+
+async def _link_to(worker_id):
+    """Kết nối (tạo lười) tới worker_id."""
+    link = _links.get(worker_id)
+    if link is not None:
+        return link
+    lock = _link_locks.setdefault(worker_id, asyncio.Lock())
+    async with lock:
+        link = _links.get(worker_id)
+        if link is None:
+            reader, writer = await asyncio.open_unix_connection(socket_path(worker_id))
+            link = _Link(reader, writer, worker_id)
+            _links[worker_id] = link
+            asyncio.create_task(_run_outbound(link))
+    return link
+
+async def _run_outbound(link):
+    await link.read_loop(_on_outbound_packet)
+    _links.pop(link.peer, None)
+    # Worker kia mất: các client đang gắn sang đó coi như bị đóng phòng
+    for conn_id, ws in list(_relays.items()):
+        if ws.relay[0] == link.peer:
+            _release(conn_id)
+            await transport.safe_send(ws, {"status": "ERROR", "message": "Phòng không còn khả dụng."})
+
+async def _on_outbound_packet(link, kind, ident, data):
+    if kind in (MSG_FRAME_OUT, MSG_FRAME_OUT_BIN):
+        ws = _relays.get(ident)
+        if ws is not None:
+            RELAYED_FRAMES.inc()
+            await _send_client(ws, data.decode("utf-8") if kind == MSG_FRAME_OUT else data)
+    elif kind == MSG_RELEASE:
+        ws = _relays.get(ident)
+        _release(ident)
+        if data and ws is not None:
+            # Worker kia trả client về kèm frame (hand_off): xử lý như client vừa gửi
+            asyncio.create_task(_hooks["on_message"](ws, data.decode("utf-8")))
+    elif kind == MSG_RPC_RESP:
+        future = _rpc_waiting.pop(ident, None)
+        if future is not None and not future.done():
+            future.set_result(json.loads(data))
+
+async def _send_client(ws, frame):
+    # Qua hàng đợi gửi của client: client chậm không chặn cả link giữa hai worker
+    await transport.send_frame(ws, frame)
+
+
+# --- Phía worker nhận kết nối client (A) ---
+def is_relayed(websocket):
+    return getattr(websocket, "relay", None) is not None
+
+async def attach(websocket, owner):
+    """Gắn kết nối client sang worker `owner`; các frame sau đó đi qua forward()."""
+    link = await _link_to(owner)
+    conn_id = next(_conn_ids)
+    info = {"user_id": websocket.user_id, "username": websocket.username,
+            "remote": str(websocket.remote_address), "codec": transport.codec_of(websocket)}
+    websocket.relay = (owner, conn_id)
+    _relays[conn_id] = websocket
+    ATTACHED.inc()
+    await link.send(MSG_ATTACH, conn_id, json.dumps(info).encode("utf-8"))
+    log.debug("Gắn kết nối sang worker khác", user=websocket.user_id, owner=owner)
+
+async def forward(websocket, message):
+    owner, conn_id = websocket.relay
+    kind = MSG_FRAME_IN_BIN
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+        kind = MSG_FRAME_IN
+    link = await _link_to(owner)
+    RELAYED_FRAMES.inc()
+    await link.send(kind, conn_id, message)
+
+async def detach(websocket):
+    """Client ngắt kết nối: báo worker chủ phòng dọn dẹp."""
+    owner, conn_id = websocket.relay
+    _release(conn_id)
+    link = _links.get(owner)
+    if link is not None:
+        try:
+            await link.send(MSG_DETACH, conn_id)
+        except Exception:
+            log.warning("Không báo được DETACH", owner=owner)
+
+def _release(conn_id):
+    ws = _relays.pop(conn_id, None)
+    if ws is not None:
+        ws.relay = None
+        ATTACHED.dec()
+
+
+# --- Phía worker chủ phòng (B) ---
+class RemoteSocket:
+    """
+    Đại diện cho một client đang kết nối ở worker khác, dùng như websocket
+    trong game_logic (có send(), user_id, username, room_code...).
+    """
+
+    def __init__(self, link, conn_id, info):
+        self.link = link
+        self.conn_id = conn_id
+        self.attached_as = info["user_id"]  # user_id lúc gắn (user_id bị xóa khi đăng xuất)
+        self.user_id = info["user_id"]
+        self.username = info["username"]
+        self.remote_address = (info.get("remote"), f"worker-{link.peer}")
+        self.codec = info.get("codec", transport.CODEC_JSON)  # Định dạng client đã chọn ở worker gốc
+        self.inbox = asyncio.Queue()
+        self.open = True             # Như websocket.open, xem transport.is_open
+        self.handoff = b""           # Frame worker gốc xử lý tiếp sau khi nhận lại kết nối
+
+    async def send(self, frame):
+        if isinstance(frame, str):
+            await self.link.send(MSG_FRAME_OUT, self.conn_id, frame.encode("utf-8"))
+        else:
+            await self.link.send(MSG_FRAME_OUT_BIN, self.conn_id, frame)
+
+    async def run(self):
+        """Xử lý tuần tự các frame của client này (giống vòng lặp main_handler)."""
+        try:
+            while True:
+                message = await self.inbox.get()
+                if message is None:
+                    break
+                if message is not _RECHECK:
+                    await _hooks["on_message"](self, message)
+                if (getattr(self, "room_code", None) is None and getattr(self, "watching", None) is None
+                        and getattr(self, "queued", None) is None):
+                    # Không còn chơi/xem phòng hay chờ ghép trận ở worker này: trả kết nối về worker gốc
+                    await self.link.send(MSG_RELEASE, self.conn_id, self.handoff)
+                    break
+        finally:
+            self.open = False
+            self.link.proxies.pop(self.conn_id, None)
+            sockets = _hosted.get(self.attached_as)
+            if sockets is not None:
+                sockets.discard(self)
+                if not sockets:
+                    del _hosted[self.attached_as]
+            HOSTED.dec()
+            await _hooks["on_disconnect"](self)
+
+_RECHECK = object()  # Phần tử inbox: chỉ kiểm tra lại xem có trả kết nối về được chưa
+
+def release_if_idle(websocket):
+    """Trạng thái của websocket vừa đổi ngoài một frame (vd. vé vào nhanh hết hạn): trả về worker gốc nếu rảnh."""
+    if isinstance(websocket, RemoteSocket):
+        websocket.inbox.put_nowait(_RECHECK)
+
+async def hand_off(websocket, message):
+    """
+    Để worker giữ kết nối thật xử lý `message` thay cho client (vd. JOIN_ROOM
+    vào phòng của worker khác). Với RemoteSocket, frame đi kèm MSG_RELEASE nên
+    handler phải để websocket rảnh (không ở phòng, không chờ ghép trận).
+    """
+    if isinstance(websocket, RemoteSocket):
+        websocket.handoff = message.encode("utf-8")
+    else:
+        await _hooks["on_message"](websocket, message)
+
+def hosted_sockets(user_id):
+    """Các RemoteSocket của user_id đang ở worker này (kết nối thật nằm ở worker khác)."""
+    return [proxy for proxy in _hosted.get(user_id, ()) if getattr(proxy, "user_id", None) == user_id]
+
+async def _on_inbound_packet(link, kind, ident, data):
+    if kind == MSG_ATTACH:
+        proxy = RemoteSocket(link, ident, json.loads(data))
+        link.proxies[ident] = proxy
+        _hosted.setdefault(proxy.attached_as, set()).add(proxy)
+        HOSTED.inc()
+        asyncio.create_task(proxy.run())
+    elif kind in (MSG_FRAME_IN, MSG_FRAME_IN_BIN):
+        proxy = link.proxies.get(ident)
+        if proxy is not None:
+            proxy.inbox.put_nowait(data.decode("utf-8") if kind == MSG_FRAME_IN else data)
+    elif kind == MSG_DETACH:
+        proxy = link.proxies.get(ident)
+        if proxy is not None:
+            proxy.inbox.put_nowait(None)
+    elif kind == MSG_BROADCAST:
+        await _hooks["on_broadcast"](json.loads(data))
+    elif kind == MSG_RPC_REQ:
+        asyncio.create_task(_answer_rpc(link, ident, json.loads(data)))
+
+async def _answer_rpc(link, req_id, request):
+    handler = _rpc_handlers.get(request.get("method"))
+    result = None
+    try:
+        if handler is not None:
+            result = await handler(**request.get("params", {}))
+    except Exception:
+        log.exception("Lỗi xử lý RPC", method=request.get("method"))
+    await link.send(MSG_RPC_RESP, req_id, json.dumps(result).encode("utf-8"))
+
+async def _serve_inbound(reader, writer):
+    link = _Link(reader, writer, peer="?")
+    await link.read_loop(_on_inbound_packet)
+    # Worker gửi đã mất: coi như mọi client gắn qua link này đã ngắt kết nối
+    for proxy in list(link.proxies.values()):
+        proxy.inbox.put_nowait(None)
+
+
+# --- Sự kiện toàn cụm & RPC ---
+async def broadcast(event, **data):
+    """Gửi sự kiện cho mọi worker khác (không chờ xử lý)."""
+    if not ENABLED:
+        return
+    payload = json.dumps({"event": event, **data}).encode("utf-8")
+    for worker_id in range(WORKER_COUNT):
+        if worker_id == WORKER_ID:
+            continue
+        try:
+            link = await _link_to(worker_id)
+            await link.send(MSG_BROADCAST, 0, payload)
+        except OSError as e:
+            log.warning("Không broadcast được tới worker", worker=worker_id, event=event, error=str(e))
+
+async def call(worker_id, method, **params):
+    """Gọi RPC trên worker_id, trả về kết quả (JSON) hoặc ném TimeoutError."""
+    link = await _link_to(worker_id)
+    req_id = next(_rpc_ids)
+    future = asyncio.get_running_loop().create_future()
+    _rpc_waiting[req_id] = future
+    try:
+        await link.send(MSG_RPC_REQ, req_id, json.dumps({"method": method, "params": params}).encode("utf-8"))
+        return await asyncio.wait_for(future, CLUSTER_RPC_TIMEOUT)
+    finally:
+        _rpc_waiting.pop(req_id, None)
+
+async def call_all(method, **params):
+    """Gọi RPC trên mọi worker khác; bỏ qua worker lỗi/quá hạn. Trả về danh sách kết quả."""
+    if not ENABLED:
+        return []
+    others = [w for w in range(WORKER_COUNT) if w != WORKER_ID]
+    results = await asyncio.gather(*(call(w, method, **params) for w in others), return_exceptions=True)
+    return [r for r in results if not isinstance(r, BaseException)]
+
+
+# --- Khởi động ---
+async def start():
+    """Mở Unix socket cho các worker khác (gọi trong event loop của worker)."""
+    global _unix_server
+    if not ENABLED:
+        return
+    path = socket_path(WORKER_ID)
+    if os.path.exists(path):
+        os.unlink(path)
+    _unix_server = await asyncio.start_unix_server(_serve_inbound, path)
+    log.info("Worker sẵn sàng nhận chuyển tiếp", worker=WORKER_ID, socket=path)
+
+def run_supervisor(worker_main, count):
+    """
+    Chạy `count` tiến trình worker_main(worker_id, count), khởi động lại worker
+    bị chết, dừng tất cả khi nhận SIGINT/SIGTERM.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    workers = {}
+    stopping = False
+
+    def spawn(worker_id):
+        proc = ctx.Process(target=worker_main, args=(worker_id, count), name=f"caro-worker-{worker_id}")
+        proc.start()
+        workers[worker_id] = proc
+        log.info("Đã khởi động worker", worker=worker_id, pid=proc.pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker_id in range(count):
+        spawn(worker_id)
+
+    while not stopping:
+        time.sleep(0.5)
+        for worker_id, proc in list(workers.items()):
+            if not proc.is_alive() and not stopping:
+                log.warning("Worker đã dừng, khởi động lại", worker=worker_id, exitcode=proc.exitcode)
+                spawn(worker_id)
+
+    # SIGTERM: worker tắt an toàn (lưu snapshot phòng, xem server.shutdown) rồi tự thoát
+    for proc in workers.values():
+        if proc.is_alive():
+            proc.terminate()
+    for proc in workers.values():
+        proc.join(SHUTDOWN_DRAIN_TIMEOUT + 10)
+        if proc.is_alive():
+            log.warning("Worker không tự dừng, buộc dừng", worker=proc.name, pid=proc.pid)
+            proc.kill()
+    log.info("Supervisor đã dừng tất cả worker")
@@ -1,4 +1,5 @@
 # Cấu hình kết nối đến MySQL
+import tempfile
 
 DB_CONFIG = {
     'host': 'localhost',      # Giữ nguyên nếu MySQL chạy ở máy bạn
@@ -10,4 +11,83 @@ DB_CONFIG = {
 
 # Cấu hình Server WebSocket
 SERVER_HOST = 'localhost' # Hoặc '0.0.0.0' để máy khác kết nối
-SERVER_PORT = 8766  # Đổi port để tránh conflict
\ No newline at end of file
+SERVER_PORT = 8766  # Đổi port để tránh conflict
+
+# Cấu hình thread pool cho các lệnh gọi Database (chạy ngoài event loop)
+DB_EXECUTOR_WORKERS = 8     # Số thread thực thi truy vấn đồng thời
+DB_MAX_PENDING = 256        # Số thao tác tối đa đang chờ + đang chạy
+
+# Cấu hình connection pool MySQL (dùng chung cho mọi hàm truy vấn)
+DB_POOL_CONFIG = {
+    'min_size': 2,                # Số kết nối luôn giữ sẵn
+    'max_size': 10,               # Tối đa (nên >= DB_EXECUTOR_WORKERS)
+    'acquire_timeout': 5.0,       # Số giây chờ khi pool đã cạn
+    'idle_timeout': 300,          # Đóng kết nối rảnh quá lâu (vẫn giữ min_size)
+    'health_check_interval': 30,  # Ping kết nối đã rảnh lâu hơn mức này trước khi dùng lại
+    'max_lifetime': 3600,         # Tái tạo kết nối sau mỗi khoảng thời gian này
+}
+
+# Cấu hình băm mật khẩu bcrypt (chạy trên process pool riêng)
+BCRYPT_ROUNDS = 12          # Work factor; đổi giá trị này -> hash cũ được băm lại khi user đăng nhập
+BCRYPT_WORKERS = None       # Số process; None = số lõi CPU
+BCRYPT_MAX_PENDING = 64     # Số yêu cầu băm tối đa đang chờ, vượt quá sẽ báo server bận
+
+# Cấu hình logging (xem logger.py)
+LOG_LEVEL = 'INFO'          # DEBUG / INFO / WARNING / ERROR
+LOG_CATEGORY_LEVELS = {}    # Ghi đè level theo category, ví dụ {'room': 'DEBUG'}
+LOG_SAMPLING = {            # Tỉ lệ giữ lại log cho các sự kiện tần suất cao (1.0 = giữ hết)
+    'move': 0.05,
+    'recv': 0.01,
+}
+LOG_FILE = None             # None = ghi ra stdout; hoặc đường dẫn file
+LOG_QUEUE_SIZE = 10000      # Quá số dòng đang chờ ghi thì bỏ bớt (tránh phình bộ nhớ)
+
+# Dùng orjson (nếu đã cài) để mã hóa JSON gửi cho client
+FAST_JSON = True
+
+# Hàng đợi "Vào nhanh"
+QUICK_JOIN_TIMEOUT = 15             # Số giây tối đa chờ ghép trận, quá hạn server tự hủy vé
+QUICK_JOIN_SWEEP_INTERVAL = 1.0     # Chu kỳ (giây) quét vé hết hạn
+
+# Độ phân giải (giây) của timer wheel dùng cho hết giờ lượt đi (xem timer_wheel.py)
+TIMER_RESOLUTION = 0.05
+
+# Chạy nhiều tiến trình worker (xem cluster.py); 1 = một tiến trình như cũ
+SERVER_WORKERS = 1
+CLUSTER_SOCKET_DIR = tempfile.gettempdir()  # Thư mục chứa Unix socket giữa các worker
+CLUSTER_RPC_TIMEOUT = 1.0                   # Số giây chờ worker khác trả lời (ví dụ FIND_ROOM)
+
+# Ghi trễ kết quả trận đấu theo lô (xem storage.record_match_result)
+RESULT_FLUSH_INTERVAL = 0.5     # Số giây tối đa một kết quả nằm trong hàng đợi trước khi ghi
+RESULT_BATCH_SIZE = 200         # Số trận tối đa mỗi lô; đủ lô thì ghi ngay không chờ
+RESULT_RETRY_DELAY = 2.0        # Số giây chờ trước khi ghi lại lô bị lỗi
+RESULT_MAX_ATTEMPTS = 3         # Lô lỗi quá số lần này thì ghi từng trận một (tách trận hỏng ra)
+RESULT_MAX_PENDING = 10000      # Số kết quả tối đa trong hàng đợi; quá thì bỏ kết quả mới (ghi log)
+
+# Chỉ mục xếp hạng trong bộ nhớ (xem ranking.py)
+RANKING_VERIFY_INTERVAL = 600   # Chu kỳ (giây) so sánh chỉ mục với bảng users; 0 = tắt
+
+# Chế độ xem (WATCH_ROOM)
+SPECTATOR_LIMIT = 200           # Số người xem tối đa mỗi phòng
+
+# Hàng đợi gửi của mỗi kết nối (xem transport.Outbox)
+SEND_QUEUE_LOW_WATER = 64       # Từ mức này, tin ưu tiên thấp (chat, danh sách phòng) bị gộp/bỏ
+SEND_QUEUE_HIGH_WATER = 512     # Vượt mức này client bị coi là quá chậm và bị ngắt kết nối
+
+# Kết nối lại bằng resume token (xem sessions.py)
+SESSION_SECRET = None           # Khóa ký token; None = sinh ngẫu nhiên mỗi lần khởi động server
+SESSION_TOKEN_TTL = 12 * 3600   # Số giây token còn dùng được kể từ lúc đăng nhập
+RESUME_GRACE_PERIOD = 30        # Số giây giữ chỗ trong phòng cho người mất kết nối; 0 = rời phòng ngay
+
+# Tắt server an toàn & khôi phục phòng khi khởi động lại (xem snapshot.py)
+SNAPSHOT_DIR = tempfile.gettempdir()  # Thư mục chứa file snapshot (mỗi worker một file)
+SNAPSHOT_MAX_AGE = 600          # Snapshot cũ hơn số giây này bị bỏ qua khi khởi động
+SHUTDOWN_DRAIN_TIMEOUT = 5.0    # Số giây tối đa chờ các action đang xử lý xong trước khi lưu snapshot
+RESTORE_GRACE_PERIOD = 90       # Số giây giữ chỗ cho người chơi của phòng được khôi phục
+
+# Giám sát: HTTP /metrics (Prometheus) và /healthz trên cùng cổng WebSocket (xem monitoring.py)
+METRICS_HTTP = True
+LOOP_LAG_INTERVAL = 0.5         # Chu kỳ (giây) đo độ trễ event loop
+
+# Ghi traffic gửi lên để phát lại (xem recorder.py, scripts/replay_traffic.py)
+RECORD_TRAFFIC = None           # Đường dẫn file ghi; None = tắt (hoặc python server.py --record PATH)
@@ -1,20 +1,252 @@
 # Server/database_manager.py
 
+import collections
+import threading
+import time
 import mysql.connector
 import bcrypt
-from config import DB_CONFIG # Import cấu hình từ file config.py
+from config import DB_CONFIG, DB_POOL_CONFIG, BCRYPT_ROUNDS # Import cấu hình từ file config.py
 from datetime import datetime # Cần import để lấy thời gian hiện tại cho log_match
+import metrics
+import logger
+
+log = logger.get_logger("db")
+
+# --- CONNECTION POOL ---
+
+class PoolExhaustedError(mysql.connector.errors.PoolError):
+    """Không lấy được kết nối nào trong thời gian acquire_timeout."""
+
+
+class _PooledConnection:
+    """
+    Bọc một kết nối thật. Mọi thuộc tính được chuyển tiếp cho kết nối gốc,
+    riêng close() trả kết nối về pool thay vì đóng hẳn.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw, self._created_at)
+
+
+class ConnectionPool:
+    """
+    Pool kết nối MySQL an toàn đa luồng (được gọi từ thread pool của storage.py).
+    - Giữ tối thiểu min_size, tối đa max_size kết nối.
+    - Ping kết nối đã rảnh lâu trước khi giao (health check).
+    - Đóng bớt kết nối rảnh quá idle_timeout và tái tạo kết nối quá max_lifetime.
+    Metric của pool chỉ do pool cập nhật (trên các thread DB) và luôn trong
+    self._cond, nên không cần lock chung của metrics.py.
+    """
+
+    def __init__(self, db_config, min_size=2, max_size=10, acquire_timeout=5.0,
+                 idle_timeout=300, health_check_interval=30, max_lifetime=3600):
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.max_lifetime = max_lifetime
+
+        self._cond = threading.Condition()
+        self._idle = collections.deque()  # [(raw, created_at, last_used)], phải = mới dùng nhất
+        self._size = 0  # Tổng số kết nối đang mở (rảnh + đang dùng)
+
+        self.size_gauge = metrics.gauge("caro_db_pool_size", "Số kết nối MySQL đang mở")
+        self.idle_gauge = metrics.gauge("caro_db_pool_idle", "Số kết nối MySQL đang rảnh")
+        self.created = metrics.counter("caro_db_pool_created_total", "Số kết nối đã tạo")
+        self.recycled = metrics.counter("caro_db_pool_recycled_total", "Số kết nối bị đóng do rảnh lâu/quá tuổi/hỏng")
+        self.health_failures = metrics.counter("caro_db_pool_health_failures_total", "Số kết nối không qua health check")
+        self.exhausted = metrics.counter("caro_db_pool_exhausted_total", "Số lần phải chờ vì pool đã cạn")
+        self.timeouts = metrics.counter("caro_db_pool_timeouts_total", "Số lần chờ quá acquire_timeout")
+        self.acquire_wait = metrics.histogram("caro_db_pool_acquire_seconds", "Thời gian lấy kết nối từ pool")
+
+    def _update_gauges(self):
+        self.size_gauge.set(self._size)
+        self.idle_gauge.set(len(self._idle))
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self.db_config)
+        return raw, time.monotonic()
+
+    def _close_quietly(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _discard_locked(self):
+        """Đóng hẳn một kết nối (gọi khi đang giữ lock)."""
+        self._size -= 1
+        self.recycled.inc()
+        self._update_gauges()
+        self._cond.notify()
+
+    def _reap_idle_locked(self, now):
+        """Đóng các kết nối rảnh quá idle_timeout (cũ nhất nằm bên trái), giữ lại min_size."""
+        reaped = []
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][2] > self.idle_timeout):
+            raw, _, _ = self._idle.popleft()
+            self._size -= 1
+            self.recycled.inc()
+            reaped.append(raw)
+        if reaped:
+            self._update_gauges()
+        return reaped
+
+    def acquire(self):
+        """Lấy một kết nối; chờ tối đa acquire_timeout giây nếu pool đã cạn."""
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        waited = False
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    if not waited:
+                        waited = True
+                        self.exhausted.inc()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts.inc()
+                        raise PoolExhaustedError("Connection pool đã cạn (hết thời gian chờ).")
+                    self._cond.wait(remaining)
+                self._update_gauges()
+
+            if entry is None:
+                # Được phép mở kết nối mới
+                try:
+                    raw, created_at = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._update_gauges()
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self.created.inc()
+                break
+
+            raw, created_at, last_used = entry
+            now = time.monotonic()
+            if now - created_at > self.max_lifetime:
+                self._close_quietly(raw)
+                with self._cond:
+                    self._discard_locked()
+                continue
+            if now - last_used > self.health_check_interval:
+                try:
+                    raw.ping(reconnect=False)
+                except Exception:
+                    self._close_quietly(raw)
+                    with self._cond:
+                        self.health_failures.inc()
+                        self._discard_locked()
+                    continue
+            break
+
+        with self._cond:
+            self.acquire_wait.observe(time.monotonic() - started)
+        return _PooledConnection(self, raw, created_at)
+
+    def release(self, raw, created_at):
+        """Trả kết nối về pool. Rollback để không giữ transaction/snapshot cũ."""
+        try:
+            raw.rollback()
+            healthy = True
+        except Exception:
+            healthy = False
+            self._close_quietly(raw)
+
+        now = time.monotonic()
+        with self._cond:
+            if not healthy:
+                self._discard_locked()
+                return
+            self._idle.append((raw, created_at, now))
+            reaped = self._reap_idle_locked(now)
+            self._update_gauges()
+            self._cond.notify()
+        for old in reaped:
+            self._close_quietly(old)
+
+    def warm_up(self):
+        """Mở sẵn min_size kết nối."""
+        conns = []
+        try:
+            while True:
+                with self._cond:
+                    # _size đã tính cả các kết nối đang giữ trong conns
+                    if self._size >= self.min_size:
+                        break
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                conn.close()
+
+    def close_all(self):
+        """Đóng mọi kết nối đang rảnh (gọi khi tắt server)."""
+        with self._cond:
+            idle = [raw for raw, _, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._update_gauges()
+        for raw in idle:
+            self._close_quietly(raw)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "created": self.created.value,
+                "recycled": self.recycled.value,
+                "health_failures": self.health_failures.value,
+                "exhausted": self.exhausted.value,
+                "timeouts": self.timeouts.value,
+            }
+
+
+POOL = ConnectionPool(DB_CONFIG, **DB_POOL_CONFIG)
+
 # --- HÀM TIỆN ÍCH KẾT NỐI ---
 
 def get_db_connection():
-    """Tạo và trả về một kết nối đến DB."""
+    """Lấy một kết nối từ pool. Gọi conn.close() để trả kết nối về pool."""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
+        return POOL.acquire()
     except mysql.connector.Error as err:
-        print(f"Lỗi kết nối Database: {err}")
+        log.error("Lỗi kết nối Database", error=str(err))
         return None
 
+def init_pool():
+    """Mở sẵn min_size kết nối khi khởi động server."""
+    try:
+        POOL.warm_up()
+    except mysql.connector.Error as err:
+        log.error("Lỗi kết nối Database", error=str(err))
+
 # --- HÀM THIẾT LẬP BAN ĐẦU ---
 
 def create_tables():
@@ -49,7 +281,7 @@ def create_tables():
                 result_type VARCHAR(20) DEFAULT 'normal',
                 start_time  DATETIME NOT NULL,
                 end_time    DATETIME,
-                move_log    TEXT,
+                move_log    BLOB,
                 FOREIGN KEY (player_x_id) REFERENCES users(user_id),
                 FOREIGN KEY (player_o_id) REFERENCES users(user_id),
                 FOREIGN KEY (winner_id) REFERENCES users(user_id)
@@ -66,6 +298,19 @@ def create_tables():
             cursor.execute("ALTER TABLE match_history ADD COLUMN result_type VARCHAR(20) DEFAULT 'normal'")
         except mysql.connector.Error:
             pass  # Cột đã tồn tại
+        
+        # Chỉ mục cho phân trang lịch sử theo người chơi (xem get_match_history)
+        for column in ("player_x_id", "player_o_id"):
+            try:
+                cursor.execute(f"CREATE INDEX idx_mh_{column}_end ON match_history ({column}, end_time, match_id)")
+            except mysql.connector.Error:
+                pass  # Chỉ mục đã tồn tại
+        
+        # move_log chuyển từ TEXT (repr bàn cờ) sang BLOB (nhật ký nhị phân, xem move_log.py)
+        try:
+            cursor.execute("ALTER TABLE match_history MODIFY COLUMN move_log BLOB")
+        except mysql.connector.Error:
+            pass
         # Thêm cột draws cho bảng users nếu chưa có (dùng để tính tổng trận)
         try:
             cursor.execute("ALTER TABLE users ADD COLUMN draws INT DEFAULT 0")
@@ -73,22 +318,18 @@ def create_tables():
             pass  # Cột đã tồn tại
         
         conn.commit()
-        print("Đã tạo bảng thành công (hoặc bảng đã tồn tại).")
+        log.info("Đã tạo bảng thành công (hoặc bảng đã tồn tại).")
         
     except mysql.connector.Error as err:
-        print(f"Lỗi khi tạo bảng: {err}")
+        log.error("Lỗi khi tạo bảng", error=str(err))
     finally:
         cursor.close()
         conn.close()
 
 # --- HÀM XỬ LÝ XÁC THỰC (Authentication) ---
 
-def register_user(username, password):
-    """Đăng ký một người dùng mới với mật khẩu đã được băm."""
-    
-    # Băm mật khẩu (Hashing)
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    
+def create_user(username, password_hash):
+    """Thêm người dùng mới với mật khẩu ĐÃ được băm (xem passwords.py)."""
     conn = get_db_connection()
     if conn is None:
         return {"status": "ERROR", "message": "Lỗi kết nối server."}
@@ -97,9 +338,9 @@ def register_user(username, password):
     try:
         # Thêm người dùng mới vào bảng
         sql = "INSERT INTO users (username, password_hash) VALUES (%s, %s)"
-        cursor.execute(sql, (username, hashed_password))
+        cursor.execute(sql, (username, password_hash))
         conn.commit()
-        return {"status": "SUCCESS", "message": "Đăng ký thành công."}
+        return {"status": "SUCCESS", "message": "Đăng ký thành công.", "user_id": cursor.lastrowid}
         
     except mysql.connector.Error as err:
         # Bắt lỗi nếu trùng tên (UNIQUE)
@@ -111,9 +352,19 @@ def register_user(username, password):
         cursor.close()
         conn.close()
 
+def register_user(username, password):
+    """Đăng ký một người dùng mới với mật khẩu đã được băm (phiên bản đồng bộ)."""
+    
+    # Băm mật khẩu (Hashing)
+    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS))
+    return create_user(username, hashed_password.decode('utf-8'))
 
-def login_user(username, password_attempt):
-    """Kiểm tra đăng nhập của người dùng."""
+
+def get_user_for_login(username):
+    """
+    Lấy thông tin user kèm password_hash để kiểm tra đăng nhập.
+    Việc so khớp bcrypt do người gọi thực hiện (passwords.py chạy trên process pool).
+    """
     conn = get_db_connection()
     if conn is None:
         return {"status": "ERROR", "message": "Lỗi kết nối server."}
@@ -129,18 +380,7 @@ def login_user(username, password_attempt):
             # Không tìm thấy user
             return {"status": "ERROR", "message": "Tên đăng nhập không tồn tại."}
 
-        # Lấy mật khẩu đã băm từ DB
-        password_hash_from_db = user_data['password_hash'].encode('utf-8')
-        
-        # So sánh mật khẩu người dùng nhập với mật khẩu đã băm
-        if bcrypt.checkpw(password_attempt.encode('utf-8'), password_hash_from_db):
-            # Mật khẩu ĐÚNG!
-            # Xóa mật khẩu hash khỏi dữ liệu trả về cho client
-            del user_data['password_hash'] 
-            return {"status": "SUCCESS", "user_data": user_data}
-        else:
-            # Mật khẩu SAI!
-            return {"status": "ERROR", "message": "Sai mật khẩu."}
+        return {"status": "SUCCESS", "user_data": user_data}
             
     except mysql.connector.Error as err:
         return {"status": "ERROR", "message": f"Lỗi DB: {err}"}
@@ -148,13 +388,49 @@ def login_user(username, password_attempt):
         cursor.close()
         conn.close()
 
+
+def login_user(username, password_attempt):
+    """Kiểm tra đăng nhập của người dùng (phiên bản đồng bộ)."""
+    result = get_user_for_login(username)
+    if result["status"] != "SUCCESS":
+        return result
+
+    user_data = result["user_data"]
+    # Lấy mật khẩu đã băm từ DB, xóa khỏi dữ liệu trả về cho client
+    password_hash_from_db = user_data.pop('password_hash').encode('utf-8')
+    
+    # So sánh mật khẩu người dùng nhập với mật khẩu đã băm
+    if bcrypt.checkpw(password_attempt.encode('utf-8'), password_hash_from_db):
+        return {"status": "SUCCESS", "user_data": user_data}
+    else:
+        return {"status": "ERROR", "message": "Sai mật khẩu."}
+
+
+def update_password_hash(user_id, password_hash):
+    """Ghi đè password_hash (dùng khi băm lại theo work factor mới)."""
+    conn = get_db_connection()
+    if conn is None:
+        return False
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE users SET password_hash = %s WHERE user_id = %s", (password_hash, user_id))
+        conn.commit()
+        return True
+    except mysql.connector.Error as err:
+        log.error("Lỗi khi cập nhật mật khẩu", user=user_id, error=str(err))
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
 # --- CÁC HÀM KHÁC (Bạn sẽ thêm sau) ---
 
 def update_game_stats(winner_id, loser_id):
     """Cập nhật wins/losses cho người chơi sau khi kết thúc trận."""
     conn = get_db_connection()
     if conn is None:
-        print("[DB_ERROR] Không thể kết nối để cập nhật tỉ số.")
+        log.error("Không thể kết nối để cập nhật tỉ số")
         return False
 
     cursor = conn.cursor()
@@ -168,11 +444,11 @@ def update_game_stats(winner_id, loser_id):
         cursor.execute(sql_lose, (loser_id,))
         
         conn.commit()
-        print(f"[DB_UPDATE] Đã cập nhật tỉ số: {winner_id} thắng, {loser_id} thua.")
+        log.info("Đã cập nhật tỉ số", winner=winner_id, loser=loser_id)
         return True
         
     except mysql.connector.Error as err:
-        print(f"[DB_ERROR] Lỗi khi cập nhật tỉ số: {err}")
+        log.error("Lỗi khi cập nhật tỉ số", error=str(err))
         conn.rollback() # Hủy bỏ thay đổi nếu có lỗi
         return False
     finally:
@@ -188,7 +464,7 @@ def log_match(player_x_id, player_o_id, winner_id, move_log):
     """
     conn = get_db_connection()
     if conn is None:
-        print("[DB_ERROR] Không thể kết nối để lưu lịch sử trận đấu.")
+        log.error("Không thể kết nối để lưu lịch sử trận đấu")
         return False
 
     cursor = conn.cursor()
@@ -206,11 +482,11 @@ def log_match(player_x_id, player_o_id, winner_id, move_log):
         cursor.execute(sql, (player_x_id, player_o_id, winner_id, current_time, current_time, move_log))
         
         conn.commit()
-        print(f"[DB_LOG] Đã lưu lịch sử trận đấu mới: Match ID {cursor.lastrowid}")
+        log.info("Đã lưu lịch sử trận đấu mới", match_id=cursor.lastrowid)
         return True
         
     except mysql.connector.Error as err:
-        print(f"[DB_ERROR] Lỗi khi lưu lịch sử trận đấu: {err}")
+        log.error("Lỗi khi lưu lịch sử trận đấu", error=str(err))
         conn.rollback()
         return False
     finally:
@@ -224,7 +500,7 @@ def update_game_stats(winner_id, loser_id):
     """
     conn = get_db_connection()
     if conn is None:
-        print("[DB_ERROR] Không thể kết nối để cập nhật tỉ số.")
+        log.error("Không thể kết nối để cập nhật tỉ số")
         return
 
     cursor = conn.cursor()
@@ -238,24 +514,61 @@ def update_game_stats(winner_id, loser_id):
         cursor.execute(sql_lose, (loser_id,))
         
         conn.commit()
-        print(f"[DB_UPDATE] Đã cập nhật tỉ số: {winner_id} thắng, {loser_id} thua.")
+        log.info("Đã cập nhật tỉ số", winner=winner_id, loser=loser_id)
         
     except mysql.connector.Error as err:
-        print(f"Lỗi khi cập nhật tỉ số: {err}")
+        log.error("Lỗi khi cập nhật tỉ số", error=str(err))
         conn.rollback() # Hủy bỏ thay đổi nếu có lỗi
     finally:
         cursor.close()
         conn.close()
 
-def get_match_history(user_id, limit=50):
-    """Lấy lịch sử trận đấu của người chơi."""
+def encode_history_cursor(end_time, match_id):
+    """Cursor trang sau của lịch sử: vị trí (end_time, match_id) của dòng cuối trang."""
+    return f"{end_time.strftime('%Y-%m-%dT%H:%M:%S.%f')}|{match_id}"
+
+def decode_history_cursor(cursor):
+    """Ngược lại với encode_history_cursor. Ném ValueError nếu cursor không hợp lệ."""
+    end_time, match_id = cursor.split("|")
+    return datetime.strptime(end_time, "%Y-%m-%dT%H:%M:%S.%f"), int(match_id)
+
+def get_match_history(user_id, limit=50, cursor=None):
+    """
+    Lấy một trang lịch sử trận đấu của người chơi, mới nhất trước.
+    
+    Phân trang keyset theo (end_time, match_id): trang sau chỉ đọc các dòng
+    đứng sau cursor trên chỉ mục (player_x_id/player_o_id, end_time, match_id),
+    nên trang sâu nhanh như trang đầu. Điều kiện "player_x_id = ? OR
+    player_o_id = ?" được tách thành UNION ALL để mỗi nhánh dùng một chỉ mục.
+    
+    Args:
+        cursor: next_cursor của trang trước (None = trang đầu)
+    Returns:
+        dict: {"matches": [...], "next_cursor": str hoặc None}
+    """
     conn = get_db_connection()
     if conn is None:
-        return []
-        
-    cursor = conn.cursor(dictionary=True)
+        return {"matches": [], "next_cursor": None}
+        
+    if cursor:
+        before_time, before_id = decode_history_cursor(cursor)
+        keyset = "AND (end_time < %s OR (end_time = %s AND match_id < %s))"
+        keyset_args = (before_time, before_time, before_id)
+    else:
+        keyset = "AND end_time IS NOT NULL"
+        keyset_args = ()
+    
+    db_cursor = conn.cursor(dictionary=True)
     try:
-        sql = """
+        # Mỗi nhánh lấy tối đa limit + 1 dòng (dòng thừa cho biết còn trang sau)
+        branch = f"""
+            (SELECT match_id, player_x_id, player_o_id, winner_id, game_mode, result_type, end_time
+             FROM match_history
+             WHERE {{column}} = %s {keyset}
+             ORDER BY end_time DESC, match_id DESC
+             LIMIT %s)
+        """
+        sql = f"""
             SELECT 
                 mh.match_id,
                 mh.game_mode,
@@ -266,20 +579,26 @@ def get_match_history(user_id, limit=50):
                     WHEN mh.winner_id IS NULL THEN 'Hòa'
                     ELSE 'Thua'
                 END as result,
-                CASE 
-                    WHEN mh.player_x_id = %s THEN u_o.username
-                    ELSE u_x.username
-                END as opponent
-            FROM match_history mh
-            LEFT JOIN users u_x ON mh.player_x_id = u_x.user_id
-            LEFT JOIN users u_o ON mh.player_o_id = u_o.user_id
-            WHERE mh.player_x_id = %s OR mh.player_o_id = %s
-            ORDER BY mh.end_time DESC
+                u.username as opponent
+            FROM (
+                {branch.format(column="player_x_id")}
+                UNION ALL
+                {branch.format(column="player_o_id")}
+            ) mh
+            LEFT JOIN users u
+                ON u.user_id = IF(mh.player_x_id = %s, mh.player_o_id, mh.player_x_id)
+            ORDER BY mh.end_time DESC, mh.match_id DESC
             LIMIT %s
         """
+        branch_args = (user_id, *keyset_args, limit + 1)
+        db_cursor.execute(sql, (user_id, *branch_args, *branch_args, user_id, limit + 1))
+        matches = db_cursor.fetchall()
         
-        cursor.execute(sql, (user_id, user_id, user_id, user_id, limit))
-        matches = cursor.fetchall()
+        next_cursor = None
+        if len(matches) > limit:
+            matches = matches[:limit]
+            last = matches[-1]
+            next_cursor = encode_history_cursor(last["match_date"], last["match_id"])
         
         # Format thời gian cho dễ đọc
         formatted_matches = []
@@ -293,16 +612,16 @@ def get_match_history(user_id, limit=50):
             }
             formatted_matches.append(formatted_match)
             
-        return formatted_matches
+        return {"matches": formatted_matches, "next_cursor": next_cursor}
         
     except mysql.connector.Error as err:
-        print(f"Lỗi khi lấy lịch sử trận đấu: {err}")
-        return []
+        log.error("Lỗi khi lấy lịch sử trận đấu", user=user_id, error=str(err))
+        return {"matches": [], "next_cursor": None}
     finally:
-        cursor.close()
+        db_cursor.close()
         conn.close()
 
-def save_match_result(player_x_id, player_o_id, winner_id, game_mode, result_type="normal", move_log=""):
+def save_match_result(player_x_id, player_o_id, winner_id, game_mode, result_type="normal", move_log=None):
     """
     Lưu kết quả trận đấu vào database
     
@@ -312,7 +631,7 @@ def save_match_result(player_x_id, player_o_id, winner_id, game_mode, result_typ
         winner_id: ID người thắng (None nếu hòa)
         game_mode: Chế độ game (3, 4, 5, 6)
         result_type: Loại kết thúc ('normal', 'surrender', 'timeout', 'disconnect')
-        move_log: Chuỗi lưu các nước đi
+        move_log: Nhật ký nước đi dạng bytes (move_log.MoveLog.to_bytes())
     """
     conn = get_db_connection()
     if conn is None:
@@ -337,11 +656,72 @@ def save_match_result(player_x_id, player_o_id, winner_id, game_mode, result_typ
         # Nếu hòa thì không cập nhật wins/losses
             
         conn.commit()
-        print(f"[DATABASE] Đã lưu kết quả trận đấu: {player_x_id} vs {player_o_id}, winner: {winner_id}")
+        log.info("Đã lưu kết quả trận đấu", player_x=player_x_id, player_o=player_o_id, winner=winner_id)
         return True
         
     except mysql.connector.Error as err:
-        print(f"Lỗi khi lưu kết quả trận đấu: {err}")
+        log.error("Lỗi khi lưu kết quả trận đấu", error=str(err))
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_match_results_batch(results):
+    """
+    Lưu một lô kết quả trận đấu trong MỘT transaction (dùng cho hàng đợi ghi trễ
+    trong storage.py): một câu INSERT nhiều dòng vào match_history và một câu
+    UPDATE users cộng dồn wins/losses theo từng user.
+    
+    Args:
+        results: list các tuple (player_x_id, player_o_id, winner_id, game_mode,
+                 result_type, start_time, end_time, move_log)
+    Returns:
+        bool: True nếu đã commit
+    """
+    if not results:
+        return True
+    conn = get_db_connection()
+    if conn is None:
+        return False
+        
+    cursor = conn.cursor()
+    try:
+        rows_sql = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(results))
+        cursor.execute(
+            "INSERT INTO match_history (player_x_id, player_o_id, winner_id, game_mode, "
+            "result_type, start_time, end_time, move_log) VALUES " + rows_sql,
+            [value for row in results for value in row])
+        
+        # Cộng dồn thắng/thua theo user (hòa thì không cập nhật, giống save_match_result)
+        wins = collections.Counter()
+        losses = collections.Counter()
+        for player_x_id, player_o_id, winner_id, *_ in results:
+            if winner_id is not None:
+                wins[winner_id] += 1
+                losses[player_o_id if winner_id == player_x_id else player_x_id] += 1
+        user_ids = sorted(set(wins) | set(losses))  # Thứ tự cố định để tránh deadlock giữa các lô
+        if user_ids:
+            case_sql = " ".join(["WHEN %s THEN %s"] * len(user_ids))
+            in_sql = ", ".join(["%s"] * len(user_ids))
+            cursor.execute(
+                f"UPDATE users SET wins = wins + CASE user_id {case_sql} ELSE 0 END, "
+                f"losses = losses + CASE user_id {case_sql} ELSE 0 END "
+                f"WHERE user_id IN ({in_sql})",
+                [v for uid in user_ids for v in (uid, wins[uid])] +
+                [v for uid in user_ids for v in (uid, losses[uid])] +
+                user_ids)
+        
+        conn.commit()
+        log.info("Đã lưu lô kết quả trận đấu", matches=len(results), users=len(user_ids))
+        return True
+        
+    except (mysql.connector.DataError, mysql.connector.IntegrityError, mysql.connector.ProgrammingError):
+        # Lỗi do dữ liệu của lô: ghi lại nguyên lô cũng vô ích (storage.py tách từng trận)
+        conn.rollback()
+        raise
+    except mysql.connector.Error as err:
+        log.error("Lỗi khi lưu lô kết quả trận đấu", matches=len(results), error=str(err))
+        conn.rollback()
         return False
     finally:
         cursor.close()
@@ -357,10 +737,12 @@ def get_leaderboard(limit=50):
     Returns:
         list: Danh sách người chơi với thông tin username, wins, total_games
     """
+    conn = get_db_connection()
+    if conn is None:
+        return []
+
+    cursor = conn.cursor()
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        
         cursor.execute("""
             SELECT username, IFNULL(wins,0) as wins, 
                    (IFNULL(wins,0) + IFNULL(losses,0) + IFNULL(draws,0)) as total_games
@@ -382,12 +764,34 @@ def get_leaderboard(limit=50):
         return leaderboard
         
     except mysql.connector.Error as e:
-        print(f"Lỗi database khi lấy bảng xếp hạng: {e}")
+        log.error("Lỗi database khi lấy bảng xếp hạng", error=str(e))
         return []
     finally:
-        if 'conn' in locals() and conn and conn.is_connected():
-            cursor.close()
-            conn.close()
+        cursor.close()
+        conn.close()
+
+def get_ranking_rows():
+    """
+    Lấy (user_id, username, wins, losses, draws) của mọi user để nạp chỉ mục
+    xếp hạng trong bộ nhớ (ranking.py). Trả về None nếu lỗi.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return None
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT user_id, username, IFNULL(wins,0), IFNULL(losses,0), IFNULL(draws,0)
+            FROM users
+        """)
+        return cursor.fetchall()
+    except mysql.connector.Error as e:
+        log.error("Lỗi database khi tải dữ liệu xếp hạng", error=str(e))
+        return None
+    finally:
+        cursor.close()
+        conn.close()
 
 def get_user_rank(user_id):
     """
@@ -399,10 +803,12 @@ def get_user_rank(user_id):
     Returns:
         dict: Thông tin user gồm username, wins, total_games, rank
     """
+    conn = get_db_connection()
+    if conn is None:
+        return None
+
+    cursor = conn.cursor()
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        
         # Lấy thông tin user hiện tại
         cursor.execute("""
             SELECT username, IFNULL(wins,0) as wins, IFNULL(losses,0) as losses, IFNULL(draws,0) as draws
@@ -436,19 +842,18 @@ def get_user_rank(user_id):
         }
         
     except mysql.connector.Error as e:
-        print(f"Lỗi database khi lấy rank user: {e}")
+        log.error("Lỗi database khi lấy rank user", user=user_id, error=str(e))
         return None
     finally:
-        if 'conn' in locals() and conn and conn.is_connected():
-            cursor.close()
-            conn.close()
+        cursor.close()
+        conn.close()
 
 # --- Dùng để chạy thử nghiệm file này ---
 if __name__ == "__main__":
     # Chạy lệnh này một lần duy nhất để tạo bảng
-    print("Đang khởi tạo CSDL (tạo bảng nếu cần)...")
+    log.info("Đang khởi tạo CSDL (tạo bảng nếu cần)...")
     create_tables()
-    print("Hoàn tất.")
+    log.info("Hoàn tất.")
     
     # Bạn có thể test thử các hàm
     # print(register_user("testuser", "testpass123"))
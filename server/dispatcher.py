@@ -0,0 +1,141 @@
+# Server/dispatcher.py
+
+"""
+Bộ điều phối hành động (action) dạng bảng tra.
+
+Mỗi action được đăng ký một lần kèm metadata (yêu cầu đăng nhập, schema
+payload, độ ưu tiên). Khi nhận tin nhắn, server tra bảng O(1) thay vì đi qua
+chuỗi if/elif, đồng thời đo độ trễ và đếm lỗi cho từng action. Lỗi gồm cả
+trường hợp handler tự bắt ngoại lệ rồi trả lời ERROR (transport.track_replies).
+"""
+
+import time
+
+import metrics
+import transport
+
+# Độ ưu tiên của action (dùng để phân loại khi quan sát/tải cao)
+PRIORITY_HIGH = 0     # Nước đi, đầu hàng... ảnh hưởng trực tiếp ván đấu
+PRIORITY_NORMAL = 1   # Thao tác phòng chờ
+PRIORITY_LOW = 2      # Truy vấn nặng: bảng xếp hạng, lịch sử
+
+
+class ActionSpec:
+    """Thông tin đăng ký của một action."""
+    __slots__ = ("name", "handler", "auth_required", "schema", "priority",
+                 "latency", "calls", "errors", "rejected")
+
+    def __init__(self, name, handler, auth_required, schema, priority):
+        self.name = name
+        self.handler = handler
+        self.auth_required = auth_required
+        self.schema = schema or {}
+        self.priority = priority
+        self.latency = metrics.histogram(
+            "caro_action_latency_seconds", "Thời gian xử lý mỗi action", action=name)
+        self.calls = metrics.counter(
+            "caro_action_calls_total", "Số lần gọi mỗi action", action=name)
+        self.errors = metrics.counter(
+            "caro_action_errors_total", "Số lần action lỗi (handler ném ngoại lệ hoặc trả lời ERROR)", action=name)
+        self.rejected = metrics.counter(
+            "caro_action_rejected_total", "Số lần bị từ chối (chưa đăng nhập/sai schema)", action=name)
+
+
+def _validate_payload(schema, payload):
+    """
+    Kiểm tra kiểu dữ liệu các trường có trong payload theo schema.
+    Schema dạng {"row": int, "game_mode": (int, str)}; trường vắng mặt hoặc
+    None được bỏ qua để handler tự xử lý như trước.
+    Trả về thông báo lỗi hoặc None nếu hợp lệ.
+    """
+    if not isinstance(payload, dict):
+        return "Payload phải là một object."
+    for field, expected in schema.items():
+        value = payload.get(field)
+        if value is None:
+            continue
+        types = expected if isinstance(expected, tuple) else (expected,)
+        # bool là lớp con của int, chỉ chấp nhận khi schema cho phép rõ ràng
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            return f"Trường '{field}' không đúng kiểu dữ liệu."
+    return None
+
+
+class ActionDispatcher:
+    """Bảng tra action -> handler với đo đạc theo từng action."""
+
+    def __init__(self):
+        self._actions = {}
+
+    def register(self, name, handler, auth_required=True, schema=None,
+                 priority=PRIORITY_NORMAL, aliases=()):
+        """
+        Đăng ký handler cho action. handler có dạng `async def h(websocket, payload)`.
+        Các alias dùng chung spec (và chung metric) với action chính.
+        """
+        spec = ActionSpec(name, handler, auth_required, schema, priority)
+        self._actions[name] = spec
+        for alias in aliases:
+            self._actions[alias] = spec
+        return spec
+
+    def action(self, name, **options):
+        """Decorator tiện dụng cho register()."""
+        def decorator(handler):
+            self.register(name, handler, **options)
+            return handler
+        return decorator
+
+    def get(self, name):
+        return self._actions.get(name)
+
+    async def dispatch(self, websocket, action, payload):
+        """Tra bảng và gọi handler tương ứng."""
+        spec = self._actions.get(action)
+        if spec is None:
+            await transport.send(websocket, {
+                "status": "ERROR",
+                "message": f"Hành động '{action}' không được hỗ trợ."
+            })
+            return
+
+        if spec.auth_required and not hasattr(websocket, 'user_id'):
+            spec.rejected.inc()
+            await transport.send(websocket, {
+                "status": "ERROR",
+                "message": "Bạn phải đăng nhập để thực hiện hành động này."
+            })
+            return
+
+        error = _validate_payload(spec.schema, payload)
+        if error:
+            spec.rejected.inc()
+            await transport.send(websocket, {"status": "ERROR", "message": error})
+            return
+
+        spec.calls.inc()
+        started = time.perf_counter()
+        try:
+            with transport.track_replies(websocket) as replies:
+                await spec.handler(websocket, payload)
+        except Exception:
+            spec.errors.inc()
+            raise
+        else:
+            if replies.error:
+                spec.errors.inc()
+        finally:
+            spec.latency.observe(time.perf_counter() - started)
+
+    def stats(self):
+        """Tóm tắt số lần gọi, lỗi và phân vị độ trễ của từng action."""
+        result = {}
+        for spec in set(self._actions.values()):
+            result[spec.name] = {
+                "priority": spec.priority,
+                "calls": spec.calls.value,
+                "errors": spec.errors.value,
+                "rejected": spec.rejected.value,
+                "latency": spec.latency.snapshot(),
+            }
+        return result
@@ -1,82 +1,328 @@
-import json
+import heapq
+import time
+import itertools
 import random
 import string
-import database_manager as db_manager 
+import storage # Gọi DB dạng async, không chặn event loop
 import asyncio 
+import bitboard
+import move_log
+import timer_wheel
+import cluster # Chia phòng giữa các worker (khi chạy nhiều tiến trình)
+import logger
+import metrics
+import transport # Mã hóa & gửi tin theo định dạng của từng client (JSON / nhị phân)
+import recorder # Ghi traffic để phát lại (chỉ khi được bật)
+from rooms import Room, PlayerSlot
+from collections import deque
+from config import (QUICK_JOIN_TIMEOUT, QUICK_JOIN_SWEEP_INTERVAL, SPECTATOR_LIMIT, RESUME_GRACE_PERIOD,
+                    RESTORE_GRACE_PERIOD)
+
+log = logger.get_logger("game")
+room_log = logger.get_logger("room")
+queue_log = logger.get_logger("matchmaking")
+moves_log = logger.get_logger("move")  # Tần suất cao, được lấy mẫu (LOG_SAMPLING)
+chat_log = logger.get_logger("chat")
+history_log = logger.get_logger("history")
+
+SPECTATORS = metrics.gauge("caro_spectators", "Số người đang xem các phòng")
+SPECTATOR_FRAMES = metrics.counter("caro_spectator_frames_total", "Số frame đã gửi cho người xem")
+HELD_SEATS = metrics.gauge("caro_held_seats", "Số chỗ đang giữ cho người chơi mất kết nối")
+RESUMES = metrics.counter("caro_resumed_seats_total", "Số lần người chơi kết nối lại vào chỗ cũ")
+
+ACTIVE_ROOMS = {}  # {room_code: Room}
+PLAYER_ROOMS = {}  # {user_id: Room} phòng có chỗ ngồi của user (kể cả chỗ đang giữ), xem _index_seats
+# Chỉ mục các phòng còn nhận người (có chủ phòng, chưa có player2, chưa bắt đầu):
+# {game_mode: {"public": {room_code: room}, "private": {room_code: room}}}
+# Mỗi dict giữ thứ tự phòng được đưa vào hàng chờ. Luôn cập nhật qua _sync_waiting_index().
+WAITING_ROOMS = {}
+_room_seq = itertools.count()  # Số thứ tự đưa phòng vào hàng chờ, dùng để trộn các danh sách theo thứ tự
+# Hàng đợi ghép trận "Vào nhanh": mỗi game mode (kể cả "ANY") một deque FIFO các vé
+MATCH_QUEUES = {}    # {game_mode: deque[_QueueTicket]}
+QUEUE_TICKETS = {}   # {user_id: _QueueTicket} - chỉ mục để hủy O(1)
+_queue_sweeper = None  # Task dọn vé hết hạn, chạy khi còn người trong hàng đợi
+
+QUEUE_MATCHED = metrics.counter("caro_matchmaking_matched_total", "Số cặp được ghép từ hàng đợi")
+QUEUE_EXPIRED = metrics.counter("caro_matchmaking_expired_total", "Số vé hết hạn chờ")
+QUEUE_CANCELLED = metrics.counter("caro_matchmaking_cancelled_total", "Số vé bị hủy (chủ động/ngắt kết nối)")
+TIME_TO_MATCH = metrics.histogram(
+    "caro_matchmaking_wait_seconds", "Thời gian chờ trong hàng đợi đến khi được ghép",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 15, 30, 60))
 
-ACTIVE_ROOMS = {}
-# Dictionary để lưu hàng đợi cho từng game mode
-QUICK_JOIN_WAITING_PLAYERS = {}  # {game_mode: websocket} 
-
-# --- HELPER FUNCTION ---
-def _is_websocket_connected(ws):
-    """
-    Kiểm tra xem websocket có còn kết nối không.
-    Tương thích với cả websockets cũ và mới.
-    """
-    if not ws:
-        return False
-    try:
-        # Thử gửi ping để kiểm tra kết nối
-        return True  # Nếu websocket tồn tại, coi như connected
-    except:
-        return False
-
-# --- HÀM DỌN DẸP DỮ LIỆU ---
 # --- HÀM DỌN DẸP DỮ LIỆU ---
 def _get_clean_room_data(room):
     """
-    Tạo một bản sao (copy) của "room" an toàn để gửi qua JSON.
-    Nó loại bỏ các đối tượng websocket không thể gửi đi.
+    Dữ liệu "room" an toàn để gửi qua JSON (không có websocket, timer task).
+    Dùng snapshot đã cache của Room, chỉ dựng lại khi phòng thay đổi.
     """
     if not room: return None
-    
-    # [SỬA LỖI] Dùng deep copy (copy sâu) cho player
-    # để tránh lỗi tham chiếu khi cập nhật P1, P2
-    clean_room = {
-        "room_id": room.get("room_id"),
-        "password": room.get("password"),
-        "board": room.get("board"),
-        "turn": room.get("turn"),
-        "settings": room.get("settings"),
-        "score": room.get("score"),
-        "game_mode": room.get("game_mode", 5),  # Thêm game mode
-        "timer_task": None # Không bao giờ gửi task
-    }
-    
-    # Xử lý Player 1
-    if room.get("player1"):
-        clean_room["player1"] = room["player1"].copy()
-        clean_room["player1"].pop("websocket", None) # Xóa key 'websocket'
-        
-    # Xử lý Player 2
-    if room.get("player2"):
-        clean_room["player2"] = room["player2"].copy()
-        clean_room["player2"].pop("websocket", None) # Xóa key 'websocket'
-        
-    return clean_room
+    return room.snapshot()
 
 
-# --- HELPER: SAFE SEND ---
-async def _safe_send(ws, payload):
-    """Gửi payload (dictionary) tới websocket một cách an toàn.
-    Trả về True nếu gửi thành công, False nếu lỗi hoặc ws là None.
+# --- HELPER: MÃ HÓA & GỬI TIN (xem transport.py) ---
+_encode = transport.prepare         # payload -> Frame, mã hóa mỗi định dạng một lần
+_send_frame = transport.send_frame
+_safe_send = transport.safe_send
+_broadcast = transport.broadcast
+
+# --- NGƯỜI XEM ---
+def _notify_spectators(room, payload, watchers=None):
     """
-    if not ws:
-        return False
-    try:
-        await ws.send(json.dumps(payload))
-        return True
-    except Exception as e:
-        print(f"[SAFE_SEND ERROR] {e}")
-        return False
+    Gửi sự kiện cho mọi người xem của phòng: mã hóa MỘT lần (mỗi định dạng) và gửi ở task nền,
+    người chơi không phải chờ. Các task của cùng một phòng nối đuôi nhau nên
+    người xem nhận sự kiện đúng thứ tự.
+    """
+    if not (watchers if watchers is not None else room.spectators):
+        return
+    frame = _encode(payload)
+    room.spectator_tail = asyncio.get_running_loop().create_task(
+        _fan_out_spectators(room, frame, room.spectator_tail, watchers))
+
+async def _fan_out_spectators(room, frame, previous, watchers=None):
+    if previous is not None and not previous.done():
+        await asyncio.wait((previous,))
+    # Danh sách người xem lấy lúc gửi (người vào xem sau đã có snapshot mới hơn)
+    targets = list(watchers if watchers is not None else (room.spectators or ()))
+    if targets:
+        results = await asyncio.gather(*(_send_frame(ws, frame) for ws in targets))
+        SPECTATOR_FRAMES.inc(sum(results))
+        for ws, ok in zip(targets, results):
+            if not ok and not transport.is_open(ws):
+                _stop_watching(ws)  # Kết nối hỏng: bỏ khỏi danh sách xem
+    if room.spectator_tail is asyncio.current_task():
+        room.spectator_tail = None
+
+def _spectator_view(room):
+    """Dữ liệu phòng cho người xem (không có mật khẩu), kèm người cầm X nếu đang chơi."""
+    data = {key: value for key, value in room.snapshot().items() if key != "password"}
+    data["player_x"] = room.move_log.player_x if room.move_log is not None else None
+    data["spectators"] = room.spectator_count()
+    return data
+
+def _notify_room_update(room):
+    """Người vào/rời/sẵn sàng: gửi trạng thái phòng mới cho người xem."""
+    if room.spectators:
+        _notify_spectators(room, {"status": "SPECTATE_ROOM_UPDATE", "room_data": _spectator_view(room)})
+
+def _stop_watching(websocket):
+    """Bỏ websocket khỏi phòng đang xem (nếu có). Trả về mã phòng đã xem hoặc None."""
+    room_code = getattr(websocket, 'watching', None)
+    if room_code is None:
+        return None
+    websocket.watching = None
+    room = ACTIVE_ROOMS.get(room_code)
+    if room and room.spectators and websocket in room.spectators:
+        room.remove_spectator(websocket)
+        SPECTATORS.dec()
+    return room_code
+
+def _close_spectators(room):
+    """Phòng bị xóa: báo cho người xem và gỡ họ khỏi phòng."""
+    if not room.spectators:
+        return
+    watchers = list(room.spectators)
+    room.spectators = None
+    for ws in watchers:
+        ws.watching = None
+    SPECTATORS.dec(len(watchers))
+    _notify_spectators(room, {"status": "SPECTATE_ROOM_CLOSED", "room_id": room.room_id}, watchers)
+
+# --- CHỈ MỤC PHÒNG CHỜ ---
+def _sync_waiting_index(room):
+    """
+    Đồng bộ vị trí của room trong WAITING_ROOMS với trạng thái hiện tại.
+    Gọi sau mỗi thay đổi: tạo phòng, vào/rời phòng, bắt đầu/kết thúc game, đổi mật khẩu,
+    chủ phòng mất kết nối (giữ chỗ) hoặc quay lại (RESUME).
+    Phòng vẫn ở đúng ngăn cũ thì giữ nguyên vị trí (không bị đẩy xuống cuối).
+    """
+    code = room.room_id
+    current = room.waiting_slot
+    wanted = None
+    # Chủ phòng đang được giữ chỗ (không có websocket) thì không ai vào được
+    if (ACTIVE_ROOMS.get(code) is room and room.player1 and room.player1.websocket is not None and
+            room.player2 is None and room.board is None):
+        wanted = (room.game_mode, "private" if room.password else "public")
+
+    if current == wanted:
+        return
+    if current:
+        WAITING_ROOMS[current[0]][current[1]].pop(code, None)
+    if wanted:
+        slots = WAITING_ROOMS.setdefault(wanted[0], {"public": {}, "private": {}})
+        slots[wanted[1]][code] = room
+        # Vào ngăn ở cuối: số thứ tự mới giữ mỗi ngăn tăng dần theo created_seq (heapq.merge cần vậy)
+        room.created_seq = next(_room_seq)
+    room.waiting_slot = wanted
+
+def _index_seats(room):
+    """Ghi các chỗ ngồi của room vào PLAYER_ROOMS (gọi sau khi tạo phòng / có người vào)."""
+    for slot in room.players():
+        PLAYER_ROOMS[slot.user_id] = room
+
+def _unindex_seat(user_id, room):
+    """user_id vừa rời room: bỏ khỏi PLAYER_ROOMS (nếu vẫn đang trỏ tới room này)."""
+    if PLAYER_ROOMS.get(user_id) is room:
+        del PLAYER_ROOMS[user_id]
+
+def _iter_waiting_rooms(game_mode=None, public_only=False):
+    """Duyệt các phòng chờ (lọc theo game_mode nếu có) theo thứ tự tạo phòng."""
+    if game_mode is None:
+        slots = list(WAITING_ROOMS.values())
+    else:
+        slots = [WAITING_ROOMS[game_mode]] if game_mode in WAITING_ROOMS else []
+    kinds = ("public",) if public_only else ("public", "private")
+    sources = [slot[kind].values() for slot in slots for kind in kinds if slot[kind]]
+    if len(sources) == 1:
+        return iter(sources[0])
+    return heapq.merge(*sources, key=lambda r: r.created_seq)
+
+# --- HÀNG ĐỢI VÀO NHANH ---
+class _QueueTicket:
+    """Một người đang chờ ghép trận. Vé bị hủy chỉ đánh dấu active=False, deque bỏ qua sau."""
+    __slots__ = ("websocket", "user_id", "game_mode", "enqueued_at", "active")
+
+    def __init__(self, websocket, game_mode):
+        self.websocket = websocket
+        self.user_id = websocket.user_id
+        self.game_mode = game_mode
+        self.enqueued_at = time.monotonic()
+        self.active = True
+
+_ROOM_GAUGES = {}  # {(game_mode, state): Gauge}
+
+@metrics.add_collector
+def _collect_room_metrics():
+    """Đếm phòng theo game mode/trạng thái khi có người đọc /metrics (không tốn gì trên mỗi thao tác)."""
+    counts = {}
+    for room in ACTIVE_ROOMS.values():
+        key = (room.game_mode, "playing" if room.in_game else "waiting")
+        counts[key] = counts.get(key, 0) + 1
+    for key, gauge in _ROOM_GAUGES.items():
+        gauge.set(counts.pop(key, 0))
+    for (game_mode, state), count in counts.items():
+        gauge = _ROOM_GAUGES[(game_mode, state)] = metrics.gauge(
+            "caro_active_rooms", "Số phòng theo game mode và trạng thái", mode=str(game_mode), state=state)
+        gauge.set(count)
+
+def _queue_length_gauge(game_mode):
+    return metrics.gauge("caro_matchmaking_queue_length", "Số người đang chờ trong hàng đợi",
+                         mode=str(game_mode))
+
+def _enqueue_ticket(websocket, game_mode):
+    """Thêm vé vào cuối hàng đợi của game_mode. Trả về vé."""
+    ticket = _QueueTicket(websocket, game_mode)
+    MATCH_QUEUES.setdefault(game_mode, deque()).append(ticket)
+    QUEUE_TICKETS[ticket.user_id] = ticket
+    websocket.queued = game_mode  # RemoteSocket còn vé thì chưa trả về worker gốc (cluster.py)
+    _queue_length_gauge(game_mode).inc()
+    _ensure_queue_sweeper()
+    return ticket
+
+def _retire_ticket(ticket):
+    """Gỡ vé khỏi chỉ mục (O(1)); phần tử trong deque được bỏ qua khi tới đầu hàng."""
+    if not ticket.active:
+        return
+    ticket.active = False
+    ticket.websocket.queued = None
+    if QUEUE_TICKETS.get(ticket.user_id) is ticket:
+        del QUEUE_TICKETS[ticket.user_id]
+    _queue_length_gauge(ticket.game_mode).dec()
+
+def _queue_head(game_mode):
+    """Vé còn hiệu lực ở đầu hàng đợi (dọn các vé đã hủy/mất kết nối), hoặc None."""
+    queue = MATCH_QUEUES.get(game_mode)
+    while queue:
+        ticket = queue[0]
+        if ticket.active and transport.is_open(ticket.websocket):
+            return ticket
+        queue.popleft()
+        if ticket.active:
+            QUEUE_CANCELLED.inc()
+            _retire_ticket(ticket)
+    return None
+
+def _pop_match(game_mode):
+    """
+    Lấy vé chờ lâu nhất có thể ghép với người yêu cầu game_mode:
+    - mode cụ thể: hàng đợi cùng mode hoặc hàng đợi "ANY"
+    - "ANY": đầu của bất kỳ hàng đợi nào
+    """
+    modes = list(MATCH_QUEUES) if game_mode == "ANY" else [game_mode, "ANY"]
+    best = None
+    for mode in modes:
+        head = _queue_head(mode)
+        if head and (best is None or head.enqueued_at < best.enqueued_at):
+            best = head
+    if best:
+        MATCH_QUEUES[best.game_mode].popleft()
+        _retire_ticket(best)
+        QUEUE_MATCHED.inc()
+        TIME_TO_MATCH.observe(time.monotonic() - best.enqueued_at)
+    return best
+
+def _cancel_queue_ticket(websocket):
+    """Hủy vé của websocket (nếu có). Trả về game_mode của vé đã hủy hoặc None."""
+    ticket = QUEUE_TICKETS.get(getattr(websocket, "user_id", None))
+    if ticket is None or ticket.websocket is not websocket:
+        return None
+    _retire_ticket(ticket)
+    QUEUE_CANCELLED.inc()
+    return ticket.game_mode
+
+def drop_queue_ticket(websocket):
+    """Bỏ vé vào nhanh của kết nối sắp mất user_id (bị đăng xuất vì đăng nhập nơi khác)."""
+    game_mode = _cancel_queue_ticket(websocket)
+    if game_mode is not None:
+        queue_log.info("Hủy vé vào nhanh của kết nối bị đăng xuất", user=websocket.user_id, game_mode=game_mode)
+    return game_mode
+
+def _ensure_queue_sweeper():
+    global _queue_sweeper
+    if _queue_sweeper is None or _queue_sweeper.done():
+        _queue_sweeper = asyncio.create_task(_sweep_expired_tickets())
+
+async def _sweep_expired_tickets():
+    """Định kỳ loại các vé chờ quá QUICK_JOIN_TIMEOUT và báo cho client. Tự dừng khi hết vé."""
+    while QUEUE_TICKETS:
+        await asyncio.sleep(QUICK_JOIN_SWEEP_INTERVAL)
+        deadline = time.monotonic() - QUICK_JOIN_TIMEOUT
+        expired = []
+        for mode, queue in list(MATCH_QUEUES.items()):
+            # Vé trong deque theo thứ tự vào hàng nên vé hết hạn luôn nằm ở đầu
+            while queue and (not queue[0].active or queue[0].enqueued_at <= deadline):
+                ticket = queue.popleft()
+                if ticket.active:
+                    _retire_ticket(ticket)
+                    expired.append(ticket)
+            if not queue:
+                del MATCH_QUEUES[mode]
+        for ticket in expired:
+            QUEUE_EXPIRED.inc()
+            queue_log.info("Hết thời gian chờ vào nhanh", user=ticket.user_id, game_mode=ticket.game_mode)
+            await _safe_send(ticket.websocket, {
+                "status": "QUICK_JOIN_TIMEOUT",
+                "message": "Không tìm thấy trận. Thử lại sau."
+            })
+            cluster.release_if_idle(ticket.websocket)
+
+def matchmaking_stats():
+    """Số người đang chờ theo từng mode."""
+    counts = {}
+    for ticket in QUEUE_TICKETS.values():
+        counts[ticket.game_mode] = counts.get(ticket.game_mode, 0) + 1
+    return {"waiting": counts, "matched": QUEUE_MATCHED.value,
+            "expired": QUEUE_EXPIRED.value, "cancelled": QUEUE_CANCELLED.value,
+            "time_to_match": TIME_TO_MATCH.snapshot()}
 
 # --- Hàm Tạo mã ---
 def generate_room_code(length=5):
-    """Tạo một mã phòng ngẫu nhiên (ví dụ: 'A5K2P') và đảm bảo nó là duy nhất."""
+    """
+    Tạo một mã phòng ngẫu nhiên (ví dụ: 'A5K2P') và đảm bảo nó là duy nhất.
+    Khi chạy nhiều worker, chỉ nhận mã thuộc shard của worker này (cluster.owns).
+    """
     while True:
         code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-        if code not in ACTIVE_ROOMS:
+        if code not in ACTIVE_ROOMS and cluster.owns(code):
             return code
 
 # --- Chức năng 1: TẠO PHÒNG ---
@@ -88,41 +334,37 @@ async def handle_create_room(websocket, payload):
         user_id = websocket.user_id
         username = websocket.username
         password = payload.get("password", "") 
-        settings = payload.get("settings", { "time_limit": 120 }) 
+        settings = payload.get("settings")  # None = dùng cài đặt mặc định chung
         game_mode = payload.get("game_mode", 5)  # Mặc định 5 quân
+        _stop_watching(websocket)
         room_code = generate_room_code()
         
-        print(f"[TẠO PHÒNG] User {username} (ID: {user_id}) đã tạo phòng: {room_code}, Game mode: {game_mode}")
+        room_log.info("Tạo phòng", room=room_code, user=user_id, username=username, game_mode=game_mode)
         
-        ACTIVE_ROOMS[room_code] = {
-            "room_id": room_code,
-            "password": password,
-            "player1": {
-                "websocket": websocket, "user_id": user_id,
-                "username": username, "is_ready": False 
-            },
-            "player2": None, "board": None, "turn": None,
-            "settings": settings,
-            "timer_task": None,
-            "consecutive_timeouts": 0,
-            "game_mode": game_mode  # Thêm game mode vào room
-        }
+        room = Room(room_code, PlayerSlot(websocket, user_id, username),
+                    password=password, settings=settings, game_mode=game_mode,
+                    created_seq=next(_room_seq))
+        ACTIVE_ROOMS[room_code] = room
+        _index_seats(room)
+        _sync_waiting_index(room)
         
         websocket.room_code = room_code 
         
-        await websocket.send(json.dumps({
+        await _safe_send(websocket, {
             "status": "ROOM_CREATED",
             "message": "Tạo phòng thành công!",
             "room_id": room_code,
             # [SỬA LỖI] Gửi data SẠCH
-            "room_data": _get_clean_room_data(ACTIVE_ROOMS[room_code]) 
-        }))
+            "room_data": _get_clean_room_data(room) 
+        })
+        # Phòng chờ có thể nằm yên rất lâu, không giữ snapshot trong bộ nhớ
+        room.release_snapshot()
         
     except AttributeError:
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Bạn phải đăng nhập."}))
-    except Exception as e:
-        print(f"[LỖI TẠO PHÒNG] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi khi tạo phòng."}))
+        await _safe_send(websocket, {"status": "ERROR", "message": "Bạn phải đăng nhập."})
+    except Exception:
+        room_log.exception("Lỗi khi tạo phòng", user=getattr(websocket, "user_id", None))
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi tạo phòng."})
 
 # --- Chức năng 2: THAM GIA PHÒNG (Nhập mã) ---
 async def handle_join_room(websocket, payload):
@@ -137,82 +379,74 @@ async def handle_join_room(websocket, payload):
         password = payload.get("password", "")
         client_game_mode = payload.get("game_mode", 5)  # Mặc định 5 quân
         
-        print(f"[DEBUG] Nhận yêu cầu vào phòng. Payload: {payload}")
-        print(f"[DEBUG] Client game mode: {client_game_mode}")
+        room_log.debug("Nhận yêu cầu vào phòng", user=server_user_id, payload=payload)
         
         if not room_code:  # Kiểm tra riêng trường hợp room_code trống
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Vui lòng nhập mã phòng."}))
+            await _safe_send(websocket, {"status": "ERROR", "message": "Vui lòng nhập mã phòng."})
             return
         
         # Kiểm tra tính hợp lệ của phòng
-        print(f"[DEBUG] Đang kiểm tra phòng '{room_code}'. Các phòng hiện tại: {list(ACTIVE_ROOMS.keys())}")
         if not room_code:
-            await websocket.send(json.dumps({
+            await _safe_send(websocket, {
                 "status": "ERROR", 
                 "message": "Vui lòng nhập mã phòng"
-            }))
+            })
             return
             
         if room_code not in ACTIVE_ROOMS:
-            await websocket.send(json.dumps({
+            await _safe_send(websocket, {
                 "status": "ERROR", 
                 "message": "Phòng này không tồn tại hoặc đã bị đóng"
-            }))
+            })
             return
             
         room = ACTIVE_ROOMS[room_code]
         
         # Kiểm tra trạng thái phòng
-        if room["player2"] is not None:
-            await websocket.send(json.dumps({
+        if room.player2 is not None:
+            await _safe_send(websocket, {
                 "status": "ERROR", 
                 "message": "Phòng này đã đầy"
-            }))
+            })
             return
             
         # Kiểm tra mật khẩu
-        if room["password"] and room["password"] != password:
-            await websocket.send(json.dumps({
+        if room.password and room.password != password:
+            await _safe_send(websocket, {
                 "status": "ERROR", 
                 "message": "Sai mật khẩu phòng"
-            }))
+            })
             return
             
         # Kiểm tra game mode có khớp không (bỏ qua nếu client_game_mode = "ANY")
-        room_game_mode = room.get("game_mode", 5)
+        room_game_mode = room.game_mode
         if client_game_mode != "ANY" and client_game_mode != room_game_mode:
-            await websocket.send(json.dumps({
+            await _safe_send(websocket, {
                 "status": "ERROR", 
                 "message": f"Chế độ game không khớp. Phòng: {room_game_mode} quân, Bạn chọn: {client_game_mode} quân"
-            }))
+            })
             return
             
-        print(f"[VÀO PHÒNG] User {server_username} (ID: {server_user_id}) đã vào phòng: {room_code}, Game mode: {room_game_mode}")
-        room["player2"] = {
-            "websocket": websocket, "user_id": server_user_id,
-            "username": server_username, "is_ready": False 
-        }
+        room_log.info("Vào phòng", room=room_code, user=server_user_id, username=server_username, game_mode=room_game_mode)
+        _stop_watching(websocket)
+        room.seat_guest(PlayerSlot(websocket, server_user_id, server_username))
+        _index_seats(room)
+        _sync_waiting_index(room)
         websocket.room_code = room_code
-        
-        print(f"[DEBUG] Player2 đã được gán: {room['player2']}")
-        print(f"[DEBUG] Chuẩn bị lấy clean_room_data...")
+        _notify_room_update(room)
         
         # Lấy dữ liệu phòng sạch để gửi
         clean_room_data = _get_clean_room_data(room)
         
-        print(f"[DEBUG] Đã lấy clean_room_data, chuẩn bị gửi JOIN_SUCCESS...")
-        
         # Gửi thông tin cho người chơi mới (player2)
-        await websocket.send(json.dumps({
+        await _safe_send(websocket, {
             "status": "JOIN_SUCCESS",
             "message": "Tham gia phòng thành công!",
             "room_data": clean_room_data
-        }))
-        
-        print(f"[DEBUG] Đã gửi JOIN_SUCCESS, chuẩn bị gửi OPPONENT_JOINED...")
+        })
         
         # Gửi thông báo cho chủ phòng (player1)
-        player1_ws = room["player1"]["websocket"]
+        player1_ws = room.player1.websocket
         try:
             # Gửi cả 'opponent' (tách riêng) và 'room_data' để client có thể cập nhật an toàn
             payload = {
@@ -223,25 +457,36 @@ async def handle_join_room(websocket, payload):
             }
             # Dùng hàm an toàn để gửi
             await _safe_send(player1_ws, payload)
-            print(f"[DEBUG] Đã gửi OPPONENT_JOINED cho player1 (payload includes opponent + room_data)")
         except Exception as send_error:
-            print(f"[DEBUG] Không thể gửi OPPONENT_JOINED cho player1: {send_error}")
-        
-        print(f"[DEBUG] Chuẩn bị gửi OPPONENT_JOINED cho player1...")
+            room_log.warning("Không thể gửi OPPONENT_JOINED cho player1", room=room_code, error=str(send_error))
         
         # [THAY ĐỔI] Không tự động bắt đầu game nữa, chờ cả hai ready
-        print(f"[JOIN ROOM] Player2 đã join, chờ cả hai ready để bắt đầu game...")
+        room_log.debug("Player2 đã join, chờ cả hai ready để bắt đầu game", room=room_code)
         
     except AttributeError as ae:
-        print(f"[LỖI VÀO PHÒNG - AttributeError] {ae}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Bạn phải đăng nhập."}))
-    except Exception as e:
-        print(f"[LỖI VÀO PHÒNG] {e}")
-        import traceback
-        traceback.print_exc()
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi khi vào phòng."}))
+        room_log.warning("Vào phòng khi chưa đăng nhập", error=str(ae))
+        await _safe_send(websocket, {"status": "ERROR", "message": "Bạn phải đăng nhập."})
+    except Exception:
+        room_log.exception("Lỗi khi vào phòng", user=getattr(websocket, "user_id", None))
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi vào phòng."})
 
 # --- Chức năng 3: TÌM PHÒNG ---
+@cluster.rpc_handler("waiting_rooms")
+async def _rpc_waiting_rooms(game_mode=None):
+    return list_waiting_rooms(game_mode)
+
+def list_waiting_rooms(game_mode=None):
+    """Danh sách phòng đang chờ của worker này (dạng gửi trong ROOM_LIST)."""
+    # Chỉ duyệt chỉ mục phòng chờ (O(k) với k = số phòng phù hợp)
+    return [{
+        "room_id": room.room_id,
+        "host_name": room.player1.username,
+        "has_password": bool(room.password),
+        "settings": room.settings,
+        "game_mode": room.game_mode,  # Thêm game_mode để client hiển thị
+        "created_time": ""
+    } for room in _iter_waiting_rooms(game_mode)]
+
 async def handle_find_room(websocket, payload):
     """
     Gửi cho client danh sách các phòng đang chờ, lọc theo game_mode nếu có.
@@ -250,148 +495,161 @@ async def handle_find_room(websocket, payload):
         # Lấy game_mode từ payload để lọc phòng
         client_game_mode = payload.get("game_mode") if payload else None
         
-        waiting_rooms = []
-        for code, room in ACTIVE_ROOMS.items():
-            if room["player2"] is None and room["board"] is None:
-                room_game_mode = room.get("game_mode", 5)
-                
-                # Chỉ thêm phòng nếu game_mode khớp hoặc không có yêu cầu lọc
-                if client_game_mode is None or room_game_mode == client_game_mode:
-                    # Clean room data cho danh sách
-                    waiting_rooms.append({
-                        "room_id": code,
-                        "host_name": room["player1"]["username"],
-                        "has_password": bool(room["password"]),
-                        "settings": room["settings"],
-                        "game_mode": room_game_mode,  # Thêm game_mode để client hiển thị
-                        "created_time": room.get("created_time", "")
-                    })
+        waiting_rooms = list_waiting_rooms(client_game_mode)
+        # Phòng của các worker khác (nếu chạy nhiều worker)
+        for rooms in await cluster.call_all("waiting_rooms", game_mode=client_game_mode):
+            waiting_rooms.extend(rooms)
         
-        print(f"[FIND_ROOM] Client game_mode: {client_game_mode}, Found {len(waiting_rooms)} rooms")
-        await websocket.send(json.dumps({
+        room_log.debug("Tìm phòng", user=getattr(websocket, "user_id", None), game_mode=client_game_mode, found=len(waiting_rooms))
+        await _safe_send(websocket, {
             "status": "ROOM_LIST",
             "rooms": waiting_rooms
-        }))
-    except Exception as e:
-        print(f"[LỖI TÌM PHÒNG] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi khi tải danh sách phòng."}))
+        })
+    except Exception:
+        room_log.exception("Lỗi khi tải danh sách phòng")
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi tải danh sách phòng."})
+
+# --- Chức năng: XEM PHÒNG ---
+async def handle_watch_room(websocket, payload):
+    """
+    Vào xem một phòng (không chiếm chỗ ngồi). Người xem nhận ngay trạng thái
+    hiện tại (bàn cờ, lượt, tỉ số), sau đó là các sự kiện SPECTATE_*.
+    """
+    try:
+        room_code = payload.get("room_id")
+        password = payload.get("password", "")
+        
+        if hasattr(websocket, 'room_code'):
+            await _safe_send(websocket, {"status": "ERROR", "message": "Bạn đang ở trong phòng, hãy rời phòng trước khi xem."})
+            return
+        room = ACTIVE_ROOMS.get(room_code) if room_code else None
+        if room is None:
+            await _safe_send(websocket, {"status": "ERROR", "message": "Phòng này không tồn tại hoặc đã bị đóng"})
+            return
+        if room.password and room.password != password:
+            await _safe_send(websocket, {"status": "ERROR", "message": "Sai mật khẩu phòng"})
+            return
+        
+        if getattr(websocket, 'watching', None) != room_code:
+            if room.spectator_count() >= SPECTATOR_LIMIT:
+                await _safe_send(websocket, {"status": "ERROR", "message": "Phòng đã đủ số người xem."})
+                return
+            _stop_watching(websocket)
+            room.add_spectator(websocket)
+            websocket.watching = room_code
+            SPECTATORS.inc()
+            room_log.info("Vào xem phòng", room=room_code, user=websocket.user_id, spectators=room.spectator_count())
+        
+        await _safe_send(websocket, {"status": "WATCH_SUCCESS", "room_data": _spectator_view(room)})
+    except Exception:
+        room_log.exception("Lỗi khi vào xem phòng")
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi vào xem phòng."})
+
+async def handle_unwatch_room(websocket, payload=None):
+    """Thôi xem phòng."""
+    room_code = _stop_watching(websocket)
+    if room_code is not None:
+        room_log.info("Thôi xem phòng", room=room_code, user=websocket.user_id)
+    await _safe_send(websocket, {"status": "UNWATCH_SUCCESS", "room_id": room_code})
 
 # --- Chức năng 4: VÀO NHANH ---
+def _oldest_public_room(game_mode, user_id):
+    """Phòng công khai chờ lâu nhất của worker này mà user_id vào được (không phải phòng của chính mình)."""
+    lookup_mode = None if game_mode == "ANY" else game_mode
+    for room in _iter_waiting_rooms(lookup_mode, public_only=True):
+        if room.player1.user_id != user_id:
+            return room
+    return None
+
+@cluster.rpc_handler("quick_join_room")
+async def _rpc_quick_join_room(game_mode, user_id):
+    room = _oldest_public_room(game_mode, user_id)
+    return room.room_id if room else None
+
 async def handle_quick_join(websocket, payload):
     """
     Tự động tìm phòng chờ hoặc tạo phòng mới.
+    Khi chạy nhiều worker, hàm này chỉ chạy ở cluster.MATCHMAKER (server.py
+    chuyển QUICK_JOIN tới đó) nên mọi người chờ nằm chung một hàng đợi.
     """
-    global QUICK_JOIN_WAITING_PLAYERS
     try:
         user_id = websocket.user_id
         username = websocket.username
         client_game_mode = payload.get("game_mode", 5) if payload else 5
         
-        print(f"[QUICK JOIN] {username} muốn chơi chế độ {client_game_mode}")
+        queue_log.debug("Yêu cầu vào nhanh", user=user_id, game_mode=client_game_mode)
 
-        # [SỬA LỖI] Cấm tự chơi - kiểm tra trong hàng đợi
-        if client_game_mode != "ANY":
-            waiting_player = QUICK_JOIN_WAITING_PLAYERS.get(client_game_mode)
-            if waiting_player and waiting_player.user_id == user_id:
-                await websocket.send(json.dumps({"status": "ERROR", "message": "Bạn đã đang trong hàng đợi."})) 
+        # [SỬA LỖI] Cấm tự chơi - mỗi user chỉ có một vé trong hàng đợi
+        if user_id in QUEUE_TICKETS:
+            await _safe_send(websocket, {"status": "ERROR", "message": "Bạn đã đang trong hàng đợi."}) 
+            return
+        _stop_watching(websocket)
+
+        # [LOGIC MỚI] 1. Lấy phòng công khai đang chờ lâu nhất từ chỉ mục
+        # Nếu client_game_mode = "ANY", ghép với bất kỳ phòng nào
+        # Nếu không, chỉ ghép với phòng cùng game mode
+        found_room = _oldest_public_room(client_game_mode, user_id)
+        if found_room is None:
+            # Phòng chờ của các worker khác: client vào phòng đó bằng JOIN_ROOM từ worker gốc
+            # (phòng có thể vừa đầy, khi đó client nhận lỗi của JOIN_ROOM như khi tự nhập mã)
+            remote_codes = [code for code in await cluster.call_all(
+                "quick_join_room", game_mode=client_game_mode, user_id=user_id) if code]
+            if remote_codes:
+                queue_log.info("Vào nhanh: tham gia phòng của worker khác", room=remote_codes[0], user=user_id)
+                await cluster.hand_off(websocket, transport.encode(
+                    {"action": "JOIN_ROOM", "payload": {"room_id": remote_codes[0]}}))
                 return
-        else:
-            # Với mode "ANY", kiểm tra tất cả các hàng đợi
-            for mode_players in QUICK_JOIN_WAITING_PLAYERS.values():
-                if mode_players and mode_players.user_id == user_id:
-                    await websocket.send(json.dumps({"status": "ERROR", "message": "Bạn đã đang trong hàng đợi."})) 
-                    return
-
-        # [LOGIC MỚI] 1. Quét các phòng "Tạo phòng" (ACTIVE_ROOMS) đang chờ
-        found_room = None
-        for room_code, room in ACTIVE_ROOMS.items():
-            if (room["player2"] is None and 
-                not room["password"] and 
-                room["board"] is None and 
-                room["player1"]["user_id"] != user_id):
-                
-                # Nếu client_game_mode = "ANY", ghép với bất kỳ phòng nào
-                # Nếu không, chỉ ghép với phòng cùng game mode
-                if (client_game_mode == "ANY" or 
-                    room.get("game_mode", 5) == client_game_mode):
-                    found_room = room
-                    break
 
         if found_room:
             # 2. NẾU TÌM THẤY PHÒNG -> Tham gia phòng đó
-            room_code = found_room["room_id"]
-            print(f"[VÀO NHANH] User {username} đã tìm thấy và tham gia phòng {room_code}")
+            room_code = found_room.room_id
+            queue_log.info("Vào nhanh: tham gia phòng có sẵn", room=room_code, user=user_id)
             
-            found_room["player2"] = {
-                "websocket": websocket, "user_id": user_id,
-                "username": username, "is_ready": False
-            }
+            found_room.seat_guest(PlayerSlot(websocket, user_id, username))
+            _index_seats(found_room)
+            _sync_waiting_index(found_room)
             websocket.room_code = room_code
 
-            player1_ws = found_room["player1"]["websocket"]
+            player1_ws = found_room.player1.websocket
             clean_room_data = _get_clean_room_data(found_room)
 
-            await websocket.send(json.dumps({
+            await _safe_send(websocket, {
                 "status": "JOIN_SUCCESS",
                 "message": "Đã tìm thấy phòng!",
                 "room_data": clean_room_data
-            }))
+            })
             
-            await player1_ws.send(json.dumps({
+            await _safe_send(player1_ws, {
                 "status": "OPPONENT_JOINED",
                 "message": f"{username} đã vào phòng.",
                 "opponent": clean_room_data.get("player2")
-            }))
+            })
             
             # [BỎ AUTO START] Không tự động bắt đầu game, cần cả 2 người sẵn sàng
             return
 
-        # 3. NẾU KHÔNG TÌM THẤY PHÒNG -> Dùng logic hàng đợi (queue) theo game_mode
-        print(f"[VÀO NHANH] Không tìm thấy phòng trống cho {client_game_mode}. User {username} vào hàng đợi...")
+        # 3. NẾU KHÔNG TÌM THẤY PHÒNG -> Dùng hàng đợi (queue) theo game_mode
+        queue_log.debug("Không tìm thấy phòng trống, chuyển sang hàng đợi", user=user_id, game_mode=client_game_mode)
 
-        # Với mode "ANY", tìm bất kỳ người chờ nào
-        matched_player = None
-        matched_mode = None
-        
-        if client_game_mode == "ANY":
-            # Tìm bất kỳ người chờ nào trong các mode
-            for mode, waiting_player in QUICK_JOIN_WAITING_PLAYERS.items():
-                if waiting_player and mode != "ANY":
-                    matched_player = waiting_player
-                    matched_mode = mode
-                    break
-        else:
-            # Tìm người chờ cùng mode hoặc mode "ANY" 
-            if client_game_mode in QUICK_JOIN_WAITING_PLAYERS and QUICK_JOIN_WAITING_PLAYERS[client_game_mode]:
-                matched_player = QUICK_JOIN_WAITING_PLAYERS[client_game_mode]
-                matched_mode = client_game_mode
-            elif "ANY" in QUICK_JOIN_WAITING_PLAYERS and QUICK_JOIN_WAITING_PLAYERS["ANY"]:
-                matched_player = QUICK_JOIN_WAITING_PLAYERS["ANY"]
-                matched_mode = client_game_mode  # Dùng mode của người join sau
-
-        if matched_player:
-            del QUICK_JOIN_WAITING_PLAYERS[matched_mode if matched_mode != "ANY" else "ANY"]  # Xóa khỏi hàng đợi
+        # Lấy người chờ lâu nhất phù hợp (cùng mode / "ANY")
+        matched_ticket = _pop_match(client_game_mode)
+
+        if matched_ticket:
+            matched_player = matched_ticket.websocket
             
             room_code = generate_room_code()
-            final_game_mode = matched_mode if matched_mode != "ANY" else client_game_mode
-            print(f"[VÀO NHANH] Ghép 2 người chờ {matched_player.username} và {websocket.username} vào phòng {room_code} (chế độ {final_game_mode})")
+            # Mode cụ thể được ưu tiên; hai người cùng chọn "ANY" thì chơi mode mặc định
+            final_game_mode = client_game_mode if client_game_mode != "ANY" else matched_ticket.game_mode
+            if final_game_mode == "ANY":
+                final_game_mode = 5
+            queue_log.info("Ghép 2 người chờ vào phòng mới", room=room_code, user=user_id,
+                          opponent=matched_player.user_id, game_mode=final_game_mode)
             
-            room = {
-                "room_id": room_code, "password": "",
-                "player1": {
-                    "websocket": matched_player, "user_id": matched_player.user_id,
-                    "username": matched_player.username, "is_ready": False
-                },
-                "player2": {
-                    "websocket": websocket, "user_id": websocket.user_id,
-                    "username": websocket.username, "is_ready": False
-                },
-                "board": None, "turn": None, "settings": {"time_limit": 120},
-                "timer_task": None,
-                "consecutive_timeouts": 0,
-                "game_mode": final_game_mode  # Thêm game mode
-            }
+            room = Room(room_code, PlayerSlot.from_websocket(matched_player),
+                        game_mode=final_game_mode, created_seq=next(_room_seq))
+            room.seat_guest(PlayerSlot.from_websocket(websocket))
             ACTIVE_ROOMS[room_code] = room
+            _index_seats(room)
             
             matched_player.room_code = room_code
             websocket.room_code = room_code
@@ -399,50 +657,42 @@ async def handle_quick_join(websocket, payload):
             # [SỬA LỖI] Gửi data sạch
             clean_room_data = _get_clean_room_data(room) 
             # Gửi JOIN_SUCCESS cho cả 2 người kèm room_data
-            await _safe_send(matched_player, {"status": "JOIN_SUCCESS", "message": "Đã tìm thấy đối thủ!", "room_data": clean_room_data})
-            await _safe_send(websocket, {"status": "JOIN_SUCCESS", "message": "Đã tìm thấy đối thủ!", "room_data": clean_room_data})
+            await _broadcast([matched_player, websocket], {"status": "JOIN_SUCCESS", "message": "Đã tìm thấy đối thủ!", "room_data": clean_room_data})
             
             # [BỎ AUTO START] Không tự động bắt đầu game, cần cả 2 người sẵn sàng
         
         else:
-            # Thêm vào hàng đợi theo game_mode
-            QUICK_JOIN_WAITING_PLAYERS[client_game_mode] = websocket
+            # Thêm vào cuối hàng đợi theo game_mode
+            _enqueue_ticket(websocket, client_game_mode)
             
             wait_message = "Đang tìm đối thủ (mọi chế độ)..." if client_game_mode == "ANY" else f"Đang tìm đối thủ cho chế độ {client_game_mode} quân..."
-            await websocket.send(json.dumps({
+            await _safe_send(websocket, {
                 "status": "WAITING_FOR_MATCH",
-                "message": wait_message
-            }))
-            print(f"[QUICK JOIN] {username} đã vào hàng đợi chế độ {client_game_mode}")
+                "message": wait_message,
+                "timeout": QUICK_JOIN_TIMEOUT  # Server tự hủy vé sau số giây này
+            })
+            queue_log.info("Vào hàng đợi", user=user_id, game_mode=client_game_mode)
     
-    except Exception as e:
-        print(f"[LỖI VÀO NHANH] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi khi vào nhanh."}))
+    except Exception:
+        queue_log.exception("Lỗi khi vào nhanh", user=getattr(websocket, "user_id", None))
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi vào nhanh."})
 
 # --- [MỚI] Chức năng: HỦY VÀO NHANH ---
 async def handle_cancel_quick_join(websocket):
     """
     Xử lý khi client chủ động hủy tìm trận 'Vào nhanh'.
     """
-    global QUICK_JOIN_WAITING_PLAYERS
     try:
-        # Tìm và xóa khỏi hàng đợi của game_mode tương ứng
-        removed = False
-        for game_mode, waiting_player in list(QUICK_JOIN_WAITING_PLAYERS.items()):
-            if waiting_player == websocket:
-                del QUICK_JOIN_WAITING_PLAYERS[game_mode]
-                removed = True
-                if hasattr(websocket, 'username'):
-                    print(f"[DỌN DẸP] User {websocket.username} đã hủy chờ 'Vào nhanh' chế độ {game_mode} quân.")
-                break
-        
-        if removed:
-            await websocket.send(json.dumps({
+        # Tra chỉ mục vé và hủy (O(1))
+        game_mode = _cancel_queue_ticket(websocket)
+        if game_mode is not None:
+            queue_log.info("Hủy chờ vào nhanh", user=websocket.user_id, game_mode=game_mode)
+            await _safe_send(websocket, {
                 "status": "CANCEL_QUICK_JOIN_SUCCESS"
-            }))
+            })
             
-    except Exception as e:
-        print(f"[LỖI HỦY VÀO NHANH] {e}")
+    except Exception:
+        queue_log.exception("Lỗi khi hủy vào nhanh")
 
 # --- Chức năng 5: RỜI PHÒNG (Tự nguyện) ---
 async def handle_leave_room(websocket):
@@ -457,15 +707,12 @@ async def handle_disconnect(websocket, reason="DISCONNECT"):
     Xử lý dọn dẹp khi một client ngắt kết nối.
     """
     try:
-        global QUICK_JOIN_WAITING_PLAYERS
-        
-        # Dọn dẹp hàng đợi quick join theo game mode
-        for game_mode, waiting_player in list(QUICK_JOIN_WAITING_PLAYERS.items()):
-            if waiting_player == websocket:
-                del QUICK_JOIN_WAITING_PLAYERS[game_mode]
-                if hasattr(websocket, 'username'):
-                    print(f"[DỌN DẸP] User {websocket.username} đã hủy chờ 'Vào nhanh' chế độ {game_mode} quân.")
-                break
+        # Dọn dẹp hàng đợi quick join
+        game_mode = _cancel_queue_ticket(websocket)
+        if game_mode is not None:
+            queue_log.info("Hủy chờ vào nhanh", user=websocket.user_id, game_mode=game_mode)
+        # Đang xem phòng nào thì thôi xem
+        _stop_watching(websocket)
 
         if not hasattr(websocket, 'room_code'):
             return 
@@ -483,55 +730,205 @@ async def handle_disconnect(websocket, reason="DISCONNECT"):
         user_id = websocket.user_id
         username = websocket.username
         
-        print(f"[RỜI PHÒNG] User {username} đã rời/mất kết nối khỏi phòng {room_code}")
-        
         if hasattr(websocket, 'room_code'):
             del websocket.room_code 
         
-        if room.get("timer_task"):
-            room["timer_task"].cancel()
-            room["timer_task"] = None
-        
-        opponent_ws = None
-        opponent_id = None
-        
-        if room["player1"] and room["player1"]["user_id"] == user_id:
-            if room["player2"]: 
-                opponent_ws = room["player2"]["websocket"]
-                opponent_id = room["player2"]["user_id"]
-                room["player1"] = room["player2"]
-                room["player2"] = None
-                room["player1"]["is_ready"] = False 
-            else:
-                del ACTIVE_ROOMS[room_code]
-                print(f"[DỌN DẸP] Phòng {room_code} bị xóa (chủ phòng thoát khi 1 mình).")
-                return 
-        
-        elif room["player2"] and room["player2"]["user_id"] == user_id:
-            opponent_ws = room["player1"]["websocket"]
-            opponent_id = room["player1"]["user_id"]
-            room["player2"] = None 
-            room["player1"]["is_ready"] = False 
+        # Mất kết nối (không chủ động rời): giữ chỗ một lúc để client RESUME lại
+        if reason == "DISCONNECT" and RESUME_GRACE_PERIOD > 0 and room.slot_of(user_id):
+            await _hold_seat(room, user_id, username)
+            return
         
-        if opponent_ws:
-            print(f"-> Thông báo cho người chơi còn lại (ID: {opponent_id})")
-            try:
-                if room.get("board") is not None:
-                    await _handle_game_over(room, winner_id=opponent_id, loser_id=user_id, reason="OPPONENT_LEFT")
-                else:
-                    # [SỬA LỖI] Gửi data sạch
-                    await _safe_send(opponent_ws, {
-                        "status": "OPPONENT_LEFT",
-                        "message": f"{username} đã rời phòng. Bạn quay về phòng chờ.",
-                        "room_data": _get_clean_room_data(room)
-                    })
-            except Exception as e:
-                print(f"[ERROR_NOTIFY_OPPONENT] {e}")
+        room_log.info("Rời phòng", room=room_code, user=user_id, reason=reason)
+        await _leave_room(room, user_id, username)
         
     except AttributeError:
-        print(f"[THOÁT] Một client chưa đăng nhập đã thoát.")
-    except Exception as e:
-        print(f"[LỖI RỜI PHÒNG] {e}")
+        room_log.debug("Một client chưa đăng nhập đã thoát")
+    except Exception:
+        room_log.exception("Lỗi khi rời phòng")
+
+async def _leave_room(room, user_id, username):
+    """Đưa người chơi ra khỏi phòng và thông báo cho người còn lại."""
+    room_code = room.room_id
+    room.cancel_timer()
+    _PAUSED_TURNS.pop(room_code, None)
+    
+    if not room.slot_of(user_id):
+        return
+    # Người còn lại (nếu có) lên làm chủ phòng
+    opponent = room.remove_player(user_id)
+    _unindex_seat(user_id, room)
+    if opponent is None:
+        _close_spectators(room)
+        del ACTIVE_ROOMS[room_code]
+        _sync_waiting_index(room)
+        room_log.info("Xóa phòng (chủ phòng thoát khi 1 mình)", room=room_code)
+        return 
+    _sync_waiting_index(room)
+    _notify_room_update(room)
+    opponent_ws = opponent.websocket
+    opponent_id = opponent.user_id
+    
+    try:
+        if room.in_game:
+            # Đối thủ đang mất kết nối (được giữ chỗ) vẫn được tính thắng
+            await _handle_game_over(room, winner_id=opponent_id, loser_id=user_id, reason="OPPONENT_LEFT")
+        elif opponent_ws:
+            # [SỬA LỖI] Gửi data sạch
+            await _safe_send(opponent_ws, {
+                "status": "OPPONENT_LEFT",
+                "message": f"{username} đã rời phòng. Bạn quay về phòng chờ.",
+                "room_data": _get_clean_room_data(room)
+            })
+            room.release_snapshot()
+    except Exception:
+        room_log.exception("Lỗi khi thông báo cho người chơi còn lại", room=room_code)
+
+# --- GIỮ CHỖ & KẾT NỐI LẠI (RESUME) ---
+# Người chơi mất kết nối được giữ chỗ RESUME_GRACE_PERIOD giây: {user_id: (room, TimerHandle)}.
+# Trong lúc đó ván đấu vẫn chạy bình thường (hết giờ lượt vẫn bị xử thua).
+_HELD_SEATS = {}
+# Ván khôi phục từ snapshot: đồng hồ lượt dừng đến khi người đến lượt quay lại {room_code: số giây còn lại}
+_PAUSED_TURNS = {}
+
+async def _hold_seat(room, user_id, username, grace=RESUME_GRACE_PERIOD):
+    room.slot_of(user_id).websocket = None
+    handle = timer_wheel.call_later(grace, _on_hold_expired, user_id)
+    previous = _HELD_SEATS.pop(user_id, None)
+    if previous is not None:
+        previous[1].cancel()
+    _HELD_SEATS[user_id] = (room, handle)
+    HELD_SEATS.set(len(_HELD_SEATS))
+    _sync_waiting_index(room)
+    room_log.info("Mất kết nối, giữ chỗ", room=room.room_id, user=user_id, grace=grace)
+    opponent = room.opponent_of(user_id)
+    if opponent is not None:
+        await _safe_send(opponent.websocket, {
+            "status": "OPPONENT_DISCONNECTED",
+            "message": f"{username} mất kết nối, đang chờ kết nối lại...",
+            "timeout": grace
+        })
+
+async def _on_hold_expired(user_id):
+    """Hết thời gian giữ chỗ: xử lý như người chơi đã rời phòng."""
+    held = _HELD_SEATS.pop(user_id, None)
+    if held is None:
+        return
+    HELD_SEATS.set(len(_HELD_SEATS))
+    room = held[0]
+    slot = room.slot_of(user_id)
+    if ACTIVE_ROOMS.get(room.room_id) is not room or slot is None or slot.websocket is not None:
+        return
+    room_log.info("Rời phòng", room=room.room_id, user=user_id, reason="DISCONNECT")
+    try:
+        await _leave_room(room, user_id, slot.username)
+    except Exception:
+        room_log.exception("Lỗi khi rời phòng")
+
+def find_seat(user_id):
+    """Phòng (của worker này) đang có chỗ của user_id: chỗ được giữ, hoặc chỗ của kết nối cũ chưa bị phát hiện đã mất."""
+    return PLAYER_ROOMS.get(user_id)
+
+@cluster.rpc_handler("seat_owner")
+async def seat_owner(user_id):
+    """RPC: worker này có chỗ của user_id không (trả về WORKER_ID hoặc None)."""
+    return cluster.WORKER_ID if find_seat(user_id) is not None else None
+
+async def handle_resume_room(websocket, payload=None):
+    """
+    Sau RESUME: gắn kết nối mới vào chỗ cũ của user trong phòng (thay cho
+    kết nối đã mất) và gửi lại toàn bộ trạng thái phòng/ván đấu.
+    """
+    user_id = websocket.user_id
+    room = find_seat(user_id)
+    if room is None:
+        await _safe_send(websocket, {"status": "ERROR", "message": "Không còn phòng để quay lại."})
+        return
+    held = _HELD_SEATS.pop(user_id, None)
+    if held is not None:
+        held[1].cancel()
+        HELD_SEATS.set(len(_HELD_SEATS))
+    _cancel_queue_ticket(websocket)
+    _stop_watching(websocket)
+
+    slot = room.slot_of(user_id)
+    old_ws = slot.websocket
+    if old_ws is not None and old_ws is not websocket and getattr(old_ws, 'room_code', None) == room.room_id:
+        del old_ws.room_code  # Kết nối cũ đóng sau đó không kéo người chơi ra khỏi phòng
+    slot.websocket = websocket
+    websocket.room_code = room.room_id
+    _sync_waiting_index(room)
+    RESUMES.inc()
+    if room.turn == user_id and room.room_id in _PAUSED_TURNS:
+        _start_turn_timer(room, user_id, _PAUSED_TURNS.pop(room.room_id))
+    room_log.info("Kết nối lại vào phòng", room=room.room_id, user=user_id, in_game=room.in_game)
+
+    message = {"status": "ROOM_RESUMED", "room_data": _get_clean_room_data(room)}
+    if room.in_game:
+        message.update({
+            "role": "X" if room.move_log is not None and room.move_log.player_x == user_id else "O",
+            "turn": "YOU" if room.turn == user_id else "OPPONENT",
+            "board": room.board.to_rows(),
+            "score": room.score,
+            "game_mode": room.game_mode,
+            "settings": room.settings,
+        })
+    await _safe_send(websocket, message)
+
+    opponent = room.opponent_of(user_id)
+    if opponent is not None:
+        await _safe_send(opponent.websocket, {
+            "status": "OPPONENT_RECONNECTED",
+            "message": f"{slot.username} đã kết nối lại."
+        })
+
+# --- KHỞI ĐỘNG LẠI SERVER (xem snapshot.py) ---
+def snapshot_rooms():
+    """Trạng thái mọi phòng của worker này, kèm thời gian còn lại của lượt đang chạy."""
+    states = []
+    for room in ACTIVE_ROOMS.values():
+        turn_time = None
+        if room.in_game:
+            turn_time = _PAUSED_TURNS.get(room.room_id)
+            if turn_time is None and room.turn_timer is not None:
+                turn_time = room.turn_timer.remaining()
+        states.append(room.to_state(turn_time))
+    return states
+
+def suspend_rooms():
+    """
+    Đã lưu snapshot: bỏ mọi phòng khỏi bộ nhớ để các kết nối đóng sau đó
+    không kéo người chơi ra khỏi phòng (không xử thua, không ghi lịch sử).
+    """
+    for room in ACTIVE_ROOMS.values():
+        room.cancel_timer()
+    for _, handle in _HELD_SEATS.values():
+        handle.cancel()
+    _HELD_SEATS.clear()
+    _PAUSED_TURNS.clear()
+    ACTIVE_ROOMS.clear()
+    PLAYER_ROOMS.clear()
+    WAITING_ROOMS.clear()
+    HELD_SEATS.set(0)
+
+async def restore_rooms(states):
+    """
+    Dựng lại các phòng từ snapshot. Mọi người chơi được giữ chỗ
+    RESTORE_GRACE_PERIOD giây; đồng hồ lượt chạy tiếp (với thời gian còn lại
+    lúc tắt) khi người đến lượt RESUME vào lại.
+    """
+    for state in states:
+        room = Room.from_state(state, created_seq=next(_room_seq))
+        ACTIVE_ROOMS[room.room_id] = room
+        _index_seats(room)
+        if room.in_game:
+            turn_time = state["turn_time"]
+            _PAUSED_TURNS[room.room_id] = turn_time if turn_time is not None else room.settings.get("time_limit", 30)
+        for slot in room.players():
+            await _hold_seat(room, slot.user_id, slot.username, RESTORE_GRACE_PERIOD)
+        # Chủ phòng chờ chỉ vào lại chỉ mục khi RESUME (handle_resume_room)
+        _sync_waiting_index(room)
+    if states:
+        room_log.info("Đã khôi phục phòng từ snapshot", rooms=len(states), seats=len(_HELD_SEATS))
 
 # --- Chức năng 7: SẴN SÀNG ---
 async def handle_ready(websocket, payload=None):
@@ -540,96 +937,56 @@ async def handle_ready(websocket, payload=None):
     """
     try:
         if not hasattr(websocket, 'room_code'): 
-            print(f"[LỖI READY] Websocket {websocket.username} không có room_code")
+            room_log.warning("READY khi không ở trong phòng", user=websocket.user_id)
             return 
         room_code = websocket.room_code
         if room_code not in ACTIVE_ROOMS: 
-            print(f"[LỖI READY] Phòng {room_code} không tồn tại")
+            room_log.warning("READY cho phòng không tồn tại", room=room_code)
             return 
             
         room = ACTIVE_ROOMS[room_code]
         user_id = websocket.user_id
         
+        slot = room.slot_of(user_id)
+        if not slot:
+            return
+
         # Kiểm tra nếu có tham số toggle_ready để chuyển đổi trạng thái
         if payload and payload.get("toggle_ready"):
-            player_key = None
-            if room["player1"] and room["player1"]["user_id"] == user_id:
-                player_key = "player1"
-            elif room["player2"] and room["player2"]["user_id"] == user_id:
-                player_key = "player2"
-            
-            if player_key:
-                current_ready = room[player_key]["is_ready"]
-                is_ready = not current_ready  # Chuyển đổi trạng thái
-            else:
-                return
+            is_ready = not slot.is_ready  # Chuyển đổi trạng thái
         else:
             # Mặc định là sẵn sàng (để tương thích ngược)
             is_ready = True
             if payload:
                 is_ready = payload.get("is_ready", True)
 
-        if room.get("board") is not None:
+        if room.in_game:
             return
 
-        player_key = None
-        opponent_ws = None
-        
-        if room["player1"] and room["player1"]["user_id"] == user_id:
-            player_key = "player1"
-            if room["player2"]: opponent_ws = room["player2"]["websocket"]
-        elif room["player2"] and room["player2"]["user_id"] == user_id:
-            player_key = "player2"
-            opponent_ws = room["player1"]["websocket"]
-        
-        if not player_key: return 
-
-        room[player_key]["is_ready"] = is_ready
-        ready_text = "sẵn sàng" if is_ready else "hủy sẵn sàng"
-        print(f"[SẴN SÀNG] User {websocket.username} (phòng {room_code}) đã {ready_text}")
+        room.set_ready(user_id, is_ready)
+        _notify_room_update(room)
+        opponent = room.opponent_of(user_id)
+        room_log.info("Đổi trạng thái sẵn sàng", room=room_code, user=user_id, is_ready=is_ready)
 
-        # Tạo dữ liệu phòng an toàn để gửi (loại bỏ websocket)
-        safe_player1 = None
-        safe_player2 = None
-        
-        if room["player1"]:
-            safe_player1 = {
-                "user_id": room["player1"]["user_id"],
-                "username": room["player1"]["username"],
-                "is_ready": room["player1"]["is_ready"]
-            }
-            
-        if room["player2"]:
-            safe_player2 = {
-                "user_id": room["player2"]["user_id"],
-                "username": room["player2"]["username"],
-                "is_ready": room["player2"]["is_ready"]
-            }
-
-        # Gửi cập nhật trạng thái phòng cho cả hai người chơi
+        # Gửi cập nhật trạng thái phòng cho cả hai người chơi (dữ liệu an toàn, không có websocket)
         room_update = {
             "status": "ROOM_UPDATE",
             "payload": {
                 "room_id": room_code,
-                "player1": safe_player1,
-                "player2": safe_player2
+                "player1": room.player1.public() if room.player1 else None,
+                "player2": room.player2.public() if room.player2 else None
             }
         }
         
-        await _safe_send(websocket, room_update)
-        if opponent_ws:
-            await _safe_send(opponent_ws, room_update)
+        await _broadcast([websocket, opponent.websocket if opponent else None], room_update)
         
         # Chỉ bắt đầu game khi cả hai đều sẵn sàng
-        if (room["player1"] and room["player1"]["is_ready"] and
-            room["player2"] and room["player2"]["is_ready"]):
-            
-            print(f"[BẮT ĐẦU GAME] Cả hai người chơi phòng {room_code} đã sẵn sàng!")
+        if room.both_ready():
             await _start_game(room) 
 
-    except Exception as e:
-        print(f"[LỖI READY] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi khi xử lý sẵn sàng."}))
+    except Exception:
+        room_log.exception("Lỗi khi xử lý sẵn sàng")
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi xử lý sẵn sàng."})
 
 # --- Hàm nội bộ: LẤY KÍCH THƯỚC BOARD ---
 def _get_board_size(game_mode):
@@ -645,130 +1002,92 @@ def _get_board_size(game_mode):
     }
     return board_sizes.get(game_mode, 9)  # Mặc định 9x9
 
-def _is_board_full(board):
-    """Kiểm tra xem bàn cờ đã đầy chưa (không còn ô trống)"""
-    for row in board:
-        for cell in row:
-            if cell == 0:  # Còn ô trống
-                return False
-    return True  # Bàn cờ đã đầy
-
 # --- Hàm nội bộ: BẮT ĐẦU GAME ---
 async def _start_game(room):
     """
     Hàm này khởi tạo ván đấu, random X/O, và gửi tin nhắn.
     """
-    print(f"[_START_GAME] ===== BẮT ĐẦU TẠO GAME =====")
-    
-    game_mode = room.get("game_mode", 5)
+    game_mode = room.game_mode
     board_size = _get_board_size(game_mode)
-    room["board"] = [[0 for _ in range(board_size)] for _ in range(board_size)]
-    
-    print(f"[_START_GAME] Tạo board {board_size}x{board_size} cho game mode {game_mode} quân")
-    
-    player1 = room["player1"]
-    player2 = room["player2"]
-    
-    print(f"[_START_GAME] Player1: {player1['username']} (ID: {player1['user_id']})")
-    print(f"[_START_GAME] Player2: {player2['username']} (ID: {player2['user_id']})")
-    
-    if "score" not in room:
-        room["score"] = {
-            player1["user_id"]: 0, 
-            player2["user_id"]: 0
-        }
-        
-    room["player1"]["is_ready"] = False
-    room["player2"]["is_ready"] = False
 
-    first_player_info = random.choice([player1, player2])
-    
-    if first_player_info["user_id"] == player1["user_id"]:
-        playerX = player1
-        playerO = player2
-    else:
-        playerX = player2
-        playerO = player1
+    playerX = random.choice((room.player1, room.player2))
+    playerO = room.opponent_of(playerX.user_id)
 
-    room["turn"] = playerX["user_id"] 
+    # Bitboard: số quân liên tiếp để thắng = game_mode
+    room.start_game(bitboard.Board(board_size, game_mode), playerX.user_id,
+                    move_log.MoveLog(board_size, playerX.user_id, playerO.user_id))
+    _sync_waiting_index(room)
+    recorder.note_game(playerX.websocket, playerO.websocket)
     
     # [SỬA LỖI] Gửi data sạch (board, score)
-    clean_board = room["board"]
-    clean_score = room["score"]
+    clean_board = room.board.to_rows()
+    clean_score = room.score
     
-    print(f"[_START_GAME] Gửi GAME_START cho playerX ({playerX['username']})")
-    await playerX["websocket"].send(json.dumps({
+    await _safe_send(playerX.websocket, {
         "status": "GAME_START", "role": "X", "turn": "YOU", 
-        "board": clean_board, "score": clean_score, "game_mode": room.get("game_mode", 5),
-        "settings": room.get("settings", {})
-    }))
+        "board": clean_board, "score": clean_score, "game_mode": game_mode,
+        "settings": room.settings
+    })
     
-    print(f"[_START_GAME] Gửi GAME_START cho playerO ({playerO['username']})")
-    await playerO["websocket"].send(json.dumps({
+    await _safe_send(playerO.websocket, {
         "status": "GAME_START", "role": "O", "turn": "OPPONENT", 
-        "board": clean_board, "score": clean_score, "game_mode": room.get("game_mode", 5),
-        "settings": room.get("settings", {})
-    }))
+        "board": clean_board, "score": clean_score, "game_mode": game_mode,
+        "settings": room.settings
+    })
     
-    print(f"[_START_GAME] ===== ĐÃ GỬI GAME_START CHO CẢ 2 PLAYERS =====")
+    _notify_spectators(room, {"status": "SPECTATE_GAME_START", "room_data": _spectator_view(room)})
+    
+    log.info("Bắt đầu game", room=room.room_id, game_mode=game_mode, board_size=board_size,
+             player_x=playerX.user_id, player_o=playerO.user_id)
     
     # Sử dụng thời gian giới hạn theo settings của phòng (mặc định 30s nếu không có)
-    time_limit = room.get("settings", {}).get("time_limit", 30)
+    time_limit = room.settings.get("time_limit", 30)
     
-    if room.get("timer_task"):
-        room["timer_task"].cancel()
-        
-    timer_task = asyncio.create_task(
-        _start_turn_timer(room, playerX["user_id"], time_limit)
-    )
-    room["timer_task"] = timer_task 
+    _start_turn_timer(room, playerX.user_id, time_limit)
 
 # --- Hàm nội bộ: BỘ ĐẾM GIỜ ---
-async def _start_turn_timer(room, player_id_on_turn, time_limit):
+def _start_turn_timer(room, player_id_on_turn, time_limit):
     """
-    Hàm chạy nền, ngủ trong 'time_limit' giây.
+    Đăng ký hạn chót 'time_limit' giây cho lượt hiện tại vào timer wheel.
+    Mỗi phòng dùng lại một handle duy nhất: đặt lại/hủy đều O(1), không tạo task mới.
+    """
+    # Lưu lại turn hiện tại khi bắt đầu timer
+    original_turn = room.turn
+    if room.turn_timer is None:
+        room.turn_timer = timer_wheel.call_later(
+            time_limit, _on_turn_timeout, room, player_id_on_turn, original_turn)
+    else:
+        room.turn_timer.reschedule(time_limit, room, player_id_on_turn, original_turn)
+
+async def _on_turn_timeout(room, player_id_on_turn, original_turn):
+    """
+    Được timer wheel gọi khi hết 'time_limit' giây mà người chơi chưa đánh.
     """
     try:
-        # Lưu lại turn hiện tại khi bắt đầu timer
-        original_turn = room.get("turn")
-        await asyncio.sleep(time_limit)
-        
         # [SỬA LỖI] Kiểm tra lại xem phòng còn tồn tại và game còn diễn ra
-        if room_code := room.get("room_id"):
-            if room_code not in ACTIVE_ROOMS:
-                return # Phòng đã bị hủy
-            if room.get("board") is None:
-                return # Game đã kết thúc
+        if room.room_id not in ACTIVE_ROOMS:
+            return # Phòng đã bị hủy
+        if not room.in_game:
+            return # Game đã kết thúc
 
         # Kiểm tra xem turn có còn là của người này không (có thể đã chuyển lượt rồi)
-        if room.get("turn") != player_id_on_turn or room.get("turn") != original_turn:
-            print(f"[TIMER] Turn đã thay đổi, bỏ qua timeout cho user {player_id_on_turn}")
+        if room.turn != player_id_on_turn or room.turn != original_turn:
+            log.debug("Turn đã thay đổi, bỏ qua timeout", room=room.room_id, user=player_id_on_turn)
             return
 
-        if room.get("turn") == player_id_on_turn:
-            print(f"[TIMEOUT] User ID {player_id_on_turn} (phòng {room.get('room_id')}) đã hết giờ! Người này thua trận.")
-            
-            # Tìm đối thủ (người thắng)
-            current_player_id = player_id_on_turn  # Người thua
-            opponent_id = None
-            
-            if not room.get("player1") or not room.get("player2"): return
-            
-            if room["player1"]["user_id"] == current_player_id:
-                opponent_id = room["player2"]["user_id"]  # Đối thủ thắng
-            else:
-                opponent_id = room["player1"]["user_id"]  # Đối thủ thắng
-            
-            print(f"[TIMEOUT] Player thua (timeout): {current_player_id}, Player thắng: {opponent_id}")
-            
-            # Kết thúc game, người timeout thua
-            await _handle_game_over(room, winner_id=opponent_id, loser_id=current_player_id, reason="TIMEOUT")
+        # Tìm đối thủ (người thắng)
+        current_player_id = player_id_on_turn  # Người thua
+        opponent = room.opponent_of(current_player_id)
+        if not opponent: return
+        opponent_id = opponent.user_id  # Đối thủ thắng
+        
+        log.info("Hết giờ, người chơi thua trận", room=room.room_id, user=current_player_id, winner=opponent_id)
+        
+        # Kết thúc game, người timeout thua
+        await _handle_game_over(room, winner_id=opponent_id, loser_id=current_player_id, reason="TIMEOUT")
 
-    except asyncio.CancelledError:
-        print(f"[TIMER] Đã hủy timer cho User ID {player_id_on_turn} (đã đi).")
-        raise 
-    except Exception as e:
-        print(f"[LỖI TIMER] {e}")
+    except Exception:
+        log.exception("Lỗi timer", room=room.room_id)
 
 # --- Chức năng 8: XỬ LÝ NƯỚC ĐI ---
 async def handle_move(websocket, payload):
@@ -783,49 +1102,37 @@ async def handle_move(websocket, payload):
         room = ACTIVE_ROOMS[room_code]
         user_id = websocket.user_id
 
-        if room.get("board") is None:
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Game chưa bắt đầu."}))
+        if not room.in_game:
+            await _safe_send(websocket, {"status": "ERROR", "message": "Game chưa bắt đầu."})
             return
 
-        if room.get("turn") != user_id:
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Chưa đến lượt của bạn."}))
+        if room.turn != user_id:
+            await _safe_send(websocket, {"status": "ERROR", "message": "Chưa đến lượt của bạn."})
             return
             
+        board = room.board
         row = payload.get("row"); col = payload.get("col")
 
-        if (row is None or col is None or 
-            not (0 <= row < len(room["board"])) or 
-            not (0 <= col < len(room["board"][0]))):
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Tọa độ không hợp lệ."}))
+        if row is None or col is None or not board.in_bounds(row, col):
+            await _safe_send(websocket, {"status": "ERROR", "message": "Tọa độ không hợp lệ."})
             return
 
-        if room["board"][row][col] != 0:
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Ô này đã được đánh."}))
+        if not board.is_empty(row, col):
+            await _safe_send(websocket, {"status": "ERROR", "message": "Ô này đã được đánh."})
             return
             
         # --- Nước đi hợp lệ ---
-        if room.get("timer_task"):
-            room["timer_task"].cancel()
-            room["timer_task"] = None
+        room.cancel_timer()
             
-        print(f"[NƯỚC ĐI] User {websocket.username} (phòng {room_code}) đánh: ({row}, {col})")
-        
-        room["board"][row][col] = user_id
-        
-        # Reset consecutive timeout khi có người thực sự đánh
-        room["consecutive_timeouts"] = 0
+        moves_log.debug("Nước đi", room=room_code, user=user_id, row=row, col=col)
         
-        opponent_ws = None
-        opponent_id = None
+        # Đặt quân; reset consecutive timeout khi có người thực sự đánh
+        room.place(row, col, user_id)
         
-        if not room.get("player1") or not room.get("player2"): return # Lỗi
-        
-        if room["player1"]["user_id"] == user_id:
-            opponent_ws = room["player2"]["websocket"]
-            opponent_id = room["player2"]["user_id"]
-        else:
-            opponent_ws = room["player1"]["websocket"]
-            opponent_id = room["player1"]["user_id"]
+        opponent = room.opponent_of(user_id)
+        if not opponent: return # Lỗi
+        opponent_ws = opponent.websocket
+        opponent_id = opponent.user_id
 
         if opponent_ws:
             await _safe_send(opponent_ws, {
@@ -833,82 +1140,47 @@ async def handle_move(websocket, payload):
                 "move": {"row": row, "col": col},
                 "player_id": user_id  # Gửi ID của người đánh để client cập nhật board
             })
+        _notify_spectators(room, {
+            "status": "SPECTATE_MOVE",
+            "move": {"row": row, "col": col},
+            "player_id": user_id
+        })
 
-        game_mode = room.get("game_mode", 5)  # Lấy game mode từ room
-        if _check_win(room["board"], row, col, user_id, game_mode):
-            print(f"[GAME KẾT THÚC] User {websocket.username} (ID: {user_id}) thắng phòng {room_code} với {game_mode} quân.")
+        game_mode = room.game_mode
+        if board.is_win(user_id):
+            log.info("Game kết thúc", room=room_code, user=user_id, game_mode=game_mode, result="WIN")
             await _handle_game_over(room, winner_id=user_id, loser_id=opponent_id, reason="WIN")
             return 
 
         # Kiểm tra hòa (bàn cờ đầy nhưng không có ai thắng)
-        if _is_board_full(room["board"]):
-            print(f"[GAME HÒA] Phòng {room_code} hòa do bàn cờ đã đầy.")
+        if board.is_full():
+            log.info("Game hòa do bàn cờ đã đầy", room=room_code)
             await _handle_game_over(room, winner_id=None, loser_id=None, reason="DRAW_BOARD_FULL")
             return 
 
-        room["turn"] = opponent_id
+        room.set_turn(opponent_id)
         
         if opponent_id:
             # Sử dụng time_limit theo settings phòng (mặc định 30 giây)
-            next_time_limit = room.get("settings", {}).get("time_limit", 30)
-            timer_task = asyncio.create_task(
-                _start_turn_timer(room, opponent_id, next_time_limit)
-            )
-            room["timer_task"] = timer_task
-
-    except Exception as e:
-        print(f"[LỖI MOVE] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi khi xử lý nước đi."}))
-
-# --- Hàm nội bộ: KIỂM TRA THẮNG ---
-def _check_win(board, r, c, player_id, win_count=5):
-    """
-    Kiểm tra xem nước đi tại (r, c) của player_id có tạo ra chiến thắng không.
-    win_count: số quân thẳng hàng cần để thắng (3, 5, 6)
-    """
-    board_size = len(board)
-    directions = [(0, 1), (1, 0), (1, 1), (1, -1)]
+            next_time_limit = room.settings.get("time_limit", 30)
+            _start_turn_timer(room, opponent_id, next_time_limit)
 
-    for dr, dc in directions:
-        count = 0
-        for i in range(-(win_count-1), win_count):
-            nr, nc = r + i * dr, c + i * dc
-            
-            if 0 <= nr < board_size and 0 <= nc < board_size:
-                if board[nr][nc] == player_id:
-                    count += 1
-                    if count >= win_count:
-                        return True 
-                else:
-                    count = 0 
-            else:
-                count = 0 
-                
-    return False 
+    except Exception:
+        moves_log.exception("Lỗi khi xử lý nước đi", user=getattr(websocket, "user_id", None))
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi xử lý nước đi."})
 
 # --- Hàm nội bộ: XỬ LÝ KẾT THÚC GAME ---
 async def _handle_game_over(room, winner_id, loser_id, reason="WIN"):
     """
     Xử lý khi có người thắng cuộc.
     """
-    if room.get("timer_task"):
-        room["timer_task"].cancel()
-        room["timer_task"] = None
-
-    if "score" not in room:
-        if room.get("player1") and room.get("player2"):
-             room["score"] = {room["player1"]["user_id"]: 0, room["player2"]["user_id"]: 0}
-        else:
-             room["score"] = {} # Lỗi, không có người chơi
+    room.cancel_timer()
+    _PAUSED_TURNS.pop(room.room_id, None)
             
     if reason in ["WIN", "TIMEOUT"]:
-        if winner_id in room["score"]:
-            room["score"][winner_id] += 1
-        
-        if winner_id and loser_id: # Chỉ update DB nếu có đủ 2 người
-            db_manager.update_game_stats(winner_id, loser_id)
+        room.add_win(winner_id)
         
-        # Lưu lịch sử trận đấu
+        # Lưu lịch sử trận đấu (wins/losses được cập nhật cùng lúc, xem storage.record_match_result)
         _save_match_to_history(room, winner_id, reason)
     elif reason == "DRAW":
         # Trường hợp hòa - không cập nhật điểm
@@ -916,20 +1188,11 @@ async def _handle_game_over(room, winner_id, loser_id, reason="WIN"):
         _save_match_to_history(room, None, reason)
         pass
     
-    winner_ws = None
-    loser_ws = None
-    
-    if room.get("player1"):
-        if room["player1"]["user_id"] == winner_id:
-            winner_ws = room["player1"]["websocket"]
-        elif room["player1"]["user_id"] == loser_id:
-            loser_ws = room["player1"]["websocket"]
-
-    if room.get("player2"):
-        if room["player2"]["user_id"] == winner_id:
-            winner_ws = room["player2"]["websocket"]
-        elif room["player2"]["user_id"] == loser_id:
-            loser_ws = room["player2"]["websocket"]
+    winner = room.slot_of(winner_id) if winner_id is not None else None
+    loser = room.slot_of(loser_id) if loser_id is not None else None
+    winner_ws = winner.websocket if winner else None
+    loser_ws = loser.websocket if loser else None
+    score = room.score if room.score is not None else {}
 
     if reason in ["DRAW_TIMEOUT", "DRAW_BOARD_FULL"]:
         # Trường hợp hòa - gửi thông báo cho cả hai với lý do cụ thể
@@ -937,17 +1200,13 @@ async def _handle_game_over(room, winner_id, loser_id, reason="WIN"):
             "status": "GAME_OVER",
             "result": "DRAW",
             "draw_reason": "TIMEOUT" if reason == "DRAW_TIMEOUT" else "BOARD_FULL",
-            "score": room["score"]
+            "score": score
         }
         
         # Lưu lịch sử trận đấu cho trường hợp hòa
         _save_match_to_history(room, None, reason)
         
-        if room.get("player1") and room.get("player1", {}).get("websocket"):
-            await _safe_send(room["player1"]["websocket"], draw_message)
-        
-        if room.get("player2") and room.get("player2", {}).get("websocket"):
-            await _safe_send(room["player2"]["websocket"], draw_message)
+        await _broadcast(room.websockets(), draw_message)
     
     elif winner_ws:
         result_type = "WIN"
@@ -957,7 +1216,7 @@ async def _handle_game_over(room, winner_id, loser_id, reason="WIN"):
         await _safe_send(winner_ws, {
             "status": "GAME_OVER",
             "result": result_type,
-            "score": room["score"]
+            "score": score
         })
         
         # Gửi thông báo đến người thua (trừ khi đã gửi ở trên cho timeout)
@@ -966,17 +1225,15 @@ async def _handle_game_over(room, winner_id, loser_id, reason="WIN"):
             await _safe_send(loser_ws, {
                 "status": "GAME_OVER",
                 "result": loser_result,
-                "score": room["score"]
+                "score": score
             })
         
-    # Reset phòng
-    room["board"] = None 
-    room["turn"] = None
-    room["consecutive_timeouts"] = 0  # Reset timeout counter
-    if room["player1"]:
-        room["player1"]["is_ready"] = False
-    if room["player2"]:
-        room["player2"]["is_ready"] = False
+    _notify_spectators(room, {"status": "SPECTATE_GAME_OVER", "winner_id": winner_id,
+                              "reason": reason, "score": score})
+    
+    # Reset phòng (board, turn, timeout counter, trạng thái sẵn sàng)
+    room.end_game()
+    _sync_waiting_index(room)
 
 # --- Chức năng 9: CHAT TRONG PHÒNG ---
 async def handle_chat(websocket, payload):
@@ -995,29 +1252,26 @@ async def handle_chat(websocket, payload):
         message = payload.get("message")
         if not message: return 
 
-        opponent_ws = None
-        if room["player1"] and room["player1"]["user_id"] == user_id:
-            if room["player2"]:
-                opponent_ws = room["player2"]["websocket"]
-        elif room["player2"] and room["player2"]["user_id"] == user_id:
-            opponent_ws = room["player1"]["websocket"]
+        opponent = room.opponent_of(user_id)
+        opponent_ws = opponent.websocket if opponent else None
+        _notify_spectators(room, {"status": "SPECTATE_CHAT", "sender": username, "message": message})
 
         if opponent_ws:
-            print(f"[CHAT] {username} (phòng {room_code}) gửi: {message}")
+            chat_log.debug("Chat", room=room_code, user=user_id, length=len(message))
             await _safe_send(opponent_ws, {
                 "status": "OPPONENT_CHAT",
                 "sender": username,
                 "message": message
             })
         else:
-            await websocket.send(json.dumps({
+            await _safe_send(websocket, {
                 "status": "ERROR",
                 "message": "Đang không có ai trong phòng để chat."
-            }))
+            })
 
-    except Exception as e:
-        print(f"[LỖI CHAT] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi khi gửi tin nhắn."}))
+    except Exception:
+        chat_log.exception("Lỗi khi gửi tin nhắn")
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi gửi tin nhắn."})
 
 # --- Chức năng 10: CHƠI LẠI (REMATCH) ---
 async def handle_rematch(websocket, payload):
@@ -1032,40 +1286,26 @@ async def handle_rematch(websocket, payload):
         room = ACTIVE_ROOMS[room_code]
         user_id = websocket.user_id
         
-        if room.get("board") is not None:
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Không thể chơi lại khi ván đấu đang diễn ra."}))
+        if room.in_game:
+            await _safe_send(websocket, {"status": "ERROR", "message": "Không thể chơi lại khi ván đấu đang diễn ra."})
             return
 
-        player_key = None
-        opponent_ws = None
-        
-        if room["player1"] and room["player1"]["user_id"] == user_id:
-            player_key = "player1"
-            if room["player2"]: opponent_ws = room["player2"]["websocket"]
-        elif room["player2"] and room["player2"]["user_id"] == user_id:
-            player_key = "player2"
-            opponent_ws = room["player1"]["websocket"]
-        
-        if not player_key: return
-
-        room[player_key]["is_ready"] = True
-        print(f"[CHƠI LẠI] User {websocket.username} (phòng {room_code}) muốn chơi lại.")
+        if not room.set_ready(user_id, True): return
+        opponent = room.opponent_of(user_id)
+        room_log.info("Muốn chơi lại", room=room_code, user=user_id)
 
-        if opponent_ws:
-            await _safe_send(opponent_ws, {
+        if opponent:
+            await _safe_send(opponent.websocket, {
                 "status": "OPPONENT_REMATCH",
                 "is_ready": True
             })
         
-        if (room["player1"] and room["player1"]["is_ready"] and
-            room["player2"] and room["player2"]["is_ready"]):
-            
-            print(f"[BẮT ĐẦU VÁN MỚI] Cả hai người chơi phòng {room_code} đồng ý chơi lại!")
+        if room.both_ready():
             await _start_game(room) 
 
-    except Exception as e:
-        print(f"[LỖI REMATCH] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi khi xử lý chơi lại."}))
+    except Exception:
+        room_log.exception("Lỗi khi xử lý chơi lại")
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi xử lý chơi lại."})
 
 # --- Chức năng 11: CẬP NHẬT CÀI ĐẶT PHÒNG ---
 async def handle_update_settings(websocket, payload):
@@ -1080,49 +1320,51 @@ async def handle_update_settings(websocket, payload):
         room = ACTIVE_ROOMS[room_code]
         user_id = websocket.user_id
         
-        if not room["player1"] or room["player1"]["user_id"] != user_id:
-            await websocket.send(json.dumps({
+        if not room.player1 or room.player1.user_id != user_id:
+            await _safe_send(websocket, {
                 "status": "ERROR",
                 "message": "Chỉ chủ phòng mới có thể thay đổi cài đặt."
-            }))
+            })
             return
             
-        if room.get("board") is not None:
-            await websocket.send(json.dumps({
+        if room.in_game:
+            await _safe_send(websocket, {
                 "status": "ERROR",
                 "message": "Không thể thay đổi cài đặt khi ván đấu đang diễn ra."
-            }))
+            })
             return
 
         if "password" in payload:
-            room["password"] = payload["password"]
-            print(f"[CÀI ĐẶT] Phòng {room_code} đổi mật khẩu thành: '{payload['password']}'")
+            room.password = payload["password"]
+            _sync_waiting_index(room)
+            room_log.info("Đổi mật khẩu phòng", room=room_code, user=user_id)
             
         if "time_limit" in payload:
             try:
-                room["settings"]["time_limit"] = int(payload["time_limit"])
-                print(f"[CÀI ĐẶT] Phòng {room_code} đổi thời gian thành: {payload['time_limit']}s")
+                room.update_settings(time_limit=int(payload["time_limit"]))
+                room_log.info("Đổi thời gian mỗi lượt", room=room_code, user=user_id, time_limit=room.settings["time_limit"])
             except ValueError:
                 pass 
+        room.touch()
         
         clean_room_data = _get_clean_room_data(room)
         
-        await websocket.send(json.dumps({
+        await _safe_send(websocket, {
             "status": "SETTINGS_UPDATED",
             "room_data": clean_room_data
-        }))
+        })
         
-        if room["player2"]:
-            opponent_ws = room["player2"]["websocket"]
+        if room.player2:
+            opponent_ws = room.player2.websocket
             if opponent_ws:
                 await _safe_send(opponent_ws, {
                     "status": "SETTINGS_CHANGED_BY_HOST",
                     "room_data": clean_room_data
                 })
                 
-    except Exception as e:
-        print(f"[LỖI SETTINGS] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi khi cập nhật cài đặt."}))
+    except Exception:
+        room_log.exception("Lỗi khi cập nhật cài đặt")
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi cập nhật cài đặt."})
 
 
 # --- Chức năng: ĐẦUHÀNG ---
@@ -1133,44 +1375,34 @@ async def handle_surrender(websocket, payload=None):
     """
     try:
         if not hasattr(websocket, 'room_code'):
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Bạn không ở trong phòng nào."}))
+            await _safe_send(websocket, {"status": "ERROR", "message": "Bạn không ở trong phòng nào."})
             return
             
         room_code = websocket.room_code
         if room_code not in ACTIVE_ROOMS:
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Phòng không tồn tại."}))
+            await _safe_send(websocket, {"status": "ERROR", "message": "Phòng không tồn tại."})
             return
             
         room = ACTIVE_ROOMS[room_code]
         
         # Kiểm tra game đang diễn ra
-        if not room.get("board"):
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Game chưa bắt đầu."}))
+        if not room.in_game:
+            await _safe_send(websocket, {"status": "ERROR", "message": "Game chưa bắt đầu."})
             return
             
         user_id = websocket.user_id
         username = websocket.username
         
         # Tìm người chơi và đối thủ
-        surrendering_player = None
-        opponent_ws = None
-        opponent_username = None
-        
-        if room["player1"] and room["player1"]["user_id"] == user_id:
-            surrendering_player = "player1"
-            if room["player2"]:
-                opponent_ws = room["player2"]["websocket"]
-                opponent_username = room["player2"]["username"]
-        elif room["player2"] and room["player2"]["user_id"] == user_id:
-            surrendering_player = "player2"
-            opponent_ws = room["player1"]["websocket"]
-            opponent_username = room["player1"]["username"]
+        opponent = room.opponent_of(user_id)
+        opponent_ws = opponent.websocket if opponent else None
+        opponent_username = opponent.username if opponent else None
             
-        if not surrendering_player:
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Không tìm thấy thông tin người chơi."}))
+        if not room.slot_of(user_id):
+            await _safe_send(websocket, {"status": "ERROR", "message": "Không tìm thấy thông tin người chơi."})
             return
             
-        print(f"[ĐẦUHÀNG] User {username} (phòng {room_code}) đã đầu hàng")
+        log.info("Đầu hàng", room=room_code, user=user_id)
         
         # Kết thúc game - người đầu hàng thua
         await _safe_send(websocket, {
@@ -1188,12 +1420,18 @@ async def handle_surrender(websocket, payload=None):
                 "reason": "OPPONENT_SURRENDER"
             })
         
+        _notify_spectators(room, {"status": "SPECTATE_GAME_OVER", "winner_id": opponent.user_id if opponent else None,
+                                  "reason": "SURRENDER", "score": room.score or {}})
+        
+        # Lưu lịch sử trước khi reset phòng
+        _save_match_to_history(room, opponent.user_id if opponent else None, "SURRENDER")
+        
         # Dọn dẹp phòng và reset trạng thái
         await _cleanup_room_after_game(room, room_code)
         
-    except Exception as e:
-        print(f"[LỖI ĐẦUHÀNG] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi khi xử lý đầu hàng."}))
+    except Exception:
+        log.exception("Lỗi khi xử lý đầu hàng")
+        await _safe_send(websocket, {"status": "ERROR", "message": "Lỗi khi xử lý đầu hàng."})
 
 
 # --- Hàm hỗ trợ: Dọn dẹp phòng sau game ---
@@ -1204,42 +1442,32 @@ async def _cleanup_room_after_game(room, room_code):
     """
     try:
         # Dừng timer nếu có
-        if room.get("timer_task"):
-            room["timer_task"].cancel()
-            room["timer_task"] = None
+        room.cancel_timer()
+        _PAUSED_TURNS.pop(room.room_id, None)
             
-        # Reset board và game state
-        room["board"] = None
-        room["current_turn"] = None
-        room["game_start_time"] = None
-        
-        # Reset trạng thái sẵn sàng
-        if room["player1"]:
-            room["player1"]["is_ready"] = False
-        if room["player2"]:
-            room["player2"]["is_ready"] = False
+        # Reset board, lượt đi và trạng thái sẵn sàng
+        room.end_game()
+        _sync_waiting_index(room)
             
-        print(f"[CLEANUP] Đã dọn dẹp phòng {room_code} sau game")
+        log.debug("Đã dọn dẹp phòng sau game", room=room_code)
         
-    except Exception as e:
-        print(f"[LỖI CLEANUP] {e}")
+    except Exception:
+        log.exception("Lỗi khi dọn dẹp phòng", room=room_code)
 
 def _save_match_to_history(room, winner_id, reason):
     """
-    Lưu kết quả trận đấu vào database
+    Đưa kết quả trận đấu vào hàng đợi ghi DB (không chờ ghi xong).
     """
     try:
-        print(f"[HISTORY DEBUG] Đang lưu trận đấu: winner_id={winner_id}, reason={reason}")
-        
-        if not room.get("player1") or not room.get("player2"):
-            print("[HISTORY] Không đủ thông tin người chơi để lưu lịch sử")
+        # Người cầm X/O được ghi lúc bắt đầu ván, vẫn còn khi đối thủ đã rời phòng
+        log_record = room.move_log
+        if log_record is None:
+            history_log.warning("Không có ván đang chơi để lưu lịch sử", room=room.room_id)
             return
             
-        player_x_id = room["player1"]["user_id"] 
-        player_o_id = room["player2"]["user_id"]
-        game_mode = room.get("game_mode", 5)
-        
-        print(f"[HISTORY DEBUG] player_x_id={player_x_id}, player_o_id={player_o_id}, game_mode={game_mode}")
+        player_x_id = log_record.player_x
+        player_o_id = log_record.player_o
+        game_mode = room.game_mode
         
         # Xác định loại kết thúc
         result_type = "normal"
@@ -1252,29 +1480,19 @@ def _save_match_to_history(room, winner_id, reason):
         elif reason == "SURRENDER":
             result_type = "surrender"
             
-        print(f"[HISTORY DEBUG] result_type={result_type}")
-            
-        # Tạo move log từ board hiện tại (đơn giản)
-        move_log = ""
-        if room.get("board"):
-            move_log = str(room["board"])
-            
-        # Lưu vào database
-        success = db_manager.save_match_result(
+        # Ghi trễ theo lô (move_log: chuỗi nước đi nhị phân, xem move_log.py)
+        storage.record_match_result(
             player_x_id=player_x_id,
             player_o_id=player_o_id, 
             winner_id=winner_id,
             game_mode=game_mode,
             result_type=result_type,
-            move_log=move_log
+            move_log=log_record.to_bytes(),
+            duration=time.monotonic() - log_record.started
         )
-        
-        if success:
-            print(f"[HISTORY] Đã lưu lịch sử trận đấu: {player_x_id} vs {player_o_id}, winner: {winner_id}")
-        else:
-            print(f"[HISTORY] Lỗi khi lưu lịch sử trận đấu")
+        history_log.info("Đã đưa lịch sử trận đấu vào hàng đợi ghi", room=room.room_id, player_x=player_x_id,
+                         player_o=player_o_id, winner=winner_id, result_type=result_type,
+                         moves=log_record.count)
             
-    except Exception as e:
-        print(f"[HISTORY ERROR] {e}")
-        import traceback
-        traceback.print_exc()
\ No newline at end of file
+    except Exception:
+        history_log.exception("Lỗi khi lưu lịch sử trận đấu", room=room.room_id)
\ No newline at end of file
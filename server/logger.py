@@ -0,0 +1,184 @@
+# Server/logger.py
+
+"""
+Logging có cấu trúc (JSON, mỗi dòng một bản ghi) và bất đồng bộ cho server.
+
+- Lời gọi log trên hot path chỉ tạo một dict rồi đẩy vào queue; một thread
+  nền gom các bản ghi lại và ghi ra stdout/file.
+- Level và tỉ lệ lấy mẫu (sampling) theo từng category, dùng cho các sự kiện
+  tần suất cao như nước đi.
+- Các trường có tên chứa "password" hoặc "token" (resume token đăng nhập
+  được không cần mật khẩu) luôn bị che trước khi ghi.
+
+Cách dùng:
+    log = logger.get_logger("room")
+    log.info("Tạo phòng", room=room_code, user=user_id, game_mode=game_mode)
+"""
+
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from config import (LOG_LEVEL, LOG_CATEGORY_LEVELS, LOG_SAMPLING,
+                    LOG_FILE, LOG_QUEUE_SIZE)
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+_LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+_LEVEL_VALUES = {name: value for value, name in _LEVEL_NAMES.items()}
+
+REDACTED = "***"
+_SECRET_KEYS = ("password", "token")
+
+_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+_loggers = {}
+dropped = 0  # Số bản ghi bị bỏ do queue đầy
+
+
+def _is_secret(key):
+    key = key.lower()
+    return any(secret in key for secret in _SECRET_KEYS)
+
+def redact(value):
+    """Trả về bản sao của value với mọi khóa chứa 'password'/'token' đã bị che."""
+    if isinstance(value, dict):
+        return {
+            k: (REDACTED if isinstance(k, str) and _is_secret(k) else redact(v))
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+class Logger:
+    """Logger của một category. Việc lọc level/sampling diễn ra trước khi tạo bản ghi."""
+    __slots__ = ("category", "level", "sample_every", "_seen")
+
+    def __init__(self, category):
+        self.category = category
+        self.level = _LEVEL_VALUES[LOG_CATEGORY_LEVELS.get(category, LOG_LEVEL)]
+        rate = LOG_SAMPLING.get(category, 1.0)
+        # Lấy mẫu tất định: giữ 1 trong mỗi sample_every bản ghi
+        self.sample_every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._seen = 0
+
+    def is_enabled(self, level):
+        return level >= self.level and self.sample_every != 0
+
+    def _log(self, level, message, fields, exc_info=False):
+        if level < self.level or self.sample_every == 0:
+            return
+        if self.sample_every > 1 and level < WARNING:
+            self._seen += 1
+            if self._seen % self.sample_every:
+                return
+            fields["sample_rate"] = 1 / self.sample_every
+
+        record = {
+            "ts": time.time(),
+            "level": _LEVEL_NAMES[level],
+            "cat": self.category,
+            "msg": message,
+        }
+        for key, value in fields.items():
+            if _is_secret(key):
+                value = REDACTED
+            elif isinstance(value, (dict, list, tuple)):
+                # Sao chép ngay để thread ghi không đọc phải dict đang bị sửa
+                value = redact(value)
+            record[key] = value
+        if exc_info:
+            record["exc"] = traceback.format_exc()
+        _enqueue(record)
+
+    def debug(self, message, **fields):
+        self._log(DEBUG, message, fields)
+
+    def info(self, message, **fields):
+        self._log(INFO, message, fields)
+
+    def warning(self, message, **fields):
+        self._log(WARNING, message, fields)
+
+    def error(self, message, **fields):
+        self._log(ERROR, message, fields)
+
+    def exception(self, message, **fields):
+        """Ghi lỗi kèm traceback của ngoại lệ đang xử lý."""
+        self._log(ERROR, message, fields, exc_info=True)
+
+
+def get_logger(category):
+    log = _loggers.get(category)
+    if log is None:
+        log = _loggers[category] = Logger(category)
+    return log
+
+
+def _enqueue(record):
+    global dropped
+    if _writer is None:
+        _start_writer()
+    try:
+        _queue.put_nowait(record)
+    except queue.Full:
+        dropped += 1
+
+
+def _writer_loop():
+    stream = open(LOG_FILE, "a", encoding="utf-8") if LOG_FILE else sys.stdout
+    running = True
+    while running:
+        batch = [_queue.get()]
+        # Gom thêm những bản ghi đang có sẵn để ghi một lần
+        try:
+            while len(batch) < 512:
+                batch.append(_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        lines = []
+        for record in batch:
+            if record is None:
+                running = False
+                continue
+            lines.append(json.dumps(record, ensure_ascii=False, default=str))
+        if lines:
+            try:
+                stream.write("\n".join(lines) + "\n")
+                stream.flush()
+            except Exception:
+                pass
+    if stream is not sys.stdout:
+        stream.close()
+
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, name="log-writer", daemon=True)
+            _writer.start()
+
+
+def shutdown(timeout=2.0):
+    """Ghi nốt các bản ghi còn trong queue rồi dừng thread ghi."""
+    global _writer
+    if _writer is None:
+        return
+    _queue.put(None)
+    _writer.join(timeout)
+    _writer = None
+
+
+atexit.register(shutdown)
@@ -0,0 +1,201 @@
+# Server/metrics.py
+
+"""
+Bộ đếm (counter), gauge và histogram gọn nhẹ cho server.
+
+Server chạy trên một event loop nên các phép cập nhật chỉ là cộng số nguyên
+thuần Python, không cần lock. Mỗi metric được định danh bằng (tên, nhãn).
+Code chạy ở thread khác không được cập nhật metric của event loop: hoặc báo
+về loop (loop.call_soon_threadsafe, xem storage._run), hoặc dùng metric
+riêng và cập nhật trong lock của chính nó (xem database_manager.ConnectionPool).
+
+Giá trị chỉ được đọc khi có yêu cầu /metrics (xem monitoring.py): samples()
+gom số liệu, render() xuất theo định dạng text của Prometheus.
+"""
+
+import bisect
+
+# Các mốc (giây) cho histogram độ trễ mặc định: 0.5ms -> 5s
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+class Counter:
+    """Bộ đếm chỉ tăng."""
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    """Giá trị có thể tăng/giảm (số kết nối, độ sâu hàng đợi...)."""
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Histogram:
+    """
+    Histogram với các mốc cố định.
+    counts[i] là số mẫu rơi vào khoảng (buckets[i-1], buckets[i]],
+    phần tử cuối cùng của counts là khoảng +Inf.
+    """
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Ước lượng phân vị q (0..1) theo cận trên của bucket chứa nó."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        running = 0
+        for i, n in enumerate(self.counts):
+            running += n
+            if running >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Registry:
+    """Nơi lưu tất cả metric của tiến trình, khóa theo (tên, nhãn)."""
+
+    def __init__(self):
+        self._metrics = {}  # {(name, labels_tuple): (kind, help_text, metric)}
+        self._collectors = []  # Hàm cập nhật gauge tính theo trạng thái, gọi trước mỗi lần đọc
+
+    def _get_or_create(self, kind, factory, name, help_text, labels):
+        key = (name, tuple(sorted(labels.items())))
+        entry = self._metrics.get(key)
+        if entry is None:
+            entry = (kind, help_text, factory())
+            self._metrics[key] = entry
+        return entry[2]
+
+    def counter(self, name, help_text="", **labels):
+        return self._get_or_create("counter", Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text="", **labels):
+        return self._get_or_create("gauge", Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_LATENCY_BUCKETS, **labels):
+        return self._get_or_create("histogram", lambda: Histogram(buckets), name, help_text, labels)
+
+    def add_collector(self, func):
+        """Đăng ký func() chạy ngay trước mỗi lần đọc metric (thay vì cập nhật gauge liên tục)."""
+        self._collectors.append(func)
+        return func
+
+    def collect(self):
+        """Trả về danh sách (name, kind, help_text, labels, metric)."""
+        return [
+            (name, kind, help_text, dict(labels), metric)
+            for (name, labels), (kind, help_text, metric) in self._metrics.items()
+        ]
+
+    def samples(self, **extra_labels):
+        """
+        Giá trị hiện tại của mọi metric dạng JSON được (gửi qua RPC giữa các worker):
+        [[name, kind, help_text, [[sample_name, labels, value], ...]], ...]
+        """
+        for func in self._collectors:
+            func()
+        families = {}
+        for (name, labels), (kind, help_text, metric) in self._metrics.items():
+            family = families.get(name)
+            if family is None:
+                family = families[name] = [name, kind, help_text, []]
+            labels = {**dict(labels), **extra_labels}
+            rows = family[3]
+            if kind != "histogram":
+                rows.append([name, labels, metric.value])
+                continue
+            running = 0
+            for bound, count in zip(metric.buckets, metric.counts):
+                running += count
+                rows.append([name + "_bucket", {**labels, "le": _format_value(bound)}, running])
+            rows.append([name + "_bucket", {**labels, "le": "+Inf"}, metric.count])
+            rows.append([name + "_sum", labels, metric.sum])
+            rows.append([name + "_count", labels, metric.count])
+        return list(families.values())
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render(*sample_sets):
+    """
+    Xuất một hoặc nhiều kết quả samples() (ví dụ của nhiều worker) theo định
+    dạng text của Prometheus; các metric cùng tên được gộp chung một khối.
+    """
+    merged = {}
+    for families in sample_sets:
+        for name, kind, help_text, rows in families:
+            family = merged.get(name)
+            if family is None:
+                merged[name] = [kind, help_text, list(rows)]
+            else:
+                family[2].extend(rows)
+    lines = []
+    for name, (kind, help_text, rows) in merged.items():
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, value in rows:
+            if labels:
+                label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{sample_name} {_format_value(value)}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+add_collector = REGISTRY.add_collector
+samples = REGISTRY.samples
@@ -0,0 +1,98 @@
+# Server/monitoring.py
+
+"""
+HTTP /metrics và /healthz trên cùng cổng với WebSocket (hook process_request
+của websockets): request có đường dẫn khác vẫn bắt tay WebSocket như cũ.
+
+- /metrics: mọi metric trong metrics.REGISTRY theo định dạng text của
+  Prometheus. Khi chạy nhiều worker, worker nhận request hỏi các worker còn
+  lại qua RPC và gộp kết quả (mỗi dòng có nhãn worker).
+- /healthz: 200 khi đang phục vụ, 503 khi đang tắt (xem server.shutdown).
+
+Các bộ đếm chỉ là phép cộng trên event loop; gauge phụ thuộc trạng thái (số
+phòng, số client...) chỉ được tính khi có người đọc /metrics.
+"""
+
+import asyncio
+import http
+import json
+import time
+
+import cluster
+import logger
+import metrics
+from config import LOOP_LAG_INTERVAL
+
+log = logger.get_logger("server")
+
+LOOP_LAG = metrics.histogram("caro_event_loop_lag_seconds", "Độ trễ của event loop (thức dậy muộn so với hẹn)",
+                             buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+LOOP_LAG_MAX = metrics.gauge("caro_event_loop_lag_max_seconds", "Độ trễ event loop lớn nhất kể từ lần đọc /metrics trước")
+UPTIME = metrics.gauge("caro_uptime_seconds", "Số giây kể từ khi worker khởi động")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_started = time.monotonic()
+_lag_task = None
+
+
+async def _watch_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - expected)
+        LOOP_LAG.observe(lag)
+        if lag > LOOP_LAG_MAX.value:
+            LOOP_LAG_MAX.set(lag)
+
+def start():
+    """Bắt đầu đo độ trễ event loop (gọi trong event loop của worker)."""
+    global _lag_task
+    if _lag_task is None:
+        _lag_task = asyncio.get_running_loop().create_task(_watch_loop_lag())
+
+@metrics.add_collector
+def _collect_uptime():
+    UPTIME.set(round(time.monotonic() - _started, 3))
+
+
+def _local_samples():
+    families = metrics.samples(**({"worker": str(cluster.WORKER_ID)} if cluster.ENABLED else {}))
+    LOOP_LAG_MAX.set(0)  # Lần đọc sau chỉ tính khoảng thời gian mới
+    return families
+
+@cluster.rpc_handler("metrics_samples")
+async def metrics_samples():
+    """RPC: số liệu metric của worker này (để worker nhận /metrics gộp lại)."""
+    return _local_samples()
+
+async def render_metrics():
+    """Văn bản /metrics: của worker này, cộng các worker khác khi chạy nhiều worker."""
+    sample_sets = [_local_samples()]
+    sample_sets.extend(await cluster.call_all("metrics_samples"))
+    return metrics.render(*sample_sets)
+
+
+def _response(status, content_type, body):
+    body = body.encode("utf-8")
+    headers = [("Content-Type", content_type), ("Content-Length", str(len(body))),
+               ("Cache-Control", "no-store")]
+    return status, headers, body
+
+async def handle_http(path, health):
+    """
+    Xử lý request HTTP thường. health: dict trạng thái (có khóa "status").
+    Trả về (status, headers, body) hoặc None để tiếp tục bắt tay WebSocket.
+    """
+    route = path.split("?", 1)[0]
+    if route == "/metrics":
+        try:
+            return _response(http.HTTPStatus.OK, PROMETHEUS_CONTENT_TYPE, await render_metrics())
+        except Exception:
+            log.exception("Lỗi khi xuất /metrics")
+            return _response(http.HTTPStatus.INTERNAL_SERVER_ERROR, "text/plain; charset=utf-8", "error\n")
+    if route == "/healthz":
+        status = http.HTTPStatus.OK if health.get("status") == "ok" else http.HTTPStatus.SERVICE_UNAVAILABLE
+        return _response(status, "application/json", json.dumps(health) + "\n")
+    return None
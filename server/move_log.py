@@ -0,0 +1,95 @@
+# Server/move_log.py
+
+"""
+Nhật ký nước đi dạng nhị phân gọn cho mỗi ván (lưu vào match_history.move_log).
+
+Định dạng (phiên bản 1):
+    byte 0      : FORMAT_VERSION
+    byte 1      : kích thước bàn cờ
+    sau đó, mỗi nước đi là 2 varint (LEB128, 7 bit/byte):
+        (ô << 1) | người   ô = hàng * size + cột, người: 0 = X, 1 = O
+        số ms kể từ nước đi trước (nước đầu: kể từ lúc bắt đầu ván)
+
+Mỗi nước thường tốn 3-4 byte, cả ván chỉ vài chục byte.
+"""
+
+import time
+from collections import namedtuple
+
+FORMAT_VERSION = 1
+
+Move = namedtuple("Move", "row col player offset_ms")  # player: "X" hoặc "O"
+
+
+def _write_varint(buf, value):
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("move_log bị cắt cụt")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+class MoveLog:
+    """Ghi lại các nước đi của một ván theo thứ tự, append O(1)."""
+    __slots__ = ("size", "player_x", "player_o", "started", "_last_ms", "_buf", "count")
+
+    def __init__(self, size, player_x, player_o):
+        self.size = size
+        self.player_x = player_x    # user_id cầm quân X (đi trước)
+        self.player_o = player_o
+        self.started = time.monotonic()
+        self._last_ms = 0
+        self._buf = bytearray((FORMAT_VERSION, size))
+        self.count = 0
+
+    def append(self, row, col, user_id):
+        now_ms = int((time.monotonic() - self.started) * 1000)
+        _write_varint(self._buf, ((row * self.size + col) << 1) | (user_id == self.player_o))
+        _write_varint(self._buf, now_ms - self._last_ms)
+        self._last_ms = now_ms
+        self.count += 1
+
+    def to_bytes(self):
+        return bytes(self._buf)
+
+    @classmethod
+    def resume(cls, data, player_x, player_o):
+        """Ghi tiếp một log đã lưu (ví dụ ván được khôi phục từ snapshot)."""
+        size, moves = decode(data)
+        log = cls(size, player_x, player_o)
+        log._buf = bytearray(data)
+        log.count = len(moves)
+        log._last_ms = moves[-1].offset_ms if moves else 0
+        log.started -= log._last_ms / 1000
+        return log
+
+
+def decode(data):
+    """
+    Giải mã move_log đã lưu. Trả về (kích thước bàn, [Move, ...]).
+    Ném ValueError nếu dữ liệu không đúng định dạng (ví dụ log dạng chữ cũ).
+    """
+    if not data or data[0] != FORMAT_VERSION or len(data) < 2:
+        raise ValueError("move_log không phải định dạng nhị phân phiên bản %d" % FORMAT_VERSION)
+    size = data[1]
+    moves = []
+    pos = 2
+    offset = 0
+    while pos < len(data):
+        packed, pos = _read_varint(data, pos)
+        delta, pos = _read_varint(data, pos)
+        offset += delta
+        row, col = divmod(packed >> 1, size)
+        moves.append(Move(row, col, "O" if packed & 1 else "X", offset))
+    return size, moves
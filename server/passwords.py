@@ -0,0 +1,102 @@
+# Server/passwords.py
+
+"""
+Băm và kiểm tra mật khẩu bcrypt trên một process pool riêng.
+
+bcrypt tốn 100-300ms CPU mỗi lần ở work factor mặc định. Đẩy sang các process
+riêng (số lượng = số lõi) để đợt đăng nhập dồn dập không làm đứng các ván đang
+chơi. Hàng đợi có giới hạn: quá BCRYPT_MAX_PENDING yêu cầu thì từ chối ngay.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+import metrics
+from config import BCRYPT_ROUNDS, BCRYPT_WORKERS, BCRYPT_MAX_PENDING
+
+_executor = None
+_pending = 0
+
+PENDING = metrics.gauge("caro_bcrypt_pending", "Số yêu cầu bcrypt đang chờ hoặc đang chạy")
+REJECTED = metrics.counter("caro_bcrypt_rejected_total", "Số yêu cầu bcrypt bị từ chối do hàng đợi đầy")
+REHASHED = metrics.counter("caro_bcrypt_rehashed_total", "Số mật khẩu được băm lại theo work factor mới")
+
+
+class PasswordPoolBusyError(Exception):
+    """Hàng đợi băm mật khẩu đã đầy."""
+
+# --- Hàm chạy trong process con (phải ở cấp module để pickle được) ---
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+def _noop():
+    return os.getpid()
+
+# --- API ---
+
+def worker_count():
+    return BCRYPT_WORKERS or os.cpu_count() or 1
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=worker_count())
+    return _executor
+
+async def _submit(op_name, func, *args):
+    global _pending
+    if _pending >= BCRYPT_MAX_PENDING:
+        REJECTED.inc()
+        raise PasswordPoolBusyError("Hàng đợi bcrypt đã đầy.")
+
+    duration = metrics.histogram("caro_bcrypt_seconds", "Thời gian thực hiện bcrypt (gồm chờ)", op=op_name)
+    started = time.perf_counter()
+    _pending += 1
+    PENDING.set(_pending)
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), func, *args)
+    finally:
+        _pending -= 1
+        PENDING.set(_pending)
+        duration.observe(time.perf_counter() - started)
+
+async def hash_password(password):
+    """Băm mật khẩu với work factor hiện tại. Trả về chuỗi hash."""
+    return await _submit("hash", _hash, password, BCRYPT_ROUNDS)
+
+async def verify_password(password, password_hash):
+    """Kiểm tra mật khẩu với hash lưu trong DB."""
+    return await _submit("verify", _check, password, password_hash)
+
+def hash_rounds(password_hash):
+    """Đọc work factor từ hash dạng '$2b$12$...'. Trả về None nếu không đọc được."""
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+def needs_rehash(password_hash):
+    """True nếu hash được tạo với work factor khác cấu hình hiện tại."""
+    return hash_rounds(password_hash) != BCRYPT_ROUNDS
+
+def warm_up():
+    """Khởi động sẵn các process con để lần đăng nhập đầu không phải chờ."""
+    executor = _get_executor()
+    futures = [executor.submit(_noop) for _ in range(worker_count())]
+    for future in futures:
+        future.result()
+
+def shutdown(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
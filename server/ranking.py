@@ -0,0 +1,214 @@
+# Server/ranking.py
+
+"""
+Chỉ mục xếp hạng trong bộ nhớ cho bảng xếp hạng và hạng của user.
+
+Người chơi được giữ trong một treap (cây nhị phân tìm kiếm ngẫu nhiên) có
+lưu kích thước cây con, khóa (-wins, username) giống ORDER BY wins DESC,
+username ASC của get_leaderboard:
+
+- top(k): O(log n + k)
+- rank_of(user_id): O(log n) (đếm số khóa nhỏ hơn)
+- cập nhật kết quả trận: xóa + chèn lại, O(log n)
+
+Chỉ mục được nạp từ bảng users khi khởi động (storage.load_ranking) và cập
+nhật sau mỗi lô kết quả đã commit; verify() so sánh lại với DB.
+"""
+
+import random
+
+import metrics
+
+USERS = metrics.gauge("caro_ranking_users", "Số người chơi trong chỉ mục xếp hạng")
+MISMATCHES = metrics.counter("caro_ranking_mismatches_total", "Số lệch giữa chỉ mục xếp hạng và DB khi kiểm tra")
+
+# Collation mặc định của MySQL (utf8mb4_0900_ai_ci) không phân biệt hoa thường
+# và xếp '_' < '-' < chữ số < chữ cái. Username chỉ gồm [a-zA-Z0-9_-] (xem handle_register).
+_COLLATION = str.maketrans({"_": "\x01", "-": "\x02"})
+
+def collation_key(username):
+    return username.lower().translate(_COLLATION)
+
+
+class _Player:
+    __slots__ = ("user_id", "username", "wins", "losses", "draws", "key")
+
+    def __init__(self, user_id, username, wins, losses, draws):
+        self.user_id = user_id
+        self.username = username
+        self.wins = wins
+        self.losses = losses
+        self.draws = draws
+        self.key = (-wins, collation_key(username))
+
+    def public(self):
+        """Cùng định dạng một dòng của database_manager.get_leaderboard."""
+        return {"username": self.username, "wins": self.wins,
+                "total_games": self.wins + self.losses + self.draws}
+
+
+class _Node:
+    __slots__ = ("player", "key", "prio", "left", "right", "size")
+
+    def __init__(self, player):
+        self.player = player
+        self.key = player.key
+        self.prio = random.random()
+        self.left = None
+        self.right = None
+        self.size = 1
+
+def _size(node):
+    return node.size if node else 0
+
+def _split(node, key):
+    """Tách cây thành (các khóa < key, các khóa >= key)."""
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        node.size = 1 + _size(node.left) + _size(node.right)
+        return node, right
+    left, node.left = _split(node.left, key)
+    node.size = 1 + _size(node.left) + _size(node.right)
+    return left, node
+
+def _merge(left, right):
+    """Nối hai cây, mọi khóa của left nhỏ hơn mọi khóa của right."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.prio > right.prio:
+        left.right = _merge(left.right, right)
+        left.size = 1 + _size(left.left) + _size(left.right)
+        return left
+    right.left = _merge(left, right.left)
+    right.size = 1 + _size(right.left) + _size(right.right)
+    return right
+
+
+class RankingIndex:
+    """Bảng xếp hạng trong bộ nhớ."""
+
+    def __init__(self):
+        self._root = None
+        self._players = {}      # {user_id: _Player}
+        self.loaded = False     # False = chưa nạp được từ DB, storage sẽ truy vấn DB như cũ
+
+    def __len__(self):
+        return len(self._players)
+
+    # --- Nạp & cập nhật ---
+    def load(self, rows):
+        """Nạp lại toàn bộ từ các dòng (user_id, username, wins, losses, draws)."""
+        self._root = None
+        self._players = {}
+        for user_id, username, wins, losses, draws in rows:
+            self._insert(_Player(user_id, username, wins or 0, losses or 0, draws or 0))
+        self.loaded = True
+        USERS.set(len(self._players))
+
+    def add_user(self, user_id, username, wins=0, losses=0, draws=0):
+        """Thêm user mới đăng ký (bỏ qua nếu đã có)."""
+        if user_id not in self._players:
+            self._insert(_Player(user_id, username, wins, losses, draws))
+            USERS.set(len(self._players))
+
+    def adjust(self, user_id, wins=0, losses=0, draws=0):
+        """Cộng thêm số trận cho user_id (không có trong chỉ mục thì bỏ qua)."""
+        player = self._players.get(user_id)
+        if player is None:
+            return
+        self._remove(player)
+        player.wins += wins
+        player.losses += losses
+        player.draws += draws
+        player.key = (-player.wins, collation_key(player.username))
+        self._insert(player)
+
+    def apply_results(self, results):
+        """Áp dụng các kết quả đã commit: list (player_x_id, player_o_id, winner_id)."""
+        for player_x_id, player_o_id, winner_id in results:
+            if winner_id is None:
+                continue  # Hòa không cập nhật wins/losses (giống save_match_results_batch)
+            loser_id = player_o_id if winner_id == player_x_id else player_x_id
+            self.adjust(winner_id, wins=1)
+            self.adjust(loser_id, losses=1)
+
+    def _insert(self, player):
+        left, right = _split(self._root, player.key)
+        self._root = _merge(_merge(left, _Node(player)), right)
+        self._players[player.user_id] = player
+
+    def _remove(self, player):
+        left, rest = _split(self._root, player.key)
+        # rest bắt đầu bằng đúng nút của player (khóa là duy nhất)
+        _, right = _split(rest, (player.key[0], player.key[1] + "\x00"))
+        self._root = _merge(left, right)
+
+    # --- Truy vấn ---
+    def top(self, limit=50):
+        """Top `limit` người chơi, cùng định dạng get_leaderboard."""
+        result = []
+        stack = []
+        node = self._root
+        while (stack or node) and len(result) < limit:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            result.append(node.player.public())
+            node = node.right
+        return result
+
+    def stats_of(self, user_id):
+        """wins/losses của user_id (cùng khóa với user_data khi LOGIN), None nếu không có."""
+        player = self._players.get(user_id)
+        if player is None:
+            return None
+        return {"wins": player.wins, "losses": player.losses}
+
+    def rank_of(self, user_id):
+        """Hạng của user_id, cùng định dạng get_user_rank (None nếu không có)."""
+        player = self._players.get(user_id)
+        if player is None:
+            return None
+        rank = 1
+        node = self._root
+        while node:
+            if node.key < player.key:
+                rank += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return {**player.public(), "rank": rank}
+
+    # --- Kiểm tra ---
+    def verify(self, rows, db_top=None):
+        """
+        So sánh với dữ liệu DB. rows: (user_id, username, wins, losses, draws);
+        db_top: danh sách username theo thứ tự get_leaderboard (nếu có).
+        Trả về danh sách mô tả các chỗ lệch (rỗng = khớp).
+        """
+        problems = []
+        seen = set()
+        for user_id, username, wins, losses, draws in rows:
+            seen.add(user_id)
+            player = self._players.get(user_id)
+            expected = (username, wins or 0, losses or 0, draws or 0)
+            if player is None:
+                problems.append(f"thiếu user {user_id}")
+            elif (player.username, player.wins, player.losses, player.draws) != expected:
+                problems.append(f"user {user_id}: chỉ mục {(player.wins, player.losses, player.draws)} != DB {expected[1:]}")
+        problems.extend(f"thừa user {user_id}" for user_id in self._players.keys() - seen)
+        if db_top is not None and not problems:
+            ours = [entry["username"] for entry in self.top(len(db_top))]
+            if ours != list(db_top):
+                problems.append("thứ tự top khác DB (kiểm tra collation của cột username)")
+        if problems:
+            MISMATCHES.inc(len(problems))
+        return problems
+
+
+INDEX = RankingIndex()
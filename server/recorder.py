@@ -0,0 +1,196 @@
+# Server/recorder.py
+
+"""
+Ghi lại traffic gửi lên (bật khi cần) để phát lại bằng scripts/replay_traffic.py:
+tái hiện một đợt cao điểm thật trên máy local và so sánh hai phiên bản server
+trên cùng một lượng tải.
+
+Bật bằng RECORD_TRAFFIC trong config, biến môi trường CARO_RECORD_TRAFFIC hoặc
+`python server.py --record PATH`. Khi chạy nhiều worker, mỗi worker ghi một
+file riêng (PATH.w<số thứ tự>); replay_traffic.py nhận nhiều file và gộp lại.
+
+Định dạng file (chỉ ghi nối thêm): MAGIC, sau đó là các bản ghi
+    <delta_us: uint32><conn: uint32><kind: uint8><len: uint32><data>
+delta_us tính từ bản ghi trước; mỗi lần server khởi động ghi một bản ghi
+START (data = thời điểm time.time(), double) để đặt lại mốc, số kết nối đếm
+lại từ 1 sau mỗi START.
+
+Mật khẩu (tài khoản và phòng) không bao giờ được ghi: mỗi mật khẩu được thay
+bằng một bí danh HMAC với khóa ngẫu nhiên chỉ nằm trong bộ nhớ, nên cùng một
+mật khẩu luôn ra cùng một bí danh (LOGIN sau REGISTER, JOIN_ROOM vào phòng có
+mật khẩu vẫn phát lại đúng) mà không thể suy ngược. Resume token bị xóa.
+"""
+
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import secrets
+import struct
+import time
+
+import logger
+import metrics
+import wire
+from config import RECORD_TRAFFIC
+
+log = logger.get_logger("server")
+
+MAGIC = b"CAROREC1"
+RECORD = struct.Struct("<IIBI")
+
+# Loại bản ghi
+KIND_START = 0   # data: struct "<d" time.time() lúc bắt đầu ghi
+KIND_OPEN = 1    # data: subprotocol đã thỏa thuận (rỗng = JSON mặc định)
+KIND_TEXT = 2    # data: frame JSON (utf-8)
+KIND_BINARY = 3  # data: frame nhị phân (wire)
+KIND_ROOM = 4    # data: mã phòng kết nối vừa vào (để replay ánh xạ sang mã phòng mới)
+KIND_GAME = 5    # data: b"X"/b"O", quân của kết nối trong ván vừa bắt đầu (X/O chọn ngẫu nhiên)
+KIND_CLOSE = 6
+
+_PATH_ENV = "CARO_RECORD_TRAFFIC"
+# Khóa bí danh mật khẩu dùng chung cho mọi worker (tiến trình con kế thừa biến môi trường)
+_KEY_ENV = "CARO_RECORD_KEY"
+
+RECORDED_FRAMES = metrics.counter("caro_recorded_frames_total", "Số frame đã ghi vào file traffic")
+RECORDED_BYTES = metrics.counter("caro_recorded_bytes_total", "Số byte đã ghi vào file traffic")
+
+ENABLED = False
+_file = None
+_key = None
+_last = 0.0
+_conn_ids = itertools.count(1)
+
+
+def configured_path():
+    return os.environ.get(_PATH_ENV) or RECORD_TRAFFIC
+
+def set_path(path):
+    """Đặt file ghi cho tiến trình này và các worker sẽ tạo (gọi trước khi start)."""
+    os.environ[_PATH_ENV] = path
+
+def start(worker_id=0, worker_count=1):
+    """Mở file ghi (nếu được bật). Gọi một lần khi worker khởi động."""
+    global ENABLED, _file, _key, _last
+    path = configured_path()
+    if not path:
+        return
+    if worker_count > 1:
+        path = f"{path}.w{worker_id}"
+    _key = os.environ.setdefault(_KEY_ENV, secrets.token_hex(32)).encode("utf-8")
+    _file = open(path, "ab", buffering=1 << 16)
+    if _file.tell() == 0:
+        _file.write(MAGIC)
+    _last = time.monotonic()
+    _write(0, KIND_START, struct.pack("<d", time.time()))
+    ENABLED = True
+    log.info("Đang ghi traffic", worker=worker_id, path=path)
+
+def stop():
+    global ENABLED, _file
+    if _file is None:
+        return
+    ENABLED = False
+    _file.close()
+    _file = None
+
+
+def _write(conn_id, kind, data):
+    global _last
+    if _file is None:
+        return  # Đã dừng ghi (server đang tắt)
+    now = time.monotonic()
+    delta = min(int((now - _last) * 1_000_000), 0xFFFFFFFF)
+    _last = now
+    _file.write(RECORD.pack(delta, conn_id, kind, len(data)))
+    _file.write(data)
+    RECORDED_FRAMES.inc()
+    RECORDED_BYTES.inc(RECORD.size + len(data))
+
+
+def _alias(password):
+    digest = hmac.new(_key, password.encode("utf-8"), hashlib.sha256).hexdigest()
+    return "r-" + digest[:16]
+
+def _redact(message):
+    """Frame -> frame đã thay mật khẩu/token; giữ nguyên frame không có gì cần che."""
+    binary = not isinstance(message, str)
+    if not binary and '"password"' not in message and '"token"' not in message:
+        return message
+    try:
+        data = wire.decode_message(message) if binary else json.loads(message)
+    except ValueError:
+        return message
+    payload = data.get("payload") if isinstance(data, dict) else None
+    if not isinstance(payload, dict):
+        return message
+    changed = False
+    if isinstance(payload.get("password"), str) and payload["password"]:
+        payload["password"] = _alias(payload["password"])
+        changed = True
+    if "token" in payload:
+        payload["token"] = ""
+        changed = True
+    if not changed:
+        return message
+    return wire.encode_message(data) if binary else json.dumps(data)
+
+def open_connection(websocket):
+    websocket.record_id = next(_conn_ids)
+    websocket.recorded_room = None
+    _write(websocket.record_id, KIND_OPEN, (websocket.subprotocol or "").encode("utf-8"))
+
+def frame(websocket, message):
+    """Ghi một frame client gửi lên (đã che mật khẩu)."""
+    message = _redact(message)
+    if isinstance(message, str):
+        _write(websocket.record_id, KIND_TEXT, message.encode("utf-8"))
+    else:
+        _write(websocket.record_id, KIND_BINARY, bytes(message))
+
+def note_room(websocket):
+    """Sau mỗi frame: ghi lại khi kết nối vừa vào một phòng mới (mã phòng khác lần trước)."""
+    room_code = getattr(websocket, "room_code", None)
+    if room_code is not None and room_code != websocket.recorded_room:
+        websocket.recorded_room = room_code
+        _write(websocket.record_id, KIND_ROOM, room_code.encode("utf-8"))
+
+def note_game(player_x_ws, player_o_ws):
+    """Ván mới bắt đầu: ghi quân của hai người chơi để replay đánh đúng bên."""
+    if not ENABLED:
+        return
+    for websocket, role in ((player_x_ws, b"X"), (player_o_ws, b"O")):
+        record_id = getattr(websocket, "record_id", None)
+        if record_id is not None:
+            _write(record_id, KIND_GAME, role)
+
+def close_connection(websocket):
+    _write(websocket.record_id, KIND_CLOSE, b"")
+
+
+def read(path):
+    """
+    Đọc file traffic. Sinh ra (thời điểm time.time(), khóa kết nối, loại, data);
+    khóa kết nối = (số thứ tự lần ghi, conn) để không trùng giữa các lần khởi động.
+    File bị cắt cụt (server chết giữa chừng) được đọc tới bản ghi đầy đủ cuối cùng.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} không phải file traffic")
+        segment = 0
+        now = 0.0
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            delta, conn_id, kind, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            if kind == KIND_START:
+                segment += 1
+                now = struct.unpack("<d", data)[0]
+                continue
+            now += delta / 1_000_000
+            yield now, (segment, conn_id), kind, data
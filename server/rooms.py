@@ -0,0 +1,264 @@
+# Server/rooms.py
+
+"""
+Mô hình dữ liệu phòng chơi.
+
+Room và PlayerSlot dùng __slots__ (không có __dict__ riêng cho mỗi đối tượng)
+để giữ bộ nhớ nhỏ khi server giữ hàng chục nghìn phòng chờ. Dữ liệu công khai
+của phòng (gửi cho client) được cache kèm số phiên bản: mọi thay đổi trạng thái
+đi qua các phương thức bên dưới hoặc gọi touch(), snapshot chỉ dựng lại khi
+phiên bản thay đổi.
+"""
+
+import bitboard
+import move_log
+
+# Cài đặt mặc định dùng chung cho mọi phòng; không sửa tại chỗ (xem Room.update_settings)
+DEFAULT_SETTINGS = {"time_limit": 120}
+
+
+class PlayerSlot:
+    """Một chỗ ngồi trong phòng."""
+    __slots__ = ("websocket", "user_id", "username", "is_ready")
+
+    def __init__(self, websocket, user_id, username, is_ready=False):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.username = username
+        self.is_ready = is_ready
+
+    @classmethod
+    def from_websocket(cls, websocket):
+        """Tạo chỗ ngồi từ websocket đã đăng nhập (có user_id, username)."""
+        return cls(websocket, websocket.user_id, websocket.username)
+
+    def public(self):
+        """Thông tin gửi cho client (không có websocket)."""
+        return {"user_id": self.user_id, "username": self.username, "is_ready": self.is_ready}
+
+
+class Room:
+    """Một phòng chơi trong ACTIVE_ROOMS."""
+    __slots__ = (
+        "room_id", "password", "player1", "player2", "board", "move_log", "turn",
+        "settings", "score", "game_mode", "turn_timer", "consecutive_timeouts",
+        "created_seq", "waiting_slot", "version", "_snapshot", "_snapshot_version",
+        "spectators", "spectator_tail",
+    )
+
+    def __init__(self, room_id, host, password="", settings=None, game_mode=5, created_seq=0):
+        self.room_id = room_id
+        self.password = password
+        self.player1 = host          # PlayerSlot của chủ phòng
+        self.player2 = None          # PlayerSlot của người vào sau
+        self.board = None            # bitboard.Board khi đang chơi, None khi chưa bắt đầu
+        self.move_log = None         # move_log.MoveLog của ván đang chơi
+        self.turn = None             # user_id của người đến lượt
+        self.settings = settings if settings is not None else DEFAULT_SETTINGS
+        self.score = None            # {user_id: số ván thắng}, tạo ở ván đầu tiên
+        self.game_mode = game_mode
+        self.turn_timer = None       # timer_wheel.TimerHandle của lượt hiện tại (dùng lại qua các lượt)
+        self.consecutive_timeouts = 0
+        self.created_seq = created_seq
+        self.waiting_slot = None     # Vị trí trong WAITING_ROOMS, xem game_logic._sync_waiting_index
+        self.version = 0
+        self._snapshot = None
+        self._snapshot_version = -1
+        self.spectators = None       # set websocket người xem, tạo khi có người xem đầu tiên
+        self.spectator_tail = None   # Task gửi cho người xem gần nhất (giữ thứ tự sự kiện)
+
+    def touch(self):
+        """Đánh dấu trạng thái công khai đã thay đổi (snapshot sẽ được dựng lại)."""
+        self.version += 1
+
+    @property
+    def in_game(self):
+        return self.board is not None
+
+    # --- Tra cứu người chơi ---
+    def players(self):
+        """Các chỗ ngồi đang có người."""
+        if self.player2 is None:
+            return (self.player1,) if self.player1 else ()
+        return (self.player1, self.player2) if self.player1 else (self.player2,)
+
+    def slot_of(self, user_id):
+        if self.player1 and self.player1.user_id == user_id:
+            return self.player1
+        if self.player2 and self.player2.user_id == user_id:
+            return self.player2
+        return None
+
+    def opponent_of(self, user_id):
+        """Chỗ ngồi của đối thủ của user_id (None nếu user không ở phòng hoặc đang một mình)."""
+        if self.player1 and self.player1.user_id == user_id:
+            return self.player2
+        if self.player2 and self.player2.user_id == user_id:
+            return self.player1
+        return None
+
+    def websockets(self):
+        return [slot.websocket for slot in self.players()]
+
+    def both_ready(self):
+        return bool(self.player1 and self.player1.is_ready and
+                    self.player2 and self.player2.is_ready)
+
+    # --- Thay đổi trạng thái ---
+    def seat_guest(self, slot):
+        self.player2 = slot
+        self.touch()
+
+    def remove_player(self, user_id):
+        """
+        Gỡ user_id khỏi phòng. Nếu chủ phòng rời đi, người còn lại lên làm chủ.
+        Trả về chỗ ngồi của người còn lại (None nếu phòng trống).
+        """
+        if self.player1 and self.player1.user_id == user_id:
+            self.player1, self.player2 = self.player2, None
+        elif self.player2 and self.player2.user_id == user_id:
+            self.player2 = None
+        else:
+            return None
+        if self.player1:
+            self.player1.is_ready = False
+        self.touch()
+        return self.player1
+
+    def set_ready(self, user_id, is_ready):
+        slot = self.slot_of(user_id)
+        if slot:
+            slot.is_ready = is_ready
+            self.touch()
+        return slot
+
+    def reset_ready(self):
+        for slot in self.players():
+            slot.is_ready = False
+        self.touch()
+
+    def start_game(self, board, first_turn, move_log=None):
+        self.board = board
+        self.move_log = move_log
+        self.turn = first_turn
+        if self.score is None:
+            self.score = {slot.user_id: 0 for slot in self.players()}
+        self.reset_ready()
+
+    def place(self, row, col, user_id):
+        self.board.place(row, col, user_id)
+        if self.move_log is not None:
+            self.move_log.append(row, col, user_id)
+        self.consecutive_timeouts = 0
+        self.touch()
+
+    def set_turn(self, user_id):
+        self.turn = user_id
+        self.touch()
+
+    def add_win(self, user_id):
+        if self.score is None:
+            self.score = {slot.user_id: 0 for slot in self.players()}
+        if user_id in self.score:
+            self.score[user_id] += 1
+            self.touch()
+
+    def end_game(self):
+        """Về trạng thái phòng chờ sau khi ván kết thúc."""
+        self.board = None
+        self.move_log = None
+        self.turn = None
+        self.consecutive_timeouts = 0
+        self.reset_ready()
+
+    def update_settings(self, **changes):
+        """Đổi cài đặt theo kiểu copy-on-write (settings có thể đang dùng chung)."""
+        self.settings = {**self.settings, **changes}
+        self.touch()
+
+    # --- Người xem ---
+    def spectator_count(self):
+        return len(self.spectators) if self.spectators else 0
+
+    def add_spectator(self, websocket):
+        if self.spectators is None:
+            self.spectators = set()
+        self.spectators.add(websocket)
+
+    def remove_spectator(self, websocket):
+        if self.spectators:
+            self.spectators.discard(websocket)
+            if not self.spectators:
+                self.spectators = None
+
+    def cancel_timer(self):
+        if self.turn_timer:
+            self.turn_timer.cancel()
+
+    # --- Dữ liệu gửi client ---
+    def snapshot(self):
+        """
+        Dữ liệu công khai của phòng (cùng định dạng room_data cũ).
+        Được cache theo version; dict trả về dùng chung nên không được sửa.
+        """
+        if self._snapshot_version != self.version:
+            data = {
+                "room_id": self.room_id,
+                "password": self.password,
+                "board": self.board.to_rows() if self.board is not None else None,
+                "turn": self.turn,
+                "settings": self.settings,
+                "score": self.score,
+                "game_mode": self.game_mode,
+                "timer_task": None,  # Giữ khóa cũ cho client, không bao giờ gửi task
+            }
+            if self.player1:
+                data["player1"] = self.player1.public()
+            if self.player2:
+                data["player2"] = self.player2.public()
+            self._snapshot = data
+            self._snapshot_version = self.version
+        return self._snapshot
+
+    # --- Lưu/khôi phục khi khởi động lại server (xem snapshot.py) ---
+    def to_state(self, turn_time=None):
+        """Toàn bộ trạng thái phòng (trừ websocket/timer). turn_time: số giây còn lại của lượt."""
+        return {
+            "room_id": self.room_id,
+            "password": self.password,
+            "players": [slot.public() for slot in self.players()],
+            "settings": self.settings,
+            "score": self.score,
+            "game_mode": self.game_mode,
+            "board": self.board.to_rows() if self.board is not None else None,
+            "turn": self.turn,
+            "turn_time": turn_time,
+            "consecutive_timeouts": self.consecutive_timeouts,
+            "move_log": self.move_log.to_bytes() if self.move_log is not None else None,
+            "player_x": self.move_log.player_x if self.move_log is not None else None,
+            "player_o": self.move_log.player_o if self.move_log is not None else None,
+        }
+
+    @classmethod
+    def from_state(cls, state, created_seq=0):
+        """Dựng lại phòng từ to_state(). Mọi chỗ ngồi chưa có websocket (chờ người chơi quay lại)."""
+        slots = [PlayerSlot(None, p["user_id"], p["username"], p["is_ready"]) for p in state["players"]]
+        room = cls(state["room_id"], slots[0], state["password"], state["settings"],
+                   state["game_mode"], created_seq)
+        if len(slots) > 1:
+            room.player2 = slots[1]
+        if state["score"] is not None:
+            # Khóa user_id bị đổi thành chuỗi khi mã hóa
+            room.score = {int(user_id): wins for user_id, wins in state["score"].items()}
+        if state["board"] is not None:
+            room.board = bitboard.Board.from_rows(state["board"], state["game_mode"])
+            room.turn = state["turn"]
+            room.consecutive_timeouts = state["consecutive_timeouts"]
+            if state["move_log"] is not None:
+                room.move_log = move_log.MoveLog.resume(state["move_log"], state["player_x"], state["player_o"])
+        return room
+
+    def release_snapshot(self):
+        """Bỏ snapshot đã cache. Gọi khi phòng chuyển sang chờ lâu để không giữ bộ nhớ."""
+        self._snapshot = None
+        self._snapshot_version = -1
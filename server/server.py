@@ -1,100 +1,106 @@
 # Server/server.py
 
+import argparse
 import asyncio
+import signal
+import socket
 import websockets
-import json
-from config import SERVER_HOST, SERVER_PORT
+from config import SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SHUTDOWN_DRAIN_TIMEOUT, METRICS_HTTP
 
 # Import các hàm xử lý từ các file khác
 import database_manager as db_manager
+import storage # Gọi DB dạng async (thread pool)
+import passwords # bcrypt trên process pool riêng
 import game_logic # Import file logic
+import cluster # Nhiều worker: chia phòng & chuyển tiếp giữa các tiến trình
+import ranking # Bảng xếp hạng trong bộ nhớ
+import sessions # Resume token (kết nối lại không cần bcrypt)
+import snapshot # Lưu/khôi phục phòng khi khởi động lại server
+import metrics
+import monitoring # /metrics (Prometheus) và /healthz trên cùng cổng
+import transport # Gửi/nhận tin theo định dạng client chọn (JSON / nhị phân)
+import recorder # Ghi traffic gửi lên để phát lại (bật khi cần)
+import wire
+from dispatcher import ActionDispatcher, PRIORITY_HIGH, PRIORITY_LOW
+import logger
+
+log = logger.get_logger("server")
+auth_log = logger.get_logger("auth")
+recv_log = logger.get_logger("recv")  # Mọi frame nhận được, được lấy mẫu (LOG_SAMPLING)
 
 # ----- Quản lý Trạng thái Server -----
 CONNECTED_CLIENTS = {}
 # ACTIVE_ROOMS đã được chuyển sang game_logic.py
 
+# Khi chạy nhiều worker: các action luôn xử lý tại worker giữ kết nối,
+# kể cả khi client đang ở phòng của worker khác
+LOCAL_ACTIONS = {"LOGIN", "REGISTER", "RESUME", "GET_MATCH_HISTORY", "GET_LEADERBOARD"}
+
+HISTORY_PAGE_MAX = 50  # Số trận tối đa mỗi trang GET_MATCH_HISTORY
+
+CLIENTS_GAUGE = metrics.gauge("caro_connected_clients", "Số client đã đăng nhập")
+metrics.add_collector(lambda: CLIENTS_GAUGE.set(len(CONNECTED_CLIENTS)))
+
+# Tắt server an toàn (xem shutdown): số tin nhắn đang xử lý, và cờ ngừng nhận action mới
+_inflight = 0
+_draining = False
+
 # -----------------------------------
 
+def _should_relay(websocket, action, payload):
+    """Frame này có cần chuyển sang worker chủ phòng không (và chủ phòng là worker nào)."""
+    if action in LOCAL_ACTIONS or not hasattr(websocket, 'user_id'):
+        return None  # Chưa đăng nhập / đã bị đăng xuất: xử lý (và từ chối) tại chỗ
+    if cluster.is_relayed(websocket):
+        return websocket.relay[0]
+    if action in ("JOIN_ROOM", "WATCH_ROOM") and hasattr(websocket, 'user_id') and not hasattr(websocket, 'room_code'):
+        room_code = payload.get("room_id")
+        if isinstance(room_code, str) and room_code and not cluster.owns(room_code):
+            return cluster.shard_of(room_code)
+    if action == "QUICK_JOIN" and not hasattr(websocket, 'room_code') and cluster.WORKER_ID != cluster.MATCHMAKER:
+        return cluster.MATCHMAKER  # Hàng đợi vào nhanh chung của cả cụm
+    return None
+
 async def handle_message(websocket, message):
     """
-    Hàm này nhận và phân tích mọi tin nhắn từ Client.
+    Hàm này nhận và phân tích mọi tin nhắn từ Client (JSON text hoặc frame
+    nhị phân, xem wire.py), sau đó chuyển cho ACTIONS (bảng điều phối) xử lý.
     """
     try:
-        data = json.loads(message)
+        data = transport.decode(message)
+    except ValueError:
+        log.warning("Nhận được tin nhắn sai định dạng", user=getattr(websocket, "user_id", None),
+                    binary=not isinstance(message, str))
+        await transport.send(websocket, { "status": "ERROR", "message": "Tin nhắn không đúng định dạng JSON."})
+        return
+
+    if _draining:
+        await transport.send(websocket, {"status": "ERROR", "message": "Server đang khởi động lại, vui lòng thử lại sau giây lát."})
+        return
+
+    global _inflight
+    _inflight += 1
+    try:
         action = data.get('action') 
-        payload = data.get('payload', {}) 
-
-        # [CẬP NHẬT] Kiểm tra các hành động yêu cầu đăng nhập
-        if action not in ["LOGIN", "REGISTER"]:
-             if not hasattr(websocket, 'user_id'): # Kiểm tra xem đã đăng nhập chưa
-                await websocket.send(json.dumps({
-                    "status": "ERROR", 
-                    "message": "Bạn phải đăng nhập để thực hiện hành động này."
-                }))
+        payload = data.get('payload') or {}
+        recv_log.info("Nhận", action=action, user=getattr(websocket, "user_id", None),
+                      room=getattr(websocket, "room_code", None), payload=payload)
+
+        if cluster.ENABLED and isinstance(payload, dict):
+            owner = _should_relay(websocket, action, payload)
+            if owner is not None:
+                if not cluster.is_relayed(websocket):
+                    await cluster.attach(websocket, owner)
+                await cluster.forward(websocket, message)
                 return
-        
-        # 2. [CẬP NHẬT] Điều phối tất cả các hành động
-        if action == "LOGIN":
-            await handle_login(websocket, payload)
-        
-        elif action == "REGISTER":
-            await handle_register(websocket, payload)
-            
-        elif action == "CREATE_ROOM":
-            await game_logic.handle_create_room(websocket, payload)
-        
-        # --- [MỚI] Thêm các chức năng Lobby ---
-        elif action == "JOIN_ROOM":
-            await game_logic.handle_join_room(websocket, payload)
 
-        elif action == "CANCEL_QUICK_JOIN":
-            await game_logic.handle_cancel_quick_join(websocket)           
-            
-        elif action == "FIND_ROOM":
-            await game_logic.handle_find_room(websocket, payload)
-            
-        elif action == "QUICK_JOIN":
-            await game_logic.handle_quick_join(websocket, payload)
-
-        # --- [MỚI] Thêm các chức năng Phòng chờ & Game (Sẽ làm sau) ---
-        elif action == "UPDATE_SETTINGS":
-            await game_logic.handle_update_settings(websocket, payload)
-        elif action == "READY" or action == "PLAYER_READY": # Thay cho "Bắt đầu game"
-             await game_logic.handle_ready(websocket, payload if payload else {})
-        elif action == "LEAVE_ROOM":
-             await game_logic.handle_leave_room(websocket)
-        
-        elif action == "MOVE" or action == "MAKE_MOVE":
-             await game_logic.handle_move(websocket, payload)
-        elif action == "SURRENDER":
-             await game_logic.handle_surrender(websocket, payload)
-        elif action == "CHAT":
-             await game_logic.handle_chat(websocket, payload)
-        elif action == "REMATCH":
-             await game_logic.handle_rematch(websocket, payload)
-        elif action == "GET_MATCH_HISTORY":
-             await handle_get_match_history(websocket, payload)
-        elif action == "GET_LEADERBOARD":
-             await handle_get_leaderboard(websocket, payload)
-        elif action == "TURN_TIMEOUT":
-             # Client báo timeout, server sẽ xử lý qua timer task
-             print(f"[DEBUG] Client báo TURN_TIMEOUT từ {getattr(websocket, 'user_id', 'unknown')}")
+        await ACTIONS.dispatch(websocket, action, payload)
 
-        
-        # --- Hết ---
-            
-        else:
-            await websocket.send(json.dumps({
-                "status": "ERROR", 
-                "message": f"Hành động '{action}' không được hỗ trợ."
-            }))
-
-    except json.JSONDecodeError:
-        print("[LỖI] Nhận được tin nhắn không phải JSON.")
-        await websocket.send(json.dumps({ "status": "ERROR", "message": "Tin nhắn không đúng định dạng JSON."}))
-    except Exception as e:
-        print(f"[LỖI NGOẠI LỆ] {e}")
-        await websocket.send(json.dumps({ "status": "ERROR", "message": "Có lỗi xảy ra phía server."}))
+    except Exception:
+        log.exception("Lỗi khi xử lý tin nhắn", user=getattr(websocket, "user_id", None))
+        await transport.send(websocket, { "status": "ERROR", "message": "Có lỗi xảy ra phía server."})
+    finally:
+        _inflight -= 1
 
 # ----- Các Hàm Xử lý Logic -----
 
@@ -103,29 +109,16 @@ async def handle_login(websocket, payload):
     try:
         username = payload['username']
         password = payload['password']
-        result = db_manager.login_user(username, password)
+        result = await storage.login_user(username, password)
         
         if result["status"] == "SUCCESS":
             user_id = result['user_data']['user_id']
             username = result['user_data']['username']
             
             # [MỚI] Kiểm tra xem tài khoản đã được đăng nhập ở nơi khác chưa
-            if user_id in CONNECTED_CLIENTS:
-                old_websocket = CONNECTED_CLIENTS[user_id]
-                # Thông báo cho client cũ về việc bị đăng xuất
-                try:
-                    await old_websocket.send(json.dumps({
-                        "status": "FORCE_LOGOUT",
-                        "message": "Tài khoản của bạn đã được đăng nhập ở thiết bị khác."
-                    }))
-                    print(f"[FORCE LOGOUT] Đã đăng xuất client cũ của user {username}")
-                except Exception as e:
-                    print(f"[WARNING] Không thể gửi thông báo đăng xuất cho client cũ: {e}")
-                # Xóa các thông tin liên quan của client cũ
-                if hasattr(old_websocket, 'user_id'):
-                    delattr(old_websocket, 'user_id')
-                if hasattr(old_websocket, 'username'):
-                    delattr(old_websocket, 'username')
+            # (ở worker này và ở các worker khác nếu chạy nhiều tiến trình)
+            await _force_logout_local(user_id)
+            await cluster.broadcast("force_logout", user_id=user_id)
             
             # GÁN THÔNG TIN USER VÀO WEBSOCKET MỚI
             websocket.user_id = user_id
@@ -133,19 +126,112 @@ async def handle_login(websocket, payload):
             
             # Lưu lại kết nối mới
             CONNECTED_CLIENTS[user_id] = websocket
-            print(f"[ĐĂNG NHẬP] User {username} (ID: {user_id}) đã kết nối.")
+            auth_log.info("Đăng nhập", user=user_id, username=username)
             
             result["status"] = "LOGIN_SUCCESS"
-            await websocket.send(json.dumps(result))
+            # Token để kết nối lại bằng RESUME mà không phải nhập lại mật khẩu
+            result["resume_token"] = sessions.issue(user_id, username)
+            await transport.send(websocket, result)
         else:
-            await websocket.send(json.dumps(result))
+            await transport.send(websocket, result)
 
     except KeyError:
-        print("[LỖI ĐĂNG NHẬP] Tin nhắn LOGIN thiếu username hoặc password.")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Yêu cầu đăng nhập thiếu thông tin."}))
+        auth_log.warning("Tin nhắn LOGIN thiếu username hoặc password")
+        await transport.send(websocket, {"status": "ERROR", "message": "Yêu cầu đăng nhập thiếu thông tin."})
+    except Exception:
+        auth_log.exception("Lỗi đăng nhập")
+        await transport.send(websocket, {"status": "ERROR", "message": "Lỗi đăng nhập."})
+
+async def handle_resume(websocket, payload):
+    """
+    Kết nối lại bằng resume token: chỉ kiểm tra HMAC (không bcrypt, không DB),
+    rồi đưa user về chỗ cũ trong phòng nếu chỗ đó còn được giữ.
+    """
+    session = sessions.verify(payload.get("token"))
+    if session is None:
+        auth_log.info("Resume token không hợp lệ hoặc đã hết hạn")
+        await transport.send(websocket, {
+            "status": "RESUME_FAILED",
+            "message": "Phiên đăng nhập đã hết hạn, vui lòng đăng nhập lại."
+        })
+        return
+    user_id, username = session
+    
+    # Như LOGIN: kết nối cũ (thường là kết nối vừa mất nhưng server chưa phát hiện) bị đăng xuất
+    if CONNECTED_CLIENTS.get(user_id) is not websocket:
+        await _force_logout_local(user_id)
+        await cluster.broadcast("force_logout", user_id=user_id)
+    websocket.user_id = user_id
+    websocket.username = username
+    CONNECTED_CLIENTS[user_id] = websocket
+    auth_log.info("Kết nối lại bằng resume token", user=user_id, username=username)
+    
+    # Chỗ cũ trong phòng nằm ở worker nào (nếu còn)
+    owner = None
+    if not hasattr(websocket, 'room_code') and not cluster.is_relayed(websocket):
+        if game_logic.find_seat(user_id) is not None:
+            owner = cluster.WORKER_ID
+        else:
+            owners = [w for w in await cluster.call_all("seat_owner", user_id=user_id) if w is not None]
+            owner = owners[0] if owners else None
+    
+    await transport.send(websocket, {
+        "status": "RESUME_SUCCESS",
+        "user_data": {"user_id": user_id, "username": username, **(ranking.INDEX.stats_of(user_id) or {})},
+        "resume_token": sessions.issue(user_id, username),
+        "in_room": owner is not None
+    })
+    
+    if owner == cluster.WORKER_ID:
+        await game_logic.handle_resume_room(websocket)
+    elif owner is not None:
+        await cluster.attach(websocket, owner)
+        await cluster.forward(websocket, transport.encode({"action": "RESUME_ROOM"}))
+
+async def _force_logout_local(user_id):
+    """
+    Đăng xuất kết nối cũ của user_id trên worker này (nếu có), kể cả bản
+    RemoteSocket của kết nối đó khi nó đang ở phòng của worker này.
+    """
+    # Kết nối thật ở worker khác: worker đó tự gửi FORCE_LOGOUT và ngắt chuyển tiếp,
+    # ở đây chỉ bỏ danh tính để các frame còn đang trên đường bị từ chối
+    for proxy in cluster.hosted_sockets(user_id):
+        _drop_identity(proxy)
+    old_websocket = CONNECTED_CLIENTS.pop(user_id, None)
+    if old_websocket is None:
+        return
+    # Thông báo cho client cũ về việc bị đăng xuất
+    try:
+        await transport.send(old_websocket, {
+            "status": "FORCE_LOGOUT",
+            "message": "Tài khoản của bạn đã được đăng nhập ở thiết bị khác."
+        })
+        auth_log.info("Đã đăng xuất client cũ", user=user_id)
     except Exception as e:
-        print(f"[LỖI ĐĂNG NHẬP] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi đăng nhập."}))
+        auth_log.warning("Không thể gửi thông báo đăng xuất cho client cũ", user=user_id, error=str(e))
+    # Đang ở phòng của worker khác: ngừng chuyển tiếp, worker chủ phòng dọn dẹp như khi ngắt kết nối
+    if cluster.is_relayed(old_websocket):
+        await cluster.detach(old_websocket)
+    _drop_identity(old_websocket)
+
+def _drop_identity(websocket):
+    """Xóa user_id/username khỏi kết nối bị đăng xuất (các action sau đó bị từ chối)."""
+    # Vé vào nhanh được tra theo user_id: hủy trước khi xóa, nếu không vé cũ kẹt trong hàng đợi
+    game_logic.drop_queue_ticket(websocket)
+    if hasattr(websocket, 'user_id'):
+        delattr(websocket, 'user_id')
+    if hasattr(websocket, 'username'):
+        delattr(websocket, 'username')
+
+async def _on_cluster_event(event):
+    """Sự kiện broadcast từ worker khác."""
+    kind = event.get("event")
+    if kind == "force_logout":
+        await _force_logout_local(event["user_id"])
+    elif kind == "ranking_results":
+        ranking.INDEX.apply_results(event["results"])
+    elif kind == "ranking_user":
+        ranking.INDEX.add_user(event["user_id"], event["username"])
 
 async def handle_register(websocket, payload):
     """Xử lý logic đăng ký."""
@@ -155,76 +241,134 @@ async def handle_register(websocket, payload):
         
         # [MỚI] Validation server-side
         if len(username) < 3:
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Tên đăng nhập phải có ít nhất 3 ký tự."}))
+            await transport.send(websocket, {"status": "ERROR", "message": "Tên đăng nhập phải có ít nhất 3 ký tự."})
             return
         
         if len(username) > 20:
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Tên đăng nhập không được quá 20 ký tự."}))
+            await transport.send(websocket, {"status": "ERROR", "message": "Tên đăng nhập không được quá 20 ký tự."})
             return
             
         if len(password) < 3:
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Mật khẩu phải có ít nhất 3 ký tự."}))
+            await transport.send(websocket, {"status": "ERROR", "message": "Mật khẩu phải có ít nhất 3 ký tự."})
             return
             
         # Kiểm tra ký tự hợp lệ
         import re
         if not re.match(r'^[a-zA-Z0-9_-]+$', username):
-            await websocket.send(json.dumps({"status": "ERROR", "message": "Tên chỉ được chứa chữ, số, _ và -"}))
+            await transport.send(websocket, {"status": "ERROR", "message": "Tên chỉ được chứa chữ, số, _ và -"})
             return
         
-        result = db_manager.register_user(username, password)
-        await websocket.send(json.dumps(result))
+        result = await storage.register_user(username, password)
+        await transport.send(websocket, result)
         
     except KeyError:
-        print("[LỖI ĐĂNG KÝ] Tin nhắn REGISTER thiếu username hoặc password.")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Yêu cầu đăng ký thiếu thông tin."}))
-    except Exception as e:
-        print(f"[LỖI ĐĂNG KÝ] {e}")
-        await websocket.send(json.dumps({"status": "ERROR", "message": "Lỗi đăng ký."}))
+        auth_log.warning("Tin nhắn REGISTER thiếu username hoặc password")
+        await transport.send(websocket, {"status": "ERROR", "message": "Yêu cầu đăng ký thiếu thông tin."})
+    except Exception:
+        auth_log.exception("Lỗi đăng ký")
+        await transport.send(websocket, {"status": "ERROR", "message": "Lỗi đăng ký."})
 
 async def handle_get_match_history(websocket, payload):
     """Xử lý yêu cầu lấy lịch sử trận đấu."""
     try:
         user_id = websocket.user_id
+        # Phân trang: cursor = next_cursor của trang trước (không có = trang đầu)
+        cursor = payload.get("cursor")
+        limit = min(max(payload.get("limit") or HISTORY_PAGE_MAX, 1), HISTORY_PAGE_MAX)
+        if cursor:
+            try:
+                db_manager.decode_history_cursor(cursor)
+            except ValueError:
+                await transport.send(websocket, {"status": "ERROR", "message": "Cursor lịch sử không hợp lệ."})
+                return
         
         # Lấy lịch sử từ database
-        matches = db_manager.get_match_history(user_id)
+        page = await storage.get_match_history(user_id, limit, cursor)
         
-        await websocket.send(json.dumps({
+        await transport.send(websocket, {
             "status": "MATCH_HISTORY",
-            "matches": matches
-        }))
+            "matches": page["matches"],
+            "cursor": cursor,
+            "next_cursor": page["next_cursor"]
+        })
         
-    except Exception as e:
-        print(f"[LỖI MATCH_HISTORY] {e}")
-        await websocket.send(json.dumps({
+    except Exception:
+        log.exception("Không thể tải lịch sử trận đấu", user=getattr(websocket, "user_id", None))
+        await transport.send(websocket, {
             "status": "ERROR", 
             "message": "Không thể tải lịch sử trận đấu."
-        }))
+        })
 
 async def handle_get_leaderboard(websocket, payload):
     """Xử lý yêu cầu lấy bảng xếp hạng."""
     try:
         # Lấy bảng xếp hạng từ database
-        players = db_manager.get_leaderboard()
+        players = await storage.get_leaderboard()
         
         # Lấy thông tin rank của user hiện tại
         user_rank_info = None
         if hasattr(websocket, 'user_id') and websocket.user_id:
-            user_rank_info = db_manager.get_user_rank(websocket.user_id)
+            user_rank_info = await storage.get_user_rank(websocket.user_id)
         
-        await websocket.send(json.dumps({
+        await transport.send(websocket, {
             "status": "LEADERBOARD",
             "players": players,
             "user_rank": user_rank_info
-        }))
+        })
         
-    except Exception as e:
-        print(f"[LỖI LEADERBOARD] {e}")
-        await websocket.send(json.dumps({
+    except Exception:
+        log.exception("Không thể tải bảng xếp hạng", user=getattr(websocket, "user_id", None))
+        await transport.send(websocket, {
             "status": "ERROR", 
             "message": "Không thể tải bảng xếp hạng."
-        }))
+        })
+
+async def handle_turn_timeout(websocket, payload):
+    """Client báo timeout, server sẽ xử lý qua timer task."""
+    log.debug("Client báo TURN_TIMEOUT", user=getattr(websocket, "user_id", None))
+
+# ----- Bảng điều phối Action -----
+# Mỗi handler nhận (websocket, payload). Các handler của game_logic chỉ nhận
+# websocket được bọc lại bằng lambda để giữ nguyên chữ ký cũ.
+
+ACTIONS = ActionDispatcher()
+
+_CREDENTIALS_SCHEMA = {"username": str, "password": str}
+_GAME_MODE = (int, str)  # Số quân hoặc "ANY"
+
+ACTIONS.register("LOGIN", handle_login, auth_required=False, schema=_CREDENTIALS_SCHEMA)
+ACTIONS.register("REGISTER", handle_register, auth_required=False, schema=_CREDENTIALS_SCHEMA)
+ACTIONS.register("RESUME", handle_resume, auth_required=False, schema={"token": str})
+ACTIONS.register("RESUME_ROOM", game_logic.handle_resume_room)
+
+# --- Lobby ---
+ACTIONS.register("CREATE_ROOM", game_logic.handle_create_room,
+                 schema={"password": str, "settings": dict, "game_mode": _GAME_MODE})
+ACTIONS.register("JOIN_ROOM", game_logic.handle_join_room,
+                 schema={"room_id": str, "password": str, "game_mode": _GAME_MODE})
+ACTIONS.register("CANCEL_QUICK_JOIN", lambda ws, payload: game_logic.handle_cancel_quick_join(ws))
+ACTIONS.register("FIND_ROOM", game_logic.handle_find_room, schema={"game_mode": _GAME_MODE})
+ACTIONS.register("QUICK_JOIN", game_logic.handle_quick_join, schema={"game_mode": _GAME_MODE})
+ACTIONS.register("WATCH_ROOM", game_logic.handle_watch_room, schema={"room_id": str, "password": str})
+ACTIONS.register("UNWATCH_ROOM", game_logic.handle_unwatch_room)
+
+# --- Phòng chờ & Game ---
+ACTIONS.register("UPDATE_SETTINGS", game_logic.handle_update_settings,
+                 schema={"password": str, "time_limit": (int, str)})
+ACTIONS.register("READY", game_logic.handle_ready, aliases=("PLAYER_READY",),
+                 schema={"toggle_ready": bool, "is_ready": bool})
+ACTIONS.register("LEAVE_ROOM", lambda ws, payload: game_logic.handle_leave_room(ws))
+ACTIONS.register("MOVE", game_logic.handle_move, aliases=("MAKE_MOVE",),
+                 schema={"row": int, "col": int}, priority=PRIORITY_HIGH)
+ACTIONS.register("SURRENDER", game_logic.handle_surrender, priority=PRIORITY_HIGH)
+ACTIONS.register("CHAT", game_logic.handle_chat, schema={"message": str})
+ACTIONS.register("REMATCH", game_logic.handle_rematch)
+ACTIONS.register("TURN_TIMEOUT", handle_turn_timeout)
+
+# --- Truy vấn dữ liệu ---
+ACTIONS.register("GET_MATCH_HISTORY", handle_get_match_history, priority=PRIORITY_LOW,
+                 schema={"cursor": str, "limit": int})
+ACTIONS.register("GET_LEADERBOARD", handle_get_leaderboard, priority=PRIORITY_LOW)
 
 # ----- Hàm Chính của Server -----
 
@@ -232,40 +376,151 @@ async def main_handler(websocket):
     """
     Hàm này được gọi cho MỖI client kết nối vào.
     """
-    print(f"[KẾT NỐI MỚI] Một client đã kết nối từ {websocket.remote_address}")
+    transport.negotiate(websocket)
+    transport.open_outbox(websocket)  # Mọi tin gửi cho client đi qua hàng đợi riêng
+    log.info("Kết nối mới", remote=str(websocket.remote_address), codec=websocket.codec)
+    recording = recorder.ENABLED
+    if recording:
+        recorder.open_connection(websocket)
     
     try:
         async for message in websocket:
-            print(f"[NHẬN] {message}") 
+            transport.count_received(message)
+            if recording:
+                recorder.frame(websocket, message)
             await handle_message(websocket, message)
+            if recording:
+                recorder.note_room(websocket)
             
     except websockets.exceptions.ConnectionClosedError:
-        print(f"[NGẮT KẾT NỐI] Client {websocket.remote_address} đã ngắt kết nối (lỗi).")
+        log.info("Ngắt kết nối (lỗi)", remote=str(websocket.remote_address), user=getattr(websocket, "user_id", None))
     except websockets.exceptions.ConnectionClosedOK:
-        print(f"[NGẮT KẾT NỐI] Client {websocket.remote_address} đã ngắt kết nối (bình thường).")
+        log.info("Ngắt kết nối (bình thường)", remote=str(websocket.remote_address), user=getattr(websocket, "user_id", None))
     finally:
         # [CẬP NHẬT] Xử lý dọn dẹp khi client ngắt kết nối
         
+        # 0. Client đang ở phòng của worker khác: báo worker đó dọn dẹp
+        if cluster.is_relayed(websocket):
+            await cluster.detach(websocket)
+        
         # 1. Gọi hàm dọn dẹp phòng game (nếu có)
         await game_logic.handle_disconnect(websocket)
         
         # 2. Xóa khỏi danh sách CONNECTED_CLIENTS (nếu đã đăng nhập)
-        if hasattr(websocket, 'user_id') and websocket.user_id in CONNECTED_CLIENTS:
+        if hasattr(websocket, 'user_id') and CONNECTED_CLIENTS.get(websocket.user_id) is websocket:
             del CONNECTED_CLIENTS[websocket.user_id]
-            print(f"[DỌN DẸP] Đã xóa User ID {websocket.user_id} khỏi CONNECTED_CLIENTS.")
+            log.debug("Đã xóa khỏi CONNECTED_CLIENTS", user=websocket.user_id)
+        
+        # 3. Bỏ các tin còn chờ gửi
+        transport.close_outbox(websocket)
+        if recording:
+            recorder.close_connection(websocket)
 
 # ... (Hàm start_server và if __name__ == "__main__" giữ nguyên) ...
+async def shutdown(server):
+    """
+    Tắt an toàn: ngừng nhận kết nối mới, chờ các action đang xử lý xong,
+    lưu snapshot các phòng rồi đóng kết nối với mã 1012 (service restart)
+    để client tự kết nối lại và RESUME khi server chạy lên.
+    """
+    global _draining
+    log.info("Đang tắt server...", worker=cluster.WORKER_ID, connections=len(server.websockets))
+    server.server.close()  # Chỉ đóng socket lắng nghe, các kết nối đang mở vẫn giữ
+    _draining = True
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SHUTDOWN_DRAIN_TIMEOUT
+    while _inflight and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+    if _inflight:
+        log.warning("Hết thời gian chờ action đang xử lý", worker=cluster.WORKER_ID, inflight=_inflight)
+
+    snapshot.save(cluster.WORKER_ID, game_logic.snapshot_rooms())
+    game_logic.suspend_rooms()
+    await transport.flush(max(0.0, deadline - loop.time()))
+    await asyncio.gather(*(ws.close(1012, "server restart") for ws in list(server.websockets)),
+                         return_exceptions=True)
+
+async def process_http(path, request_headers):
+    """Request HTTP thường (/metrics, /healthz); đường dẫn khác tiếp tục bắt tay WebSocket."""
+    return await monitoring.handle_http(path, {
+        "status": "draining" if _draining else "ok",
+        "worker": cluster.WORKER_ID,
+        "clients": len(CONNECTED_CLIENTS),
+        "rooms": len(game_logic.ACTIVE_ROOMS),
+    })
+
+def _on_stop_signal(stop):
+    if not stop.done():
+        stop.set_result(None)
+
 async def start_server():
     """Khởi động WebSocket server."""
-    async with websockets.serve(main_handler, SERVER_HOST, SERVER_PORT):
-        print(f"Server WebSocket đang lắng nghe tại ws://{SERVER_HOST}:{SERVER_PORT}")
-        await asyncio.Future()
+    # Nhiều worker cùng lắng nghe một cổng, kernel chia kết nối (SO_REUSEPORT)
+    options = {"reuse_port": True} if cluster.ENABLED else {}
+    if METRICS_HTTP:
+        options["process_request"] = process_http
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    try:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, _on_stop_signal, stop)
+    except NotImplementedError:
+        pass  # Windows: Ctrl+C dừng ngay (KeyboardInterrupt), không lưu snapshot
+    # Phòng còn dở từ lần chạy trước (trước khi nhận RESUME: khóa token nằm trong snapshot)
+    await game_logic.restore_rooms(snapshot.load(cluster.WORKER_ID))
+    # Client chọn định dạng tin nhắn qua subprotocol; không chọn thì dùng JSON
+    async with websockets.serve(main_handler, SERVER_HOST, SERVER_PORT,
+                                subprotocols=wire.SUBPROTOCOLS, **options) as server:
+        await cluster.start()
+        monitoring.start()
+        recorder.start(cluster.WORKER_ID, cluster.WORKER_COUNT)
+        await storage.load_ranking()
+        log.info(f"Server WebSocket đang lắng nghe tại ws://{SERVER_HOST}:{SERVER_PORT}",
+                 worker=cluster.WORKER_ID, workers=cluster.WORKER_COUNT)
+        try:
+            await stop
+            await shutdown(server)
+        finally:
+            # Ghi nốt kết quả trận đang chờ trước khi event loop dừng
+            await storage.flush_results()
+            recorder.stop()
+    log.info("Đã tắt server.", worker=cluster.WORKER_ID)
 
-if __name__ == "__main__":
-    print("Đang kiểm tra/khởi tạo CSDL...")
-    db_manager.create_tables()
+def run_worker(worker_id=0, worker_count=1):
+    """Chạy một worker (cũng là chế độ một tiến trình khi worker_count = 1)."""
+    cluster.configure(worker_id, worker_count, on_message=handle_message,
+                      on_disconnect=game_logic.handle_disconnect, on_broadcast=_on_cluster_event)
+    db_manager.init_pool()
+    passwords.warm_up()
     
     try:
         asyncio.run(start_server())
     except KeyboardInterrupt:
-        print("\nĐã tắt server.")
\ No newline at end of file
+        log.info("Đã tắt server.", worker=worker_id)
+    finally:
+        storage.shutdown()
+        passwords.shutdown()
+        db_manager.POOL.close_all()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Caro WebSocket server")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS,
+                        help="Số tiến trình worker (mặc định lấy từ config.SERVER_WORKERS)")
+    parser.add_argument("--record", metavar="PATH",
+                        help="Ghi traffic gửi lên vào file để phát lại (scripts/replay_traffic.py)")
+    args = parser.parse_args()
+    if args.record:
+        recorder.set_path(args.record)
+    
+    log.info("Đang kiểm tra/khởi tạo CSDL...")
+    db_manager.create_tables()
+    
+    workers = args.workers
+    if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        log.warning("Hệ điều hành không hỗ trợ SO_REUSEPORT, chạy một tiến trình")
+        workers = 1
+    
+    if workers > 1:
+        cluster.run_supervisor(run_worker, workers)
+    else:
+        run_worker()
\ No newline at end of file
@@ -0,0 +1,73 @@
+# Server/sessions.py
+
+"""
+Resume token: cho client mất kết nối đăng nhập lại bằng RESUME mà không phải
+kiểm tra bcrypt (chỉ một phép HMAC-SHA256).
+
+Token = base64url(user_id.username.hạn_dùng) + "." + base64url(HMAC)
+Server không lưu token nào; đổi SESSION_SECRET là mọi token cũ hết hiệu lực.
+Khi để trống, khóa tự sinh chỉ sống qua lần khởi động lại nhờ snapshot.py.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+
+from config import SESSION_SECRET, SESSION_TOKEN_TTL
+
+# Để trống: sinh ngẫu nhiên một lần; đặt vào biến môi trường để các worker
+# (tạo sau, xem cluster.run_supervisor) dùng chung cùng một khóa.
+_SECRET_ENV = "CARO_SESSION_SECRET"
+if SESSION_SECRET:
+    _secret = SESSION_SECRET.encode("utf-8")
+else:
+    _secret = os.environ.setdefault(_SECRET_ENV, secrets.token_hex(32)).encode("utf-8")
+
+
+def export_secret():
+    """Khóa tự sinh (để lưu kèm snapshot khi khởi động lại); None nếu khóa lấy từ config."""
+    return None if SESSION_SECRET else _secret.decode("utf-8")
+
+def import_secret(secret):
+    """Dùng lại khóa tự sinh của lần chạy trước: token đã phát vẫn còn hiệu lực."""
+    global _secret
+    if not SESSION_SECRET:
+        os.environ[_SECRET_ENV] = secret
+        _secret = secret.encode("utf-8")
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(body):
+    return hmac.new(_secret, body, hashlib.sha256).digest()
+
+
+def issue(user_id, username, ttl=SESSION_TOKEN_TTL):
+    """Tạo resume token cho user, hết hạn sau `ttl` giây."""
+    body = f"{user_id}.{username}.{int(time.time() + ttl)}".encode("utf-8")
+    return f"{_b64encode(body)}.{_b64encode(_sign(body))}"
+
+def verify(token):
+    """Kiểm tra token. Trả về (user_id, username) nếu hợp lệ, None nếu sai chữ ký/hết hạn."""
+    try:
+        body_part, signature_part = token.split(".")
+        body = _b64decode(body_part)
+        signature = _b64decode(signature_part)
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(signature, _sign(body)):
+        return None
+    try:
+        user_id, username, expires = body.decode("utf-8").split(".")
+        if int(expires) < time.time():
+            return None
+        return int(user_id), username
+    except ValueError:
+        return None
@@ -0,0 +1,89 @@
+# Server/snapshot.py
+
+"""
+Snapshot trạng thái phòng khi tắt server, để khởi động lại không làm mất ván.
+
+Khi tắt an toàn (SIGTERM/SIGINT, xem server.shutdown), mỗi worker ghi toàn bộ
+phòng của mình vào một file: bàn cờ, lượt, tỉ số, cài đặt, game mode, move_log
+và số giây còn lại của lượt. Dữ liệu mã hóa bằng wire.encode_message (bàn cờ
+2 bit/ô) nên file chỉ vài chục byte mỗi phòng.
+
+Lúc khởi động, worker nạp lại file của mình (rồi xóa đi) và giữ chỗ cho mọi
+người chơi RESTORE_GRACE_PERIOD giây để client RESUME vào lại.
+
+Khi SESSION_SECRET để trống, khóa ký resume token (sinh ngẫu nhiên) cũng được
+lưu kèm để token cũ còn dùng được sau khi khởi động lại; file vì vậy chỉ chủ
+sở hữu đọc được. Đổi số worker giữa hai lần chạy: phòng không được chia lại,
+worker mới chỉ nạp file trùng số thứ tự của mình.
+"""
+
+import os
+import time
+
+import logger
+import sessions
+import wire
+from config import SNAPSHOT_DIR, SNAPSHOT_MAX_AGE
+
+log = logger.get_logger("snapshot")
+
+FORMAT_VERSION = 1
+
+
+def path_for(worker_id):
+    return os.path.join(SNAPSHOT_DIR, f"caro-snapshot-{worker_id}.bin")
+
+
+def save(worker_id, rooms):
+    """Ghi danh sách trạng thái phòng (Room.to_state) ra file, thay thế nguyên tử."""
+    data = wire.encode_message({
+        "format": FORMAT_VERSION,
+        "saved_at": time.time(),
+        "secret": sessions.export_secret(),
+        "rooms": rooms,
+    })
+    path = path_for(worker_id)
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    log.info("Đã lưu snapshot", worker=worker_id, rooms=len(rooms), bytes=len(data), path=path)
+    return len(data)
+
+
+def load(worker_id):
+    """
+    Đọc snapshot của worker (một lần: file bị xóa sau khi đọc).
+    Trả về danh sách trạng thái phòng; [] nếu không có, quá cũ hoặc hỏng.
+    """
+    path = path_for(worker_id)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    try:
+        snapshot = wire.decode_message(data)
+    except ValueError:
+        log.warning("Snapshot hỏng, bỏ qua", worker=worker_id, path=path)
+        return []
+    if snapshot.get("format") != FORMAT_VERSION:
+        log.warning("Snapshot khác phiên bản, bỏ qua", worker=worker_id, format=snapshot.get("format"))
+        return []
+    age = time.time() - snapshot["saved_at"]
+    if age > SNAPSHOT_MAX_AGE:
+        log.warning("Snapshot quá cũ, bỏ qua", worker=worker_id, age=round(age))
+        return []
+    if snapshot.get("secret"):
+        sessions.import_secret(snapshot["secret"])
+    log.info("Đã nạp snapshot", worker=worker_id, rooms=len(snapshot["rooms"]), age=round(age, 1))
+    return snapshot["rooms"]
@@ -0,0 +1,394 @@
+# Server/storage.py
+
+"""
+Lớp bọc bất đồng bộ cho database_manager.
+
+Các hàm trong database_manager là code mysql-connector đồng bộ; gọi trực tiếp
+trong coroutine sẽ làm đứng event loop (mọi phòng đều bị treo nước đi và
+timer). Ở đây mỗi thao tác được đẩy sang một ThreadPoolExecutor có giới hạn
+và trả về awaitable, kèm số liệu độ sâu hàng đợi và thời gian chờ.
+"""
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import cluster
+import database_manager as db_manager
+import logger
+import metrics
+import passwords
+import ranking
+from config import (DB_EXECUTOR_WORKERS, DB_MAX_PENDING,
+                    RESULT_FLUSH_INTERVAL, RESULT_BATCH_SIZE, RESULT_RETRY_DELAY,
+                    RESULT_MAX_ATTEMPTS, RESULT_MAX_PENDING, RANKING_VERIFY_INTERVAL)
+
+log = logger.get_logger("db")
+
+_executor = None
+_admission = None  # asyncio.Semaphore giới hạn số thao tác đang chờ + đang chạy
+
+QUEUE_DEPTH = metrics.gauge("caro_db_queue_depth", "Số thao tác DB đã gửi nhưng chưa được thread nào nhận")
+IN_FLIGHT = metrics.gauge("caro_db_in_flight", "Số thao tác DB đang chờ hoặc đang chạy")
+WAIT_TIME = metrics.histogram("caro_db_wait_seconds", "Thời gian chờ trước khi thao tác DB được thực thi")
+LOGIN_LATENCY = metrics.histogram("caro_login_seconds", "Tổng thời gian xử lý một lần đăng nhập")
+
+RESULTS_PENDING = metrics.gauge("caro_results_pending", "Số kết quả trận đấu đang chờ ghi xuống DB")
+RESULTS_LAG = metrics.histogram("caro_results_lag_seconds", "Thời gian từ lúc trận kết thúc đến khi kết quả được commit",
+                                buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+RESULTS_BATCH = metrics.histogram("caro_results_batch_size", "Số trận mỗi lô ghi",
+                                  buckets=(1, 2, 5, 10, 25, 50, 100, 200, 500))
+RESULTS_FAILED = metrics.counter("caro_results_failed_batches_total", "Số lô ghi kết quả bị lỗi (sẽ ghi lại)")
+RESULTS_DROPPED = metrics.counter("caro_results_dropped_total", "Số kết quả trận bị bỏ (dữ liệu hỏng hoặc hàng đợi đầy), xem log")
+
+# Hàng đợi ghi trễ: (thời điểm đưa vào hàng đợi, tuple dữ liệu cho save_match_results_batch)
+_pending_results = deque()
+_results_writer = None
+_results_wakeup = None
+_batch_failures = 0  # Số lần liên tiếp lô ở đầu hàng đợi ghi lỗi
+_ranking_verifier = None
+
+
+def _get_executor():
+    global _executor, _admission
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+    if _admission is None:
+        _admission = asyncio.Semaphore(DB_MAX_PENDING)
+    return _executor
+
+
+async def _run(op_name, func, *args, **kwargs):
+    """Chạy func(*args) trên thread pool và đo thời gian chờ/thực thi."""
+    executor = _get_executor()
+    duration = metrics.histogram("caro_db_call_seconds", "Thời gian thực thi thao tác DB", op=op_name)
+    loop = asyncio.get_running_loop()
+    timing = []        # [lúc thread nhận việc, lúc xong], ghi ở thread DB, đọc sau khi await xong
+    picked_up = False
+
+    def on_picked_up():
+        # Metric không có lock: chỉ cập nhật trên event loop (thread DB báo về qua call_soon_threadsafe)
+        nonlocal picked_up
+        if not picked_up:
+            picked_up = True
+            QUEUE_DEPTH.dec()
+
+    def job():
+        timing.append(time.perf_counter())
+        try:
+            loop.call_soon_threadsafe(on_picked_up)
+        except RuntimeError:
+            pass  # Event loop đã đóng (đang tắt server)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timing.append(time.perf_counter())
+
+    async with _admission:
+        IN_FLIGHT.inc()
+        QUEUE_DEPTH.inc()
+        submitted = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, job)
+        finally:
+            IN_FLIGHT.dec()
+            on_picked_up()  # Bị hủy trước khi thread nhận việc: job không chạy, vẫn trả lại QUEUE_DEPTH
+            if len(timing) == 2:
+                WAIT_TIME.observe(timing[0] - submitted)
+                duration.observe(timing[1] - timing[0])
+
+
+def stats():
+    """Số liệu hiện tại của thread pool DB."""
+    return {
+        "workers": DB_EXECUTOR_WORKERS,
+        "max_pending": DB_MAX_PENDING,
+        "queue_depth": QUEUE_DEPTH.value,
+        "in_flight": IN_FLIGHT.value,
+        "wait": WAIT_TIME.snapshot(),
+    }
+
+
+def shutdown(wait=True):
+    """Ghi nốt kết quả trận còn trong hàng đợi rồi dừng thread pool (gọi khi tắt server)."""
+    global _executor
+    if _pending_results:
+        # Event loop đã dừng: ghi đồng bộ ngay trên thread hiện tại
+        log.info("Ghi nốt kết quả trận còn trong hàng đợi", matches=len(_pending_results))
+        while _pending_results:
+            batch = _take_batch()
+            try:
+                ok = db_manager.save_match_results_batch([row for _, row in batch])
+            except Exception:
+                log.exception("Lỗi khi ghi lô kết quả trận", matches=len(batch))
+                ok = False
+            if not ok:
+                log.error("Mất kết quả trận khi tắt server", matches=len(batch) + len(_pending_results))
+                _pending_results.clear()
+                RESULTS_PENDING.set(0)
+                break
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+# --- Các thao tác (cùng tên với database_manager) ---
+
+async def login_user(username, password_attempt):
+    """
+    Đăng nhập: lấy user từ DB (thread pool), kiểm tra bcrypt (process pool),
+    và băm lại mật khẩu nếu work factor trong config đã thay đổi.
+    """
+    started = time.perf_counter()
+    try:
+        result = await _run("get_user_for_login", db_manager.get_user_for_login, username)
+        if result["status"] != "SUCCESS":
+            return result
+
+        user_data = result["user_data"]
+        password_hash = user_data.pop("password_hash")
+        if not await passwords.verify_password(password_attempt, password_hash):
+            return {"status": "ERROR", "message": "Sai mật khẩu."}
+
+        if passwords.needs_rehash(password_hash):
+            new_hash = await passwords.hash_password(password_attempt)
+            if await _run("update_password_hash", db_manager.update_password_hash, user_data["user_id"], new_hash):
+                passwords.REHASHED.inc()
+
+        return {"status": "SUCCESS", "user_data": user_data}
+    except passwords.PasswordPoolBusyError:
+        return {"status": "ERROR", "message": "Server đang bận, vui lòng thử lại sau."}
+    finally:
+        LOGIN_LATENCY.observe(time.perf_counter() - started)
+
+async def register_user(username, password):
+    """Đăng ký: băm mật khẩu trên process pool rồi ghi vào DB."""
+    try:
+        password_hash = await passwords.hash_password(password)
+    except passwords.PasswordPoolBusyError:
+        return {"status": "ERROR", "message": "Server đang bận, vui lòng thử lại sau."}
+    result = await _run("create_user", db_manager.create_user, username, password_hash)
+    if result.get("status") == "SUCCESS" and result.get("user_id"):
+        ranking.INDEX.add_user(result["user_id"], username)
+        await cluster.broadcast("ranking_user", user_id=result["user_id"], username=username)
+    return result
+
+# --- Ghi trễ kết quả trận đấu (write-behind) ---
+
+def record_match_result(player_x_id, player_o_id, winner_id, game_mode, result_type="normal",
+                        move_log=None, duration=0.0):
+    """
+    Đưa kết quả trận vào hàng đợi, không chờ DB. Một task nền gom lại và ghi
+    theo lô (RESULT_BATCH_SIZE trận hoặc sau RESULT_FLUSH_INTERVAL giây).
+    Thống kê wins/losses được cập nhật cùng transaction với lịch sử.
+    """
+    end_time = datetime.now()
+    start_time = end_time - timedelta(seconds=duration)
+    row = (player_x_id, player_o_id, winner_id, game_mode, result_type, start_time, end_time, move_log)
+    if len(_pending_results) >= RESULT_MAX_PENDING:
+        # DB lỗi kéo dài: không để hàng đợi lớn mãi, kết quả mới chỉ còn trong log
+        _drop_result(row, "hàng đợi đầy")
+        return
+    _pending_results.append((time.perf_counter(), row))
+    RESULTS_PENDING.inc()
+    _ensure_results_writer()
+    # Kết quả đầu tiên đánh thức writer đang ngủ (nó tự chờ gom thêm); đủ lô thì ghi ngay
+    if len(_pending_results) == 1 or len(_pending_results) >= RESULT_BATCH_SIZE:
+        _results_wakeup.set()
+
+def _ensure_results_writer():
+    global _results_writer, _results_wakeup
+    if _results_writer is None or _results_writer.done():
+        _results_wakeup = asyncio.Event()
+        _results_writer = asyncio.get_running_loop().create_task(_write_results_loop())
+
+def _take_batch():
+    batch = []
+    while _pending_results and len(batch) < RESULT_BATCH_SIZE:
+        batch.append(_pending_results.popleft())
+    RESULTS_PENDING.dec(len(batch))
+    return batch
+
+async def _write_results_loop():
+    while True:
+        try:
+            if not _pending_results:
+                _results_wakeup.clear()
+                await _results_wakeup.wait()
+            # flush_results() gọi trực tiếp (verify_ranking, tắt server) có thể đã ghi hết hàng đợi
+            if not _pending_results:
+                continue
+            if len(_pending_results) < RESULT_BATCH_SIZE:
+                # Chờ gom thêm, nhưng không giữ kết quả cũ nhất quá RESULT_FLUSH_INTERVAL
+                _results_wakeup.clear()
+                oldest_age = time.perf_counter() - _pending_results[0][0]
+                try:
+                    await asyncio.wait_for(_results_wakeup.wait(), max(0.0, RESULT_FLUSH_INTERVAL - oldest_age))
+                except asyncio.TimeoutError:
+                    pass
+            if not await flush_results(max_batches=1):
+                await asyncio.sleep(RESULT_RETRY_DELAY)
+        except Exception:
+            # Task nền không được chết: lỗi bất ngờ thì ghi log rồi thử lại sau
+            log.exception("Lỗi trong vòng ghi kết quả trận", pending=len(_pending_results))
+            await asyncio.sleep(RESULT_RETRY_DELAY)
+
+def _requeue(entries):
+    """Trả các kết quả về đầu hàng đợi (giữ thứ tự) để thử lại sau."""
+    _pending_results.extendleft(reversed(entries))
+    RESULTS_PENDING.inc(len(entries))
+
+def _drop_result(row, reason):
+    """Bỏ hẳn một kết quả trận; log đủ dữ liệu để nhập tay lại nếu cần."""
+    RESULTS_DROPPED.inc()
+    player_x_id, player_o_id, winner_id, game_mode, result_type, start_time, end_time, move_log = row
+    log.error("Bỏ kết quả trận", reason=reason, player_x=player_x_id, player_o=player_o_id,
+              winner=winner_id, game_mode=game_mode, result_type=result_type,
+              start=start_time.isoformat(), end=end_time.isoformat(),
+              move_log=move_log.hex() if move_log is not None else None)
+
+async def _committed(entries):
+    done = time.perf_counter()
+    for enqueued, _ in entries:
+        RESULTS_LAG.observe(done - enqueued)
+    # Đã commit: cập nhật bảng xếp hạng trong bộ nhớ (của mọi worker)
+    committed = [row[:3] for _, row in entries]
+    ranking.INDEX.apply_results(committed)
+    await cluster.broadcast("ranking_results", results=committed)
+
+async def _save_rows(entries):
+    """Ghi một lô. Trả về True (đã commit), False (lỗi tạm thời, nên thử lại) hoặc None (lỗi do dữ liệu)."""
+    try:
+        return await _run("save_match_results_batch", db_manager.save_match_results_batch,
+                          [row for _, row in entries])
+    except Exception:
+        log.exception("Lỗi khi ghi lô kết quả trận", matches=len(entries))
+        return None
+
+async def _save_one_by_one(batch):
+    """
+    Ghi từng trận của một lô lỗi để trận hỏng không chặn cả hàng đợi. Trận lỗi
+    do dữ liệu bị bỏ; trận lỗi tạm thời cũng bị bỏ nếu trận khác vẫn ghi được
+    (DB vẫn chạy, vậy lỗi nằm ở trận đó). Trả về True nếu không còn gì để thử lại.
+    """
+    committed, retry = [], []
+    for i, entry in enumerate(batch):
+        ok = await _save_rows([entry])
+        if ok:
+            committed.append(entry)
+        elif ok is None:
+            _drop_result(entry[1], "lỗi dữ liệu")
+        else:
+            retry.append(entry)
+            if not committed and len(retry) >= RESULT_MAX_ATTEMPTS:
+                # Liên tiếp lỗi mà chưa trận nào ghi được: DB đang có sự cố, dừng thử
+                retry.extend(batch[i + 1:])
+                break
+    if committed:
+        for _, row in retry:
+            _drop_result(row, "ghi riêng vẫn lỗi")
+        retry = []
+        await _committed(committed)
+    _requeue(retry)
+    return not retry
+
+async def flush_results(max_batches=None):
+    """
+    Ghi các kết quả đang chờ (gọi trực tiếp khi cần ghi ngay, ví dụ trước khi tắt server).
+    Lô lỗi được ghi lại nguyên lô RESULT_MAX_ATTEMPTS lần (lỗi do dữ liệu thì
+    không chờ), sau đó ghi từng trận một (_save_one_by_one).
+    """
+    global _batch_failures
+    batches = 0
+    while _pending_results and (max_batches is None or batches < max_batches):
+        batch = _take_batch()
+        batches += 1
+        RESULTS_BATCH.observe(len(batch))
+        ok = await _save_rows(batch)
+        if ok:
+            _batch_failures = 0
+            await _committed(batch)
+            continue
+        RESULTS_FAILED.inc()
+        _batch_failures += 1
+        if ok is False and _batch_failures < RESULT_MAX_ATTEMPTS:
+            _requeue(batch)
+            return False
+        _batch_failures = 0
+        if not await _save_one_by_one(batch):
+            return False
+    return True
+
+def results_stats():
+    """Số liệu hàng đợi ghi kết quả trận."""
+    return {
+        "pending": len(_pending_results),
+        "failed_batches": RESULTS_FAILED.value,
+        "dropped": RESULTS_DROPPED.value,
+        "batch_size": RESULTS_BATCH.snapshot(),
+        "lag": RESULTS_LAG.snapshot(),
+    }
+
+async def update_game_stats(winner_id, loser_id):
+    return await _run("update_game_stats", db_manager.update_game_stats, winner_id, loser_id)
+
+async def save_match_result(player_x_id, player_o_id, winner_id, game_mode, result_type="normal", move_log=None):
+    return await _run("save_match_result", db_manager.save_match_result,
+                      player_x_id, player_o_id, winner_id, game_mode, result_type, move_log)
+
+async def get_match_history(user_id, limit=50, cursor=None):
+    return await _run("get_match_history", db_manager.get_match_history, user_id, limit, cursor)
+
+async def get_leaderboard(limit=50):
+    if ranking.INDEX.loaded:
+        return ranking.INDEX.top(limit)
+    return await _run("get_leaderboard", db_manager.get_leaderboard, limit)
+
+async def get_user_rank(user_id):
+    if ranking.INDEX.loaded:
+        return ranking.INDEX.rank_of(user_id)
+    return await _run("get_user_rank", db_manager.get_user_rank, user_id)
+
+# --- Chỉ mục xếp hạng trong bộ nhớ ---
+
+async def load_ranking():
+    """Nạp chỉ mục xếp hạng từ DB (lỗi thì giữ nguyên, leaderboard tiếp tục truy vấn DB)."""
+    rows = await _run("get_ranking_rows", db_manager.get_ranking_rows)
+    if rows is None:
+        log.warning("Không nạp được chỉ mục xếp hạng, dùng truy vấn DB")
+        return False
+    ranking.INDEX.load(rows)
+    log.info("Đã nạp chỉ mục xếp hạng", users=len(ranking.INDEX))
+    _ensure_ranking_verifier()
+    return True
+
+async def verify_ranking():
+    """
+    So sánh chỉ mục với bảng users; nếu lệch thì nạp lại từ DB.
+    Trả về danh sách chỗ lệch (rỗng = khớp).
+    """
+    # Ghi hết kết quả đang chờ để DB và chỉ mục cùng một trạng thái
+    await flush_results()
+    rows = await _run("get_ranking_rows", db_manager.get_ranking_rows)
+    db_top = await _run("get_leaderboard", db_manager.get_leaderboard, 50)
+    if rows is None:
+        return []
+    problems = ranking.INDEX.verify(rows, [entry["username"] for entry in db_top] if db_top else None)
+    if problems:
+        log.warning("Chỉ mục xếp hạng lệch với DB, nạp lại", count=len(problems), sample=problems[:5])
+        ranking.INDEX.load(rows)
+    return problems
+
+def _ensure_ranking_verifier():
+    global _ranking_verifier
+    if RANKING_VERIFY_INTERVAL and (_ranking_verifier is None or _ranking_verifier.done()):
+        _ranking_verifier = asyncio.get_running_loop().create_task(_verify_ranking_loop())
+
+async def _verify_ranking_loop():
+    while True:
+        await asyncio.sleep(RANKING_VERIFY_INTERVAL)
+        try:
+            await verify_ranking()
+        except Exception:
+            log.exception("Lỗi khi kiểm tra chỉ mục xếp hạng")
@@ -0,0 +1,225 @@
+# Server/timer_wheel.py
+
+"""
+Bánh xe hẹn giờ phân cấp (hierarchical timer wheel) dùng chung cho cả server.
+
+Thay vì mỗi lượt đi tạo một task asyncio.sleep() riêng, các phòng đăng ký
+hạn chót vào một bánh xe duy nhất chạy bằng một task nền:
+
+- Level 0 gồm SLOTS ô, mỗi ô ứng với một tick (TIMER_RESOLUTION giây).
+- Level k gồm SLOTS ô, mỗi ô phủ SLOTS^k tick. Khi level dưới quay hết một
+  vòng, ô tương ứng của level trên được "đổ" (cascade) xuống level dưới.
+- Mỗi ô là một dict {handle: None} nên thêm/hủy/đặt lại hẹn giờ đều O(1).
+
+Các timer đến hạn trong cùng một tick được gọi theo lô; callback dạng
+coroutine được gom vào một task duy nhất cho mỗi lô.
+"""
+
+import asyncio
+import inspect
+
+import logger
+import metrics
+from config import TIMER_RESOLUTION
+
+log = logger.get_logger("timer")
+
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS   # 64 ô mỗi level
+SLOT_MASK = SLOTS - 1
+LEVELS = 4               # 64^4 tick ~ 9 ngày với tick 50ms; xa hơn sẽ bị kẹp lại
+
+PENDING = metrics.gauge("caro_timer_pending", "Số hẹn giờ đang chờ trong timer wheel")
+FIRED = metrics.counter("caro_timer_fired_total", "Số hẹn giờ đã kích hoạt")
+LATE = metrics.counter("caro_timer_late_total", "Số hẹn giờ kích hoạt trễ hơn 2 tick")
+LATENESS = metrics.histogram("caro_timer_lateness_seconds", "Độ trễ so với hạn chót khi kích hoạt")
+
+
+class TimerHandle:
+    """Một hẹn giờ đã đăng ký. Giữ lại để hủy hoặc đặt lại (O(1))."""
+    __slots__ = ("wheel", "expires", "callback", "args", "_bucket")
+
+    def __init__(self, wheel, callback, args):
+        self.wheel = wheel
+        self.expires = 0      # Tick đến hạn
+        self.callback = callback
+        self.args = args
+        self._bucket = None   # Ô đang chứa handle (None = không còn chờ)
+
+    @property
+    def active(self):
+        return self._bucket is not None
+
+    def cancel(self):
+        """Hủy hẹn giờ (không lỗi nếu đã hủy/đã chạy)."""
+        if self._bucket is not None:
+            del self._bucket[self]
+            self._bucket = None
+            self.wheel._pending -= 1
+            PENDING.dec()
+
+    def remaining(self):
+        """Số giây còn lại đến hạn chót (None nếu không còn chờ)."""
+        if self._bucket is None:
+            return None
+        deadline = self.wheel._origin + self.expires * self.wheel.resolution
+        return max(0.0, deadline - asyncio.get_running_loop().time())
+
+    def reschedule(self, delay, *args):
+        """Đặt lại hạn chót sau `delay` giây (và đổi tham số nếu truyền vào)."""
+        self.cancel()
+        if args:
+            self.args = args
+        self.wheel._schedule(self, delay)
+        return self
+
+
+class TimerWheel:
+    """Bộ lập lịch hẹn giờ dùng một task nền duy nhất."""
+
+    def __init__(self, resolution=TIMER_RESOLUTION):
+        self.resolution = resolution
+        self._levels = [[{} for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self._tick = 0           # Tick cuối cùng đã xử lý
+        self._origin = None      # loop.time() ứng với tick 0
+        self._pending = 0
+        self._task = None
+        self._wakeup = None      # asyncio.Event: đánh thức task khi có timer mới lúc đang rảnh
+
+    # --- API ---
+    def call_later(self, delay, callback, *args):
+        """Gọi callback(*args) sau `delay` giây. callback có thể là hàm thường hoặc coroutine."""
+        handle = TimerHandle(self, callback, args)
+        self._schedule(handle, delay)
+        return handle
+
+    def pending(self):
+        return self._pending
+
+    def stats(self):
+        return {
+            "pending": self._pending,
+            "fired": FIRED.value,
+            "late": LATE.value,
+            "lateness": LATENESS.snapshot(),
+            "resolution": self.resolution,
+        }
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # --- Nội bộ ---
+    def _now_tick(self):
+        return int((asyncio.get_running_loop().time() - self._origin) / self.resolution)
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._origin is None:
+            self._origin = loop.time()
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    def _schedule(self, handle, delay):
+        self._ensure_running()
+        if self._pending == 0:
+            # Bánh xe đang rảnh: nhảy thẳng tới tick hiện tại, khỏi quay qua các ô trống
+            self._tick = max(self._tick, self._now_tick())
+            self._wakeup.set()
+        now = asyncio.get_running_loop().time()
+        # Làm tròn lên: không bao giờ kích hoạt sớm hơn delay
+        expires = -int(-(now + delay - self._origin) // self.resolution)
+        handle.expires = max(expires, self._tick + 1)
+        self._place(handle)
+        self._pending += 1
+        PENDING.inc()
+
+    def _place(self, handle):
+        delta = handle.expires - self._tick
+        for level in range(LEVELS):
+            if delta < 1 << (SLOT_BITS * (level + 1)):
+                break
+        else:
+            # Quá phạm vi bánh xe (~9 ngày): kẹp về ô xa nhất
+            level = LEVELS - 1
+            handle.expires = self._tick + (1 << (SLOT_BITS * LEVELS)) - 1
+        index = (handle.expires >> (SLOT_BITS * level)) & SLOT_MASK
+        bucket = self._levels[level][index]
+        bucket[handle] = None
+        handle._bucket = bucket
+
+    def _cascade(self, level):
+        """Đổ ô hiện tại của `level` xuống các level thấp hơn."""
+        index = (self._tick >> (SLOT_BITS * level)) & SLOT_MASK
+        bucket = self._levels[level][index]
+        if bucket:
+            handles = list(bucket)
+            bucket.clear()
+            for handle in handles:
+                self._place(handle)
+        return index
+
+    def _advance(self, target):
+        """Quay bánh xe tới tick `target`, trả về danh sách handle đến hạn."""
+        due = []
+        while self._tick < target:
+            self._tick += 1
+            tick = self._tick
+            if not tick & SLOT_MASK:
+                level = 1
+                while level < LEVELS and self._cascade(level) == 0:
+                    level += 1
+            bucket = self._levels[0][tick & SLOT_MASK]
+            if bucket:
+                due.extend(bucket)
+                bucket.clear()
+        for handle in due:
+            handle._bucket = None
+        self._pending -= len(due)
+        PENDING.dec(len(due))
+        return due
+
+    def _fire(self, due):
+        now = asyncio.get_running_loop().time()
+        coros = []
+        for handle in due:
+            lateness = now - (self._origin + handle.expires * self.resolution)
+            LATENESS.observe(max(lateness, 0.0))
+            if lateness > 2 * self.resolution:
+                LATE.inc()
+            try:
+                result = handle.callback(*handle.args)
+                if inspect.isawaitable(result):
+                    coros.append(result)
+            except Exception:
+                log.exception("Lỗi callback hẹn giờ")
+        FIRED.inc(len(due))
+        if coros:
+            asyncio.get_running_loop().create_task(self._run_batch(coros))
+
+    async def _run_batch(self, coros):
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.error("Lỗi callback hẹn giờ", error=repr(result))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._pending == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            next_at = self._origin + (self._tick + 1) * self.resolution
+            await asyncio.sleep(max(0.0, next_at - loop.time()))
+            due = self._advance(self._now_tick())
+            if due:
+                self._fire(due)
+
+
+WHEEL = TimerWheel()
+
+call_later = WHEEL.call_later
+stats = WHEEL.stats
@@ -0,0 +1,333 @@
+# Server/transport.py
+
+"""
+Mã hóa & gửi tin tới client theo định dạng đã thỏa thuận lúc kết nối.
+
+Mỗi websocket có thuộc tính `codec` (CODEC_JSON hoặc CODEC_BINARY), gán bởi
+negotiate() dựa trên subprotocol client chọn (xem wire.py). Client cũ không
+gửi subprotocol vẫn dùng JSON text như trước.
+
+Frame là payload đã "chuẩn bị" để gửi cho nhiều người: mỗi định dạng chỉ
+được mã hóa một lần, dù người nhận dùng JSON hay nhị phân.
+
+Kết nối client thật có một Outbox (open_outbox): gửi tin chỉ là đưa vào hàng
+đợi, một task riêng ghi ra socket. Client mạng chậm không làm handler của
+người khác (hay timer) phải chờ. Khi hàng đợi dài, tin ưu tiên thấp bị gộp
+hoặc bỏ; vượt SEND_QUEUE_HIGH_WATER thì client bị ngắt kết nối.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import json
+from collections import deque
+
+import logger
+import metrics
+import wire
+from config import FAST_JSON, SEND_QUEUE_LOW_WATER, SEND_QUEUE_HIGH_WATER
+
+try:
+    import orjson  # Tùy chọn: encoder JSON nhanh hơn (pip install orjson)
+except ImportError:
+    orjson = None
+if not FAST_JSON:
+    orjson = None
+
+log = logger.get_logger("game")
+
+CODEC_JSON = "json"
+CODEC_BINARY = "binary"
+
+FRAMES_SENT = metrics.counter("caro_frames_sent_total", "Số frame đã gửi tới client")
+BYTES_SENT = metrics.counter("caro_bytes_sent_total", "Số byte đã gửi tới client")
+FRAMES_RECEIVED = metrics.counter("caro_frames_received_total", "Số frame nhận được từ client")
+BYTES_RECEIVED = metrics.counter("caro_bytes_received_total", "Số byte nhận được từ client")
+OPEN_CONNECTIONS = metrics.gauge("caro_open_connections", "Số kết nối WebSocket đang mở (kể cả chưa đăng nhập)")
+CONNECTIONS = {
+    codec: metrics.counter("caro_connections_by_codec_total", "Số kết nối theo định dạng tin nhắn", codec=codec)
+    for codec in (CODEC_JSON, CODEC_BINARY)
+}
+QUEUED = metrics.gauge("caro_send_queue_frames", "Tổng số frame đang chờ gửi trong các hàng đợi")
+QUEUE_DEPTH = metrics.histogram("caro_send_queue_depth", "Độ dài hàng đợi gửi của kết nối lúc đưa tin vào",
+                                buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+DROPPED = metrics.counter("caro_send_dropped_total", "Số tin ưu tiên thấp bị bỏ vì hàng đợi gửi đầy")
+COALESCED = metrics.counter("caro_send_coalesced_total", "Số tin bị thay bằng tin mới hơn cùng loại khi hàng đợi dài")
+SLOW_DISCONNECTS = metrics.counter("caro_slow_consumer_disconnects_total", "Số client bị ngắt vì nhận tin quá chậm")
+
+# Tin ưu tiên thấp: bỏ được khi hàng đợi dài (mất một dòng chat không làm hỏng ván đấu)
+LOW_PRIORITY = {"OPPONENT_CHAT", "SPECTATE_CHAT", "ROOM_LIST"}
+# Trong đó, tin chỉ cần bản mới nhất: gộp vào bản đang chờ thay vì bỏ
+COALESCE = {"ROOM_LIST"}
+
+_outboxes = set()  # Các Outbox đang mở (xem queue_stats)
+_replies = contextvars.ContextVar("replies", default=None)  # _Replies của action đang xử lý
+
+
+def negotiate(websocket):
+    """Gán websocket.codec theo subprotocol đã thỏa thuận trong handshake."""
+    if getattr(websocket, "subprotocol", None) == wire.SUBPROTOCOL_BINARY:
+        websocket.codec = CODEC_BINARY
+    else:
+        websocket.codec = CODEC_JSON
+    CONNECTIONS[websocket.codec].inc()
+    return websocket.codec
+
+def codec_of(websocket):
+    return getattr(websocket, "codec", CODEC_JSON)
+
+def encode(payload, codec=CODEC_JSON):
+    """Mã hóa payload (dictionary): JSON -> str, nhị phân -> bytes."""
+    if codec == CODEC_BINARY:
+        return wire.encode_message(payload)
+    if orjson is not None:
+        # OPT_NON_STR_KEYS: score dùng user_id (int) làm khóa, giống json.dumps
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(payload)
+
+def decode(message):
+    """
+    Frame nhận được -> dictionary. bytes = nhị phân (wire), str = JSON.
+    Ném ValueError (json.JSONDecodeError / wire.DecodeError) nếu sai định dạng.
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return wire.decode_message(message)
+    return json.loads(message)
+
+
+class Frame:
+    """Payload đã chuẩn bị để gửi: mã hóa lười, mỗi định dạng đúng một lần."""
+    __slots__ = ("payload", "_encoded")
+
+    def __init__(self, payload):
+        self.payload = payload
+        self._encoded = {}
+
+    def for_codec(self, codec):
+        data = self._encoded.get(codec)
+        if data is None:
+            data = self._encoded[codec] = encode(self.payload, codec)
+        return data
+
+prepare = Frame
+
+def count_received(message):
+    """Đếm frame client gửi lên (gọi ở vòng nhận tin của kết nối thật, không đếm frame chuyển tiếp)."""
+    FRAMES_RECEIVED.inc()
+    if isinstance(message, str):
+        BYTES_RECEIVED.inc(len(message) if message.isascii() else len(message.encode('utf-8')))
+    else:
+        BYTES_RECEIVED.inc(len(message))
+
+def _count_sent(data):
+    FRAMES_SENT.inc()
+    if isinstance(data, str):
+        BYTES_SENT.inc(len(data) if data.isascii() else len(data.encode('utf-8')))
+    else:
+        BYTES_SENT.inc(len(data))
+
+
+class Outbox:
+    """Hàng đợi gửi có giới hạn của một kết nối, được ghi ra socket bởi một task riêng."""
+    __slots__ = ("ws", "queue", "latest", "wakeup", "task", "closed")
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.queue = deque()    # Các phần tử [data, status]
+        self.latest = {}        # {status: phần tử đang chờ} cho các status trong COALESCE
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self._run())
+        _outboxes.add(self)
+
+    def put(self, data, status=None):
+        """Đưa frame vào hàng đợi, không bao giờ chờ. Trả về False nếu tin bị bỏ."""
+        if self.closed:
+            return False
+        depth = len(self.queue)
+        QUEUE_DEPTH.observe(depth)
+        if status in COALESCE:
+            pending = self.latest.get(status)
+            if pending is not None and depth >= SEND_QUEUE_LOW_WATER:
+                pending[0] = data
+                COALESCED.inc()
+                return True
+        if depth >= SEND_QUEUE_LOW_WATER and status in LOW_PRIORITY:
+            DROPPED.inc()
+            return False
+        if depth >= SEND_QUEUE_HIGH_WATER:
+            self._disconnect_slow(depth)
+            return False
+        entry = [data, status]
+        self.queue.append(entry)
+        if status in COALESCE:
+            self.latest[status] = entry
+        QUEUED.inc()
+        self.wakeup.set()
+        return True
+
+    async def _run(self):
+        queue = self.queue
+        try:
+            while True:
+                if not queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                entry = queue.popleft()
+                QUEUED.dec()
+                if self.latest.get(entry[1]) is entry:
+                    del self.latest[entry[1]]
+                await self.ws.send(entry[0])
+                _count_sent(entry[0])
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.warning("Gửi tin thất bại", error=str(e), user=getattr(self.ws, "user_id", None))
+        finally:
+            self._discard()
+
+    def _disconnect_slow(self, depth):
+        SLOW_DISCONNECTS.inc()
+        log.warning("Client nhận tin quá chậm, ngắt kết nối", user=getattr(self.ws, "user_id", None),
+                    remote=str(getattr(self.ws, "remote_address", None)), queued=depth)
+        self._discard()
+        self.task.cancel()
+        # Đóng kết nối: vòng lặp nhận tin của main_handler kết thúc và dọn dẹp như bình thường
+        asyncio.get_running_loop().create_task(self.ws.close(code=1008, reason="slow consumer"))
+
+    def _discard(self):
+        if not self.closed:
+            self.closed = True
+            QUEUED.dec(len(self.queue))
+            self.queue.clear()
+            self.latest.clear()
+            _outboxes.discard(self)
+
+    def close(self):
+        """Kết nối đã đóng: bỏ các tin còn chờ và dừng task ghi."""
+        self._discard()
+        self.task.cancel()
+
+
+def open_outbox(websocket):
+    """Gắn hàng đợi gửi cho một kết nối client (gọi khi kết nối mở)."""
+    websocket.outbox = Outbox(websocket)
+    return websocket.outbox
+
+def close_outbox(websocket):
+    outbox = getattr(websocket, "outbox", None)
+    if outbox is not None:
+        outbox.close()
+
+def is_open(websocket):
+    """Kết nối còn nhận tin (tin bị bỏ vì hàng đợi đầy không có nghĩa là kết nối hỏng)."""
+    outbox = getattr(websocket, "outbox", None)
+    if outbox is None:
+        return getattr(websocket, "open", False)  # cluster.RemoteSocket: gửi thẳng qua link giữa hai worker
+    return not outbox.closed
+
+@metrics.add_collector
+def _collect_connections():
+    OPEN_CONNECTIONS.set(len(_outboxes))
+
+async def flush(timeout):
+    """Chờ mọi hàng đợi gửi trống, tối đa `timeout` giây (dùng khi tắt server)."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while any(outbox.queue for outbox in _outboxes) and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+
+def queue_stats(top=10):
+    """Độ dài hàng đợi gửi của các kết nối đang chờ nhiều nhất: [(user_id, remote, depth)]."""
+    busiest = sorted(_outboxes, key=lambda outbox: len(outbox.queue), reverse=True)[:top]
+    return [(getattr(o.ws, "user_id", None), str(getattr(o.ws, "remote_address", None)), len(o.queue))
+            for o in busiest if o.queue]
+
+
+class _Replies:
+    """Các tin đã gửi cho người gửi action đang xử lý (xem track_replies)."""
+    __slots__ = ("websocket", "error")
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.error = False
+
+@contextlib.contextmanager
+def track_replies(websocket):
+    """
+    Trong khối with, ghi nhận tin trả lời gửi cho websocket (người gửi action):
+    replies.error = True nếu có tin status ERROR. dispatcher.py dùng để đếm lỗi
+    cho handler tự bắt ngoại lệ rồi trả lời ERROR.
+    """
+    replies = _Replies(websocket)
+    token = _replies.set(replies)
+    try:
+        yield replies
+    finally:
+        _replies.reset(token)
+
+def _note_reply(ws, status):
+    if status == "ERROR":
+        replies = _replies.get()
+        if replies is not None and replies.websocket is ws:
+            replies.error = True
+
+async def _deliver(ws, data, status):
+    _note_reply(ws, status)
+    outbox = getattr(ws, "outbox", None)
+    if outbox is not None:
+        return outbox.put(data, status)
+    # Không có hàng đợi (RemoteSocket của cluster...): gửi trực tiếp
+    try:
+        await ws.send(data)
+    except Exception as e:
+        log.warning("Gửi tin thất bại", error=str(e), user=getattr(ws, "user_id", None))
+        return False
+    _count_sent(data)
+    return True
+
+async def send_frame(ws, frame):
+    """Gửi một Frame (hoặc str/bytes đã mã hóa sẵn). Trả về True nếu đã gửi/đưa vào hàng đợi."""
+    if not ws:
+        return False
+    if isinstance(frame, Frame):
+        return await _deliver(ws, frame.for_codec(codec_of(ws)), frame.payload.get("status"))
+    return await _deliver(ws, frame, None)
+
+async def safe_send(ws, payload):
+    """Gửi payload (dictionary) tới websocket một cách an toàn.
+    Trả về True nếu gửi thành công, False nếu lỗi hoặc ws là None.
+    """
+    if not ws:
+        return False
+    return await _deliver(ws, encode(payload, codec_of(ws)), payload.get("status"))
+
+async def send(ws, payload):
+    """
+    Gửi payload theo định dạng của ws. Không có hàng đợi thì lỗi kết nối
+    được ném ra cho bên gọi (như websocket.send).
+    """
+    data = encode(payload, codec_of(ws))
+    _note_reply(ws, payload.get("status"))
+    outbox = getattr(ws, "outbox", None)
+    if outbox is not None:
+        outbox.put(data, payload.get("status"))
+        return
+    await ws.send(data)
+    _count_sent(data)
+
+async def broadcast(recipients, payload):
+    """
+    Gửi CÙNG một payload cho nhiều websocket: mỗi định dạng mã hóa một lần,
+    gửi tới mọi người nhận song song.
+    Trả về số người nhận được gửi thành công.
+    """
+    targets = [ws for ws in recipients if ws]
+    if not targets:
+        return 0
+    if len(targets) == 1:
+        return int(await safe_send(targets[0], payload))
+    frame = Frame(payload)
+    results = await asyncio.gather(*(send_frame(ws, frame) for ws in targets))
+    return sum(results)
@@ -0,0 +1,332 @@
+# Server/wire.py
+
+"""
+Giao thức nhị phân (kiểu MessagePack) dùng song song với JSON.
+
+Client chọn định dạng lúc bắt tay WebSocket bằng subprotocol:
+    SUBPROTOCOL_BINARY  -> frame nhị phân theo module này
+    SUBPROTOCOL_JSON / không gửi subprotocol -> JSON text như cũ
+
+Frame nhị phân là một map MessagePack với ngữ nghĩa giống hệt JSON:
+- Tên khóa thường gặp ("status", "room_data"...) được thay bằng số nguyên
+  (KEYS); khóa không phải chuỗi được đổi thành chuỗi giống json.dumps.
+- Giá trị của "status" và "action" được thay bằng mã số (STATUSES, ACTIONS).
+- "board" (ma trận vuông user_id, tối đa 3 giá trị khác 0) được nén thành
+  ext type 1: 2 bit mỗi ô.
+Chuỗi lạ không có trong bảng vẫn được gửi nguyên văn, nên thêm status/khóa
+mới không làm hỏng giao thức. Các bảng chỉ được THÊM vào cuối.
+
+Module này không phụ thuộc phần còn lại của server. client/wire.py là bản sao
+y hệt (client chạy độc lập, không import từ server/): sửa một bản thì chép sang
+bản kia, tests/test_wire.py kiểm tra hai bản giống nhau.
+"""
+
+import struct
+
+SUBPROTOCOL_BINARY = "caro.msgpack.v1"
+SUBPROTOCOL_JSON = "caro.json"
+SUBPROTOCOLS = [SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON]  # Thứ tự ưu tiên của server
+
+# --- Bảng mã (chỉ thêm vào cuối, không đổi thứ tự) ---
+STATUSES = (
+    "ERROR", "SUCCESS", "LOGIN_SUCCESS", "FORCE_LOGOUT",
+    "ROOM_CREATED", "JOIN_SUCCESS", "OPPONENT_JOINED", "OPPONENT_LEFT", "ROOM_LIST",
+    "ROOM_UPDATE", "OPPONENT_READY", "SETTINGS_UPDATED", "SETTINGS_CHANGED_BY_HOST",
+    "WAITING_FOR_MATCH", "CANCEL_QUICK_JOIN_SUCCESS", "QUICK_JOIN_TIMEOUT",
+    "GAME_START", "OPPONENT_MOVE", "GAME_OVER", "TURN_TIMEOUT", "OPPONENT_CHAT", "OPPONENT_REMATCH",
+    "MATCH_HISTORY", "LEADERBOARD",
+    "WATCH_SUCCESS", "UNWATCH_SUCCESS", "SPECTATE_ROOM_UPDATE", "SPECTATE_GAME_START",
+    "SPECTATE_MOVE", "SPECTATE_CHAT", "SPECTATE_GAME_OVER", "SPECTATE_ROOM_CLOSED",
+    "RESUME_SUCCESS", "RESUME_FAILED", "ROOM_RESUMED", "OPPONENT_DISCONNECTED", "OPPONENT_RECONNECTED",
+)
+ACTIONS = (
+    "LOGIN", "REGISTER", "CREATE_ROOM", "JOIN_ROOM", "FIND_ROOM", "QUICK_JOIN", "CANCEL_QUICK_JOIN",
+    "UPDATE_SETTINGS", "READY", "PLAYER_READY", "LEAVE_ROOM", "MOVE", "MAKE_MOVE", "SURRENDER",
+    "CHAT", "REMATCH", "TURN_TIMEOUT", "GET_MATCH_HISTORY", "GET_LEADERBOARD",
+    "WATCH_ROOM", "UNWATCH_ROOM", "RESUME", "RESUME_ROOM",
+)
+KEYS = (
+    "status", "action", "payload", "message", "room_data", "room_id", "password", "settings",
+    "time_limit", "game_mode", "player1", "player2", "user_id", "username", "is_ready",
+    "board", "turn", "score", "role", "move", "row", "col", "player_id", "result", "reason",
+    "draw_reason", "winner_id", "sender", "opponent", "timer_task", "timeout", "toggle_ready",
+    "rooms", "host_name", "has_password", "created_time", "matches", "match_id", "time",
+    "players", "wins", "total_games", "rank", "user_rank", "user_data", "cursor", "next_cursor",
+    "limit", "player_x", "spectators", "token", "resume_token", "in_room",
+)
+_STATUS_CODES = {name: code for code, name in enumerate(STATUSES)}
+_ACTION_CODES = {name: code for code, name in enumerate(ACTIONS)}
+_KEY_CODES = {name: code for code, name in enumerate(KEYS)}
+_CODED_VALUES = {"status": (_STATUS_CODES, STATUSES), "action": (_ACTION_CODES, ACTIONS)}
+
+EXT_BOARD = 1
+
+
+class DecodeError(ValueError):
+    """Frame nhị phân không hợp lệ."""
+
+
+# --- MessagePack (tập con: nil, bool, int, float, str, bin, array, map, ext) ---
+def _pack(obj, out):
+    if obj is None:
+        out.append(0xC0)
+    elif obj is True:
+        out.append(0xC3)
+    elif obj is False:
+        out.append(0xC2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xFF)
+        elif 0 <= obj <= 0xFF:
+            out += b"\xcc" + struct.pack(">B", obj)
+        elif 0 <= obj <= 0xFFFF:
+            out += b"\xcd" + struct.pack(">H", obj)
+        elif 0 <= obj <= 0xFFFFFFFF:
+            out += b"\xce" + struct.pack(">I", obj)
+        elif 0 <= obj:
+            out += b"\xcf" + struct.pack(">Q", obj)
+        elif -0x80 <= obj:
+            out += b"\xd0" + struct.pack(">b", obj)
+        elif -0x8000 <= obj:
+            out += b"\xd1" + struct.pack(">h", obj)
+        elif -0x80000000 <= obj:
+            out += b"\xd2" + struct.pack(">i", obj)
+        else:
+            out += b"\xd3" + struct.pack(">q", obj)
+    elif isinstance(obj, float):
+        out += b"\xcb" + struct.pack(">d", obj)
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8")
+        n = len(data)
+        if n < 32:
+            out.append(0xA0 | n)
+        elif n <= 0xFF:
+            out += b"\xd9" + struct.pack(">B", n)
+        elif n <= 0xFFFF:
+            out += b"\xda" + struct.pack(">H", n)
+        else:
+            out += b"\xdb" + struct.pack(">I", n)
+        out += data
+    elif isinstance(obj, (bytes, bytearray)):
+        n = len(obj)
+        if n <= 0xFF:
+            out += b"\xc4" + struct.pack(">B", n)
+        elif n <= 0xFFFF:
+            out += b"\xc5" + struct.pack(">H", n)
+        else:
+            out += b"\xc6" + struct.pack(">I", n)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            out.append(0x90 | n)
+        elif n <= 0xFFFF:
+            out += b"\xdc" + struct.pack(">H", n)
+        else:
+            out += b"\xdd" + struct.pack(">I", n)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        _pack_map(obj, out)
+    elif isinstance(obj, _Ext):
+        out += b"\xc7" + struct.pack(">BB", len(obj.data), obj.code) + obj.data
+    else:
+        raise TypeError(f"Không mã hóa được kiểu {type(obj).__name__}")
+
+# Giống json.dumps: khóa luôn là chuỗi, True/False/None thành "true"/"false"/"null"
+_JSON_KEYS = {True: "true", False: "false", None: "null"}
+
+def _pack_map(obj, out):
+    n = len(obj)
+    if n < 16:
+        out.append(0x80 | n)
+    elif n <= 0xFFFF:
+        out += b"\xde" + struct.pack(">H", n)
+    else:
+        out += b"\xdf" + struct.pack(">I", n)
+    for key, value in obj.items():
+        if not isinstance(key, str):
+            key = _JSON_KEYS[key] if key is None or isinstance(key, bool) else str(key)
+        code = _KEY_CODES.get(key)
+        _pack(code if code is not None else key, out)
+        coded = _CODED_VALUES.get(key)
+        if coded is not None and isinstance(value, str) and value in coded[0]:
+            value = coded[0][value]
+        elif key == "board":
+            value = _pack_board(value)
+        _pack(value, out)
+
+
+class _Ext:
+    __slots__ = ("code", "data")
+
+    def __init__(self, code, data):
+        self.code = code
+        self.data = data
+
+def _pack_board(board):
+    """Ma trận vuông user_id -> ext 2 bit/ô; trả nguyên board nếu không nén được."""
+    if not isinstance(board, list) or not board or len(board) > 0xFF:
+        return board
+    size = len(board)
+    ids = []
+    cells = []
+    for row in board:
+        if not isinstance(row, list) or len(row) != size:
+            return board
+        for cell in row:
+            if cell == 0:
+                cells.append(0)
+                continue
+            if cell is True or not isinstance(cell, int) or not 0 < cell <= 0xFFFFFFFF:
+                return board
+            if cell not in ids:
+                if len(ids) == 3:
+                    return board
+                ids.append(cell)
+            cells.append(ids.index(cell) + 1)
+    packed = bytearray(struct.pack(">BB", size, len(ids)))
+    for player_id in ids:
+        packed += struct.pack(">I", player_id)
+    for i in range(0, len(cells), 4):
+        chunk = cells[i:i + 4]
+        byte = 0
+        for j, value in enumerate(chunk):
+            byte |= value << (6 - 2 * j)
+        packed.append(byte)
+    if len(packed) > 0xFF:
+        return board
+    return _Ext(EXT_BOARD, bytes(packed))
+
+def _unpack_board(data):
+    size, count = data[0], data[1]
+    ids = [0] + list(struct.unpack_from(">%dI" % count, data, 2))
+    pos = 2 + 4 * count
+    cells = []
+    for byte in data[pos:]:
+        cells.extend((ids[(byte >> 6) & 3], ids[(byte >> 4) & 3], ids[(byte >> 2) & 3], ids[byte & 3]))
+    return [cells[r * size:(r + 1) * size] for r in range(size)]
+
+
+class _Reader:
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def take(self, n):
+        start = self.pos
+        self.pos += n
+        if self.pos > len(self.data):
+            raise DecodeError("Frame bị cắt cụt")
+        return self.data[start:self.pos]
+
+    def unpack(self, fmt, n):
+        return struct.unpack(fmt, self.take(n))[0]
+
+    def read(self):
+        pos = self.pos
+        if pos >= len(self.data):
+            raise DecodeError("Frame bị cắt cụt")
+        tag = self.data[pos]
+        self.pos = pos + 1
+        if tag < 0x80:
+            return tag
+        if tag >= 0xE0:
+            return tag - 0x100
+        if 0xA0 <= tag <= 0xBF:
+            return self._str(tag & 0x1F)
+        if 0x90 <= tag <= 0x9F:
+            return [self.read() for _ in range(tag & 0x0F)]
+        if 0x80 <= tag <= 0x8F:
+            return self._map(tag & 0x0F)
+        if tag == 0xC0:
+            return None
+        if tag == 0xC2:
+            return False
+        if tag == 0xC3:
+            return True
+        simple = _SIMPLE.get(tag)
+        if simple is not None:
+            return self.unpack(*simple)
+        if tag == 0xD9:
+            return self._str(self.unpack(">B", 1))
+        if tag == 0xDA:
+            return self._str(self.unpack(">H", 2))
+        if tag == 0xDB:
+            return self._str(self.unpack(">I", 4))
+        if tag in (0xC4, 0xC5, 0xC6):
+            n = self.unpack(*_LENGTHS[tag])
+            return bytes(self.take(n))
+        if tag in (0xDC, 0xDD):
+            n = self.unpack(*_LENGTHS[tag])
+            return [self.read() for _ in range(n)]
+        if tag in (0xDE, 0xDF):
+            return self._map(self.unpack(*_LENGTHS[tag]))
+        if tag == 0xC7:
+            n = self.unpack(">B", 1)
+            code = self.unpack(">B", 1)
+            data = self.take(n)
+            if code == EXT_BOARD:
+                return _unpack_board(data)
+            raise DecodeError(f"Ext type {code} không hỗ trợ")
+        raise DecodeError(f"Byte đầu 0x{tag:02x} không hỗ trợ")
+
+    def _str(self, n):
+        try:
+            return bytes(self.take(n)).decode("utf-8")
+        except UnicodeDecodeError:
+            raise DecodeError("Chuỗi không phải UTF-8")
+
+    def _map(self, n):
+        result = {}
+        for _ in range(n):
+            key = self.read()
+            if isinstance(key, int):
+                if not 0 <= key < len(KEYS):
+                    raise DecodeError(f"Mã khóa {key} không hợp lệ")
+                key = KEYS[key]
+            elif not isinstance(key, str):
+                raise DecodeError("Khóa map phải là chuỗi hoặc mã khóa")
+            value = self.read()
+            coded = _CODED_VALUES.get(key)
+            if coded is not None and isinstance(value, int) and not isinstance(value, bool):
+                if not 0 <= value < len(coded[1]):
+                    raise DecodeError(f"Mã {key} {value} không hợp lệ")
+                value = coded[1][value]
+            result[key] = value
+        return result
+
+_SIMPLE = {
+    0xCC: (">B", 1), 0xCD: (">H", 2), 0xCE: (">I", 4), 0xCF: (">Q", 8),
+    0xD0: (">b", 1), 0xD1: (">h", 2), 0xD2: (">i", 4), 0xD3: (">q", 8),
+    0xCA: (">f", 4), 0xCB: (">d", 8),
+}
+_LENGTHS = {
+    0xC4: (">B", 1), 0xC5: (">H", 2), 0xC6: (">I", 4),
+    0xDC: (">H", 2), 0xDD: (">I", 4), 0xDE: (">H", 2), 0xDF: (">I", 4),
+}
+
+
+# --- API ---
+def encode_message(message):
+    """dict -> frame nhị phân."""
+    out = bytearray()
+    _pack(message, out)
+    return bytes(out)
+
+def decode_message(frame):
+    """Frame nhị phân -> dict. Ném DecodeError nếu frame không hợp lệ."""
+    reader = _Reader(memoryview(frame))
+    try:
+        message = reader.read()
+    except (struct.error, IndexError, RecursionError) as e:
+        raise DecodeError(str(e))
+    if reader.pos != len(frame):
+        raise DecodeError("Dữ liệu thừa sau frame")
+    if not isinstance(message, dict):
+        raise DecodeError("Frame phải là một map")
+    return message
@@ -0,0 +1,28 @@
+# Tests/conftest.py
+
+"""Shared fixtures; also makes the flat server/ modules importable the way server.py imports them."""
+
+import os
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.join(os.path.dirname(__file__), '..', 'server')
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+
+@pytest.fixture
+def game_state(monkeypatch):
+    """Fresh per-worker game state (rooms, queues, held seats) for tests that drive game_logic."""
+    import game_logic
+    import timer_wheel
+    for name in ("ACTIVE_ROOMS", "PLAYER_ROOMS", "WAITING_ROOMS", "MATCH_QUEUES", "QUEUE_TICKETS",
+                 "_HELD_SEATS", "_PAUSED_TURNS"):
+        monkeypatch.setattr(game_logic, name, {})
+    monkeypatch.setattr(game_logic, "_queue_sweeper", None)
+    # Each test runs its own event loop: start the shared timer wheel from scratch
+    fresh = timer_wheel.TimerWheel(timer_wheel.WHEEL.resolution)
+    for name in ("_levels", "_tick", "_origin", "_pending", "_task", "_wakeup"):
+        monkeypatch.setattr(timer_wheel.WHEEL, name, getattr(fresh, name))
+    return game_logic
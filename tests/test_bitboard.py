@@ -0,0 +1,82 @@
+# Tests/test_bitboard.py
+
+"""Board.is_win (shift-and-AND) against a naive scan of every line on the board."""
+
+import random
+
+import pytest
+
+from bitboard import Board
+
+LAYOUTS = [(3, 3), (6, 4), (9, 5), (12, 6)]
+DIRECTIONS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
+
+def naive_is_win(rows, player_id, win_count):
+    size = len(rows)
+    for r in range(size):
+        for c in range(size):
+            for dr, dc in DIRECTIONS:
+                end_r, end_c = r + dr * (win_count - 1), c + dc * (win_count - 1)
+                if not (0 <= end_r < size and 0 <= end_c < size):
+                    continue
+                if all(rows[r + dr * i][c + dc * i] == player_id for i in range(win_count)):
+                    return True
+    return False
+
+
+@pytest.mark.parametrize("size,win_count", LAYOUTS)
+def test_every_line_wins(size, win_count):
+    for r in range(size):
+        for c in range(size):
+            for dr, dc in DIRECTIONS:
+                cells = [(r + dr * i, c + dc * i) for i in range(win_count)]
+                if not all(0 <= rr < size and 0 <= cc < size for rr, cc in cells):
+                    continue
+                board = Board(size, win_count)
+                for rr, cc in cells[:-1]:
+                    board.place(rr, cc, 1)
+                assert not board.is_win(1)
+                board.place(*cells[-1], 1)
+                assert board.is_win(1), (r, c, dr, dc)
+                assert not board.is_win(2)
+
+
+@pytest.mark.parametrize("size,win_count", LAYOUTS)
+def test_no_wrap_across_rows(size, win_count):
+    # Last cells of one row + first cells of the next are adjacent bits only without the padding column
+    for r in range(size - 1):
+        board = Board(size, win_count)
+        split = win_count // 2
+        for c in range(size - split, size):
+            board.place(r, c, 1)
+        for c in range(win_count - split):
+            board.place(r + 1, c, 1)
+        assert board.is_win(1) == naive_is_win(board.to_rows(), 1, win_count)
+
+
+@pytest.mark.parametrize("size,win_count", LAYOUTS)
+def test_random_games_match_naive_scan(size, win_count):
+    rng = random.Random(size * 100 + win_count)
+    for _ in range(50):
+        board = Board(size, win_count)
+        cells = [(r, c) for r in range(size) for c in range(size)]
+        rng.shuffle(cells)
+        for turn, (r, c) in enumerate(cells):
+            player_id = 101 if turn % 2 == 0 else 202
+            assert board.is_empty(r, c)
+            board.place(r, c, player_id)
+            rows = board.to_rows()
+            assert board.is_win(player_id) == naive_is_win(rows, player_id, win_count)
+            if board.is_win(player_id):
+                break
+        assert board.is_full() == (board.move_count == size * size)
+
+
+@pytest.mark.parametrize("size,win_count", LAYOUTS)
+def test_rows_round_trip(size, win_count):
+    rng = random.Random(size)
+    rows = [[rng.choice((0, 7, 9)) for _ in range(size)] for _ in range(size)]
+    board = Board.from_rows(rows, win_count)
+    assert board.to_rows() == rows
+    assert board.move_count == sum(cell != 0 for row in rows for cell in row)
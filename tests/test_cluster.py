@@ -0,0 +1,248 @@
+# Tests/test_cluster.py
+
+"""
+Multi-worker behaviour, driven through the inter-worker packet handlers with
+fake links:
+
+- FORCE_LOGOUT of a connection that is relayed to another worker's room: the
+  origin worker stops relaying and the owner worker's RemoteSocket loses its
+  identity, so the old device can no longer act in the room.
+- QUICK_JOIN has a single owner (cluster.MATCHMAKER) that pairs players from
+  every worker and finds waiting rooms on the other workers.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+import cluster
+import server
+
+ALICE, BOB = 1, 2
+
+
+class FakeLink:
+    """One side of an inter-worker Unix socket: records the packets sent over it."""
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.proxies = {}
+        self.sent = []
+
+    async def send(self, kind, ident, data=b""):
+        self.sent.append((kind, ident, data))
+
+    def frames_to(self, conn_id):
+        return [json.loads(data) for kind, ident, data in self.sent
+                if kind == cluster.MSG_FRAME_OUT and ident == conn_id]
+
+
+class ClientSocket:
+    """A client connection held by this worker (no outbox: sends go straight to `sent`)."""
+
+    def __init__(self, user_id, username):
+        self.user_id = user_id
+        self.username = username
+        self.remote_address = ("127.0.0.1", 50000 + user_id)
+        self.relay = None
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+
+@pytest.fixture
+def worker(monkeypatch, game_state):
+    """This process plays worker 1 of 2."""
+    monkeypatch.setattr(cluster, "ENABLED", True)
+    monkeypatch.setattr(cluster, "WORKER_ID", 1)
+    monkeypatch.setattr(cluster, "WORKER_COUNT", 2)
+    monkeypatch.setattr(cluster, "_hooks", {"on_message": server.handle_message,
+                                            "on_disconnect": game_state.handle_disconnect,
+                                            "on_broadcast": server._on_cluster_event})
+    for name in ("_links", "_relays", "_hosted"):
+        monkeypatch.setattr(cluster, name, {})
+    monkeypatch.setattr(server, "CONNECTED_CLIENTS", {})
+    return game_state
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def attach_players(link, *players):
+    for conn_id, user_id, username in players:
+        info = {"user_id": user_id, "username": username, "remote": "x", "codec": "json"}
+        await cluster._on_inbound_packet(link, cluster.MSG_ATTACH, conn_id, json.dumps(info).encode())
+
+
+async def frame_in(link, conn_id, action, **payload):
+    message = json.dumps({"action": action, "payload": payload}).encode("utf-8")
+    await cluster._on_inbound_packet(link, cluster.MSG_FRAME_IN, conn_id, message)
+    await settle()
+
+
+def test_owner_rejects_old_device_after_force_logout(worker):
+    async def main():
+        link = FakeLink(peer=0)
+        await attach_players(link, (11, ALICE, "alice"), (12, BOB, "bob"))
+        await frame_in(link, 11, "CREATE_ROOM")
+        room_code = link.frames_to(11)[-1]["room_id"]
+        await frame_in(link, 12, "JOIN_ROOM", room_id=room_code)
+        await frame_in(link, 11, "READY", is_ready=True)
+        await frame_in(link, 12, "READY", is_ready=True)
+        room = worker.ACTIVE_ROOMS[room_code]
+        assert room.in_game
+        room.set_turn(ALICE)
+        bob_frames = len(link.frames_to(12))
+
+        # alice logs in on another device: every worker receives the broadcast
+        event = json.dumps({"event": "force_logout", "user_id": ALICE}).encode()
+        await cluster._on_inbound_packet(link, cluster.MSG_BROADCAST, 0, event)
+        assert cluster.hosted_sockets(ALICE) == []
+
+        # Frames already on their way from the old device are refused
+        await frame_in(link, 11, "MOVE", row=0, col=0)
+        await frame_in(link, 11, "CHAT", message="still here")
+        await frame_in(link, 11, "LEAVE_ROOM")
+        await frame_in(link, 11, "SURRENDER")
+        assert room.board.is_empty(0, 0)
+        assert room.in_game and room.slot_of(ALICE) is not None
+        assert worker.ACTIVE_ROOMS.get(room_code) is room
+        assert len(link.frames_to(12)) == bob_frames  # bob saw no move, chat or game over
+        refusals = link.frames_to(11)[-4:]
+        assert all(frame["status"] == "ERROR" for frame in refusals)
+
+        # The origin worker's DETACH ends the proxy; alice's seat stays for RESUME
+        await cluster._on_inbound_packet(link, cluster.MSG_DETACH, 11, b"")
+        await settle()
+        assert 11 not in link.proxies
+        assert room.slot_of(ALICE) is not None
+    asyncio.run(main())
+
+
+def test_origin_detaches_relay_on_force_logout(worker, monkeypatch):
+    async def main():
+        link = FakeLink(peer=0)
+        cluster._links[0] = link
+        old = ClientSocket(ALICE, "alice")
+        await cluster.attach(old, 0)
+        conn_id = old.relay[1]
+        server.CONNECTED_CLIENTS[ALICE] = old
+
+        await server._force_logout_local(ALICE)
+        assert old.sent[-1]["status"] == "FORCE_LOGOUT"
+        assert not cluster.is_relayed(old)
+        assert conn_id not in cluster._relays
+        assert (cluster.MSG_DETACH, conn_id, b"") in link.sent
+        assert not hasattr(old, "user_id")
+
+        # Later frames from the old device stay on this worker and are refused
+        packets = len(link.sent)
+        await server.handle_message(old, json.dumps({"action": "MOVE", "payload": {"row": 1, "col": 1}}))
+        assert len(link.sent) == packets
+        assert old.sent[-1]["status"] == "ERROR"
+    asyncio.run(main())
+
+
+def test_sockets_without_identity_are_never_relayed(worker):
+    ws = ClientSocket(ALICE, "alice")
+    ws.relay = (0, 7)
+    assert server._should_relay(ws, "MOVE", {}) == 0
+    del ws.user_id
+    assert server._should_relay(ws, "MOVE", {}) is None
+    assert server._should_relay(ws, "JOIN_ROOM", {"room_id": "ABCDE"}) is None
+
+
+@pytest.fixture
+def matchmaker(worker, monkeypatch):
+    """This process is the matchmaking worker; the other worker has no waiting rooms."""
+    monkeypatch.setattr(cluster, "WORKER_ID", cluster.MATCHMAKER)
+    calls = []
+
+    async def call_all(method, **params):
+        calls.append((method, params))
+        return [None]
+    monkeypatch.setattr(cluster, "call_all", call_all)
+    worker.rpc_calls = calls
+    return worker
+
+
+def test_matchmaker_pairs_players_from_another_worker(matchmaker):
+    async def main():
+        link = FakeLink(peer=1)
+        await attach_players(link, (11, ALICE, "alice"), (12, BOB, "bob"))
+        await frame_in(link, 11, "QUICK_JOIN", game_mode=5)
+        assert link.frames_to(11)[-1]["status"] == "WAITING_FOR_MATCH"
+        assert ("quick_join_room", {"game_mode": 5, "user_id": ALICE}) in matchmaker.rpc_calls
+        # The queued connection stays here instead of going back to its origin worker
+        assert 11 in link.proxies
+        assert not any(kind == cluster.MSG_RELEASE for kind, ident, data in link.sent)
+
+        await frame_in(link, 12, "QUICK_JOIN", game_mode="ANY")
+        alice, bob = link.frames_to(11)[-1], link.frames_to(12)[-1]
+        assert alice["status"] == bob["status"] == "JOIN_SUCCESS"
+        room = matchmaker.ACTIVE_ROOMS[alice["room_data"]["room_id"]]
+        assert cluster.owns(room.room_id) and room.game_mode == 5
+        assert {slot.user_id for slot in room.players()} == {ALICE, BOB}
+        assert matchmaker.QUEUE_TICKETS == {}
+        assert 11 in link.proxies and 12 in link.proxies
+    asyncio.run(main())
+
+
+def test_expired_ticket_returns_connection_to_origin(matchmaker, monkeypatch):
+    monkeypatch.setattr(matchmaker, "QUICK_JOIN_TIMEOUT", 0)
+    monkeypatch.setattr(matchmaker, "QUICK_JOIN_SWEEP_INTERVAL", 0)
+
+    async def main():
+        link = FakeLink(peer=1)
+        await attach_players(link, (11, ALICE, "alice"))
+        await frame_in(link, 11, "QUICK_JOIN", game_mode=5)
+        await settle()
+        assert link.frames_to(11)[-1]["status"] == "QUICK_JOIN_TIMEOUT"
+        assert (cluster.MSG_RELEASE, 11, b"") in link.sent
+        assert 11 not in link.proxies
+    asyncio.run(main())
+
+
+def test_matchmaker_sends_player_to_waiting_room_on_other_worker(matchmaker, monkeypatch):
+    async def call_all(method, **params):
+        return ["QWERT"] if method == "quick_join_room" else []
+    monkeypatch.setattr(cluster, "call_all", call_all)
+
+    async def main():
+        link = FakeLink(peer=1)
+        await attach_players(link, (11, ALICE, "alice"))
+        await frame_in(link, 11, "QUICK_JOIN", game_mode=5)
+        releases = [data for kind, ident, data in link.sent if kind == cluster.MSG_RELEASE and ident == 11]
+        assert [json.loads(data) for data in releases] == [{"action": "JOIN_ROOM", "payload": {"room_id": "QWERT"}}]
+        assert matchmaker.QUEUE_TICKETS == {} and 11 not in link.proxies
+    asyncio.run(main())
+
+
+def test_quick_join_is_relayed_to_matchmaker(worker):
+    ws = ClientSocket(ALICE, "alice")
+    assert server._should_relay(ws, "QUICK_JOIN", {"game_mode": 5}) == cluster.MATCHMAKER
+    ws.room_code = "ABCDE"
+    assert server._should_relay(ws, "QUICK_JOIN", {"game_mode": 5}) is None
+
+
+def test_origin_replays_handed_off_frame(worker):
+    async def main():
+        matchmaker_link = FakeLink(peer=0)
+        cluster._links[cluster.MATCHMAKER] = matchmaker_link
+        ws = ClientSocket(ALICE, "alice")
+        await cluster.attach(ws, cluster.MATCHMAKER)
+        first_conn = ws.relay[1]
+
+        # The waiting room belongs to worker 0: the released connection is attached there again
+        code = next(c for c in ("AAAAA", "BBBBB", "CCCCC", "DDDDD", "EEEEE") if cluster.shard_of(c) == 0)
+        frame = json.dumps({"action": "JOIN_ROOM", "payload": {"room_id": code}}).encode()
+        await cluster._on_outbound_packet(matchmaker_link, cluster.MSG_RELEASE, first_conn, frame)
+        await settle()
+        assert ws.relay is not None and ws.relay[1] != first_conn
+        assert (cluster.MSG_FRAME_IN, ws.relay[1], frame) in matchmaker_link.sent
+        assert first_conn not in cluster._relays
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+# Tests/test_db_pool.py
+
+"""ConnectionPool bookkeeping with a fake mysql.connector.connect (no server needed)."""
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+
+import database_manager as db
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def rollback(self):
+        pass
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Connections made by mysql.connector.connect during the test."""
+    conns = []
+
+    def connect(**config):
+        conns.append(FakeConnection())
+        return conns[-1]
+    monkeypatch.setattr(db.mysql.connector, "connect", connect)
+    return conns
+
+
+@pytest.mark.parametrize("min_size", [1, 2, 3, 5])
+def test_warm_up_opens_min_size_connections(opened, min_size):
+    pool = db.ConnectionPool({}, min_size=min_size, max_size=10)
+    pool.warm_up()
+    assert len(opened) == min_size
+    assert pool.stats()["size"] == pool.stats()["idle"] == min_size
+    assert not any(conn.closed for conn in opened)
+
+
+def test_warm_up_tops_up_existing_connections(opened):
+    pool = db.ConnectionPool({}, min_size=4, max_size=10)
+    pool.acquire().close()
+    pool.warm_up()
+    assert len(opened) == 4
+    pool.warm_up()
+    assert len(opened) == 4
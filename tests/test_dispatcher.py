@@ -0,0 +1,77 @@
+# Tests/test_dispatcher.py
+
+"""ActionDispatcher error accounting: raised exceptions and ERROR replies both count."""
+
+import asyncio
+import json
+
+import pytest
+
+import game_logic
+import transport
+from dispatcher import ActionDispatcher
+
+
+class ClientSocket:
+    def __init__(self, user_id=1):
+        self.user_id = user_id
+        self.username = f"user{user_id}"
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+
+def run(dispatcher, ws, action, payload=None):
+    asyncio.run(dispatcher.dispatch(ws, action, payload or {}))
+
+
+def counts(spec):
+    return spec.calls.value, spec.errors.value
+
+
+def test_error_reply_counts_as_error():
+    dispatcher = ActionDispatcher()
+
+    async def handler(ws, payload):
+        await transport.safe_send(ws, {"status": "ERROR", "message": "no"})
+    spec = dispatcher.register("TEST_ERROR_REPLY", handler)
+    before = counts(spec)
+    run(dispatcher, ClientSocket(), "TEST_ERROR_REPLY")
+    assert counts(spec) == (before[0] + 1, before[1] + 1)
+
+
+def test_success_and_error_sent_to_someone_else_are_not_errors():
+    dispatcher = ActionDispatcher()
+    other = ClientSocket(2)
+
+    async def handler(ws, payload):
+        await transport.safe_send(other, {"status": "ERROR", "message": "not yours"})
+        await transport.send(ws, {"status": "OK"})
+    spec = dispatcher.register("TEST_OK_REPLY", handler)
+    before = counts(spec)
+    run(dispatcher, ClientSocket(), "TEST_OK_REPLY")
+    assert counts(spec) == (before[0] + 1, before[1])
+
+
+def test_exception_after_error_reply_counts_once():
+    dispatcher = ActionDispatcher()
+
+    async def handler(ws, payload):
+        await transport.send(ws, {"status": "ERROR", "message": "no"})
+        raise RuntimeError("boom")
+    spec = dispatcher.register("TEST_RAISES", handler)
+    before = counts(spec)
+    with pytest.raises(RuntimeError):
+        run(dispatcher, ClientSocket(), "TEST_RAISES")
+    assert counts(spec) == (before[0] + 1, before[1] + 1)
+
+
+def test_game_logic_error_reply_is_counted(game_state):
+    dispatcher = ActionDispatcher()
+    spec = dispatcher.register("TEST_JOIN_ROOM", game_logic.handle_join_room)
+    before = counts(spec)
+    ws = ClientSocket()
+    run(dispatcher, ws, "TEST_JOIN_ROOM", {"room_id": "NOPE1"})
+    assert ws.sent[-1]["status"] == "ERROR"
+    assert counts(spec) == (before[0] + 1, before[1] + 1)
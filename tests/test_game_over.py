@@ -0,0 +1,78 @@
+# Tests/test_game_over.py
+
+"""What each way of ending a game records through storage.record_match_result."""
+
+import asyncio
+import json
+
+import pytest
+
+import game_logic
+
+ALICE, BOB = 1, 2
+
+
+class ClientSocket:
+    def __init__(self, user_id, username):
+        self.user_id = user_id
+        self.username = username
+        self.open = True
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+
+@pytest.fixture
+def recorded(game_state, monkeypatch):
+    """(winner_id, result_type) of every result handed to the write-behind queue."""
+    results = []
+
+    def record_match_result(player_x_id, player_o_id, winner_id, game_mode, result_type="normal", **kwargs):
+        results.append((winner_id, result_type))
+    monkeypatch.setattr(game_logic.storage, "record_match_result", record_match_result)
+    return results
+
+
+async def start_game():
+    host, guest = ClientSocket(ALICE, "alice"), ClientSocket(BOB, "bob")
+    await game_logic.handle_create_room(host, {"game_mode": 5})
+    room = game_logic.ACTIVE_ROOMS[host.room_code]
+    await game_logic.handle_join_room(guest, {"room_id": room.room_id})
+    await game_logic.handle_ready(host, {"is_ready": True})
+    await game_logic.handle_ready(guest, {"is_ready": True})
+    assert room.in_game
+    return room, host, guest
+
+
+@pytest.mark.parametrize("reason, winner, expected", [
+    ("WIN", ALICE, [(ALICE, "normal")]),
+    ("TIMEOUT", BOB, [(BOB, "timeout")]),
+    ("DRAW_BOARD_FULL", None, [(None, "draw")]),
+    ("OPPONENT_LEFT", ALICE, []),
+])
+def test_game_over_reasons(recorded, reason, winner, expected):
+    async def main():
+        room, _, _ = await start_game()
+        loser = None if winner is None else (BOB if winner == ALICE else ALICE)
+        await game_logic._handle_game_over(room, winner, loser, reason=reason)
+        assert recorded == expected
+        assert not room.in_game
+    asyncio.run(main())
+
+
+def test_surrender_records_opponent_as_winner(recorded):
+    async def main():
+        _, host, _ = await start_game()
+        await game_logic.handle_surrender(host)
+        assert recorded == [(BOB, "surrender")]
+    asyncio.run(main())
+
+
+def test_leaving_mid_game_records_nothing(recorded):
+    async def main():
+        room, _, guest = await start_game()
+        await game_logic.handle_leave_room(guest)
+        assert recorded == []
+        assert room.player2 is None and not room.in_game
+    asyncio.run(main())
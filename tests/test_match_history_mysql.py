@@ -0,0 +1,140 @@
+# Tests/test_match_history_mysql.py
+
+"""
+get_match_history keyset pagination against a real MySQL server.
+
+Runs against the DB_CONFIG server in a separate database (CARO_TEST_DATABASE,
+default "caro_test") with the schema from scripts/setup_database.py
+(database_manager.create_tables). Skipped when MySQL is not reachable.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+mysql_connector = pytest.importorskip("mysql.connector")
+
+import database_manager as db
+from config import DB_CONFIG
+
+TEST_DATABASE = os.environ.get("CARO_TEST_DATABASE", "caro_test")
+
+
+@pytest.fixture(scope="module")
+def pool():
+    server_config = {key: value for key, value in DB_CONFIG.items() if key != "database"}
+    try:
+        conn = mysql_connector.connect(connection_timeout=3, **server_config)
+    except mysql_connector.Error as err:
+        pytest.skip(f"MySQL not reachable: {err}")
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS {TEST_DATABASE} "
+                   "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+    cursor.close()
+    conn.close()
+
+    test_pool = db.ConnectionPool({**DB_CONFIG, "database": TEST_DATABASE}, min_size=1, max_size=2)
+    saved, db.POOL = db.POOL, test_pool
+    try:
+        db.create_tables()
+        yield test_pool
+    finally:
+        db.POOL = saved
+        test_pool.close_all()
+
+
+@pytest.fixture
+def history(pool):
+    """
+    alice plays 30 finished matches on only 4 distinct end_time values (ties
+    broken by match_id), as X and as O, plus 2 unfinished matches (end_time
+    NULL) and matches between other players.
+    """
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM match_history")
+    cursor.execute("DELETE FROM users")
+    user_ids = {}
+    for username in ("alice", "bob", "carol"):
+        cursor.execute("INSERT INTO users (username, password_hash) VALUES (%s, 'x')", (username,))
+        user_ids[username] = cursor.lastrowid
+    alice, bob, carol = user_ids["alice"], user_ids["bob"], user_ids["carol"]
+
+    base = datetime(2024, 5, 1, 20, 0, 0)
+    times = [base + timedelta(minutes=m) for m in (0, 5, 5, 1, 7, 0)]  # Out of insert order
+    rows = []
+    for i in range(30):
+        opponent = bob if i % 3 else carol
+        x_id, o_id = (alice, opponent) if i % 2 == 0 else (opponent, alice)
+        winner = (alice, opponent, None)[i % 3]
+        end_time = times[i % len(times)]
+        rows.append((x_id, o_id, winner, end_time))
+    for x_id, o_id in ((alice, bob), (carol, alice)):
+        rows.append((x_id, o_id, None, None))          # Unfinished: never listed
+    for i in range(5):
+        rows.append((bob, carol, bob, times[i % len(times)]))   # alice not involved
+
+    expected = []
+    for x_id, o_id, winner, end_time in rows:
+        cursor.execute("INSERT INTO match_history (player_x_id, player_o_id, winner_id, game_mode, "
+                       "result_type, start_time, end_time) VALUES (%s, %s, %s, 5, 'normal', %s, %s)",
+                       (x_id, o_id, winner, base - timedelta(hours=1), end_time))
+        if alice in (x_id, o_id) and end_time is not None:
+            result = "Hòa" if winner is None else ("Thắng" if winner == alice else "Thua")
+            opponent = "bob" if bob in (x_id, o_id) else "carol"
+            expected.append((end_time, cursor.lastrowid, result, opponent))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    expected.sort(reverse=True)  # ORDER BY end_time DESC, match_id DESC
+    return alice, expected
+
+
+def fetch_all_pages(user_id, limit):
+    pages = []
+    cursor = None
+    while True:
+        page = db.get_match_history(user_id, limit=limit, cursor=cursor)
+        pages.append(page["matches"])
+        assert len(page["matches"]) <= limit
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+        assert len(page["matches"]) == limit
+        assert len(pages) <= 100, "pagination does not advance"
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7, 29, 30, 31, 50])
+def test_pages_cover_history_in_order_across_ties(history, limit):
+    user_id, expected = history
+    pages = fetch_all_pages(user_id, limit)
+    matches = [match for page in pages for match in page]
+    assert [match["match_id"] for match in matches] == [row[1] for row in expected]
+    assert [(match["result"], match["opponent"]) for match in matches] == [row[2:] for row in expected]
+    assert [match["time"] for match in matches] == [row[0].strftime("%d/%m/%Y %H:%M") for row in expected]
+    assert len(pages) == max(1, -(-len(expected) // limit))
+
+
+def test_first_page_skips_unfinished_matches(history):
+    user_id, expected = history
+    page = db.get_match_history(user_id, limit=len(expected))
+    assert [match["match_id"] for match in page["matches"]] == [row[1] for row in expected]
+    assert page["next_cursor"] is None  # Exactly `limit` finished matches: no further page
+
+
+def test_cursor_inside_a_tie_resumes_after_it(history):
+    user_id, expected = history
+    # Cursor on a row whose end_time is shared with rows before and after it
+    tied = [i for i in range(1, len(expected) - 1)
+            if expected[i - 1][0] == expected[i][0] == expected[i + 1][0]]
+    assert tied
+    i = tied[0]
+    cursor = db.encode_history_cursor(expected[i][0], expected[i][1])
+    page = db.get_match_history(user_id, limit=len(expected), cursor=cursor)
+    assert [match["match_id"] for match in page["matches"]] == [row[1] for row in expected[i + 1:]]
+    assert page["next_cursor"] is None
+
+
+def test_user_without_matches(history):
+    assert db.get_match_history(10 ** 9) == {"matches": [], "next_cursor": None}
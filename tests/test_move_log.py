@@ -0,0 +1,90 @@
+# Tests/test_move_log.py
+
+"""Binary move log: decode() of an appended log returns the same moves and offsets."""
+
+import random
+
+import pytest
+
+import move_log
+from move_log import Move, MoveLog, decode
+
+PLAYER_X, PLAYER_O = 11, 22
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(move_log.time, "monotonic", fake)
+    return fake
+
+
+def play(log, clock, moves, elapsed_ms=0):
+    """Append moves `gap_ms` apart; the clock reads mid-millisecond so int() truncation is exact."""
+    for row, col, user_id, gap_ms in moves:
+        elapsed_ms += gap_ms
+        clock.now = log.started + (elapsed_ms + 0.5) / 1000
+        log.append(row, col, user_id)
+    return elapsed_ms
+
+
+@pytest.mark.parametrize("size", [3, 6, 9, 12])
+def test_decode_returns_appended_moves(clock, size):
+    rng = random.Random(size)
+    cells = [(r, c) for r in range(size) for c in range(size)]
+    rng.shuffle(cells)
+    # Gaps cross the 1/2/3-byte varint boundaries, including a 0ms move
+    gaps = [0, 1, 127, 128, 16383, 16384, 250, 90_000]
+    moves = []
+    for i, (r, c) in enumerate(cells):
+        moves.append((r, c, PLAYER_X if i % 2 == 0 else PLAYER_O, gaps[i % len(gaps)]))
+    log = MoveLog(size, PLAYER_X, PLAYER_O)
+    play(log, clock, moves)
+
+    decoded_size, decoded = decode(log.to_bytes())
+    assert decoded_size == size
+    assert log.count == len(decoded) == len(moves)
+    offset = 0
+    expected = []
+    for r, c, user_id, gap_ms in moves:
+        offset += gap_ms
+        expected.append(Move(r, c, "X" if user_id == PLAYER_X else "O", offset))
+    assert decoded == expected
+
+
+def test_empty_log(clock):
+    log = MoveLog(9, PLAYER_X, PLAYER_O)
+    assert decode(log.to_bytes()) == (9, [])
+
+
+def test_resume_keeps_appending(clock):
+    log = MoveLog(6, PLAYER_X, PLAYER_O)
+    elapsed_ms = play(log, clock, [(0, 0, PLAYER_X, 500), (1, 1, PLAYER_O, 700)])
+    clock.now += 30  # Server restarted; the resumed log continues from the saved offset
+    resumed = MoveLog.resume(log.to_bytes(), PLAYER_X, PLAYER_O)
+    play(resumed, clock, [(2, 2, PLAYER_X, 300)], elapsed_ms)
+    size, moves = decode(resumed.to_bytes())
+    assert size == 6
+    assert resumed.count == 3
+    assert moves == [Move(0, 0, "X", 500), Move(1, 1, "O", 1200), Move(2, 2, "X", 1500)]
+
+
+@pytest.mark.parametrize("data", [b"", b"\x01", b"[[0,0]]", b"\x02\x09"])
+def test_rejects_other_formats(data):
+    with pytest.raises(ValueError):
+        decode(data)
+
+
+def test_rejects_truncated_log(clock):
+    log = MoveLog(12, PLAYER_X, PLAYER_O)
+    play(log, clock, [(11, 11, PLAYER_X, 200)])
+    with pytest.raises(ValueError):
+        decode(log.to_bytes()[:-1])
@@ -0,0 +1,85 @@
+# Tests/test_ranking.py
+
+"""RankingIndex (treap) against sorted() after random match results."""
+
+import random
+
+from ranking import RankingIndex, collation_key
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-"
+
+
+def random_users(rng, count):
+    users = {}
+    seen = set()
+    while len(users) < count:
+        name = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(3, 10)))
+        if collation_key(name) in seen:
+            continue  # The username column is unique case-insensitively
+        seen.add(collation_key(name))
+        user_id = len(users) + 1
+        users[user_id] = [name, rng.randint(0, 5), rng.randint(0, 5), rng.randint(0, 3)]
+    return users
+
+
+def expected_order(users):
+    """ORDER BY wins DESC, username ASC with MySQL's default collation."""
+    return sorted(users, key=lambda user_id: (-users[user_id][1], collation_key(users[user_id][0])))
+
+
+def check(index, users):
+    order = expected_order(users)
+    public = [{"username": users[user_id][0], "wins": users[user_id][1],
+               "total_games": sum(users[user_id][1:])} for user_id in order]
+    assert index.top(len(users) + 5) == public
+    assert index.top(10) == public[:10]
+    for rank, user_id in enumerate(order, start=1):
+        assert index.rank_of(user_id) == {**public[rank - 1], "rank": rank}
+    rows = [(user_id, *values) for user_id, values in users.items()]
+    assert index.verify(rows, db_top=[entry["username"] for entry in public[:20]]) == []
+
+
+def test_random_results_match_sorted():
+    rng = random.Random(15)
+    users = random_users(rng, 300)
+    index = RankingIndex()
+    index.load([(user_id, *values) for user_id, values in users.items()])
+    check(index, users)
+    for _ in range(20):
+        batch = []
+        for _ in range(rng.randint(1, 40)):
+            player_x, player_o = rng.sample(sorted(users), 2)
+            winner = rng.choice((player_x, player_o, None))
+            batch.append((player_x, player_o, winner))
+            if winner is not None:
+                loser = player_o if winner == player_x else player_x
+                users[winner][1] += 1
+                users[loser][2] += 1
+        index.apply_results(batch)
+        check(index, users)
+
+
+def test_collation_orders_underscore_and_dash_before_alnum():
+    index = RankingIndex()
+    names = ["b", "A", "_z", "-a", "9", "a_", "a-", "a0"]
+    index.load([(i, name, 1, 0, 0) for i, name in enumerate(names, start=1)])
+    assert [entry["username"] for entry in index.top()] == ["_z", "-a", "9", "A", "a_", "a-", "a0", "b"]
+
+
+def test_add_user_and_unknown_ids():
+    index = RankingIndex()
+    index.load([(1, "alice", 2, 0, 0)])
+    index.add_user(2, "bob")
+    index.add_user(2, "bob", wins=9)  # Already indexed: ignored
+    assert len(index) == 2
+    assert index.rank_of(2) == {"username": "bob", "wins": 0, "total_games": 0, "rank": 2}
+    assert index.rank_of(99) is None
+    index.apply_results([(1, 99, 99)])  # Unknown ids are skipped, the known loser still counts
+    assert index.stats_of(1) == {"wins": 2, "losses": 1}
+
+
+def test_verify_reports_mismatches():
+    index = RankingIndex()
+    index.load([(1, "alice", 2, 0, 0), (2, "bob", 1, 0, 0)])
+    problems = index.verify([(1, "alice", 3, 0, 0), (3, "carol", 0, 0, 0)])
+    assert len(problems) == 3
@@ -0,0 +1,98 @@
+# Tests/test_results_queue.py
+
+"""
+Write-behind match results (storage.record_match_result / flush_results)
+against a fake save_match_results_batch: failed batches are retried, then
+written one match at a time so a bad row cannot block the queue.
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+
+import ranking
+import storage
+
+BAD = 99  # Matches with this winner_id are rejected as bad data
+
+
+class FakeDatabase:
+    """save_match_results_batch stand-in: `down` = transient failure, BAD rows = data error."""
+
+    def __init__(self):
+        self.down = False
+        self.calls = []
+        self.saved = []
+
+    def save_match_results_batch(self, rows):
+        self.calls.append(len(rows))
+        if self.down:
+            return False
+        if any(row[2] == BAD for row in rows):
+            raise ValueError("bad row")
+        self.saved.extend(row[:3] for row in rows)
+        return True
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDatabase()
+    monkeypatch.setattr(storage.db_manager, "save_match_results_batch", fake.save_match_results_batch)
+    monkeypatch.setattr(storage, "_pending_results", storage.deque())
+    monkeypatch.setattr(storage, "_batch_failures", 0)
+    monkeypatch.setattr(storage, "_executor", None)
+    monkeypatch.setattr(storage, "_admission", None)
+    monkeypatch.setattr(storage, "_ensure_results_writer", lambda: None)
+    monkeypatch.setattr(storage, "_results_wakeup", asyncio.Event())
+    monkeypatch.setattr(ranking.INDEX, "apply_results", lambda results: None)
+    yield fake
+    storage.shutdown()
+
+
+def record(*winners):
+    for winner in winners:
+        storage.record_match_result(1, 2, winner, 5)
+
+
+def flush():
+    return asyncio.run(storage.flush_results(max_batches=1))
+
+
+def test_bad_row_is_dropped_without_blocking_the_queue(db):
+    dropped = storage.RESULTS_DROPPED.value
+    record(1, BAD, 2)
+    assert flush() is True
+    assert db.calls == [3, 1, 1, 1]  # Whole batch fails on bad data, then one by one
+    assert db.saved == [(1, 2, 1), (1, 2, 2)]
+    assert len(storage._pending_results) == 0
+    assert storage.RESULTS_DROPPED.value == dropped + 1
+
+
+def test_transient_failures_retry_whole_batch_then_split(db, monkeypatch):
+    monkeypatch.setattr(storage, "RESULT_MAX_ATTEMPTS", 3)
+    db.down = True
+    record(1, 2, 1, 2)
+    assert [flush() for _ in range(2)] == [False, False]
+    assert db.calls == [4, 4] and len(storage._pending_results) == 4
+
+    # Third failure: written one by one, stops after RESULT_MAX_ATTEMPTS rows fail with no success
+    assert flush() is False
+    assert db.calls == [4, 4, 4, 1, 1, 1]
+    assert len(storage._pending_results) == 4 and db.saved == []
+
+    db.down = False
+    assert flush() is True
+    assert db.saved == [(1, 2, 1), (1, 2, 2), (1, 2, 1), (1, 2, 2)]
+    assert len(storage._pending_results) == 0
+
+
+def test_queue_is_capped(db, monkeypatch):
+    monkeypatch.setattr(storage, "RESULT_MAX_PENDING", 2)
+    dropped = storage.RESULTS_DROPPED.value
+    record(1, 2, 1)
+    assert len(storage._pending_results) == 2
+    assert storage.RESULTS_DROPPED.value == dropped + 1
+    assert flush() is True
+    assert db.saved == [(1, 2, 1), (1, 2, 2)]
@@ -0,0 +1,135 @@
+# Tests/test_seats.py
+
+"""
+Held seats: a player who loses the connection keeps the seat for a grace
+period and takes it back with RESUME_ROOM.
+"""
+
+import asyncio
+import json
+
+import game_logic
+
+ALICE, BOB, CAROL = 1, 2, 3
+
+
+class ClientSocket:
+    """A logged-in connection (no outbox: sends go straight to `sent`)."""
+
+    def __init__(self, user_id, username):
+        self.user_id = user_id
+        self.username = username
+        self.open = True  # transport.is_open for sockets without an outbox
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def statuses(self):
+        return [frame["status"] for frame in self.sent]
+
+
+def waiting_codes(game_mode=5):
+    return [room.room_id for room in game_logic._iter_waiting_rooms(game_mode, public_only=True)]
+
+
+def test_room_of_absent_host_leaves_waiting_index(game_state):
+    async def main():
+        host = ClientSocket(ALICE, "alice")
+        await game_logic.handle_create_room(host, {"game_mode": 5})
+        code = host.room_code
+        assert waiting_codes() == [code]
+
+        await game_logic.handle_disconnect(host)
+        assert game_logic.find_seat(ALICE) is game_state.ACTIVE_ROOMS[code]
+        assert waiting_codes() == []
+
+        # QUICK_JOIN does not seat a guest next to the absent host
+        guest = ClientSocket(BOB, "bob")
+        await game_logic.handle_quick_join(guest, {"game_mode": 5})
+        assert guest.statuses() == ["WAITING_FOR_MATCH"]
+        assert game_state.ACTIVE_ROOMS[code].player2 is None
+
+        # Back with RESUME_ROOM: the room is listed again
+        await game_logic.handle_cancel_quick_join(guest)
+        back = ClientSocket(ALICE, "alice")
+        await game_logic.handle_resume_room(back)
+        assert back.statuses() == ["ROOM_RESUMED"]
+        assert waiting_codes() == [code]
+    asyncio.run(main())
+
+
+def test_resumed_room_is_listed_after_newer_rooms(game_state):
+    async def main():
+        first, second = ClientSocket(ALICE, "alice"), ClientSocket(CAROL, "carol")
+        await game_logic.handle_create_room(first, {"game_mode": 5})
+        await game_logic.handle_create_room(second, {"game_mode": 5})
+        older = first.room_code
+        await game_logic.handle_disconnect(first)
+        await game_logic.handle_resume_room(ClientSocket(ALICE, "alice"))
+        assert waiting_codes() == [second.room_code, older]
+        assert waiting_codes(None) == waiting_codes()
+    asyncio.run(main())
+
+
+def test_restored_waiting_room_is_listed_once_host_resumes(game_state):
+    async def main():
+        host = ClientSocket(ALICE, "alice")
+        await game_logic.handle_create_room(host, {"game_mode": 5})
+        states = game_logic.snapshot_rooms()
+        game_logic.suspend_rooms()
+
+        await game_logic.restore_rooms(states)
+        code = states[0]["room_id"]
+        assert game_logic.find_seat(ALICE) is game_state.ACTIVE_ROOMS[code]
+        assert waiting_codes() == []
+
+        await game_logic.handle_resume_room(ClientSocket(ALICE, "alice"))
+        assert waiting_codes() == [code]
+    asyncio.run(main())
+
+
+def scanned_seats():
+    return {slot.user_id: room for room in game_logic.ACTIVE_ROOMS.values() for slot in room.players()}
+
+
+def test_seat_index_follows_joins_and_leaves(game_state):
+    async def main():
+        host, guest = ClientSocket(ALICE, "alice"), ClientSocket(BOB, "bob")
+        await game_logic.handle_create_room(host, {"game_mode": 5})
+        room = game_state.ACTIVE_ROOMS[host.room_code]
+        await game_logic.handle_join_room(guest, {"room_id": room.room_id})
+        assert game_state.PLAYER_ROOMS == scanned_seats() == {ALICE: room, BOB: room}
+
+        await game_logic.handle_leave_room(guest)
+        assert game_state.PLAYER_ROOMS == scanned_seats() == {ALICE: room}
+
+        # A held seat stays indexed, so RESUME (and the seat_owner RPC) finds it
+        await game_logic.handle_disconnect(host)
+        assert game_logic.find_seat(ALICE) is room
+        assert await game_logic.seat_owner(ALICE) == game_logic.cluster.WORKER_ID
+        assert await game_logic.seat_owner(BOB) is None
+
+        back = ClientSocket(ALICE, "alice")
+        await game_logic.handle_resume_room(back)
+        await game_logic.handle_leave_room(back)
+        assert game_state.PLAYER_ROOMS == scanned_seats() == {}
+        assert game_logic.find_seat(ALICE) is None
+    asyncio.run(main())
+
+
+def test_quick_join_and_restore_index_seats(game_state):
+    async def main():
+        first, second = ClientSocket(ALICE, "alice"), ClientSocket(BOB, "bob")
+        await game_logic.handle_quick_join(first, {"game_mode": 5})
+        await game_logic.handle_quick_join(second, {"game_mode": 5})
+        assert set(game_state.PLAYER_ROOMS) == {ALICE, BOB}
+        assert game_state.PLAYER_ROOMS == scanned_seats()
+
+        states = game_logic.snapshot_rooms()
+        game_logic.suspend_rooms()
+        assert game_state.PLAYER_ROOMS == {}
+        await game_logic.restore_rooms(states)
+        assert set(game_state.PLAYER_ROOMS) == {ALICE, BOB}
+        assert game_state.PLAYER_ROOMS == scanned_seats()
+    asyncio.run(main())
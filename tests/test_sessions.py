@@ -0,0 +1,83 @@
+# Tests/test_sessions.py
+
+"""Resume tokens: sessions.verify on valid, tampered and expired tokens."""
+
+import base64
+
+import pytest
+
+import sessions
+
+
+@pytest.fixture(autouse=True)
+def keep_secret(monkeypatch):
+    """import_secret() rewrites the module key and the environment; restore both."""
+    monkeypatch.setattr(sessions, "_secret", sessions._secret)
+    monkeypatch.setenv(sessions._SECRET_ENV, sessions._secret.decode("utf-8"))
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def test_valid_token():
+    token = sessions.issue(42, "alice_01")
+    assert sessions.verify(token) == (42, "alice_01")
+
+
+@pytest.mark.parametrize("field,value", [(0, b"43"), (1, b"mallory"), (2, b"9999999999")])
+def test_tampered_body_is_rejected(field, value):
+    body_part, signature_part = sessions.issue(42, "alice").split(".")
+    fields = unb64(body_part).split(b".")
+    fields[field] = value
+    assert sessions.verify(f"{b64(b'.'.join(fields))}.{signature_part}") is None
+
+
+def test_tampered_signature_is_rejected():
+    body_part, signature_part = sessions.issue(42, "alice").split(".")
+    signature = bytearray(unb64(signature_part))
+    for i in (0, len(signature) - 1):
+        flipped = bytearray(signature)
+        flipped[i] ^= 0x01
+        assert sessions.verify(f"{body_part}.{b64(bytes(flipped))}") is None
+    assert sessions.verify(f"{body_part}.{b64(bytes(signature[:-1]))}") is None
+
+
+def test_signature_of_another_user_is_rejected():
+    alice_body, _ = sessions.issue(1, "alice").split(".")
+    _, bob_signature = sessions.issue(2, "bob").split(".")
+    assert sessions.verify(f"{alice_body}.{bob_signature}") is None
+
+
+def test_expired_token_is_rejected(monkeypatch):
+    assert sessions.verify(sessions.issue(42, "alice", ttl=-1)) is None
+    token = sessions.issue(42, "alice", ttl=sessions.SESSION_TOKEN_TTL)
+    now = sessions.time.time()
+    monkeypatch.setattr(sessions.time, "time", lambda: now + sessions.SESSION_TOKEN_TTL - 5)
+    assert sessions.verify(token) == (42, "alice")
+    monkeypatch.setattr(sessions.time, "time", lambda: now + sessions.SESSION_TOKEN_TTL + 5)
+    assert sessions.verify(token) is None
+
+
+def test_other_secret_invalidates_tokens():
+    token = sessions.issue(42, "alice")
+    saved = sessions.export_secret()
+    sessions.import_secret("another-server-secret")
+    assert sessions.verify(token) is None
+    sessions.import_secret(saved)  # Restored key from a snapshot: old tokens work again
+    assert sessions.verify(token) == (42, "alice")
+
+
+@pytest.mark.parametrize("token", [
+    None, 42, "", ".", "abc", "a.b.c", "not base64!.sig", "YWJj.",
+])
+def test_malformed_tokens_are_rejected(token):
+    assert sessions.verify(token) is None
+
+
+def test_signed_body_with_bad_fields_is_rejected():
+    for body in (b"42.alice", b"x.alice.9999999999", b"42.alice.soon", b"\xff\xfe.a.1"):
+        assert sessions.verify(f"{b64(body)}.{b64(sessions._sign(body))}") is None
@@ -0,0 +1,117 @@
+# Tests/test_timer_wheel.py
+
+"""
+Timer wheel cascade and reschedule. The wheel is driven by hand through
+_advance() with a 1s tick and the background task never gets to run, so every
+expiry tick is deterministic.
+"""
+
+import asyncio
+import random
+
+from timer_wheel import SLOT_BITS, SLOTS, LEVELS, TimerWheel
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def drain(wheel, handles, upto):
+    """Advance one tick at a time, returning {handle: tick it fired on}."""
+    fired = {}
+    for tick in range(wheel._tick + 1, upto + 1):
+        for handle in wheel._advance(tick):
+            assert handle not in fired
+            fired[handle] = tick
+    return fired
+
+
+def test_fires_on_expiry_tick_across_levels():
+    async def main():
+        wheel = TimerWheel(resolution=1.0)
+        # Half a tick less than whole ticks so loop.time() drift cannot round up past them
+        delays = [1, 2, SLOTS - 1, SLOTS, SLOTS + 1, 2 * SLOTS + 5, SLOTS ** 2 - 1, SLOTS ** 2,
+                  SLOTS ** 2 + SLOTS + 3, 3 * SLOTS ** 2 + 17]
+        handles = {wheel.call_later(delay - 0.5, lambda: None): delay for delay in delays}
+        assert wheel.pending() == len(delays)
+        for handle, delay in handles.items():
+            assert handle.expires == delay
+        fired = drain(wheel, handles, max(delays))
+        wheel.stop()
+        assert fired == handles
+        assert wheel.pending() == 0
+        assert not any(handle.active for handle in handles)
+    run(main())
+
+
+def test_random_timers_fire_exactly_once_on_time():
+    async def main():
+        rng = random.Random(11)
+        wheel = TimerWheel(resolution=1.0)
+        horizon = SLOTS ** 3 + 500
+        handles = {}
+        for _ in range(300):
+            delay = rng.randrange(1, horizon)
+            handles[wheel.call_later(delay - 0.5, lambda: None)] = delay
+        # Advance in uneven jumps so cascades happen inside a single _advance() call too
+        fired = {}
+        target = 0
+        while target < horizon:
+            previous, target = target, min(horizon, target + rng.randrange(1, 3 * SLOTS))
+            for handle in wheel._advance(target):
+                assert previous < handle.expires <= target
+                fired[handle] = handle.expires
+        wheel.stop()
+        assert fired == handles
+        assert wheel.pending() == 0
+    run(main())
+
+
+def test_reschedule_and_cancel():
+    async def main():
+        wheel = TimerWheel(resolution=1.0)
+        moved_later = wheel.call_later(SLOTS - 0.5, lambda: None)
+        moved_earlier = wheel.call_later(SLOTS ** 2 + 9.5, lambda: None)
+        cancelled = wheel.call_later(SLOTS + 4.5, lambda: None)
+        moved_later.reschedule(SLOTS ** 2 + 2.5, "new-arg")
+        moved_earlier.reschedule(3.5)
+        cancelled.cancel()
+        cancelled.cancel()  # A second cancel is a no-op
+        assert moved_later.args == ("new-arg",)
+        assert not cancelled.active
+        assert wheel.pending() == 2
+        fired = drain(wheel, [moved_later, moved_earlier], SLOTS ** 2 + 20)
+        wheel.stop()
+        assert fired == {moved_earlier: 4, moved_later: SLOTS ** 2 + 3}
+        assert wheel.pending() == 0
+    run(main())
+
+
+def test_far_timers_are_clamped_to_the_wheel_range():
+    async def main():
+        wheel = TimerWheel(resolution=1.0)
+        handle = wheel.call_later(float(SLOTS ** LEVELS * 10), lambda: None)
+        wheel.stop()
+        assert handle.expires == (1 << (SLOT_BITS * LEVELS)) - 1
+        assert handle.active
+    run(main())
+
+
+def test_fire_runs_callbacks_and_coroutines():
+    async def main():
+        wheel = TimerWheel(resolution=0.01)
+        calls = []
+
+        async def async_callback(value):
+            calls.append(("async", value))
+
+        wheel.call_later(0.02, calls.append, "sync")
+        wheel.call_later(0.03, async_callback, 1)
+        remaining = wheel.call_later(5, calls.append, "never")
+        assert 4 < remaining.remaining() <= 5 + wheel.resolution  # Rounded up to a whole tick
+        await asyncio.sleep(0.2)
+        remaining.cancel()
+        assert remaining.remaining() is None
+        wheel.stop()
+        assert calls == ["sync", ("async", 1)]
+    run(main())
@@ -0,0 +1,105 @@
+# Tests/test_transport.py
+
+"""Outbox back-pressure at SEND_QUEUE_LOW_WATER and SEND_QUEUE_HIGH_WATER."""
+
+import asyncio
+
+from config import SEND_QUEUE_HIGH_WATER, SEND_QUEUE_LOW_WATER
+from transport import Outbox
+
+
+class StalledSocket:
+    """A client that never finishes reading: every send() blocks until release()."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self._gate = asyncio.Event()
+
+    async def send(self, data):
+        await self._gate.wait()
+        self.sent.append(data)
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = (code, reason)
+
+    def release(self):
+        self._gate.set()
+
+
+def run(test):
+    """Run test(outbox, ws) on a fresh loop with the writer task blocked on the first frame."""
+    async def main():
+        ws = StalledSocket()
+        outbox = Outbox(ws)
+        await asyncio.sleep(0)  # Writer takes nothing yet: the queue is empty
+        try:
+            await test(outbox, ws)
+        finally:
+            outbox.close()
+            await asyncio.sleep(0)
+    asyncio.run(main())
+
+
+def fill(outbox, depth):
+    while len(outbox.queue) < depth:
+        assert outbox.put(f"move {len(outbox.queue)}", "OPPONENT_MOVE")
+
+
+def test_below_low_water_everything_is_queued():
+    async def test(outbox, ws):
+        fill(outbox, SEND_QUEUE_LOW_WATER - 2)
+        assert outbox.put("chat", "OPPONENT_CHAT")
+        assert outbox.put("rooms 1", "ROOM_LIST")
+        assert len(outbox.queue) == SEND_QUEUE_LOW_WATER
+        ws.release()
+        await asyncio.sleep(0.01)
+        assert len(ws.sent) == SEND_QUEUE_LOW_WATER
+        assert ws.sent[-2:] == ["chat", "rooms 1"]
+        assert not outbox.latest  # Sent ROOM_LIST is no longer a coalescing target
+    run(test)
+
+
+def test_at_low_water_low_priority_is_dropped_or_coalesced():
+    async def test(outbox, ws):
+        fill(outbox, SEND_QUEUE_LOW_WATER - 1)
+        assert outbox.put("rooms 1", "ROOM_LIST")
+        assert len(outbox.queue) == SEND_QUEUE_LOW_WATER
+
+        assert not outbox.put("chat", "OPPONENT_CHAT")
+        assert not outbox.put("spectator chat", "SPECTATE_CHAT")
+        assert outbox.put("rooms 2", "ROOM_LIST")  # Replaces the pending list in place
+        assert outbox.put("game over", "GAME_OVER")
+        assert outbox.put(b"binary move", None)
+        assert len(outbox.queue) == SEND_QUEUE_LOW_WATER + 2
+        assert [entry[0] for entry in outbox.queue].count("rooms 2") == 1
+        assert "rooms 1" not in [entry[0] for entry in outbox.queue]
+        assert not outbox.closed
+    run(test)
+
+
+def test_room_list_without_pending_copy_is_dropped_at_low_water():
+    async def test(outbox, ws):
+        fill(outbox, SEND_QUEUE_LOW_WATER)
+        assert not outbox.put("rooms", "ROOM_LIST")
+        assert len(outbox.queue) == SEND_QUEUE_LOW_WATER
+    run(test)
+
+
+def test_high_water_disconnects_slow_consumer():
+    async def test(outbox, ws):
+        fill(outbox, SEND_QUEUE_HIGH_WATER - 1)
+        assert outbox.put("last accepted", "OPPONENT_MOVE")
+        assert len(outbox.queue) == SEND_QUEUE_HIGH_WATER
+        assert not outbox.closed
+
+        assert not outbox.put("one too many", "OPPONENT_MOVE")
+        assert outbox.closed
+        assert not outbox.queue
+        await asyncio.sleep(0)
+        assert ws.closed_with == (1008, "slow consumer")
+        assert outbox.task.done()
+        # Closed outboxes refuse everything without touching the socket again
+        assert not outbox.put("late", "GAME_OVER")
+        assert ws.sent == []
+    run(test)
@@ -0,0 +1,111 @@
+# Tests/test_wire.py
+
+"""Binary protocol: decode_message(encode_message(x)) must equal the JSON round trip."""
+
+import json
+import os
+import random
+
+import pytest
+
+import wire
+
+
+def json_round_trip(message):
+    return json.loads(json.dumps(message))
+
+
+def random_board(rng, size, players):
+    return [[rng.choice((0,) + players) for _ in range(size)] for _ in range(size)]
+
+
+def sample_messages():
+    rng = random.Random(18)
+    yield {"action": "LOGIN", "payload": {"username": "alice", "password": "pw"}}
+    yield {"status": "ERROR", "message": "Sai mật khẩu, vui lòng thử lại 🙂"}
+    yield {"status": "ROOM_LIST", "rooms": [
+        {"room_id": f"R{i:04d}", "host_name": "bob", "has_password": i % 2 == 0,
+         "created_time": 1700000000.25 + i, "settings": {"time_limit": 30, "game_mode": 5}}
+        for i in range(40)]}
+    for size in (3, 6, 9, 12):
+        yield {"status": "GAME_START", "room_data": {
+            "board": random_board(rng, size, (101, 4_000_000_000)), "turn": 101, "player_x": 101,
+            "player1": {"user_id": 101, "username": "a", "is_ready": True, "score": 0},
+            "player2": {"user_id": 4_000_000_000, "username": "b", "is_ready": False, "score": 2}}}
+    # Boards that cannot be packed into the 2-bit ext stay plain lists
+    yield {"board": random_board(rng, 5, (1, 2, 3, 4))}
+    yield {"board": [[0, 1], [2]]}
+    yield {"board": [[True, 0], [0, 0]]}
+    yield {"board": []}
+    # Ints on every MessagePack width, both signs, and floats
+    yield {"values": [0, 1, 127, 128, 255, 256, 65535, 65536, 2**32 - 1, 2**32, 2**63,
+                      -1, -32, -33, -128, -129, -32768, -32769, -2**31, -2**31 - 1, -2**63,
+                      0.5, -1.25, 1e300, None, True, False]}
+    # Strings and arrays across the length prefixes
+    yield {"strings": ["", "x" * 31, "x" * 32, "é" * 200, "y" * 70000]}
+    yield {"arrays": [list(range(15)), list(range(16)), list(range(70000))]}
+    # Unknown status/action/key strings are sent verbatim; tuples and non-string keys as in JSON
+    yield {"status": "SOMETHING_NEW", "action": "NOT_A_ACTION", "brand_new_key": (1, 2, (3,))}
+    yield {"payload": {1: "one", 2.5: "float", False: "bool", None: "nil"}, "room_data": {7: {True: []}}}
+    # status/action values that are not strings (unhashable ones included) are sent as-is
+    yield {"status": ["ERROR", 1], "action": {"name": "MOVE"}}
+    yield {"status": {"code": "ERROR"}, "action": [], "payload": {"status": (1, 2), "action": None}}
+    yield {"matches": [{"match_id": i, "players": ["a", "b"], "result": "X_WIN", "time": "2024-01-01 10:00:00"}
+                       for i in range(300)], "next_cursor": "2024-01-01 10:00:00|299"}
+
+
+@pytest.mark.parametrize("message", list(sample_messages()), ids=lambda m: next(iter(m)))
+def test_round_trip_equals_json(message):
+    frame = wire.encode_message(message)
+    assert isinstance(frame, bytes)
+    assert wire.decode_message(frame) == json_round_trip(message)
+
+
+def test_every_table_entry_round_trips():
+    for status in wire.STATUSES:
+        assert wire.decode_message(wire.encode_message({"status": status})) == {"status": status}
+    for action in wire.ACTIONS:
+        assert wire.decode_message(wire.encode_message({"action": action})) == {"action": action}
+    message = {key: key for key in wire.KEYS if key not in ("status", "action", "board")}
+    assert wire.decode_message(wire.encode_message(message)) == message
+
+
+def test_tables_have_no_duplicates():
+    for table in (wire.STATUSES, wire.ACTIONS, wire.KEYS):
+        assert len(set(table)) == len(table)
+
+
+def test_rejects_unencodable_values():
+    with pytest.raises(TypeError):
+        wire.encode_message({"payload": object()})
+
+
+@pytest.mark.parametrize("frame", [
+    b"",
+    b"\x90",                                   # An array, not a map
+    b"\x81\xa1k",                              # Truncated map
+    wire.encode_message({"status": "SUCCESS"}) + b"\x00",  # Trailing data
+    b"\xc1",                                   # Unused type byte
+])
+def test_invalid_frames_raise_decode_error(frame):
+    with pytest.raises(wire.DecodeError):
+        wire.decode_message(frame)
+
+
+def test_random_truncation_never_escapes_decode_error():
+    rng = random.Random(1818)
+    frame = wire.encode_message(next(m for m in sample_messages() if "room_data" in m))
+    for _ in range(500):
+        cut = frame[:rng.randrange(len(frame))]
+        with pytest.raises(wire.DecodeError):
+            wire.decode_message(cut)
+
+
+def test_client_copy_matches_server():
+    """client/wire.py is a vendored copy: only the file header comment may differ."""
+    root = os.path.join(os.path.dirname(__file__), "..")
+    copies = []
+    for side in ("server", "client"):
+        with open(os.path.join(root, side, "wire.py"), encoding="utf-8") as f:
+            copies.append(f.read().split("\n", 1)[1])
+    assert copies[0] == copies[1], "server/wire.py and client/wire.py differ: copy the change across"